@@ -11,14 +11,18 @@ from nav_config import APP_ICON, APP_TITLE, PAGE_SECTIONS, PageSpec
 from sidebar_ui import render_sidebar
 
 
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _read_icon(path: str, mtime_ns: int):
+    image = Image.open(path)
+    image.load()
+    return image
+
+
 def load_page_icon():
     icon_path = Path(APP_ICON)
     if not icon_path.exists():
         return APP_ICON
-
-    image = Image.open(icon_path)
-    image.load()
-    return image
+    return _read_icon(str(icon_path), icon_path.stat().st_mtime_ns)
 
 
 st.set_page_config(page_title=APP_TITLE, page_icon=load_page_icon(), layout="wide")
@@ -27,13 +31,24 @@ BROKEN_PAGES: list[tuple[str, str]] = []
 MISSING_PAGES: list[str] = []
 
 
-def syntax_ok(path: Path) -> bool:
+# 每次 rerun 都會重跑這支程式：每個頁面在同一個 process 只解析一次語法，
+# 檔案有改（mtime / 大小是快取 key 的一部分）才重新檢查
+@st.cache_resource(show_spinner=False, max_entries=256)
+def syntax_error(path: str, mtime_ns: int, size: int) -> str | None:
     try:
-        ast.parse(path.read_text(encoding="utf-8-sig"), filename=str(path))
-        return True
+        ast.parse(Path(path).read_text(encoding="utf-8-sig"), filename=path)
+        return None
     except Exception as exc:
-        BROKEN_PAGES.append((str(path), repr(exc)))
+        return repr(exc)
+
+
+def syntax_ok(path: Path) -> bool:
+    stat = path.stat()
+    error = syntax_error(str(path), stat.st_mtime_ns, stat.st_size)
+    if error is not None:
+        BROKEN_PAGES.append((str(path), error))
         return False
+    return True
 
 
 def make_page(spec: PageSpec):
@@ -0,0 +1,87 @@
+"""
+Arrow 字串欄位（省記憶體）
+- 讀檔原本用 dtype=str / .astype(str)，在 pandas 2 會變成 Python 物件欄（每格 50+ bytes）
+- 改用 TEXT_DTYPE：有 pyarrow 時為 Arrow 字串欄（連續緩衝區），.str 操作一樣向量化
+- 低基數代碼欄（儲位類型 / BOXTYPE / 職務 / 來源檔名…）可再轉 category
+- 全域開關：環境變數 ARROW_STRINGS=0 → 退回原本的 Python 字串（dtype=str）
+"""
+
+from __future__ import annotations
+
+import os
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+
+def _resolve_text_dtype():
+    if os.environ.get("ARROW_STRINGS", "1").strip().lower() in ("0", "false", "no", "off"):
+        return str
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return str
+    # 空值用 NaN、比較結果是一般 bool（與 object 字串欄行為一致，既有的 df[mask] 寫法不用改）
+    try:
+        return pd.StringDtype("pyarrow", na_value=np.nan)  # pandas >= 2.3
+    except TypeError:
+        pass
+    try:
+        return pd.StringDtype("pyarrow_numpy")  # pandas 2.1 / 2.2
+    except (TypeError, ValueError):
+        return str
+
+
+TEXT_DTYPE = _resolve_text_dtype()  # 給 read_excel / read_csv 的 dtype=
+ARROW_STRINGS = TEXT_DTYPE is not str
+
+# 低基數代碼欄：重複值多，轉 category 只存一份字典 + 整數代碼
+CATEGORY_COLUMNS = (
+    "儲位類型", "BOXTYPE", "箱類型", "buyersreference", "職務", "組別",
+    "訂單類型", "備註", "來源檔名", "來源檔案",
+)
+
+
+def as_text(s: pd.Series, *, fill: Optional[str] = "", strip: bool = True) -> pd.Series:
+    """
+    取代 .fillna("").astype(str).str.strip()
+    - fill=None：保留空值（對應原本沒有 fillna 的 .astype(str)）
+    """
+    mask = s.isna() if fill is not None else None
+    out = s.astype(TEXT_DTYPE)
+    if mask is not None and mask.any():
+        out = out.mask(mask, fill)
+    if strip:
+        out = out.str.strip()
+    return out
+
+
+def text_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """整張表的純文字 object 欄轉 TEXT_DTYPE（數字 / 日期 / 混型欄不動）"""
+    if not ARROW_STRINGS:
+        return df
+    for i, dtype in enumerate(df.dtypes):
+        if dtype == object and pd.api.types.infer_dtype(df.iloc[:, i], skipna=True) in ("string", "empty"):
+            df.isetitem(i, df.iloc[:, i].astype(TEXT_DTYPE))
+    return df
+
+
+def categorize(
+    df: pd.DataFrame,
+    columns: Iterable[str] = CATEGORY_COLUMNS,
+    *,
+    max_ratio: float = 0.5,
+) -> pd.DataFrame:
+    """
+    指定欄位若不重複值 ≤ 列數 × max_ratio 就轉 category
+    ⚠️ 只用在之後不會 groupby / 填入新值的欄位（pandas 2 的 category groupby 會帶出空組）
+    """
+    if not ARROW_STRINGS or df.empty:
+        return df
+    limit = max(1, int(len(df) * max_ratio))
+    for col in columns:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            if df[col].nunique(dropna=True) <= limit:
+                df[col] = df[col].astype("category")
+    return df
@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-import io
 from dataclasses import dataclass
 from urllib.parse import quote, unquote
 from typing import List, Optional, Sequence, Dict, Any
@@ -8,6 +7,9 @@ from typing import List, Optional, Sequence, Dict, Any
 import pandas as pd
 import streamlit as st
 
+from excel_export import PLAIN_STYLE, write_workbook
+from export_recipe import Exportable, download_button
+
 
 # =========================================================
 # Theme / CSS（物流專業風格）
@@ -577,40 +579,39 @@ def sidebar_controls(
 # Downloads
 # =========================================================
 def download_excel(
-    xlsx_bytes: bytes,
+    xlsx_bytes: Exportable,
     filename: str = "KPI報表.xlsx",
     label: str = "⬇️ 匯出 KPI 報表",
     use_container_width: bool = True,
 ):
-    st.download_button(
-        label=label,
-        data=xlsx_bytes,
+    download_button(
+        label,
+        xlsx_bytes,
         file_name=filename,
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         use_container_width=use_container_width,
     )
 
 
 def download_excel_button(
-    xlsx_bytes: bytes,
+    xlsx_bytes: Exportable,
     filename: str = "KPI報表.xlsx",
     label: str = "⬇️ 匯出 KPI 報表",
 ):
     """
     你要的效果：畫面只看到「一行」，而且那一行就是按鈕。
     用法：頁面上直接呼叫（不要再 card_open）
+    xlsx_bytes 可為 ExportRecipe：按下載時才產生 Excel
     """
-    st.download_button(
-        label=label,
-        data=xlsx_bytes,
+    download_button(
+        label,
+        xlsx_bytes,
         file_name=filename,
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         use_container_width=True,
     )
 
 
 def download_excel_card(
-    xlsx_bytes: bytes,
+    xlsx_bytes: Exportable,
     filename: str = "KPI報表.xlsx",
     label: str = "⬇️ 匯出 KPI 報表",
 ):
@@ -626,14 +627,7 @@ def download_excel_card(
 # Excel helpers
 # =========================================================
 def dataframe_to_excel_bytes(sheets: Dict[str, pd.DataFrame]) -> bytes:
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-        for name, df in sheets.items():
-            if df is None:
-                continue
-            safe_name = str(name)[:31] or "Sheet1"
-            df.to_excel(writer, sheet_name=safe_name, index=False)
-    return output.getvalue()
+    return write_workbook(sheets, default_style=PLAIN_STYLE)
 
 
 # =========================================================
@@ -0,0 +1,149 @@
+"""
+下載暫存區（伺服器端）
+- 產出的檔案直接寫到本機暫存目錄，session 只記一個隨機 token（不放整份 bytes、不轉 base64）
+- token 有使用期限：逾時自動清掉；使用者按下載、檔案送出後立即刪除
+- 下載鈕用 Streamlit 的延後產生（data=callable）：按下時才從磁碟讀檔，不必每次重跑都把檔案塞進記憶體
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import BinaryIO, Callable, Optional
+
+import streamlit as st
+
+from excel_export import XLSX_MIME
+
+# ===== 可調參數（可用環境變數覆寫） =====
+STORE_DIR = Path(os.environ.get("DOWNLOAD_STORE_DIR", os.path.join(tempfile.gettempdir(), "gf_download_store")))
+DEFAULT_TTL = int(os.environ.get("DOWNLOAD_STORE_TTL", "1800"))  # 秒
+
+
+_LOCK = threading.Lock()
+
+
+def _data_path(token: str) -> Path:
+    return STORE_DIR / f"{token}.bin"
+
+
+def _meta_path(token: str) -> Path:
+    return STORE_DIR / f"{token}.json"
+
+
+def _valid_token(token: Optional[str]) -> bool:
+    return bool(token) and all(ch.isalnum() or ch in "-_" for ch in token)
+
+
+def _read_meta(token: str) -> Optional[dict]:
+    try:
+        return json.loads(_meta_path(token).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def discard(token: Optional[str]) -> None:
+    if not _valid_token(token):
+        return
+    for p in (_data_path(token), _meta_path(token)):
+        try:
+            p.unlink()
+        except OSError:
+            pass
+
+
+def purge_expired(now: Optional[float] = None) -> None:
+    """刪掉逾時的暫存檔（含寫到一半、沒有 meta 的孤兒檔）"""
+    now = time.time() if now is None else now
+    if not STORE_DIR.exists():
+        return
+    for p in STORE_DIR.glob("*.bin"):
+        token = p.stem
+        meta = _read_meta(token)
+        if meta is None:
+            try:
+                if now - p.stat().st_mtime > DEFAULT_TTL:
+                    p.unlink()
+            except OSError:
+                pass
+            continue
+        if meta.get("expires", 0) < now:
+            discard(token)
+
+
+def put(write: Callable[[BinaryIO], None], file_name: str, *, mime: str = XLSX_MIME, ttl: int = DEFAULT_TTL) -> str:
+    """
+    write(f) 直接把內容寫進暫存檔（例如 wb.save(f)），回傳 token
+    - 內容不經過記憶體中的 bytes
+    """
+    with _LOCK:
+        purge_expired()
+    STORE_DIR.mkdir(parents=True, exist_ok=True)
+    token = secrets.token_urlsafe(18)
+    path = _data_path(token)
+    try:
+        with open(path, "wb") as f:
+            write(f)
+    except Exception:
+        discard(token)
+        raise
+    meta = {"file_name": file_name, "mime": mime, "expires": time.time() + ttl, "size": path.stat().st_size}
+    _meta_path(token).write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+    return token
+
+
+def put_bytes(data: bytes, file_name: str, *, mime: str = XLSX_MIME, ttl: int = DEFAULT_TTL) -> str:
+    return put(lambda f: f.write(data), file_name, mime=mime, ttl=ttl)
+
+
+def info(token: Optional[str]) -> Optional[dict]:
+    """未逾時的項目 → meta（file_name / mime / size / expires）；否則 None"""
+    if not _valid_token(token) or not _data_path(token).exists():
+        return None
+    meta = _read_meta(token)
+    if meta is None or meta.get("expires", 0) < time.time():
+        discard(token)
+        return None
+    return meta
+
+
+def take(token: str) -> BinaryIO:
+    """
+    開啟暫存檔後立即刪除（一次性下載），回傳檔案物件交給 Streamlit 直接讀，這裡不另組一份 bytes
+    - POSIX：刪除後已開啟的檔案照樣讀得完，檔案關閉時空間才釋放
+    - Windows 開啟中的檔案刪不掉：留給 purge_expired 逾時清除
+    """
+    f = open(_data_path(token), "rb")
+    discard(token)
+    return f
+
+
+def download_button(label: str, token: Optional[str], *, key: str, **kwargs) -> bool:
+    """
+    暫存區檔案的下載鈕；項目不存在 / 已逾時 → 不顯示並回傳 False
+    - 新版 Streamlit：按下時才讀檔（data=callable），送出後刪除
+    - 舊版不支援 callable：當下讀出內容，按下後（on_click）刪除
+    """
+    meta = info(token)
+    if meta is None:
+        return False
+    common = dict(file_name=meta["file_name"], mime=meta["mime"], **kwargs)
+    try:
+        st.download_button(label, data=lambda: take(token), key=key, **common)
+    except Exception:
+        with open(_data_path(token), "rb") as f:
+            data = f.read()
+        st.download_button(label, data=data, key=f"{key}_bytes", on_click=discard, args=(token,), **common)
+    return True
+
+
+def clear_store() -> None:
+    """清空暫存目錄（維護用）"""
+    with _LOCK:
+        shutil.rmtree(STORE_DIR, ignore_errors=True)
@@ -0,0 +1,476 @@
+"""
+共用 Excel 匯出服務（xlsxwriter 單趟串流寫出）
+- 各頁只要給 DataFrame + SheetStyle（宣告式樣式）：表頭格式、欄寬、數字格式、條件格式、凍結窗格、表格樣式
+- 預設 constant_memory：逐列寫出、寫完一列就落地到暫存檔，10 萬列以上的明細也不會整張表留在記憶體
+- 取代原本「pandas 寫出 → load_workbook 重開 → 逐格套樣式 → 再存一次」的做法
+- 唯一例外：要原生表格（table_style）時 xlsxwriter 不支援 constant_memory，該活頁簿改用一般模式（仍是單趟寫出）
+"""
+
+from __future__ import annotations
+
+import io
+import os
+import re
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple, Union
+
+import pandas as pd
+import xlsxwriter
+from xlsxwriter.utility import xl_col_to_name
+
+from arrow_strings import TEXT_DTYPE, as_text
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+DATE_FORMAT = "yyyy-mm-dd hh:mm:ss"
+
+# Excel 不接受的控制字元（xlsxwriter 會轉成 _xHHHH_ 保留；要跟舊版一樣直接移除時用 strip_control_chars）
+CONTROL_CHARS_RE = re.compile(r"[\000-\010]|[\013-\014]|[\016-\037]")
+
+# pandas to_excel 預設表頭（粗體、框線、置中）
+PANDAS_HEADER: Dict[str, Any] = {"bold": True, "border": 1, "align": "center", "valign": "top"}
+
+# Excel 單一工作表列數上限（含表頭）；超過時自動拆成多張編號工作表
+EXCEL_MAX_ROWS = 1_048_576
+
+# RichText 上限：超過這個列數改用「後 n 碼輔助欄」（RichText 檔案大、Excel 開啟慢）
+RICH_TEXT_MAX_ROWS = int(os.environ.get("RICH_TEXT_MAX_ROWS", "50000"))
+
+# 條件格式公式裡的 {欄名} / {col} / {row} 佔位符
+_PLACEHOLDER_RE = re.compile(r"\{([^{}]+)\}")
+
+CellWriter = Callable[..., None]
+
+
+# =====================================
+# 宣告式樣式
+# =====================================
+@dataclass(frozen=True)
+class ConditionalRule:
+    """
+    xlsxwriter conditional_format 規則
+    - columns：套用的欄名
+    - options：conditional_format 參數；"format" 直接給格式 dict
+      公式可用佔位符：{col}=目前欄字母、{row}=範圍第一列列號、{欄名}=該欄字母
+    - first_row / last_row：只套用部分資料列（0 起算，不含表頭）；None = 全部資料列
+    """
+    columns: Tuple[str, ...]
+    options: Dict[str, Any]
+    first_row: Optional[int] = None
+    last_row: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class SuffixEmphasis:
+    """
+    條碼欄「後 n 碼放大」（給現場看後幾碼）
+    - normalize：整欄向量化轉字串（預設去空白；空字串視為空白格）
+    - 列數 ≤ max_rich_rows：同一格 RichText（前段一般字、後 n 碼套 big）
+    - 超過：條碼欄寫純文字，右邊插入輔助欄（helper_header）只放後 n 碼並整欄套 big
+    """
+    n: int = 5
+    big: Dict[str, Any] = field(default_factory=lambda: {"bold": True, "font_size": 18})
+    normal: Optional[Dict[str, Any]] = None
+    normalize: Optional[Callable[[pd.Series], pd.Series]] = None
+    max_rich_rows: Optional[int] = RICH_TEXT_MAX_ROWS
+    helper_header: str = "{col}後{n}碼"
+
+    def use_rich(self, n_rows: int) -> bool:
+        return self.max_rich_rows is None or n_rows <= self.max_rich_rows
+
+
+@dataclass(frozen=True)
+class SheetStyle:
+    header: Optional[Dict[str, Any]] = field(default_factory=lambda: dict(PANDAS_HEADER))
+    body: Optional[Dict[str, Any]] = None                 # 所有資料格
+    band: Optional[Dict[str, Any]] = None                 # 隔列底色（資料第 1、3、5… 列，即 Excel 第 2、4、6… 列）
+    # 欄名或欄位序號（0 起算；重複 / 空白欄名時用序號才不會互撞）→ 格式（num_format 等）
+    column_formats: Dict[Union[str, int], Dict[str, Any]] = field(default_factory=dict)
+    # 欄寬："auto" = 依內容；dict = 欄名或 Excel 欄位範圍（"C:K"）→ 寬度；None = 不設定
+    widths: Union[str, Dict[str, float], None] = "auto"
+    width_padding: int = 2
+    max_width: float = 50
+    width_sample: Optional[int] = None                    # "auto" 欄寬只看前 N 列（None = 全部）
+    freeze: Optional[Tuple[int, int]] = (1, 0)            # 從表頭列起算（1, 0 = 凍結表頭）
+    autofilter: bool = False
+    table_style: Optional[str] = None                     # 例如 "Table Style Medium 4"
+    table_name: Optional[str] = None
+    conditional: Tuple[ConditionalRule, ...] = ()
+    cell_writers: Dict[Union[str, int], CellWriter] = field(default_factory=dict)  # 欄名或欄位序號 → 自訂寫入
+    suffix_emphasis: Dict[str, SuffixEmphasis] = field(default_factory=dict)  # 欄名 → 後 n 碼放大
+    strip_control_chars: bool = False
+    row_height: Optional[float] = None                    # 全部列高（set_default_row，不必逐列設定）
+    start_row: int = 0                                    # 表頭所在列（上方留給 before 寫說明）
+    before: Optional[Callable[..., None]] = None          # before(ws, fmt)：寫在表格上方的內容
+
+
+DEFAULT_STYLE = SheetStyle()
+PLAIN_STYLE = SheetStyle(widths=None, freeze=None)
+
+
+# =====================================
+# 格式快取
+# =====================================
+class _FormatCache:
+    """同樣的格式 dict 只 add_format 一次（xlsxwriter 每個 Format 都會寫進 styles.xml）"""
+
+    def __init__(self, workbook):
+        self.workbook = workbook
+        self._cache: Dict[Tuple, Any] = {}
+
+    def __call__(self, props: Optional[Dict[str, Any]]):
+        if not props:
+            return None
+        key = tuple(sorted((k, repr(v)) for k, v in props.items()))
+        fmt = self._cache.get(key)
+        if fmt is None:
+            fmt = self._cache[key] = self.workbook.add_format(dict(props))
+        return fmt
+
+
+def _merge(*parts: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    out: Dict[str, Any] = {}
+    for p in parts:
+        if p:
+            out.update(p)
+    return out or None
+
+
+# =====================================
+# 欄位資料 → 寫入
+# =====================================
+def _column_values(s: pd.Series, strip_control: bool) -> list:
+    """整欄轉 Python 值（空值 → None），一次向量化完成"""
+    if strip_control and (
+        isinstance(s.dtype, pd.StringDtype)
+        or (s.dtype == object and pd.api.types.infer_dtype(s, skipna=True) == "string")
+    ):
+        s = s.str.replace(CONTROL_CHARS_RE, "", regex=True)
+    if isinstance(s.dtype, pd.DatetimeTZDtype):
+        s = s.dt.tz_localize(None)
+    out = s.astype(object)
+    mask = s.isna()
+    if mask.any():
+        out = out.where(~mask, None)
+    return out.tolist()
+
+
+def _pick_writer(ws, s: pd.Series):
+    """依欄型別選 xlsxwriter 的寫入函式，省去每格 ws.write() 的型別判斷"""
+    dtype = s.dtype
+    if pd.api.types.is_bool_dtype(dtype):
+        return ws.write_boolean
+    if pd.api.types.is_numeric_dtype(dtype):
+        return ws.write_number
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return ws.write_datetime
+    if isinstance(dtype, pd.StringDtype):
+        return ws.write_string
+    return ws.write
+
+
+# =====================================
+# 欄寬：寫出前直接由 DataFrame 算好（不必再掃一遍工作表）
+# =====================================
+# 東亞寬字元（中日韓文字、全形標點 / 英數）在 Excel 約佔 2 個英數字寬
+_WIDE_CHARS_RE = (
+    "[\u1100-\u115F\u2E80-\u303E\u3041-\u33FF\u3400-\u4DBF\u4E00-\u9FFF\uA000-\uA4CF"
+    "\uAC00-\uD7A3\uF900-\uFAFF\uFE30-\uFE4F\uFF00-\uFF60\uFFE0-\uFFE6\U00020000-\U0003FFFD]"
+)
+
+
+def text_display_width(text: str) -> int:
+    return len(text) + len(re.findall(_WIDE_CHARS_RE, text))
+
+
+def max_display_width(s: pd.Series) -> int:
+    """欄內最大顯示寬度（向量化：字數 + 寬字元數）"""
+    s = s.dropna()
+    if s.empty:
+        return 0
+    if not isinstance(s.dtype, pd.StringDtype):
+        s = s.astype(str).astype(TEXT_DTYPE)
+    return int((s.str.len() + s.str.count(_WIDE_CHARS_RE)).max())
+
+
+def column_widths(
+    df: pd.DataFrame,
+    *,
+    padding: int = 2,
+    max_width: float = 50,
+    min_width: float = 0,
+    sample: Optional[int] = None,
+) -> List[float]:
+    """
+    每欄欄寬 = max(表頭, 內容) 顯示寬度 + padding，限制在 [min_width, max_width]
+    - sample：只看前 N 列（None = 全部）
+    """
+    data = df.head(sample) if sample else df
+    widths: List[float] = []
+    for j, name in enumerate(df.columns):
+        length = max(text_display_width(str(name)), max_display_width(data.iloc[:, j]))
+        widths.append(min(max(length + padding, min_width), max_width))
+    return widths
+
+
+def set_openpyxl_widths(ws, widths: Sequence[float], start_col: int = 1) -> None:
+    """把 column_widths() 的結果套到 openpyxl 工作表"""
+    for j, w in enumerate(widths):
+        ws.column_dimensions[xl_col_to_name(start_col - 1 + j)].width = w
+
+
+def _apply_widths(ws, df: pd.DataFrame, style: SheetStyle) -> None:
+    if style.widths is None:
+        return
+    if style.widths == "auto":
+        widths = column_widths(df, padding=style.width_padding, max_width=style.max_width, sample=style.width_sample)
+        for j, w in enumerate(widths):
+            ws.set_column(j, j, w)
+        return
+    positions = {str(c): j for j, c in enumerate(df.columns)}
+    for key, width in style.widths.items():
+        j = positions.get(str(key))
+        if j is not None:
+            ws.set_column(j, j, width)
+        else:
+            key = str(key)
+            ws.set_column(key if ":" in key else f"{key}:{key}", width)  # Excel 欄位，例如 "D" / "C:K"
+
+
+def _fill_placeholders(text: str, letters: Mapping[str, str]) -> str:
+    return _PLACEHOLDER_RE.sub(lambda m: letters.get(m.group(1), m.group(0)), text)
+
+
+def _apply_conditionals(ws, df: pd.DataFrame, style: SheetStyle, fmt: _FormatCache) -> None:
+    if not style.conditional or df.empty:
+        return
+    top = style.start_row + 1
+    letters = {str(c): xl_col_to_name(j) for j, c in enumerate(df.columns)}
+    positions = {str(c): j for j, c in enumerate(df.columns)}
+    for rule in style.conditional:
+        first = top + (rule.first_row or 0)
+        last = top + (len(df) - 1 if rule.last_row is None else rule.last_row)
+        if last < first:
+            continue
+        for name in rule.columns:
+            j = positions.get(str(name))
+            if j is None:
+                continue
+            local = dict(letters, col=letters[str(name)], row=str(first + 1))
+            options = {}
+            for k, v in rule.options.items():
+                if k == "format":
+                    v = fmt(v)
+                elif isinstance(v, str):
+                    v = _fill_placeholders(v, local)
+                options[k] = v
+            ws.conditional_format(first, j, last, j, options)
+
+
+# =====================================
+# 條碼後 n 碼放大
+# =====================================
+def _suffix_writer(spec: SuffixEmphasis) -> CellWriter:
+    """值已是正規化後的字串；只負責切前段 / 後 n 碼"""
+
+    def write(ws, row: int, col: int, value, props, fmt) -> None:
+        if len(value) <= spec.n:
+            ws.write_string(row, col, value, fmt(_merge(props, spec.big)))
+            return
+        prefix = [fmt(spec.normal), value[:-spec.n]] if spec.normal else [value[:-spec.n]]
+        cell_fmt = [fmt(props)] if props else []  # 最後一個參數若是 Format 才是整格格式
+        ws.write_rich_string(row, col, *prefix, fmt(spec.big), value[-spec.n:], *cell_fmt)
+
+    return write
+
+
+def _shift_positions(mapping: Dict[Union[str, int], Any], pos: int) -> Dict[Union[str, int], Any]:
+    """在 pos 插入一欄後，右邊欄位的序號鍵跟著右移"""
+    return {(k + 1 if isinstance(k, int) and k >= pos else k): v for k, v in mapping.items()}
+
+
+def _prepare_suffix_columns(df: pd.DataFrame, style: SheetStyle) -> Tuple[pd.DataFrame, SheetStyle]:
+    """條碼欄整欄先正規化；超過 RichText 門檻的改成「純文字 + 後 n 碼輔助欄」"""
+    specs = {c: sp for c, sp in style.suffix_emphasis.items() if c in df.columns}
+    if not specs:
+        return df, style
+
+    df = df.copy()
+    column_formats = dict(style.column_formats)
+    cell_writers = dict(style.cell_writers)
+    for col, spec in specs.items():
+        text = spec.normalize(df[col]) if spec.normalize else as_text(df[col])
+        text = text.astype(TEXT_DTYPE)
+        text = text.mask(text.eq(""))
+        df[col] = text
+        if spec.use_rich(len(df)):
+            cell_writers[col] = _suffix_writer(spec)
+        else:
+            helper = spec.helper_header.format(col=col, n=spec.n)
+            pos = df.columns.get_loc(col) + 1
+            df.insert(pos, helper, text.str[-spec.n:])
+            column_formats = _shift_positions(column_formats, pos)
+            cell_writers = _shift_positions(cell_writers, pos)
+            column_formats[helper] = _merge({"num_format": "@"}, column_formats.get(col), column_formats.get(pos - 1), spec.big)
+    return df, replace(style, column_formats=column_formats, cell_writers=cell_writers)
+
+
+def _write_sheet(workbook, fmt: _FormatCache, name: str, df: pd.DataFrame, style: SheetStyle) -> None:
+    df, style = _prepare_suffix_columns(df, style)
+    ws = workbook.add_worksheet(name)
+    if style.row_height:
+        ws.set_default_row(style.row_height)
+    if style.before is not None:
+        style.before(ws, fmt)
+
+    top = style.start_row
+    n_rows, n_cols = df.shape
+    columns = [str(c) for c in df.columns]
+    use_table = bool(style.table_style) and n_rows > 0
+
+    # 表頭（原生表格由 add_table 自己寫表頭）
+    header_fmt = fmt(style.header)
+    if not use_table:
+        for j, col in enumerate(columns):
+            ws.write_string(top, j, col, header_fmt)
+
+    # 每欄預先算好格式 / 寫入函式
+    col_props = [
+        _merge(style.body, style.column_formats.get(c), style.column_formats.get(j))
+        for j, c in enumerate(columns)
+    ]
+    for j in range(n_cols):
+        # 日期欄有自訂格式（含隔列底色）時不會套 default_date_format，明確帶上日期格式
+        if pd.api.types.is_datetime64_any_dtype(df.dtypes.iloc[j]):
+            col_props[j] = _merge({"num_format": DATE_FORMAT}, col_props[j])
+    band_props = [_merge(p, style.band) for p in col_props] if style.band else col_props
+    plain_fmts = [fmt(p) for p in col_props]
+    band_fmts = [fmt(p) for p in band_props]
+    writers = [_pick_writer(ws, df.iloc[:, j]) for j in range(n_cols)]
+    custom = [style.cell_writers.get(j) or style.cell_writers.get(c) for j, c in enumerate(columns)]
+    values = [_column_values(df.iloc[:, j], style.strip_control_chars) for j in range(n_cols)]
+
+    for i, row in enumerate(zip(*values)):
+        r = top + 1 + i
+        banded = style.band is not None and i % 2 == 0
+        fmts = band_fmts if banded else plain_fmts
+        props = band_props if banded else col_props
+        for j, v in enumerate(row):
+            if v is None:
+                if fmts[j] is not None:
+                    ws.write_blank(r, j, None, fmts[j])
+                continue
+            if custom[j] is not None:
+                custom[j](ws, r, j, v, props[j], fmt)
+            else:
+                writers[j](r, j, v, fmts[j])
+
+    _apply_widths(ws, df, style)
+    _apply_conditionals(ws, df, style, fmt)
+
+    last_row = top + n_rows
+    if use_table:
+        options = {
+            "style": style.table_style,
+            "columns": [{"header": c, "header_format": header_fmt} for c in columns],
+        }
+        if style.table_name:
+            options["name"] = style.table_name
+        ws.add_table(top, 0, last_row, max(n_cols - 1, 0), options)
+    elif style.autofilter and n_cols:
+        ws.autofilter(top, 0, last_row, n_cols - 1)
+
+    if style.freeze:
+        ws.freeze_panes(top + style.freeze[0], style.freeze[1])
+
+
+# =====================================
+# 超過 Excel 列數上限：拆成多張工作表
+# =====================================
+def shard_name(name: str, k: int) -> str:
+    """第 k 張分頁名稱（name_k），整體仍限制 31 字"""
+    suffix = f"_{k}"
+    return f"{name[:31 - len(suffix)]}{suffix}"
+
+
+def iter_shards(name: str, df: pd.DataFrame, *, header_rows: int = 1):
+    """
+    (工作表名稱, 片段, 片段起始列) 依序產出
+    - 沒超過上限：原名稱整張一片
+    - 超過：name_1、name_2…，每片最多 EXCEL_MAX_ROWS - header_rows 列
+    """
+    limit = EXCEL_MAX_ROWS - header_rows
+    if len(df) <= limit:
+        yield name, df, 0
+        return
+    for k, start in enumerate(range(0, len(df), limit), start=1):
+        yield shard_name(name, k), df.iloc[start:start + limit], start
+
+
+def _shard_style(style: SheetStyle, offset: int, n_rows: int) -> SheetStyle:
+    """分片後的樣式：只套用落在這一片的條件格式列範圍；上方說明只寫在第一片"""
+    if offset == 0 and not any(r.first_row is not None or r.last_row is not None for r in style.conditional):
+        return style
+    rules = []
+    for rule in style.conditional:
+        first = 0 if rule.first_row is None else rule.first_row - offset
+        last = n_rows - 1 if rule.last_row is None else rule.last_row - offset
+        first, last = max(first, 0), min(last, n_rows - 1)
+        if first > last:
+            continue
+        if rule.first_row is None and rule.last_row is None:
+            rules.append(rule)
+        else:
+            rules.append(replace(rule, first_row=first, last_row=last))
+    return replace(style, conditional=tuple(rules), before=style.before if offset == 0 else None)
+
+
+# =====================================
+# 對外介面
+# =====================================
+SheetInput = Union[pd.DataFrame, Tuple[pd.DataFrame, SheetStyle]]
+
+
+def write_workbook(sheets: Mapping[str, SheetInput], *, default_style: SheetStyle = DEFAULT_STYLE) -> bytes:
+    """
+    sheets：{工作表名稱: DataFrame 或 (DataFrame, SheetStyle)}，依順序寫出
+    - 工作表名稱超過 31 字自動截斷；DataFrame 為 None 的略過
+    - 超過 Excel 列數上限的表自動拆成 名稱_1、名稱_2…
+    """
+    items: List[Tuple[str, pd.DataFrame, SheetStyle]] = []
+    for name, spec in sheets.items():
+        df, style = spec if isinstance(spec, tuple) else (spec, default_style)
+        if df is None:
+            continue
+        name = str(name)[:31] or "Sheet1"
+        for part_name, part, offset in iter_shards(name, df, header_rows=style.start_row + 1):
+            items.append((part_name, part, _shard_style(style, offset, len(part))))
+
+    # 不可加 in_memory：xlsxwriter 遇到 in_memory 會直接關掉 constant_memory。
+    # constant_memory 每張表邊寫邊落地到暫存檔，最後才組成 xlsx 寫進 output
+    constant_memory = not any(s.table_style for _, d, s in items if len(d))
+    output = io.BytesIO()
+    workbook = xlsxwriter.Workbook(output, {
+        "constant_memory": constant_memory,
+        "strings_to_formulas": False,
+        "strings_to_urls": False,
+        "strings_to_numbers": False,
+        "nan_inf_to_errors": True,
+        "default_date_format": DATE_FORMAT,
+    })
+    assert workbook.constant_memory == constant_memory, "xlsxwriter 未啟用 constant_memory（選項互相衝突？）"
+    fmt = _FormatCache(workbook)
+    for name, df, style in items:
+        _write_sheet(workbook, fmt, name, df, style)
+    if not items:
+        workbook.add_worksheet("Sheet1")
+    workbook.close()
+    return output.getvalue()
+
+
+def rows_to_frame(rows: Sequence[Sequence[Any]]) -> pd.DataFrame:
+    """[[表頭...], [值...], ...] → DataFrame（統計表常用的 list 形式）"""
+    rows = list(rows)
+    if not rows:
+        return pd.DataFrame()
+    return pd.DataFrame([list(r) for r in rows[1:]], columns=list(rows[0]))
+
@@ -0,0 +1,174 @@
+"""
+報表下載包：摘要 / KPI 仍是 Excel，原始明細表改用 Parquet 或 gzip CSV
+- 原始明細（合併原始、處理後來源分頁…）沒人會在 Excel 裡排版，卻佔掉大部分匯出時間與檔案大小
+- 選 xlsx：照舊全部寫進同一本活頁簿
+- 選 parquet / csv.gz：活頁簿只留摘要表，明細各自一個檔，與活頁簿一起打包成 ZIP
+"""
+
+from __future__ import annotations
+
+import io
+import os
+import re
+import zipfile
+from typing import Callable, Dict, Iterable, Mapping, Optional, Tuple
+
+import pandas as pd
+import streamlit as st
+
+from arrow_strings import as_text
+from export_recipe import ExportRecipe
+
+# ===== 可調參數（可用環境變數覆寫） =====
+RAW_FORMATS = {
+    "xlsx": "全部放在 Excel",
+    "parquet": "明細另存 Parquet",
+    "csv.gz": "明細另存 CSV（gzip）",
+}
+DEFAULT_RAW_FORMAT = os.environ.get("EXPORT_RAW_FORMAT", "xlsx").strip().lower()
+if DEFAULT_RAW_FORMAT not in RAW_FORMATS:
+    DEFAULT_RAW_FORMAT = "xlsx"
+
+PARQUET_COMPRESSION = os.environ.get("EXPORT_PARQUET_COMPRESSION", "zstd")
+CSV_GZIP_LEVEL = int(os.environ.get("EXPORT_CSV_GZIP_LEVEL", "6"))
+
+ZIP_MIME = "application/zip"
+
+_UNSAFE_NAME_RE = re.compile(r'[\\/:*?"<>|\x00-\x1f]+')
+
+
+# =====================================
+# 單一明細表 → bytes
+# =====================================
+def _parquet_ready(df: pd.DataFrame) -> pd.DataFrame:
+    """混型 object 欄（數字夾文字等）Arrow 轉不過：轉成文字（空值保留）"""
+    out = df.copy()
+    for c in out.columns[out.dtypes == object]:
+        out[c] = as_text(out[c], fill=None, strip=False)
+    out.columns = [str(c) for c in out.columns]
+    return out
+
+
+def raw_table_bytes(df: pd.DataFrame, fmt: str) -> bytes:
+    """fmt：parquet / csv.gz"""
+    buf = io.BytesIO()
+    if fmt == "parquet":
+        try:
+            df.to_parquet(buf, index=False, compression=PARQUET_COMPRESSION)
+        except Exception:
+            buf = io.BytesIO()
+            _parquet_ready(df).to_parquet(buf, index=False, compression=PARQUET_COMPRESSION)
+    elif fmt == "csv.gz":
+        # utf-8-sig：解壓後直接用 Excel 開也不會亂碼
+        df.to_csv(
+            buf,
+            index=False,
+            encoding="utf-8-sig",
+            compression={"method": "gzip", "compresslevel": CSV_GZIP_LEVEL, "mtime": 0},
+        )
+    else:
+        raise ValueError(f"不支援的明細格式：{fmt}")
+    return buf.getvalue()
+
+
+# =====================================
+# 打包
+# =====================================
+def _file_stem(name: str, used: set) -> str:
+    stem = _UNSAFE_NAME_RE.sub("_", str(name)).strip(" .") or "明細"
+    base, k = stem, 1
+    while stem in used:
+        k += 1
+        stem = f"{base}_{k}"
+    used.add(stem)
+    return stem
+
+
+def bundle_name(workbook_name: str) -> str:
+    stem = re.sub(r"\.xlsx?$", "", workbook_name, flags=re.IGNORECASE)
+    return f"{stem}.zip"
+
+
+def split_sheets(
+    sheets: Mapping[str, object],
+    raw_names: Iterable[str],
+    raw_format: str,
+) -> Tuple[Dict[str, object], Dict[str, pd.DataFrame]]:
+    """
+    依輸出格式把工作表分成（活頁簿工作表, 原始明細表）
+    - xlsx：全部留在活頁簿
+    - 其他：raw_names 內的表抽出來另存（值可為 DataFrame 或 (DataFrame, SheetStyle)）
+    """
+    if raw_format == "xlsx":
+        return dict(sheets), {}
+    raw_set = set(raw_names)
+    workbook, raw = {}, {}
+    for name, spec in sheets.items():
+        if name in raw_set:
+            df = spec[0] if isinstance(spec, tuple) else spec
+            if df is not None:
+                raw[name] = df
+        else:
+            workbook[name] = spec
+    return workbook, raw
+
+
+def write_bundle(
+    workbook_bytes: bytes,
+    raw_tables: Mapping[str, pd.DataFrame],
+    *,
+    raw_format: str,
+    workbook_name: str = "報表.xlsx",
+) -> bytes:
+    """活頁簿 + 各明細檔 → ZIP bytes（內容已壓縮過，ZIP 只做封裝不再壓一次）"""
+    ext = "parquet" if raw_format == "parquet" else "csv.gz"
+    out = io.BytesIO()
+    used: set = set()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_STORED) as archive:
+        archive.writestr(workbook_name, workbook_bytes)
+        for name, df in raw_tables.items():
+            archive.writestr(f"{_file_stem(name, used)}.{ext}", raw_table_bytes(df, raw_format))
+    return out.getvalue()
+
+
+def build_report(
+    sheets: Mapping[str, object],
+    raw_names: Iterable[str],
+    write: Callable[[Dict[str, object]], bytes],
+    *,
+    raw_format: str = "xlsx",
+    workbook_name: str = "報表.xlsx",
+) -> ExportRecipe:
+    """
+    write(活頁簿工作表) → xlsx bytes；回傳下載配方（按下載時才寫 Excel / 打包）
+    - 沒有要另存的明細時就是原本的 xlsx；配方的 file_name / mime 即下載檔名與類型
+    """
+    workbook_sheets, raw = split_sheets(sheets, raw_names, raw_format)
+    xlsx = ExportRecipe(write, (workbook_sheets,), file_name=workbook_name)
+    if not raw:
+        return xlsx
+    return xlsx.then(
+        write_bundle,
+        raw,
+        raw_format=raw_format,
+        workbook_name=workbook_name,
+        file_name=bundle_name(workbook_name),
+        mime=ZIP_MIME,
+    )
+
+
+# =====================================
+# UI
+# =====================================
+def raw_format_selector(key: str, *, label: str = "原始明細輸出格式", help: Optional[str] = None) -> str:
+    """各報表共用的格式選項；回傳 RAW_FORMATS 的 key"""
+    options = list(RAW_FORMATS)
+    return st.radio(
+        label,
+        options,
+        index=options.index(DEFAULT_RAW_FORMAT),
+        format_func=RAW_FORMATS.get,
+        horizontal=True,
+        key=key,
+        help=help or "明細量大時選 Parquet / CSV：摘要仍為 Excel，明細另存成檔案一起打包下載（ZIP），匯出更快、檔案更小。",
+    )
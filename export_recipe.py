@@ -0,0 +1,160 @@
+"""
+延後產生的匯出檔（export recipe）
+- 計算只回傳資料表 + 一份「怎麼產生檔案」的配方，互動路徑上不再寫 xlsx
+- 使用者按下載時才呼叫 build(*args, **kwargs)（Streamlit 下載鈕 data=callable）
+- 產生過的內容不放在配方上，而是放進 process 共用、有位元組上限的 LRU（依配方 token）：
+  配方常跟著結果留在 result_cache / session_store，內容若掛在配方上會一直被釘在記憶體、也不受預算管
+- 可串接：then() 產生「以上游產出為第一個參數」的後製配方（套門檻格式、打包 ZIP…），
+  產生時先產生上游
+- build 若是模組層級函式，配方可以 pickle（跟著結果進 result_cache / 溢出到磁碟）；
+  token 一起存，同一份快取讀回的配方共用已產生的內容
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple, Union
+
+import streamlit as st
+
+from excel_export import XLSX_MIME
+
+# ===== 可調參數（可用環境變數覆寫） =====
+RENDER_CACHE_BYTES = int(os.environ.get("EXPORT_RENDER_CACHE_BYTES", str(128 * 1024 * 1024)))
+
+_RENDER_LOCK = threading.Lock()
+_RENDERED: "OrderedDict[str, bytes]" = OrderedDict()   # 配方 token → 已產生的內容（LRU）
+
+
+def _rendered_get(token: str) -> Optional[bytes]:
+    with _RENDER_LOCK:
+        data = _RENDERED.get(token)
+        if data is not None:
+            _RENDERED.move_to_end(token)
+        return data
+
+
+def _rendered_put(token: str, data: bytes) -> None:
+    if len(data) > RENDER_CACHE_BYTES:
+        return
+    with _RENDER_LOCK:
+        _RENDERED[token] = data
+        _RENDERED.move_to_end(token)
+        total = sum(len(v) for v in _RENDERED.values())
+        while total > RENDER_CACHE_BYTES:
+            _, old = _RENDERED.popitem(last=False)
+            total -= len(old)
+
+
+def clear_rendered() -> None:
+    """清空已產生內容的快取（維護用）"""
+    with _RENDER_LOCK:
+        _RENDERED.clear()
+
+
+class ExportRecipe:
+    """build(*args, **kwargs) → bytes；args / kwargs 內的 ExportRecipe 會先產生再傳入"""
+
+    def __init__(
+        self,
+        build: Callable[..., bytes],
+        args: Tuple[Any, ...] = (),
+        kwargs: Optional[Dict[str, Any]] = None,
+        *,
+        file_name: str = "報表.xlsx",
+        mime: str = XLSX_MIME,
+    ):
+        self.build = build
+        self.args = tuple(args)
+        self.kwargs = dict(kwargs or {})
+        self.file_name = file_name
+        self.mime = mime
+        self.token = uuid.uuid4().hex
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        name = getattr(self.build, "__qualname__", repr(self.build))
+        return f"ExportRecipe({name}, file_name={self.file_name!r}, ready={self.ready})"
+
+    # pickle：只存配方本身（含 token），不存 lock
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return _rendered_get(self.token) is not None
+
+    def inputs(self) -> Iterator[Any]:
+        """build 會拿到的參數（含上游配方）；給 session_store 估算大小用"""
+        yield from self.args
+        yield from self.kwargs.values()
+
+    def render(self) -> bytes:
+        """產生（或取回已產生的）檔案內容；同一份配方同時被按多次只產生一次"""
+        with self._lock:
+            data = _rendered_get(self.token)
+            if data is None:
+                args = [render(a) if isinstance(a, ExportRecipe) else a for a in self.args]
+                kwargs = {k: render(v) if isinstance(v, ExportRecipe) else v for k, v in self.kwargs.items()}
+                data = self.build(*args, **kwargs)
+                _rendered_put(self.token, data)
+            return data
+
+    def then(
+        self,
+        build: Callable[..., bytes],
+        *args: Any,
+        file_name: Optional[str] = None,
+        mime: Optional[str] = None,
+        **kwargs: Any,
+    ) -> "ExportRecipe":
+        """後製配方：build(本配方的產出, *args, **kwargs)"""
+        return ExportRecipe(
+            build,
+            (self,) + args,
+            kwargs,
+            file_name=file_name or self.file_name,
+            mime=mime or self.mime,
+        )
+
+
+Exportable = Union[bytes, ExportRecipe]
+
+
+def render(data: Optional[Exportable]) -> Optional[bytes]:
+    """bytes 原樣回傳；配方 → 產生內容"""
+    return data.render() if isinstance(data, ExportRecipe) else data
+
+
+def download_button(
+    label: str,
+    data: Exportable,
+    *,
+    file_name: Optional[str] = None,
+    mime: Optional[str] = None,
+    **kwargs: Any,
+) -> bool:
+    """
+    st.download_button 的包裝：data 可為 bytes 或 ExportRecipe
+    - 配方：按下時才產生（data=callable）；已產生過就直接給，也不必每次重跑都把 bytes 交給前端暫存
+    - 舊版 Streamlit 不支援 callable：當下產生
+    """
+    if isinstance(data, ExportRecipe):
+        file_name = file_name or data.file_name
+        mime = mime or data.mime
+        try:
+            return st.download_button(label, data=data.render, file_name=file_name, mime=mime, **kwargs)
+        except Exception:
+            data = data.render()
+            if kwargs.get("key"):
+                kwargs["key"] = f"{kwargs['key']}_bytes"
+    return st.download_button(label, data=data, file_name=file_name, mime=mime or XLSX_MIME, **kwargs)
@@ -0,0 +1,294 @@
+"""
+串流解析 HTML 表格（ERP 匯出的「假 xls」）
+- 編碼只判斷一次：BOM → <meta charset> → UTF-8 試解 → cp950
+- 以 lxml 的 target parser 邊餵邊解析，不建 DOM 樹、也不把整份文字 decode 成一個大字串
+- <tr> 逐列寫進「每欄一個 list」的欄緩衝；只保留目前最大的一張表，其餘表解析完即丟
+- 表頭 / 空值 / 千分位數字的處理比照 pd.read_html
+"""
+
+from __future__ import annotations
+
+import codecs
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+CHUNK_SIZE = 1024 * 1024  # 每次餵給 parser 的 bytes 數
+
+_META_CHARSET_RE = re.compile(rb"<meta[^>]*charset\s*=\s*[\"']?\s*([A-Za-z0-9_\-]+)", re.IGNORECASE)
+_TABLE_TAG_RE = re.compile(rb"<table", re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r"[\r\n]+|\s{2,}")
+_NUMERIC_RE = re.compile(r"^[+-]?(\d+|\d{1,3}(,\d{3})+)?(\.\d*)?([eE][+-]?\d+)?$")
+
+# 與 pandas 預設 na_values 一致
+NA_VALUES = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+}
+
+# 網頁常見的編碼名稱 → Python codec（big5 一律用 cp950 超集合，gb 系列用 gb18030）
+_ENCODING_ALIASES = {
+    "big5": "cp950",
+    "big5-hkscs": "big5hkscs",
+    "ms950": "cp950",
+    "x-big5": "cp950",
+    "gb2312": "gb18030",
+    "gbk": "gb18030",
+    "utf8": "utf-8",
+}
+
+
+def looks_like_html(raw: bytes) -> bool:
+    head = raw[:4096].lstrip().lower()
+    return (b"<html" in head) or (b"<!doctype" in head) or (b"<table" in head)
+
+
+def detect_html_encoding(raw: bytes) -> Tuple[str, int]:
+    """回傳 (codec 名稱, 要略過的 BOM 長度)"""
+    if raw.startswith(codecs.BOM_UTF8):
+        return "utf-8", len(codecs.BOM_UTF8)
+    if raw.startswith(codecs.BOM_UTF16_LE):
+        return "utf-16-le", len(codecs.BOM_UTF16_LE)
+    if raw.startswith(codecs.BOM_UTF16_BE):
+        return "utf-16-be", len(codecs.BOM_UTF16_BE)
+
+    m = _META_CHARSET_RE.search(raw[:4096])
+    if m:
+        name = m.group(1).decode("ascii", errors="ignore").strip().lower()
+        name = _ENCODING_ALIASES.get(name, name)
+        try:
+            return codecs.lookup(name).name, 0
+        except LookupError:
+            pass
+
+    # 沒宣告：前 1MB 能用 UTF-8 解開就當 UTF-8，否則視為台灣常見的 cp950
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(raw[:CHUNK_SIZE], final=False)
+        return "utf-8", 0
+    except UnicodeDecodeError:
+        return "cp950", 0
+
+
+# =====================================
+# lxml target：逐列收集
+# =====================================
+class _TableBuffer:
+    def __init__(self):
+        self.header: Optional[List[str]] = None
+        self.columns: List[list] = []
+        self.keep: Optional[List[int]] = None
+        self.n_rows = 0
+        self.width = 0
+        self.body_started = False
+        self.in_thead = False
+        self.row: Optional[List[Tuple[str, int, int]]] = None
+        self.row_all_th = True
+        self.cell: Optional[List[str]] = None
+        self.cell_span = (1, 1)
+        self.rowspans: Dict[int, List[Any]] = {}  # 欄位索引 → [剩餘列數, 值]
+
+    def expand_row(self) -> List[str]:
+        """套用 colspan / rowspan（重複填值，與 pd.read_html 相同）"""
+        out: List[str] = []
+
+        def fill_spans():
+            while len(out) in self.rowspans:
+                idx = len(out)
+                span = self.rowspans[idx]
+                out.append(span[1])
+                span[0] -= 1
+                if span[0] <= 0:
+                    del self.rowspans[idx]
+
+        for text, colspan, rowspan in self.row or []:
+            fill_spans()
+            for _ in range(colspan):
+                if rowspan > 1:
+                    self.rowspans[len(out)] = [rowspan - 1, text]
+                out.append(text)
+        fill_spans()
+        return out
+
+    def add_header(self, values: List[str]) -> None:
+        # 多列表頭只取最後一列（報表頁都用單層欄名）
+        self.header = values
+
+    def add_body(self, values: List[str], usecols: Optional[Callable[[Any], bool]]) -> None:
+        if not self.body_started:
+            self.body_started = True
+            if self.header is not None and usecols is not None:
+                self.keep = [j for j, h in enumerate(self.header) if usecols(h)]
+                self.header = [self.header[j] for j in self.keep]
+        if self.keep is not None:
+            n = len(values)
+            values = [values[j] if j < n else "" for j in self.keep]
+        self.width = max(self.width, len(values))
+        while len(self.columns) < len(values):
+            self.columns.append([None] * self.n_rows)
+        for j, col in enumerate(self.columns):
+            v = values[j] if j < len(values) else ""
+            col.append(None if v in NA_VALUES else v)
+        self.n_rows += 1
+
+    @property
+    def n_cols(self) -> int:
+        return max(self.width, len(self.header or []))
+
+
+class _LargestTableTarget:
+    def __init__(self, usecols: Optional[Callable[[Any], bool]], min_cols: int):
+        self.usecols = usecols
+        self.min_cols = min_cols
+        self.stack: List[_TableBuffer] = []
+        self.best: Optional[_TableBuffer] = None
+
+    def start(self, tag, attrib):
+        if tag == "table":
+            self.stack.append(_TableBuffer())
+            return
+        if not self.stack:
+            return
+        t = self.stack[-1]
+        if tag == "thead":
+            t.in_thead = True
+        elif tag == "tr":
+            t.row, t.row_all_th = [], True
+        elif tag in ("td", "th") and t.row is not None:
+            t.cell = []
+            t.cell_span = (_span(attrib.get("colspan")), _span(attrib.get("rowspan")))
+            if tag == "td":
+                t.row_all_th = False
+
+    def data(self, text):
+        if self.stack and self.stack[-1].cell is not None:
+            self.stack[-1].cell.append(text)
+
+    def end(self, tag):
+        if not self.stack:
+            return
+        t = self.stack[-1]
+        if tag in ("td", "th") and t.cell is not None:
+            text = _WHITESPACE_RE.sub(" ", "".join(t.cell)).strip()
+            t.row.append((text, t.cell_span[0], t.cell_span[1]))
+            t.cell = None
+        elif tag == "tr" and t.row is not None:
+            if t.row:
+                values = t.expand_row()
+                if t.in_thead or (not t.body_started and t.row_all_th):
+                    t.add_header(values)
+                else:
+                    t.add_body(values, self.usecols)
+            t.row = None
+        elif tag == "thead":
+            t.in_thead = False
+        elif tag == "table":
+            done = self.stack.pop()
+            if done.n_cols < self.min_cols:
+                return
+            if self.best is None or done.n_rows * done.n_cols > self.best.n_rows * self.best.n_cols:
+                self.best = done
+
+    def close(self):
+        # 檔案被截斷、沒有 </table>：仍把未結束的表納入比較
+        while self.stack:
+            self.end("table")
+        return self.best
+
+
+def _span(v) -> int:
+    try:
+        return max(1, int(str(v).strip()))
+    except Exception:
+        return 1
+
+
+# =====================================
+# 組 DataFrame
+# =====================================
+def _mangle(names: List[str]) -> List[str]:
+    """重複欄名改成 A, A.1, A.2（同 pandas）"""
+    seen: Dict[str, int] = {}
+    out = []
+    for n in names:
+        if n in seen:
+            seen[n] += 1
+            out.append(f"{n}.{seen[n]}")
+        else:
+            seen[n] = 0
+            out.append(n)
+    return out
+
+
+def _is_number(v: str) -> bool:
+    return bool(_NUMERIC_RE.match(v)) and any(ch.isdigit() for ch in v)
+
+
+def _infer_column(values: list) -> pd.Series:
+    """整欄都是數字 → 數值欄（千分位逗號去掉）；否則文字欄，數字樣式的值一樣去千分位"""
+    nonnull = [v for v in values if v is not None]
+    if not nonnull:
+        return pd.Series(values, dtype=float)
+    if all(_is_number(v) for v in nonnull):
+        return pd.to_numeric(pd.Series(values, dtype=object).str.replace(",", "", regex=False))
+    if any("," in v for v in nonnull):
+        values = [v.replace(",", "") if v is not None and "," in v and _is_number(v) else v for v in values]
+    return pd.Series(values)
+
+
+def _to_frame(t: _TableBuffer) -> pd.DataFrame:
+    n_cols = t.n_cols
+    data = {j: _infer_column(t.columns[j] if j < len(t.columns) else [None] * t.n_rows) for j in range(n_cols)}
+    df = pd.DataFrame(data, index=pd.RangeIndex(t.n_rows))
+    if t.header is not None:
+        names = [h if h else f"Unnamed: {j}" for j, h in enumerate(t.header)]
+        names += [f"Unnamed: {j}" for j in range(len(names), n_cols)]
+        df.columns = _mangle(names)
+    return df
+
+
+def read_html_table(
+    raw: bytes,
+    *,
+    encoding: Optional[str] = None,
+    min_cols: int = 1,
+    usecols: Optional[Callable[[Any], bool]] = None,
+) -> pd.DataFrame:
+    """
+    串流解析 HTML，回傳「格數（列 × 欄）最大」的那張表。
+
+    - encoding 不給時自動判斷（只判斷一次）
+    - min_cols：欄數不足的表不列入比較（例如排版用的單欄表）
+    - usecols(欄名)：有表頭時只緩衝回傳 True 的欄位
+    """
+    from lxml import etree
+
+    if encoding is None:
+        encoding, skip = detect_html_encoding(raw)
+    else:
+        skip = 0
+    # 文字檔（TSV/CSV）被當 HTML 試讀時，先快速掃一次，免得整份餵給 parser
+    if not encoding.startswith("utf-16") and not _TABLE_TAG_RE.search(raw):
+        raise ValueError("HTML 內找不到表格")
+
+    target = _LargestTableTarget(usecols, min_cols)
+    parser = etree.HTMLParser(target=target, recover=True, remove_comments=True)
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+
+    view = memoryview(raw)
+    for i in range(skip, len(raw), CHUNK_SIZE):
+        text = decoder.decode(view[i:i + CHUNK_SIZE])
+        if text:
+            parser.feed(text)
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        parser.feed(tail)
+    try:
+        best = parser.close()
+    except etree.XMLSyntaxError:
+        # 空檔 / 完全不是 HTML
+        best = target.close()
+
+    if best is None:
+        raise ValueError("HTML 內找不到表格")
+    return _to_frame(best)
@@ -0,0 +1,218 @@
+"""
+儲位主檔登錄（儲位 → 棚別 / 儲位類型…）
+- 同一份主檔（內容指紋相同）只讀一次、正規化一次，整個 process 共用；各頁不再各自重讀
+- 版本 = 上傳內容指紋；換檔就是新版本，舊版本依最後使用時間（LRU）淘汰
+- 查表索引（正規化儲位 → 值）第一次用到時建立，之後留在主檔物件上給所有頁面共用：
+  exact（去空白）/ upper（去空白轉大寫）/ loc9（去空白取前 9 碼，即撥貨差異的 norm_loc）
+- 同一個 session 上傳過的主檔，其他頁面可直接沿用，不必再上傳一次
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import pandas as pd
+import streamlit as st
+
+from arrow_strings import as_text, categorize
+from report_schema import find_column
+from upload_buffer import content_digest, upload_fingerprint
+from upload_cache import cached_text_table
+
+# ===== 可調參數（可用環境變數覆寫） =====
+MASTER_ITEMS = int(os.environ.get("MASTER_DATA_ITEMS", "4"))  # process 內同時保留幾個版本
+
+MASTER_TYPES = ["xlsx", "xlsm", "xltx", "xltm", "xls", "xlsb", "csv", "tsv", "txt", "htm", "html"]
+SOURCE_COL = "來源檔案"
+SESSION_KEY = "_location_master_version"
+
+_LOCK = threading.Lock()
+_REGISTRY: "OrderedDict[str, LocationMaster]" = OrderedDict()
+
+
+# =====================================
+# 儲位正規化
+# =====================================
+def norm_loc(x) -> str:
+    """單一儲位 → 9 碼比對鍵（空值為空字串）"""
+    if pd.isna(x):
+        return ""
+    return str(x).strip()[:9]
+
+
+KEY_RULES: Dict[str, Callable[[pd.Series], pd.Series]] = {
+    "exact": lambda s: s,
+    "upper": lambda s: s.str.upper(),
+    "loc9": lambda s: s.str.slice(0, 9),
+}
+
+
+def normalize_locations(s: pd.Series, key: str = "exact") -> pd.Series:
+    """整欄儲位 → 比對鍵（向量化；空值為空字串）"""
+    return KEY_RULES[key](as_text(s, fill=""))
+
+
+# =====================================
+# 主檔物件 + 查表索引
+# =====================================
+@dataclass(eq=False)
+class LocationMaster:
+    version: str                     # 內容指紋（多檔時為各檔指紋合併）
+    name: str                        # 顯示用檔名
+    frame: pd.DataFrame              # 原始主檔（唯讀，請勿原地修改）
+    _indexes: Dict[Tuple, pd.Series] = field(default_factory=dict, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+    def column(self, candidates: Sequence[str], *, fuzzy: bool = False) -> Optional[str]:
+        return find_column(self.frame.columns, candidates, fuzzy=fuzzy)
+
+    def index(self, value_col: str, *, loc_col: str, key: str = "exact", keep: str = "first") -> pd.Series:
+        """
+        比對鍵 → 值 的雜湊索引（同一組參數只建一次）
+        - 儲位或值為空的列不列入
+        - 同一儲位出現多次：keep="first" / "last" 決定取哪一列
+        """
+        spec = (loc_col, value_col, key, keep)
+        with self._lock:
+            idx = self._indexes.get(spec)
+            if idx is None:
+                loc = normalize_locations(self.frame[loc_col], key)
+                val = as_text(self.frame[value_col], fill="")
+                m = loc.ne("") & val.ne("")
+                idx = pd.Series(val[m].array, index=pd.Index(loc[m].array), name=value_col)
+                idx = idx[~idx.index.duplicated(keep=keep)]
+                self._indexes[spec] = idx
+        return idx
+
+    def lookup(
+        self,
+        locations: pd.Series,
+        value_col: str,
+        *,
+        loc_col: str,
+        key: str = "exact",
+        keep: str = "first",
+    ) -> pd.Series:
+        """逐列查值（查不到為 NaN，與 Series.map(dict) 相同）"""
+        idx = self.index(value_col, loc_col=loc_col, key=key, keep=keep)
+        return normalize_locations(locations, key).map(idx)
+
+
+# =====================================
+# 登錄表
+# =====================================
+def _as_list(uploads) -> List:
+    if uploads is None:
+        return []
+    if isinstance(uploads, (list, tuple)):
+        return [u for u in uploads if u is not None]
+    return [uploads]
+
+
+def load_location_master(uploads) -> LocationMaster:
+    """
+    上傳檔（單檔或多檔）→ LocationMaster；同內容直接回傳登錄表中的同一個物件（含已建好的索引）
+    - 多檔依上傳順序合併，另加「來源檔案」欄
+    """
+    files = _as_list(uploads)
+    if not files:
+        raise ValueError("未上傳儲位主檔")
+    fps = [upload_fingerprint(f) for f in files]
+    version = fps[0] if len(fps) == 1 else content_digest("|".join(fps).encode("ascii"))
+
+    with _LOCK:
+        master = _REGISTRY.get(version)
+        if master is not None:
+            _REGISTRY.move_to_end(version)
+            return master
+
+    names = [getattr(f, "name", "uploaded_file") for f in files]
+    frames = [cached_text_table(f, fp).assign(**{SOURCE_COL: n}) for f, fp, n in zip(files, fps, names)]
+    frame = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+    master = LocationMaster(version, "、".join(names), categorize(frame, [SOURCE_COL]))
+
+    with _LOCK:
+        # 兩個 session 同時讀同一份：以先登錄的為準
+        master = _REGISTRY.setdefault(version, master)
+        _REGISTRY.move_to_end(version)
+        while len(_REGISTRY) > max(1, MASTER_ITEMS):
+            _REGISTRY.popitem(last=False)
+    return master
+
+
+def registered(version: str) -> Optional[LocationMaster]:
+    with _LOCK:
+        master = _REGISTRY.get(version)
+        if master is not None:
+            _REGISTRY.move_to_end(version)
+        return master
+
+
+def clear_registry() -> None:
+    """清空登錄表（維護用）"""
+    with _LOCK:
+        _REGISTRY.clear()
+
+
+# =====================================
+# session：上傳一次，各頁沿用
+# =====================================
+def remember(master: LocationMaster) -> None:
+    st.session_state[SESSION_KEY] = master.version
+
+
+def session_master() -> Optional[LocationMaster]:
+    """本 session 最近一次上傳的主檔（已被淘汰時為 None，請使用者重新上傳）"""
+    version = st.session_state.get(SESSION_KEY)
+    return registered(version) if version else None
+
+
+def location_master_uploader(
+    label: str,
+    *,
+    key: str,
+    help: Optional[str] = None,
+    accept_multiple_files: bool = False,
+    label_visibility: str = "visible",
+    types: Iterable[str] = MASTER_TYPES,
+    requires: Sequence[Sequence[str]] = (),
+    fuzzy: bool = False,
+) -> Optional[LocationMaster]:
+    """
+    各頁共用的儲位主檔上傳欄
+    - 有上傳：登錄並記為本 session 的主檔
+    - 沒上傳：沿用本 session 先前（任一頁）上傳過的主檔，但只在它有本頁要的欄位時
+      （requires：每組候選欄名至少找得到一欄；fuzzy 同 LocationMaster.column）；
+      否則回傳 None，頁面照常顯示「請上傳」
+    - 讀檔失敗：顯示錯誤並回傳 None
+    """
+    uploads = st.file_uploader(
+        label,
+        type=list(types),
+        key=key,
+        help=help,
+        accept_multiple_files=accept_multiple_files,
+        label_visibility=label_visibility,
+    )
+    if _as_list(uploads):
+        try:
+            master = load_location_master(uploads)
+        except Exception as e:
+            st.error(f"讀取儲位主檔失敗：{e}")
+            return None
+        remember(master)
+        return master
+
+    master = session_master()
+    if master is not None and not all(master.column(c, fuzzy=fuzzy) for c in requires):
+        master = None
+    if master is not None:
+        st.caption(f"沿用本次已上傳的儲位主檔：{master.name}（{len(master):,} 筆）")
+    return master
@@ -5,7 +5,7 @@ from typing import Sequence
 
 
 APP_TITLE = "大豐物流作業平台"
-APP_ICON = "assets/gf_logo.png"
+APP_ICON = "static/gf_logo.png"
 
 HIDDEN_HOME_URLS = {
     "planning-home",
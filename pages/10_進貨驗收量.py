@@ -1,222 +1,50 @@
 # pages/10_進貨驗收量.py
-import io
-import re
 import pandas as pd
 import streamlit as st
 
 from common_ui import inject_logistics_theme, set_page, card_open, card_close
+from report_schema import apply_schema, get_schema, header_matches, usecols_for
+from sheet_stream import read_sheet_streaming, sheet_names
+from upload_buffer import upload_bytes, upload_fingerprint
 
 st.set_page_config(page_title="進貨驗收量｜大樹KPI", page_icon="📥", layout="wide")
 inject_logistics_theme()
 
 SHEET_DEFAULT = "採購單驗收量明細"
 
-# ✅ 統一用「標準欄位名」做運算（先把報表欄位自動對照到這些名稱）
-REQ_COLS = ["入庫類型", "驗收入庫數量", "供應商代號", "DC採購單號", "商品品號"]
+# ✅ 統一用「標準欄位名」做運算（欄位與同義欄名登錄在 report_schema.py：inbound_receipt）
+SCHEMA = get_schema("inbound_receipt")
+REQ_COLS = SCHEMA.required_names
 
-# ✅ 你的檔案實際會出現的同義欄位（可再加）
-COL_ALIASES = {
-    "入庫類型": ["入庫類型", "入庫型態", "入庫类型"],
-    "驗收入庫數量": ["驗收入庫數量", "驗收入庫量", "驗收入庫", "驗收入庫量", "驗收入庫數量"],
-    "供應商代號": ["供應商代號", "廠商代號", "供應商編號", "廠商編號"],
-    "DC採購單號": ["DC採購單號", "DC採購單号", "DC採購單", "採購單號(DC)"],
-    # ⚠️ 若真的沒有 DC採購單號，才退回採購單號
-    "__FALLBACK_DC_ORDER__": ["採購單號"],
-    "商品品號": ["商品品號", "商品代號", "商品料號", "品號", "料號"],
-}
 
-
-def _norm_key(s: str) -> str:
-    # 去空白、全形空白、常見符號
-    s = str(s)
-    s = s.replace("\u3000", " ")
-    s = re.sub(r"\s+", "", s)
-    return s.strip()
-
-
-def _normalize_cols(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
-    df.columns = [str(c).strip().replace("\u3000", " ") for c in df.columns]
-    return df
-
-
-def _apply_column_aliases(df: pd.DataFrame) -> pd.DataFrame:
-    """
-    把「報表欄位」自動對照成「標準欄位」(REQ_COLS)
-    - 只在標準欄位不存在時才會做 rename
-    - DC採購單號：若沒有才用 採購單號 當 fallback
-    """
-    df = df.copy()
-    cols = list(df.columns)
-
-    # 建一個 normalized -> 原始欄位名 的 lookup
-    norm_map = {}
-    for c in cols:
-        nk = _norm_key(c)
-        if nk not in norm_map:
-            norm_map[nk] = c
-
-    def find_col(candidates):
-        for cand in candidates:
-            # 先直接命中
-            if cand in df.columns:
-                return cand
-            # 再用 normalized 命中
-            nk = _norm_key(cand)
-            if nk in norm_map:
-                return norm_map[nk]
-        return None
-
-    rename_map = {}
-
-    # 一般欄位
-    for target, candidates in COL_ALIASES.items():
-        if target.startswith("__"):
-            continue
-        if target in df.columns:
-            continue
-        hit = find_col(candidates)
-        if hit and hit != target:
-            rename_map[hit] = target
-
-    # DC採購單號 fallback（只有在真的沒有 DC採購單號 時才用「採購單號」）
-    if "DC採購單號" not in df.columns:
-        fb = find_col(COL_ALIASES["__FALLBACK_DC_ORDER__"])
-        if fb:
-            rename_map[fb] = "DC採購單號"
-
-    if rename_map:
-        df = df.rename(columns=rename_map)
-
-    return df
-
-
-def _is_empty_row(vals) -> bool:
-    for v in vals:
-        if v is None:
-            continue
-        if isinstance(v, str) and v.strip() == "":
-            continue
-        return False
-    return True
-
-
-def _trim_trailing_nones(vals):
-    last = -1
-    for i, v in enumerate(vals):
-        if v is None:
-            continue
-        if isinstance(v, str) and v.strip() == "":
-            continue
-        last = i
-    if last < 0:
-        return []
-    return vals[: last + 1]
-
-
-def _find_header_row(rows, required_cols, scan_rows=250):
-    req = set([c.strip() for c in required_cols])
-    for i, r in enumerate(rows[:scan_rows]):
-        cand = [str(x).strip() if x is not None else "" for x in r]
-        cand = [c for c in cand if c]
-        cand_set = set(cand)
-        if req.issubset(cand_set):
-            return i
-    return None
-
-
-def _read_xlsb_with_pyxlsb(file_bytes: bytes, sheet_name: str) -> pd.DataFrame:
-    try:
-        from pyxlsb import open_workbook
-    except Exception as e:
-        raise ImportError("讀取 .xlsb 需要安裝 pyxlsb（requirements.txt 加上 pyxlsb）。") from e
-
-    bio = io.BytesIO(file_bytes)
-    rows = []
-
-    with open_workbook(bio) as wb:
-        if sheet_name not in wb.sheets:
-            raise KeyError(f"找不到工作表：{sheet_name}（目前工作表：{', '.join(wb.sheets)}）")
-
-        with wb.get_sheet(sheet_name) as sh:
-            for row in sh.rows():
-                vals = [c.v for c in row]
-                vals = _trim_trailing_nones(vals)
-                rows.append(vals)
-
-    if not rows:
-        return pd.DataFrame()
-
-    # 先用「標準欄位」找表頭；找不到就退回第一個非空列
-    header_idx = _find_header_row(rows, list(set(sum([v for k, v in COL_ALIASES.items() if not k.startswith("__")], []))), scan_rows=250)
-    if header_idx is None:
-        header_idx = next((i for i, r in enumerate(rows[:250]) if not _is_empty_row(r)), None)
-
-    if header_idx is None:
-        return pd.DataFrame()
-
-    header = [str(x).strip() if x is not None else "" for x in rows[header_idx]]
-    header = [h if h else f"未命名欄位_{i+1}" for i, h in enumerate(header)]
-
-    data_rows = rows[header_idx + 1 :]
-
-    # 去掉前面空白列
-    while data_rows and _is_empty_row(data_rows[0]):
-        data_rows = data_rows[1:]
-
-    cleaned = []
-    empty_run = 0
-    for r in data_rows:
-        if _is_empty_row(r):
-            empty_run += 1
-            if empty_run >= 30:
-                break
-            continue
-        empty_run = 0
-        cleaned.append(r)
-
-    if not cleaned:
-        return pd.DataFrame(columns=header)
-
-    max_len = len(header)
-    fixed = []
-    for r in cleaned:
-        rr = list(r[:max_len]) + [None] * max(0, max_len - len(r))
-        fixed.append(rr)
-
-    df = pd.DataFrame(fixed, columns=header)
-    df = _normalize_cols(df)
-    df = _apply_column_aliases(df)
-    return df
+def _is_header_row(labels) -> bool:
+    """每個標準欄位（含同義欄名）都出現在這一列 → 視為表頭"""
+    return header_matches(labels, SCHEMA)
 
 
 def _get_sheet_names(file_name: str, file_bytes: bytes):
     ext = file_name.lower().split(".")[-1]
-    bio = io.BytesIO(file_bytes)
-
-    if ext == "xlsb":
-        from pyxlsb import open_workbook
-        with open_workbook(bio) as wb:
-            return list(wb.sheets)
-
-    from openpyxl import load_workbook
-    wb = load_workbook(bio, read_only=True, data_only=True)
-    return wb.sheetnames
+    return sheet_names(file_bytes, ext)
 
 
+# 快取 key = 檔名 + 內容指紋 + 工作表；_file_bytes 以底線開頭，Streamlit 不會再雜湊整份內容
 @st.cache_data(show_spinner=False)
-def _read_excel_bytes(file_name: str, file_bytes: bytes, sheet_name: str) -> pd.DataFrame:
+def _read_excel_bytes(file_name: str, fingerprint: str, sheet_name: str, _file_bytes: bytes) -> pd.DataFrame:
     ext = file_name.lower().split(".")[-1]
-    bio = io.BytesIO(file_bytes)
-
-    if ext == "xlsb":
-        return _read_xlsb_with_pyxlsb(file_bytes, sheet_name)
 
-    # xlsx / xlsm
-    df = pd.read_excel(bio, sheet_name=sheet_name, engine="openpyxl")
-    df = _normalize_cols(df)
-    df = _apply_column_aliases(df)
-    return df
+    # 串流讀取：前 250 列內找表頭（找不到退回第一個非空列）；空白列逐列略過，
+    # 不設表尾上限，避免中間夾大段空白時後面的資料被悄悄截掉
+    # 找到表頭時只緩衝 schema 內的欄位
+    df = read_sheet_streaming(
+        _file_bytes,
+        sheet_name,
+        ext,
+        is_header=_is_header_row,
+        scan_rows=250,
+        usecols=usecols_for(SCHEMA),
+    )
+    # 同義欄名 → 標準欄名、驗收入庫數量轉數值；缺欄交給 main() 顯示
+    return apply_schema(df, SCHEMA, strict=False)
 
 
 def _compute_stats(df: pd.DataFrame, inbound_type: str) -> dict:
@@ -260,7 +88,7 @@ def main():
         st.info("請先上傳檔案後再執行統計。")
         return
 
-    file_bytes = up.getvalue()
+    file_bytes = upload_bytes(up)
 
     # 工作表清單
     try:
@@ -277,7 +105,7 @@ def main():
 
     with st.spinner("讀取資料中..."):
         try:
-            df = _read_excel_bytes(up.name, file_bytes, sheet_name)
+            df = _read_excel_bytes(up.name, upload_fingerprint(up), sheet_name, file_bytes)
         except Exception as e:
             st.error(f"讀取失敗：{e}")
             st.stop()
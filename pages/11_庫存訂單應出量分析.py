@@ -6,6 +6,10 @@ import pandas as pd
 import streamlit as st
 
 from common_ui import inject_logistics_theme, set_page, card_open, card_close
+from export_bundle import build_report, raw_format_selector
+from export_recipe import download_button
+from html_table import read_html_table
+from report_schema import find_column
 
 
 # ----------------------------
@@ -43,23 +47,6 @@ def _read_csv_best_effort(b: bytes) -> pd.DataFrame:
     return pd.read_csv(io.BytesIO(b), encoding="latin-1")
 
 
-def _read_html_best_effort(b: bytes) -> pd.DataFrame:
-    text = None
-    for enc in ("utf-8", "utf-8-sig", "big5", "cp950", "latin-1"):
-        try:
-            text = b.decode(enc)
-            break
-        except Exception:
-            continue
-    if text is None:
-        text = b.decode("utf-8", errors="ignore")
-
-    tables = pd.read_html(text)
-    if not tables:
-        raise ValueError("HTML 內找不到表格")
-    return tables[0]
-
-
 def _excel_engines_for_ext(ext: str):
     ext = ext.lower()
     if ext in (".xlsx", ".xlsm", ".xltx", ".xltm"):
@@ -71,23 +58,6 @@ def _excel_engines_for_ext(ext: str):
     return []
 
 
-def _resolve_col(df: pd.DataFrame, want: str) -> str | None:
-    """
-    欄位名稱容錯：支援前後空白差異（例如「商品 」）
-    - 先找完全相同
-    - 再找 strip 後相同
-    """
-    if want in df.columns:
-        return want
-    w = want.strip()
-    if w in df.columns:
-        return w
-    for c in df.columns:
-        if isinstance(c, str) and c.strip() == w:
-            return c
-    return None
-
-
 def _load_dataframe(uploaded_file, key_prefix: str = "") -> tuple[pd.DataFrame, str]:
     """
     回傳 (df, 讀取方式描述)
@@ -102,7 +72,7 @@ def _load_dataframe(uploaded_file, key_prefix: str = "") -> tuple[pd.DataFrame,
         df = _read_csv_best_effort(b)
         return df, "CSV"
     if ext in (".html", ".htm"):
-        df = _read_html_best_effort(b)
+        df = read_html_table(b)
         return df, "HTML"
 
     # Excel
@@ -143,9 +113,9 @@ def _compute(df: pd.DataFrame) -> dict:
     - 品項數：不重複的「商品 」(含尾端空白的欄位名)，若不存在才退回商品
     - 出貨入數：排除（存在就刪）
     """
-    unit_col = _resolve_col(df, "計量單位")
-    qty_col = _resolve_col(df, "數量")
-    unitqty_col = _resolve_col(df, "計量單位數量")
+    unit_col = find_column(df.columns, ["計量單位"])
+    qty_col = find_column(df.columns, ["數量"])
+    unitqty_col = find_column(df.columns, ["計量單位數量"])
     if not unit_col or not qty_col or not unitqty_col:
         missing = [n for n, c in [("計量單位", unit_col), ("數量", qty_col), ("計量單位數量", unitqty_col)] if c is None]
         raise KeyError(f"缺少必要欄位：{missing}")
@@ -153,7 +123,7 @@ def _compute(df: pd.DataFrame) -> dict:
     out = df.copy()
 
     # 排除「出貨入數」（容錯空白）
-    ship_in_col = _resolve_col(out, "出貨入數")
+    ship_in_col = find_column(out.columns, ["出貨入數"])
     if ship_in_col in out.columns:
         out = out.drop(columns=[ship_in_col])
 
@@ -181,13 +151,11 @@ def _compute(df: pd.DataFrame) -> dict:
     成箱 = out.loc[out[unit_col] == 2, qty_col].sum()
     零散 = out.loc[out[unit_col].isin([3, 6]), unitqty_col].sum()
 
-    slot_col = _resolve_col(out, "儲位")
+    slot_col = find_column(out.columns, ["儲位"])
     儲位數 = out[slot_col].nunique() if slot_col else None
 
     # ✅ 品項數 = 不重複「商品 」(優先)
-    prod_col = _resolve_col(out, "商品 ")
-    if not prod_col:
-        prod_col = _resolve_col(out, "商品")
+    prod_col = find_column(out.columns, ["商品 ", "商品"])
 
     if prod_col:
         prod = out[prod_col].astype(str).str.strip()
@@ -205,21 +173,26 @@ def _compute(df: pd.DataFrame) -> dict:
     }
 
 
-def _download_xlsx(summary_df: pd.DataFrame, combined_df: pd.DataFrame, per_file_dfs: list[tuple[str, pd.DataFrame]]) -> bytes:
+def _result_sheets(summary_df: pd.DataFrame, combined_df: pd.DataFrame, per_file_dfs: list[tuple[str, pd.DataFrame]]) -> dict[str, pd.DataFrame]:
+    """{工作表名稱: DataFrame}：彙總、明細_合併、各檔明細（檔名去副檔名，重複時加 _1、_2…）"""
+    sheets = {"彙總": summary_df, "明細_合併": combined_df}
+    for name, df in per_file_dfs:
+        safe = Path(name).stem[:31]
+        base = safe
+        i = 1
+        while safe in sheets:
+            suffix = f"_{i}"
+            safe = (base[: max(0, 31 - len(suffix))] + suffix)[:31]
+            i += 1
+        sheets[safe] = df
+    return sheets
+
+
+def _download_xlsx(sheets: dict[str, pd.DataFrame]) -> bytes:
     bio = io.BytesIO()
     with pd.ExcelWriter(bio, engine="openpyxl") as writer:
-        summary_df.to_excel(writer, index=False, sheet_name="彙總")
-        combined_df.to_excel(writer, index=False, sheet_name="明細_合併")
-
-        for name, df in per_file_dfs:
-            safe = Path(name).stem[:31]
-            base = safe
-            i = 1
-            while safe in writer.book.sheetnames:
-                suffix = f"_{i}"
-                safe = (base[: max(0, 31 - len(suffix))] + suffix)[:31]
-                i += 1
-            df.to_excel(writer, index=False, sheet_name=safe)
+        for name, df in sheets.items():
+            df.to_excel(writer, index=False, sheet_name=name)
 
     return bio.getvalue()
 
@@ -297,13 +270,11 @@ combined_df = pd.concat([it["res"]["df"] for it in items], ignore_index=True)
 total_loose = sum(it["res"]["零散應出"] for it in items)
 total_box = sum(it["res"]["成箱應出"] for it in items)
 
-slot_col_all = _resolve_col(combined_df, "儲位")
+slot_col_all = find_column(combined_df.columns, ["儲位"])
 combined_slots = combined_df[slot_col_all].nunique() if slot_col_all else None
 
 # ✅ 合併品項數：不重複「商品 」(優先)
-prod_col_all = _resolve_col(combined_df, "商品 ")
-if not prod_col_all:
-    prod_col_all = _resolve_col(combined_df, "商品")
+prod_col_all = find_column(combined_df.columns, ["商品 ", "商品"])
 
 if prod_col_all:
     prod_all = combined_df[prod_col_all].astype(str).str.strip()
@@ -382,15 +353,27 @@ with st.expander("🔎 各檔明細預覽（點開）", expanded=False):
             st.caption(f"讀取方式：{it['read_note']}｜{it['rows']:,} 筆 / {it['cols']:,} 欄")
             st.dataframe(dfp[ordered2].head(300), use_container_width=True, height=380)
 
-xlsx_bytes = _download_xlsx(
+result_sheets = _result_sheets(
     summary_df=summary_df,
     combined_df=combined_df[ordered],
     per_file_dfs=[(it["name"], it["res"]["df"][ordered]) for it in items],
 )
 
-st.download_button(
-    label="⬇️ 下載結果（Excel：彙總 + 合併明細 + 各檔明細）",
-    data=xlsx_bytes,
-    file_name="多檔_出貨應出量分析_結果.xlsx",
-    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+# 彙總以外都是明細：選 Parquet / CSV 時另存成檔案，與彙總 Excel 一起打包
+raw_format = raw_format_selector("raw_format_11")
+report = build_report(
+    result_sheets,
+    [name for name in result_sheets if name != "彙總"],
+    _download_xlsx,
+    raw_format=raw_format,
+    workbook_name="多檔_出貨應出量分析_結果.xlsx",
+)
+
+download_button(
+    (
+        "⬇️ 下載結果（Excel：彙總 + 合併明細 + 各檔明細）"
+        if raw_format == "xlsx"
+        else "⬇️ 下載結果（ZIP：彙總 Excel + 合併明細 + 各檔明細）"
+    ),
+    report,
 )
@@ -5,6 +5,7 @@ import pandas as pd
 import streamlit as st
 
 from common_ui import inject_logistics_theme, set_page, card_open, card_close
+from export_recipe import ExportRecipe, download_button
 
 st.set_page_config(page_title="越庫訂單分析", page_icon="🧾", layout="wide")
 inject_logistics_theme()
@@ -241,14 +242,14 @@ def main():
         st.dataframe(dfx, use_container_width=True, height=420)
 
         st.markdown("#### 💾 下載 Excel")
-        excel_bytes = _to_excel_bytes(df_out, sheet_name="剔除後明細")
-        st.download_button(
-            "下載：越庫訂單分析_剔除後明細.xlsx",
-            data=excel_bytes,
+        # 只留配方，按下載時才寫 Excel
+        export = ExportRecipe(
+            _to_excel_bytes,
+            (df_out,),
+            {"sheet_name": "剔除後明細"},
             file_name="越庫訂單分析_剔除後明細.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            use_container_width=True,
         )
+        download_button("下載：越庫訂單分析_剔除後明細.xlsx", export, use_container_width=True)
     card_close()
 
 
@@ -1,13 +1,15 @@
 # pages/13_庫存訂單實出量分析.py
 import io
 import os
-import re
 from typing import Tuple, Dict, List
 
 import pandas as pd
 import streamlit as st
 
 from common_ui import inject_logistics_theme, set_page, card_open, card_close
+from export_recipe import ExportRecipe, download_button
+from html_table import read_html_table
+from report_schema import apply_schema, get_schema, resolve_columns
 
 
 # -----------------------------
@@ -20,65 +22,24 @@ inject_logistics_theme()
 # -----------------------------
 # Requirements
 # -----------------------------
-REQUIRED_COLS = [
-    "箱類型", "packqty", "入數",
-    "buyersreference", "BOXTYPE",
-    "externorderkey", "SKU", "boxid"
-]
+SCHEMA = get_schema("stock_order_actual")
+REQUIRED_COLS = SCHEMA.required_names
 BUYERS_OK = {"GSO", "GCOR"}
 
 
 # -----------------------------
 # Column mapping (auto)
-# 你可以繼續加同義欄位，越完整越不會讀不到
-# key=標準欄名, values=可能出現的同義欄名（大小寫不拘、可含空白/底線）
+# 同義欄名統一登錄在 report_schema.py（stock_order_actual），越完整越不會讀不到
+# 比對時大小寫不拘、可含空白/底線
 # -----------------------------
-COLUMN_SYNONYMS: Dict[str, List[str]] = {
-    "箱類型": ["箱類型", "箱型", "箱别", "箱別", "boxtype_name", "carton_type", "箱種", "箱种"],
-    "packqty": ["packqty", "pack_qty", "pack quantity", "數量", "数量", "pcs", "qty", "pack"],
-    "入數": ["入數", "入数", "入數量", "入数量", "innum", "in_qty", "unitspercase", "units_per_case", "casepack", "case_pack"],
-    "buyersreference": ["buyersreference", "buyers_reference", "buyer reference", "buyerref", "order_type", "單別", "单别", "refer", "buyers ref"],
-    "BOXTYPE": ["boxtype", "box_type", "箱別型態", "箱型態", "箱别型态", "箱類型代碼", "箱类型代码"],
-    "externorderkey": ["externorderkey", "extern_order_key", "orderkey", "order_key", "order id", "order_id", "訂單號", "订单号", "單號", "单号", "externorder"],
-    "SKU": ["sku", "item", "itemcode", "item_code", "商品", "商品碼", "商品码", "品號", "品号", "料號", "料号"],
-    "boxid": ["boxid", "box_id", "box id", "箱號", "箱号", "箱碼", "箱码", "cartonid", "carton_id", "containerid", "container_id"],
-}
-
-
-def _normalize_col(s: str) -> str:
-    """把欄名統一成：小寫 + 去空白 + 移除特殊字元"""
-    s = str(s).strip()
-    s = s.replace("\u3000", " ")  # 全形空白
-    s = re.sub(r"\s+", "", s)     # 移除所有空白
-    s = s.replace("-", "_").replace(".", "_").replace("/", "_")
-    s = re.sub(r"[^0-9a-zA-Z_\u4e00-\u9fff]", "", s)  # 保留中英數與底線
-    return s.lower()
-
-
 def _apply_column_mapping(df: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[str, str]]:
     """
-    依 COLUMN_SYNONYMS 自動把同義欄名 rename 成標準欄名
+    依 schema 自動把同義欄名 rename 成標準欄名，並把數值欄轉型
     回傳：新df + 命中的對照表（原欄名 -> 標準欄名）
     """
-    df = df.copy()
-    orig_cols = list(df.columns)
-
-    norm_to_orig = {}
-    for c in orig_cols:
-        norm_to_orig[_normalize_col(c)] = c
-
-    rename_map = {}  # orig -> std
-    for std, syns in COLUMN_SYNONYMS.items():
-        for syn in syns:
-            key = _normalize_col(syn)
-            if key in norm_to_orig:
-                rename_map[norm_to_orig[key]] = std
-                break
-
-    if rename_map:
-        df = df.rename(columns=rename_map)
-
-    return df, rename_map
+    found = resolve_columns(df.columns, SCHEMA)
+    hit_map = {str(orig): std for std, orig in found.items()}
+    return apply_schema(df, SCHEMA, strict=False), hit_map
 
 
 def _is_provider_fake_xls(raw: bytes) -> bool:
@@ -86,18 +47,6 @@ def _is_provider_fake_xls(raw: bytes) -> bool:
     return (b"PROVIDER" in head) or (b"<HTML" in head) or (b"<TABLE" in head)
 
 
-def _read_html_from_bytes(raw: bytes) -> pd.DataFrame:
-    for enc in ("utf-8", "utf-8-sig", "big5", "cp950", "latin1"):
-        try:
-            text = raw.decode(enc, errors="ignore")
-            tables = pd.read_html(io.StringIO(text))
-            if tables:
-                return tables[0]
-        except Exception:
-            continue
-    raise ValueError("HTML 解析失敗（可能不是表格格式或內容不完整）")
-
-
 def _read_txt_to_df(raw: bytes) -> pd.DataFrame:
     content = None
     for enc in ("utf-8", "utf-8-sig", "cp950", "big5", "latin1"):
@@ -137,7 +86,7 @@ def _read_any(uploaded) -> Tuple[pd.DataFrame, str]:
         return df, name
 
     if ext in (".html", ".htm"):
-        df = _read_html_from_bytes(raw)
+        df = read_html_table(raw)
         return df, name
 
     if ext in (".xlsx", ".xlsm"):
@@ -146,13 +95,13 @@ def _read_any(uploaded) -> Tuple[pd.DataFrame, str]:
 
     if ext == ".xls":
         if _is_provider_fake_xls(raw):
-            df = _read_html_from_bytes(raw)
+            df = read_html_table(raw)
             return df, name
         try:
             df = pd.read_excel(io.BytesIO(raw), engine="xlrd")
             return df, name
         except Exception:
-            df = _read_html_from_bytes(raw)
+            df = read_html_table(raw)
             return df, name
 
     # fallback
@@ -160,7 +109,7 @@ def _read_any(uploaded) -> Tuple[pd.DataFrame, str]:
         df = pd.read_excel(io.BytesIO(raw), engine="openpyxl")
         return df, name
     except Exception:
-        df = _read_html_from_bytes(raw)
+        df = read_html_table(raw)
         return df, name
 
 
@@ -169,14 +118,6 @@ def _validate_cols(df: pd.DataFrame) -> List[str]:
     return missing
 
 
-def _to_number(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
-    for c in ("packqty", "入數", "BOXTYPE"):
-        if c in df.columns:
-            df[c] = pd.to_numeric(df[c], errors="coerce")
-    return df
-
-
 def _compute(df: pd.DataFrame) -> dict:
     df = df.copy()
 
@@ -240,6 +181,13 @@ def _fmt_num(x) -> str:
         return str(x)
 
 
+def _detail_excel_bytes(df: pd.DataFrame) -> bytes:
+    buf = io.BytesIO()
+    with pd.ExcelWriter(buf, engine="openpyxl") as writer:
+        df.to_excel(writer, index=False, sheet_name="明細")
+    return buf.getvalue()
+
+
 # -----------------------------
 # UI
 # -----------------------------
@@ -286,9 +234,6 @@ with st.spinner("資料讀取中…請稍候（檔案越大越久）"):
 
         st.stop()
 
-    progress.progress(70, text="資料讀取中…（資料轉型）")
-    df = _to_number(df)
-
     progress.progress(90, text="資料讀取中…（計算中）")
     result = _compute(df)
 
@@ -316,16 +261,8 @@ st.divider()
 st.markdown("### 明細預覽（含：出貨單位數量）")
 st.dataframe(result["df"].head(200), use_container_width=True, height=420)
 
-# Export
-out_df = result["df"].copy()
-buf = io.BytesIO()
-with pd.ExcelWriter(buf, engine="openpyxl") as writer:
-    out_df.to_excel(writer, index=False, sheet_name="明細")
-buf.seek(0)
-
-st.download_button(
+# Export：只留配方，按下載時才寫 Excel
+download_button(
     "⬇️ 下載處理後明細（Excel）",
-    data=buf.getvalue(),
-    file_name="庫存訂單實出量分析_明細.xlsx",
-    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ExportRecipe(_detail_excel_bytes, (result["df"],), file_name="庫存訂單實出量分析_明細.xlsx"),
 )
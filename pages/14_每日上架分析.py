@@ -6,6 +6,9 @@ import pandas as pd
 import streamlit as st
 
 from common_ui import inject_logistics_theme, set_page, card_open, card_close
+from export_recipe import ExportRecipe, download_button
+from html_table import read_html_table
+from sheet_stream import read_sheet_streaming, sheet_names
 
 # ================== 固定規則 ==================
 EXCLUDE_PATTERNS = ["PD99", "QC99", "GRP", "CGS", "999", "GX010", "JCPL", "GREAT0001X"]
@@ -33,12 +36,8 @@ def _is_fake_xls_provider(raw: bytes) -> bool:
 
 
 def _read_fake_xls_text_or_html(raw: bytes) -> pd.DataFrame:
-    text = raw.decode("utf-8", errors="ignore")
-
     try:
-        tables = pd.read_html(text)
-        if tables:
-            return tables[0]
+        return read_html_table(raw)
     except Exception:
         pass
 
@@ -53,11 +52,28 @@ def _read_fake_xls_text_or_html(raw: bytes) -> pd.DataFrame:
     raise ValueError("無法以 HTML/文字表格解析此『假 xls』檔案。")
 
 
-def _pick_sheet_name(xls: pd.ExcelFile) -> str:
+def _pick_sheet_name(names: list[str]) -> str:
     preferred = "前一日上架清單"
-    if preferred in xls.sheet_names:
+    if preferred in names:
         return preferred
-    return xls.sheet_names[0]
+    return names[0]
+
+
+def _is_header_labels(labels: list[str]) -> bool:
+    s = "".join(labels)
+    return ("上架儲位" in s) or ("上架數量" in s)
+
+
+def _read_sheet_one_pass(raw: bytes, sheet: str, ext: str) -> pd.DataFrame:
+    # 只看第一列判斷表頭，同一次串流直接讀完資料（不再先 nrows=5 再整張重讀）
+    return read_sheet_streaming(
+        raw,
+        sheet,
+        ext,
+        is_header=_is_header_labels,
+        scan_rows=1,
+        fallback_first_nonempty=False,
+    )
 
 
 def _detect_header(df_head: pd.DataFrame) -> bool:
@@ -76,30 +92,16 @@ def _read_uploaded_table(uploaded) -> tuple[pd.DataFrame, dict]:
     info = {"engine": "", "sheet": "", "note": ""}
 
     if ext in {"xlsx", "xlsm", "xltx", "xltm"}:
-        engine = "openpyxl"
-        info["engine"] = engine
-        xls = pd.ExcelFile(BytesIO(raw), engine=engine)
-        sheet = _pick_sheet_name(xls)
+        info["engine"] = "openpyxl"
+        sheet = _pick_sheet_name(sheet_names(raw, ext))
         info["sheet"] = sheet
-
-        head = pd.read_excel(BytesIO(raw), sheet_name=sheet, engine=engine, nrows=5, header=None)
-        has_header = _detect_header(head)
-
-        df = pd.read_excel(BytesIO(raw), sheet_name=sheet, engine=engine, header=0 if has_header else None)
-        return df, info
+        return _read_sheet_one_pass(raw, sheet, ext), info
 
     if ext == "xlsb":
-        engine = "pyxlsb"
-        info["engine"] = engine
-        xls = pd.ExcelFile(BytesIO(raw), engine=engine)
-        sheet = _pick_sheet_name(xls)
+        info["engine"] = "pyxlsb"
+        sheet = _pick_sheet_name(sheet_names(raw, ext))
         info["sheet"] = sheet
-
-        head = pd.read_excel(BytesIO(raw), sheet_name=sheet, engine=engine, nrows=5, header=None)
-        has_header = _detect_header(head)
-
-        df = pd.read_excel(BytesIO(raw), sheet_name=sheet, engine=engine, header=0 if has_header else None)
-        return df, info
+        return _read_sheet_one_pass(raw, sheet, ext), info
 
     if ext == "xls":
         if _is_fake_xls_provider(raw):
@@ -111,7 +113,7 @@ def _read_uploaded_table(uploaded) -> tuple[pd.DataFrame, dict]:
         engine = "xlrd"
         info["engine"] = engine
         xls = pd.ExcelFile(BytesIO(raw), engine=engine)
-        sheet = _pick_sheet_name(xls)
+        sheet = _pick_sheet_name(xls.sheet_names)
         info["sheet"] = sheet
 
         head = pd.read_excel(BytesIO(raw), sheet_name=sheet, engine=engine, nrows=5, header=None)
@@ -288,14 +290,13 @@ def main():
     )
 
     df_keep = df.loc[~result["mask_exclude"]].copy()
-    xlsx_bytes = _to_xlsx_bytes(df_keep)
-    st.download_button(
-        "⬇️ 匯出（剔除後）Excel",
-        data=xlsx_bytes,
+    # 只留配方，按下載時才寫 Excel
+    export = ExportRecipe(
+        _to_xlsx_bytes,
+        (df_keep,),
         file_name=f"{uploaded.name.rsplit('.',1)[0]}_每日上架分析_剔除後.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        use_container_width=False,
     )
+    download_button("⬇️ 匯出（剔除後）Excel", export, use_container_width=False)
 
     st.markdown("### 明細預覽（前 200 列）")
     st.dataframe(df.head(200), use_container_width=True, height=420)
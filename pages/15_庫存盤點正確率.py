@@ -4,6 +4,7 @@ import streamlit as st
 from io import BytesIO
 
 from common_ui import inject_logistics_theme, set_page, card_open, card_close
+from html_table import read_html_table
 
 
 def _fmt_int(x) -> str:
@@ -32,13 +33,9 @@ def _is_fake_xls_provider(raw: bytes) -> bool:
 
 
 def _read_fake_xls_text_or_html(raw: bytes) -> pd.DataFrame:
-    text = raw.decode("utf-8", errors="ignore")
-
     # 1) HTML table
     try:
-        tables = pd.read_html(text)
-        if tables:
-            return tables[0]
+        return read_html_table(raw)
     except Exception:
         pass
 
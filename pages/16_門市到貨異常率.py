@@ -5,6 +5,8 @@ from io import BytesIO
 import streamlit.components.v1 as components
 
 from common_ui import inject_logistics_theme, set_page, card_open, card_close
+from export_recipe import ExportRecipe, download_button
+from html_table import read_html_table
 
 
 # ----------------------------
@@ -35,13 +37,9 @@ def _is_fake_xls_provider(raw: bytes) -> bool:
 
 
 def _read_fake_xls_text_or_html(raw: bytes) -> pd.DataFrame:
-    text = raw.decode("utf-8", errors="ignore")
-
     # 1) HTML table
     try:
-        tables = pd.read_html(text)
-        if tables:
-            return tables[0]
+        return read_html_table(raw)
     except Exception:
         pass
 
@@ -362,12 +360,10 @@ def main():
     # KPI 區塊：4 欄 + 同寬
     _render_kpi_cards(metrics)
 
-    out_bytes = _download_xlsx_bytes(df)
-    st.download_button(
+    # 只留配方，按下載時才寫 Excel
+    download_button(
         "⬇️ 匯出（處理後）Excel",
-        data=out_bytes,
-        file_name="門市到貨異常_處理後.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        ExportRecipe(_download_xlsx_bytes, (df,), file_name="門市到貨異常_處理後.xlsx"),
     )
 
     st.markdown("### 明細預覽（前 200 列）")
@@ -12,6 +12,9 @@ import numpy as np
 import pandas as pd
 import streamlit as st
 
+from excel_export import SheetStyle, write_workbook
+from export_recipe import ExportRecipe, download_button
+
 try:
     from common_ui import inject_logistics_theme, set_page, card_open, card_close
     HAS_COMMON_UI = True
@@ -88,20 +91,14 @@ def build_output_excel_bytes(
     total_headcount: int,
     hours_summary: pd.DataFrame,
     target_date: date,
-    out_name: str,
-) -> tuple[str, bytes]:
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-        sheet = "當日_各職務_工時"
-        start_row = 8
-        hours_summary.to_excel(writer, sheet_name=sheet, index=False, startrow=start_row)
-
-        ws = writer.sheets[sheet]
-        wb = writer.book
+) -> bytes:
+    # 職務人次寫在表格上方；6 個職務會寫到第 9 列，表格往下留一列空白（原本第 9 列會蓋掉表頭）
+    start_row = max(8, 3 + len(role_counts) + 1)
 
-        big = wb.add_format({"bold": True, "font_size": 12})
-        label = wb.add_format({"bold": True})
-        gray = wb.add_format({"font_color": "#666666"})
+    def write_notes(ws, fmt):
+        big = fmt({"bold": True, "font_size": 12})
+        label = fmt({"bold": True})
+        gray = fmt({"font_color": "#666666"})
 
         ws.write(0, 0, f"{target_date}", big)
         ws.write(1, 0, TOP_NOTE, gray)
@@ -109,18 +106,17 @@ def build_output_excel_bytes(
         ws.write(2, 1, int(total_headcount), big)
 
         row = 3
-        for _, r in role_counts.iterrows():
-            ws.write(row, 0, f"{r['職務']}：", label)
-            ws.write(row, 1, int(r["人次"]))
+        for role, count in zip(role_counts["職務"], role_counts["人次"]):
+            ws.write(row, 0, f"{role}：", label)
+            ws.write(row, 1, int(count))
             row += 1
 
-        ws.set_column(0, 0, 16)
-        ws.set_column(1, 1, 12)
-        ws.set_column(2, 10, 14)
-        ws.freeze_panes(start_row + 1, 0)
-
-    output.seek(0)
-    return out_name, output.getvalue()
+    style = SheetStyle(
+        widths={"A": 16, "B": 12, "C:K": 14},
+        start_row=start_row,
+        before=write_notes,
+    )
+    return write_workbook({"當日_各職務_工時": (hours_summary, style)})
 
 
 # =========================
@@ -268,18 +264,20 @@ _spacer(14)
 base = os.path.splitext(uploaded.name)[0]
 out_name = f"{base}_{target_date}_工時與人次.xlsx"
 
-download_name, excel_bytes = build_output_excel_bytes(
-    role_counts=role_counts,
-    total_headcount=total_headcount,
-    hours_summary=hours_summary,
-    target_date=target_date,
-    out_name=out_name,
+# 只留配方，按下載時才寫 Excel
+export = ExportRecipe(
+    build_output_excel_bytes,
+    kwargs={
+        "role_counts": role_counts,
+        "total_headcount": total_headcount,
+        "hours_summary": hours_summary,
+        "target_date": target_date,
+    },
+    file_name=out_name,
 )
 
-st.download_button(
-    label="⬇️ 下載 Excel（工時與人次）",
-    data=excel_bytes,
-    file_name=download_name,
-    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+download_button(
+    "⬇️ 下載 Excel（工時與人次）",
+    export,
     use_container_width=True,
 )
@@ -22,6 +22,8 @@ import re
 import pandas as pd
 import streamlit as st
 
+from export_recipe import ExportRecipe, download_button
+
 # ---- 套用平台風格（有就用，沒有就退回原生） ----
 try:
     from common_ui import inject_logistics_theme, set_page, card_open, card_close
@@ -232,12 +234,11 @@ def calc_util_by_zone(df: pd.DataFrame) -> pd.DataFrame:
 
 
 def build_output_excel_bytes(
-    base_name: str,
     df_detail: pd.DataFrame,
     df_util: pd.DataFrame,
     df_shelf: pd.DataFrame,
     df_type: pd.DataFrame,
-) -> tuple[str, bytes]:
+) -> bytes:
     """輸出 Excel bytes：使用率 + 明細(含分類) + 棚別統計 + 儲位類型統計"""
     out = io.BytesIO()
     with pd.ExcelWriter(out, engine="xlsxwriter") as writer:
@@ -247,9 +248,7 @@ def build_output_excel_bytes(
         df_shelf.to_excel(writer, sheet_name="棚別統計", index=False)
         df_type.to_excel(writer, sheet_name="儲位類型統計", index=False)
 
-    out.seek(0)
-    filename = f"{base_name}_18_各類儲區使用率_輸出.xlsx"
-    return filename, out.getvalue()
+    return out.getvalue()
 
 
 # =========================
@@ -415,18 +414,20 @@ _spacer(10)
 
 # 下載
 base = os.path.splitext(uploaded.name)[0]
-download_name, excel_bytes = build_output_excel_bytes(
-    base_name=base,
-    df_detail=df_detail,
-    df_util=df_util if not df_util.empty else pd.DataFrame([{"儲位類型": "（無區(溫層)欄位）"}]),
-    df_shelf=df_shelf,
-    df_type=df_type,
+# 只留配方，按下載時才寫 Excel（明細表很大，不必每次重跑都寫一次）
+export = ExportRecipe(
+    build_output_excel_bytes,
+    kwargs={
+        "df_detail": df_detail,
+        "df_util": df_util if not df_util.empty else pd.DataFrame([{"儲位類型": "（無區(溫層)欄位）"}]),
+        "df_shelf": df_shelf,
+        "df_type": df_type,
+    },
+    file_name=f"{base}_18_各類儲區使用率_輸出.xlsx",
 )
 
-st.download_button(
+download_button(
     "⬇️ 下載 Excel（使用率＋棚別統計）",
-    data=excel_bytes,
-    file_name=download_name,
-    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    export,
     use_container_width=True,
 )
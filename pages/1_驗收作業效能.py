@@ -20,7 +20,11 @@ from common_ui import (
     show_kpi_table,         # ✅ 整列紅/綠顯示（效率 < target 會紅）
 )
 
-from qc_core import run_qc_efficiency
+import session_store
+from export_bundle import ZIP_MIME, bundle_name, raw_format_selector, write_bundle
+from export_recipe import download_button
+from qc_core import run_qc_efficiency_cached
+from upload_buffer import upload_bytes, upload_fingerprint
 
 
 # =========================================================
@@ -141,303 +145,6 @@ def _adapt_exclude_windows_to_skip_rules(exclude_windows):
     return skip_rules
 
 
-def _rule_applies_to_row(rule_user: str, row: pd.Series) -> bool:
-    """
-    空白 user 視為全部人適用；有填 user 時，需符合代碼或姓名欄位。
-    """
-    rule_user = (rule_user or "").strip()
-
-    if not rule_user:
-        return True
-
-    for col in ("記錄輸入人", "資料輸入人", "輸入人", "姓名"):
-        if col in row.index and str(row.get(col, "")).strip() == rule_user:
-            return True
-
-    return False
-
-
-def _overlap_minutes_for_rules(
-    first_dt,
-    last_dt,
-    row: pd.Series,
-    skip_rules,
-    category: str | None = None,
-) -> float:
-    """
-    只扣工作區間與休息/排除區間實際重疊的分鐘數。
-
-    category 為 None 時回傳全部扣除分鐘；指定 category 時只回傳該來源。
-    """
-    first_ts = pd.to_datetime(first_dt, errors="coerce")
-    last_ts = pd.to_datetime(last_dt, errors="coerce")
-
-    if pd.isna(first_ts) or pd.isna(last_ts) or last_ts <= first_ts:
-        return 0.0
-
-    total = 0.0
-
-    for rule in skip_rules or []:
-        if not isinstance(rule, dict):
-            continue
-
-        if category and rule.get("category") != category:
-            continue
-
-        if not _rule_applies_to_row(rule.get("user", ""), row):
-            continue
-
-        start_time = rule.get("t_start")
-        end_time = rule.get("t_end")
-
-        if start_time is None or end_time is None or start_time >= end_time:
-            continue
-
-        rest_start = pd.Timestamp.combine(first_ts.date(), start_time)
-        rest_end = pd.Timestamp.combine(first_ts.date(), end_time)
-        overlap_start = max(first_ts, rest_start)
-        overlap_end = min(last_ts, rest_end)
-
-        if overlap_end > overlap_start:
-            total += (overlap_end - overlap_start).total_seconds() / 60.0
-
-    return total
-
-
-def _recalculate_rest_by_actual_overlap(
-    df: pd.DataFrame,
-    skip_rules,
-) -> pd.DataFrame:
-    """
-    依每列實際工作區間重新計算：
-    休息分鐘、登入空窗、總分鐘、總工時、效率。
-    一般空窗不顯示成欄位，但仍會納入總分鐘扣除。
-    """
-    required_cols = {
-        "第一筆修訂日期",
-        "最後一筆修訂日期",
-        "休息分鐘",
-        "總分鐘",
-        "總工時",
-        "效率",
-    }
-
-    if df is None or df.empty or not required_cols.issubset(df.columns):
-        return df
-
-    out = df.copy()
-
-    for idx, row in out.iterrows():
-        first_ts = pd.to_datetime(
-            row.get("第一筆修訂日期"),
-            errors="coerce",
-        )
-        last_ts = pd.to_datetime(
-            row.get("最後一筆修訂日期"),
-            errors="coerce",
-        )
-
-        if pd.isna(first_ts) or pd.isna(last_ts) or last_ts <= first_ts:
-            continue
-
-        rest_minutes = _overlap_minutes_for_rules(
-            first_ts,
-            last_ts,
-            row,
-            skip_rules,
-            "休息",
-        )
-        login_idle_minutes = _overlap_minutes_for_rules(
-            first_ts,
-            last_ts,
-            row,
-            skip_rules,
-            "登入空窗",
-        )
-        idle_minutes = _overlap_minutes_for_rules(
-            first_ts,
-            last_ts,
-            row,
-            skip_rules,
-            "空窗",
-        )
-        excluded_minutes = rest_minutes + login_idle_minutes + idle_minutes
-        raw_minutes = (last_ts - first_ts).total_seconds() / 60.0
-        total_minutes = max(raw_minutes - excluded_minutes, 0.0)
-        total_hours = total_minutes / 60.0
-
-        pieces = pd.to_numeric(
-            row.get("筆數"),
-            errors="coerce",
-        )
-
-        out.at[idx, "休息分鐘"] = int(round(rest_minutes))
-        out.at[idx, "登入空窗"] = int(round(login_idle_minutes))
-        out.at[idx, "總分鐘"] = round(total_minutes, 2)
-        out.at[idx, "總工時"] = round(total_hours, 2)
-
-        if pd.notna(pieces) and total_minutes > 0:
-            out.at[idx, "效率"] = round(float(pieces) / total_minutes * 60.0, 2)
-        else:
-            out.at[idx, "效率"] = 0.0
-
-    return out
-
-
-def _recalculate_result_rest_by_actual_overlap(
-    result: dict,
-    skip_rules,
-) -> dict:
-    """
-    修正 run_qc_efficiency 回傳的各個 DataFrame，避免固定休息被整班硬扣。
-    """
-    if not isinstance(result, dict):
-        return result
-
-    for key, value in list(result.items()):
-        if isinstance(value, pd.DataFrame):
-            result[key] = _recalculate_rest_by_actual_overlap(
-                value,
-                skip_rules,
-            )
-
-    return result
-
-
-def _apply_actual_overlap_rest_to_excel(
-    xlsx_bytes: bytes,
-    skip_rules,
-) -> bytes:
-    """
-    同步修正匯出 Excel 內的休息分鐘、登入空窗、總分鐘、總工時、效率。
-    一般空窗不顯示成欄位，但仍會納入總分鐘扣除。
-    """
-    if not xlsx_bytes:
-        return xlsx_bytes
-
-    input_buffer = BytesIO(xlsx_bytes)
-
-    try:
-        workbook = load_workbook(input_buffer)
-    except Exception:
-        return xlsx_bytes
-
-    required_headers = {
-        "第一筆修訂日期",
-        "最後一筆修訂日期",
-        "休息分鐘",
-        "總分鐘",
-        "總工時",
-        "效率",
-    }
-
-    for worksheet in workbook.worksheets:
-        header_row = None
-        header_to_col = {}
-
-        for row_idx in range(1, min(worksheet.max_row, 30) + 1):
-            current = {}
-            for col_idx in range(1, worksheet.max_column + 1):
-                header = worksheet.cell(row=row_idx, column=col_idx).value
-                header = str(header).strip() if header is not None else ""
-                if header:
-                    current[header] = col_idx
-
-            if required_headers.issubset(current):
-                header_row = row_idx
-                header_to_col = current
-                for new_header in ("登入空窗",):
-                    if new_header not in header_to_col:
-                        insert_at = header_to_col["休息分鐘"] + 1
-                        worksheet.insert_cols(insert_at)
-                        worksheet.cell(row=row_idx, column=insert_at).value = new_header
-                        for name, col in list(header_to_col.items()):
-                            if col >= insert_at:
-                                header_to_col[name] = col + 1
-                        header_to_col[new_header] = insert_at
-                break
-
-        if header_row is None:
-            continue
-
-        for row_idx in range(header_row + 1, worksheet.max_row + 1):
-            row_data = {
-                header: worksheet.cell(
-                    row=row_idx,
-                    column=col_idx,
-                ).value
-                for header, col_idx in header_to_col.items()
-            }
-
-            row = pd.Series(row_data)
-            first_dt = row.get("第一筆修訂日期")
-            last_dt = row.get("最後一筆修訂日期")
-            first_ts = pd.to_datetime(first_dt, errors="coerce")
-            last_ts = pd.to_datetime(last_dt, errors="coerce")
-
-            if pd.isna(first_ts) or pd.isna(last_ts) or last_ts <= first_ts:
-                continue
-
-            rest_minutes = _overlap_minutes_for_rules(
-                first_ts,
-                last_ts,
-                row,
-                skip_rules,
-                "休息",
-            )
-            login_idle_minutes = _overlap_minutes_for_rules(
-                first_ts,
-                last_ts,
-                row,
-                skip_rules,
-                "登入空窗",
-            )
-            idle_minutes = _overlap_minutes_for_rules(
-                first_ts,
-                last_ts,
-                row,
-                skip_rules,
-                "空窗",
-            )
-            excluded_minutes = rest_minutes + login_idle_minutes + idle_minutes
-            raw_minutes = (last_ts - first_ts).total_seconds() / 60.0
-            total_minutes = max(raw_minutes - excluded_minutes, 0.0)
-            total_hours = total_minutes / 60.0
-            pieces = pd.to_numeric(row.get("筆數"), errors="coerce")
-            efficiency = (
-                round(float(pieces) / total_minutes * 60.0, 2)
-                if pd.notna(pieces) and total_minutes > 0
-                else 0.0
-            )
-
-            worksheet.cell(
-                row=row_idx,
-                column=header_to_col["休息分鐘"],
-            ).value = int(round(rest_minutes))
-            worksheet.cell(
-                row=row_idx,
-                column=header_to_col["登入空窗"],
-            ).value = int(round(login_idle_minutes))
-            worksheet.cell(
-                row=row_idx,
-                column=header_to_col["總分鐘"],
-            ).value = round(total_minutes, 2)
-            worksheet.cell(
-                row=row_idx,
-                column=header_to_col["總工時"],
-            ).value = round(total_hours, 2)
-            worksheet.cell(
-                row=row_idx,
-                column=header_to_col["效率"],
-            ).value = efficiency
-
-    output_buffer = BytesIO()
-    workbook.save(output_buffer)
-    output_buffer.seek(0)
-
-    return output_buffer.getvalue()
-
-
 def _ensure_session_defaults():
     """
     建立 session_state 預設值。
@@ -445,9 +152,6 @@ def _ensure_session_defaults():
     避免 Streamlit 因為調整左側設定、下載檔案或重新渲染，
     導致已計算的結果從畫面消失。
     """
-    if "qc_last_result" not in st.session_state:
-        st.session_state.qc_last_result = None
-
     if "qc_last_filename" not in st.session_state:
         st.session_state.qc_last_filename = None
 
@@ -1038,6 +742,9 @@ def main():
         key="qc_upload_file",
     )
 
+    # 各來源分頁（原始明細）的輸出格式：Excel 或另存 Parquet / CSV 打包
+    raw_format = raw_format_selector("qc_raw_format")
+
     run_clicked = st.button(
         "🚀 產出 KPI",
         type="primary",
@@ -1053,14 +760,19 @@ def main():
     if run_clicked and uploaded is not None:
         try:
             with st.spinner("KPI 計算中，請稍候..."):
-                result = run_qc_efficiency(
-                    uploaded.getvalue(),
+                # 依實際工作區間重算扣休（引擎內向量化，寫 Excel 前就算好），
+                # 避免未跨休息時段也被固定扣 15 分鐘。
+                result = run_qc_efficiency_cached(
+                    upload_bytes(uploaded),
                     uploaded.name,
                     skip_rules,
+                    actual_overlap_rest=True,
+                    raw_format=raw_format,
+                    fingerprint=upload_fingerprint(uploaded),
                 )
 
             if not result:
-                st.session_state.qc_last_result = None
+                session_store.discard("qc_last_result")
                 st.session_state.qc_last_filename = None
 
                 st.error(
@@ -1073,26 +785,30 @@ def main():
                 result["target_eff_am"] = QC_TARGET_EFFICIENCY
                 result["target_eff_pm"] = QC_TARGET_EFFICIENCY
 
-                # 依實際工作區間重算扣休，避免未跨休息時段也被固定扣 15 分鐘。
-                result = _recalculate_result_rest_by_actual_overlap(
-                    result,
-                    skip_rules,
-                )
-
                 # 匯出 Excel 重新套用門檻格式
                 # 效率低於 29，整列顯示紅色
-                if result.get("xlsx_bytes"):
-                    result["xlsx_bytes"] = (
-                        _apply_excel_target_format(
-                            _apply_actual_overlap_rest_to_excel(
-                                result["xlsx_bytes"],
-                                skip_rules,
-                            ),
-                            target=QC_TARGET_EFFICIENCY,
-                        )
+                # （只串配方，按下載時才產生 Excel / ZIP）
+                xlsx_name = result.get("xlsx_name", "驗收作業KPI.xlsx")
+                if result.get("xlsx") is not None:
+                    result["xlsx"] = result["xlsx"].then(
+                        _apply_excel_target_format,
+                        target=QC_TARGET_EFFICIENCY,
+                        file_name=xlsx_name,
+                    )
+
+                # 原始明細另存：KPI Excel + 各來源明細檔打包成 ZIP
+                raw_tables = result.pop("raw_tables", None)
+                if raw_tables and result.get("xlsx") is not None:
+                    result["bundle"] = result["xlsx"].then(
+                        write_bundle,
+                        raw_tables,
+                        raw_format=raw_format,
+                        workbook_name=xlsx_name,
+                        file_name=bundle_name(xlsx_name),
+                        mime=ZIP_MIME,
                     )
 
-                st.session_state.qc_last_result = result
+                session_store.put("qc_last_result", result)
                 st.session_state.qc_last_filename = uploaded.name
 
                 st.success(
@@ -1102,7 +818,7 @@ def main():
                 )
 
         except Exception as exc:
-            st.session_state.qc_last_result = None
+            session_store.discard("qc_last_result")
             st.session_state.qc_last_filename = None
 
             st.error(
@@ -1114,7 +830,7 @@ def main():
     # ======================
     # 從 session_state 取用結果
     # ======================
-    result = st.session_state.qc_last_result
+    result = session_store.get("qc_last_result")
 
     if not result:
         st.info(
@@ -1158,13 +874,16 @@ def main():
     # ======================
     # 匯出 Excel
     # ======================
-    if result.get("xlsx_bytes"):
+    if result.get("bundle") is not None:
+        download_button(
+            "⬇️ 匯出 KPI 報表（Excel + 原始明細 ZIP）｜低於 29 顯示紅色",
+            result["bundle"],
+            use_container_width=True,
+        )
+    elif result.get("xlsx") is not None:
         download_excel_card(
-            result["xlsx_bytes"],
-            result.get(
-                "xlsx_name",
-                "驗收作業KPI.xlsx",
-            ),
+            result["xlsx"],
+            result["xlsx"].file_name,
             label=(
                 "⬇️ 匯出 KPI 報表（Excel）"
                 "｜低於 29 顯示紅色"
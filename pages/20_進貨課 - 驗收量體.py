@@ -10,6 +10,7 @@ import pandas as pd
 import streamlit as st
 
 from common_ui import inject_logistics_theme, set_page, card_open, card_close
+from export_recipe import ExportRecipe, download_button
 
 pd.options.display.max_columns = 200
 
@@ -246,20 +247,12 @@ with st.expander("🔎 預覽：過濾後明細（每張表前 200 筆）", expa
         st.markdown(f"**{_safe_sheet_name(sheet_name)}**（{len(df):,} 筆）")
         st.dataframe(df.head(200), use_container_width=True, hide_index=True)
 
-# 輸出
-try:
-    out_bytes = build_output_excel_bytes(tables, filtered, summary_df, per_sheet_df)
-except Exception as e:
-    st.error(f"寫檔失敗：{e}")
-    card_close()
-    st.stop()
-
-out_name = f"{base}_只保留到QC.xlsx"
-st.download_button(
-    "⬇️ 下載輸出 Excel",
-    data=out_bytes,
-    file_name=out_name,
-    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+# 輸出：只留配方，按下載時才寫 Excel
+export = ExportRecipe(
+    build_output_excel_bytes,
+    (tables, filtered, summary_df, per_sheet_df),
+    file_name=f"{base}_只保留到QC.xlsx",
 )
+download_button("⬇️ 下載輸出 Excel", export)
 
 card_close()
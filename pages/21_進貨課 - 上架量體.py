@@ -11,6 +11,8 @@ import pandas as pd
 import streamlit as st
 
 from common_ui import inject_logistics_theme, set_page, card_open, card_close
+from export_recipe import ExportRecipe, download_button
+from master_data import LocationMaster, location_master_uploader
 
 pd.options.display.max_columns = 200
 
@@ -105,13 +107,6 @@ def rename_item_column(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def detect_col(df: pd.DataFrame, candidates) -> Optional[str]:
-    for c in candidates:
-        if c in df.columns:
-            return c
-    return None
-
-
 def classify_high_low(storage_type: str) -> str:
     if pd.isna(storage_type):
         return "無法對應"
@@ -131,24 +126,16 @@ def process_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     return df[mask_qc & mask_to_ok].copy()
 
 
-def attach_storage_type(df: pd.DataFrame, loc_map: pd.DataFrame, loc_key_map: str) -> pd.DataFrame:
+def attach_storage_type(df: pd.DataFrame, master: LocationMaster, loc_key_map: str) -> pd.DataFrame:
     if "到" not in df.columns:
         df["儲位類型"] = pd.NA
         df["高低空"] = "無法對應"
         return df
 
-    map_df = loc_map.copy()
-    df["_到_key_"] = df["到"].astype(str).str.strip()
-    map_df["_loc_key_"] = map_df[loc_key_map].astype(str).str.strip()
-
-    if LOC_TYPE_COL not in map_df.columns:
-        raise RuntimeError(f"儲位明細缺少必要欄位「{LOC_TYPE_COL}」。")
-
-    map_df = map_df[["_loc_key_", LOC_TYPE_COL]].drop_duplicates("_loc_key_")
-    out = df.merge(map_df, how="left", left_on="_到_key_", right_on="_loc_key_")
-    out = out.drop(columns=["_到_key_", "_loc_key_"])
-    out["高低空"] = out[LOC_TYPE_COL].apply(classify_high_low)
-    return out
+    # 到 → 儲位類型（主檔索引由登錄表共用，重複儲位取第一筆）
+    df[LOC_TYPE_COL] = master.lookup(df["到"], LOC_TYPE_COL, loc_col=loc_key_map)
+    df["高低空"] = df[LOC_TYPE_COL].apply(classify_high_low)
+    return df
 
 
 def _safe_sheet_name(name: str) -> str:
@@ -197,15 +184,15 @@ main_up = st.file_uploader(
     accept_multiple_files=False,
 )
 
-storage_up = st.file_uploader(
+storage_master = location_master_uploader(
     "上傳儲位明細（需含：儲位類型 + 儲位鍵欄位）",
-    type=["xlsx", "xlsm", "xltx", "xltm", "xls", "xlsb", "csv", "txt"],
-    accept_multiple_files=False,
+    key="putaway_volume_storage_master",
+    requires=(LOC_KEY_CANDIDATES, [LOC_TYPE_COL]),
 )
 
 st.markdown("---")
 
-if (main_up is None) or (storage_up is None):
+if (main_up is None) or (storage_master is None):
     st.info("請先上傳「主檔」與「儲位明細」。")
     card_close()
     st.stop()
@@ -218,24 +205,19 @@ if not run:
 # 讀檔
 try:
     main_sheets = read_any_table_from_upload(main_up)
-    sto_sheets = read_any_table_from_upload(storage_up)
 except Exception as e:
     st.error(f"讀檔失敗：{e}")
     card_close()
     st.stop()
 
-# 儲位明細：取第一張表
-sto_first = list(sto_sheets.keys())[0]
-sto_df = sto_sheets[sto_first].copy()
-sto_df.columns = [str(c).strip() for c in sto_df.columns]
-
-sto_loc_col = detect_col(sto_df, LOC_KEY_CANDIDATES)
+# 儲位明細：登錄表中的主檔（第一張有資料的表）
+sto_loc_col = storage_master.column(LOC_KEY_CANDIDATES)
 if sto_loc_col is None:
     st.error(f"儲位明細找不到儲位鍵欄位（候選：{', '.join(LOC_KEY_CANDIDATES)}）。")
     card_close()
     st.stop()
 
-if LOC_TYPE_COL not in sto_df.columns:
+if LOC_TYPE_COL not in storage_master.frame.columns:
     st.error(f"儲位明細缺少欄位「{LOC_TYPE_COL}」。")
     card_close()
     st.stop()
@@ -253,7 +235,7 @@ for sn, df in main_sheets.items():
     df = rename_item_column(df)
 
     kept = process_dataframe(df)
-    kept2 = attach_storage_type(kept, sto_df, sto_loc_col)
+    kept2 = attach_storage_type(kept, storage_master, sto_loc_col)
 
     # 計數（ITEM=筆數）
     cnt = int(kept2.shape[0])
@@ -312,21 +294,13 @@ with st.expander("🔎 預覽：過濾後明細（每張表前 200 筆）", expa
         st.markdown(f"**{_safe_sheet_name(sn)}**（{len(df):,} 筆）")
         st.dataframe(df.head(200), use_container_width=True, hide_index=True)
 
-# 產出 Excel
-try:
-    base, _ = os.path.splitext(main_up.name)
-    out_bytes = build_output_excel_bytes(processed_by_sheet, summary_df, type_dist_df)
-    out_name = f"{base}_ITEM_高低空.xlsx"
-except Exception as e:
-    st.error(f"寫檔失敗：{e}")
-    card_close()
-    st.stop()
-
-st.download_button(
-    "⬇️ 下載輸出 Excel",
-    data=out_bytes,
-    file_name=out_name,
-    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+# 產出 Excel：只留配方，按下載時才寫
+base, _ = os.path.splitext(main_up.name)
+export = ExportRecipe(
+    build_output_excel_bytes,
+    (processed_by_sheet, summary_df, type_dist_df),
+    file_name=f"{base}_ITEM_高低空.xlsx",
 )
+download_button("⬇️ 下載輸出 Excel", export)
 
 card_close()
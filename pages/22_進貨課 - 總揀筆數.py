@@ -12,6 +12,8 @@ import pandas as pd
 import streamlit as st
 
 from common_ui import inject_logistics_theme, set_page, card_open, card_close
+from export_recipe import ExportRecipe, download_button
+from master_data import LocationMaster, location_master_uploader
 
 pd.options.display.max_columns = 200
 
@@ -30,12 +32,6 @@ NUM_COL_CANDIDATES = ["數量", "件數", "出貨量", "配貨量", "應揀量",
 PRODUCT_FALLBACK_COL = "商品"
 
 
-def normalize_loc(s):
-    if pd.isna(s):
-        return s
-    return str(s).strip().upper()
-
-
 def unit_mask_equal_2(series: pd.Series) -> pd.Series:
     """成箱：=2（字面 '2' 或數值 2/2.0）"""
     s = series.astype(str).str.strip()
@@ -133,7 +129,7 @@ def build_pivot2(df_source: pd.DataFrame) -> Tuple[pd.DataFrame, List[str]]:
     return pivot2, group_keys
 
 
-def process_subset(df_raw: pd.DataFrame, df_map: pd.DataFrame, subset_tag: str, mask: pd.Series):
+def process_subset(df_raw: pd.DataFrame, master: LocationMaster, map_cols: Tuple[str, str], subset_tag: str, mask: pd.Series):
     df_work = df_raw.loc[mask].copy()
     if df_work.empty:
         return subset_tag, None, 0, None
@@ -143,14 +139,9 @@ def process_subset(df_raw: pd.DataFrame, df_map: pd.DataFrame, subset_tag: str,
     if df_work.empty:
         return subset_tag, None, 0, None
 
-    # 回填儲位類型
-    df_work["儲位_norm"] = df_work["儲位"].map(normalize_loc)
-    map_first = (
-        df_map.assign(儲位_norm=df_map["儲位"].map(normalize_loc))
-        .sort_values(["儲位_norm"])
-        .drop_duplicates(subset=["儲位_norm"], keep="first")[["儲位_norm", "儲位類型"]]
-    )
-    df_out = df_work.merge(map_first, on="儲位_norm", how="left").drop(columns=["儲位_norm"])
+    # 回填儲位類型（儲位去空白、不分大小寫；主檔索引由登錄表共用）
+    loc_col, type_col = map_cols
+    df_out = df_work.assign(儲位類型=master.lookup(df_work["儲位"], type_col, loc_col=loc_col, key="upper"))
 
     pivot2, group_keys = build_pivot2(df_out)
     total_count = int(pivot2["儲位_筆數"].sum(skipna=True))
@@ -238,15 +229,15 @@ batch_files = st.file_uploader(
     accept_multiple_files=True,
 )
 
-map_file = st.file_uploader(
+map_master = location_master_uploader(
     "上傳【儲位棚別明細】（需含欄位：儲位、儲位類型）",
-    type=["xlsx", "xlsm", "xltx", "xltm", "xls", "xlsb", "csv", "txt"],
-    accept_multiple_files=False,
+    key="pick_count_map_master",
+    requires=(["儲位"], ["儲位類型"]),
 )
 
 st.markdown("---")
 
-if (not batch_files) or (map_file is None):
+if (not batch_files) or (map_master is None):
     st.info("請先上傳「批次明細（可多檔）」與「儲位棚別明細」。")
     card_close()
     st.stop()
@@ -256,17 +247,10 @@ if not run:
     card_close()
     st.stop()
 
-# 讀取 map
-try:
-    df_map = read_excel_or_csv(map_file)
-    df_map.columns = [str(c).strip() for c in df_map.columns]
-except Exception as e:
-    st.error(f"讀取『儲位棚別明細』失敗：{e}")
-    card_close()
-    st.stop()
-
-for c in ["儲位", "儲位類型"]:
-    if c not in df_map.columns:
+# 儲位棚別明細：登錄表中的主檔
+map_cols = (map_master.column(["儲位"]), map_master.column(["儲位類型"]))
+for c, found in zip(["儲位", "儲位類型"], map_cols):
+    if found is None:
         st.error(f"儲位棚別明細缺少欄位：{c}")
         card_close()
         st.stop()
@@ -306,7 +290,7 @@ for up in batch_files:
 
     any_ok = False
     for tag, mask in masks:
-        tag, pivot2, total_count, group_keys = process_subset(df_raw, df_map, tag, mask)
+        tag, pivot2, total_count, group_keys = process_subset(df_raw, map_master, map_cols, tag, mask)
 
         if pivot2 is None:
             summary_rows.append({"來源檔名": name_noext, "子集": tag, "分組鍵": "無", "加總筆數": 0, "資料筆數": 0})
@@ -366,20 +350,12 @@ st.dataframe(df_summary, use_container_width=True, hide_index=True)
 
 st.caption(f"成功：{ok} 檔；失敗：{fail} 檔")
 
-# 下載（Excel：同一張工作表，順序同畫面）
-try:
-    out_bytes = build_single_sheet_excel_bytes(df_type_total, df_detail_all, df_summary)
-    out_name = "批次_總揀筆數_單頁輸出.xlsx"
-except Exception as e:
-    st.error(f"輸出失敗：{e}")
-    card_close()
-    st.stop()
-
-st.download_button(
-    "⬇️ 下載輸出 Excel（單一工作表）",
-    data=out_bytes,
-    file_name=out_name,
-    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+# 下載（Excel：同一張工作表，順序同畫面）：只留配方，按下載時才寫
+export = ExportRecipe(
+    build_single_sheet_excel_bytes,
+    (df_type_total, df_detail_all, df_summary),
+    file_name="批次_總揀筆數_單頁輸出.xlsx",
 )
+download_button("⬇️ 下載輸出 Excel（單一工作表）", export)
 
 card_close()
@@ -5,6 +5,8 @@ import streamlit as st
 from io import BytesIO, StringIO
 
 from common_ui import inject_logistics_theme, set_page, card_open, card_close
+from export_recipe import ExportRecipe, download_button
+import session_store
 
 
 # ----------------------------
@@ -140,14 +142,14 @@ if mode == "複製貼上（推薦）":
     if parse_btn:
         try:
             df_detail = _read_pasted_table(pasted)
-            st.session_state["df_detail_pasted"] = df_detail
+            session_store.put("df_detail_pasted", df_detail)
             st.success(f"解析成功：{df_detail.shape[0]:,} 筆 × {df_detail.shape[1]} 欄")
         except Exception as e:
             st.error(f"解析失敗：{e}")
 
     # 若已解析過，沿用 session_state
-    if "df_detail_pasted" in st.session_state and df_detail is None:
-        df_detail = st.session_state["df_detail_pasted"]
+    if df_detail is None:
+        df_detail = session_store.get("df_detail_pasted")
 
 else:
     f_detail = st.file_uploader("上傳：採品明細（.xlsx）", type=["xlsx"], accept_multiple_files=False)
@@ -240,15 +242,10 @@ if missing_reasons:
     with st.expander(f"未對應分頁的 未配出原因（{len(uniq_missing)} 種）", expanded=False):
         st.write(uniq_missing)
 
-# 下載
-out_bytes = _build_output_bytes(sheets)
-out_name = "更新後的採品門市差異量.xlsx"
-
-st.download_button(
-    label="⬇️ 下載：更新後的採品門市差異量.xlsx",
-    data=out_bytes,
-    file_name=out_name,
-    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+# 下載：只留配方，按下載時才寫 Excel
+download_button(
+    "⬇️ 下載：更新後的採品門市差異量.xlsx",
+    ExportRecipe(_build_output_bytes, (sheets,), file_name="更新後的採品門市差異量.xlsx"),
 )
 
 # 預覽
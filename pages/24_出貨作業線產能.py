@@ -2,13 +2,11 @@
 import os
 import re
 import math
-import hashlib
-import base64
+import copy as _copy
 import pandas as pd
 from io import BytesIO
 
 import streamlit as st
-import streamlit.components.v1 as components
 
 from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
@@ -25,6 +23,11 @@ except Exception:
     card_open = lambda *a, **k: None
     card_close = lambda *a, **k: None
 
+import download_store
+from html_table import read_html_table
+from report_schema import get_schema, resolve_columns, usecols_for
+from upload_buffer import upload_bytes, upload_fingerprint
+
 
 # =========================
 # 基本設定
@@ -58,19 +61,20 @@ QCB_LIST = ["GT-A", "GT-J", "GT-K"]
 OLE_HEADER = b"\xD0\xCF\x11\xE0\xA1\xB1\x1A\xE1"
 ZIP_HEADER = b"PK\x03\x04"
 
+# 來源欄位（含同義欄名）登錄在 report_schema.py：line_capacity
+SOURCE_SCHEMA = get_schema("line_capacity")
+SOURCE_USECOLS = usecols_for(SOURCE_SCHEMA)
+
 
 def _try_read_html(raw: bytes) -> pd.DataFrame:
-    tables = pd.read_html(BytesIO(raw))
-    if tables:
-        return tables[0]
-    raise ValueError("HTML 讀取不到表格")
+    return read_html_table(raw, usecols=SOURCE_USECOLS)
 
 
 def _try_read_text_like(raw: bytes) -> pd.DataFrame:
     for enc in ("utf-8-sig", "utf-8", "big5", "cp950", "latin1"):
         for sep in ("\t", ",", ";", "|"):
             try:
-                df = pd.read_csv(BytesIO(raw), encoding=enc, sep=sep)
+                df = pd.read_csv(BytesIO(raw), encoding=enc, sep=sep, usecols=SOURCE_USECOLS)
                 if df.shape[1] >= 2:
                     return df
             except Exception:
@@ -79,20 +83,21 @@ def _try_read_text_like(raw: bytes) -> pd.DataFrame:
 
 
 def robust_read_bytes(raw: bytes, filename: str) -> pd.DataFrame:
+    """只解析 schema（line_capacity）內的欄位"""
     ext = os.path.splitext(filename)[1].lower()
     head = raw[:8]
     is_ole = head.startswith(OLE_HEADER)
     is_zip = head.startswith(ZIP_HEADER)
 
     if is_zip or ext in (".xlsx", ".xlsm", ".xltx", ".xltm"):
-        return pd.read_excel(BytesIO(raw), engine="openpyxl")
+        return pd.read_excel(BytesIO(raw), engine="openpyxl", usecols=SOURCE_USECOLS)
 
     if is_ole:
         try:
-            return pd.read_excel(BytesIO(raw), engine="xlrd")
+            return pd.read_excel(BytesIO(raw), engine="xlrd", usecols=SOURCE_USECOLS)
         except Exception:
             try:
-                return pd.read_excel(BytesIO(raw), engine="openpyxl")
+                return pd.read_excel(BytesIO(raw), engine="openpyxl", usecols=SOURCE_USECOLS)
             except Exception:
                 try:
                     return _try_read_html(raw)
@@ -102,7 +107,7 @@ def robust_read_bytes(raw: bytes, filename: str) -> pd.DataFrame:
     if ext == ".csv":
         for enc in ("utf-8-sig", "utf-8", "big5", "cp950", "latin1"):
             try:
-                return pd.read_csv(BytesIO(raw), encoding=enc)
+                return pd.read_csv(BytesIO(raw), encoding=enc, usecols=SOURCE_USECOLS)
             except Exception:
                 continue
         return pd.read_csv(BytesIO(raw), encoding="utf-8", errors="replace")
@@ -114,7 +119,7 @@ def robust_read_bytes(raw: bytes, filename: str) -> pd.DataFrame:
 
 
 # =========================
-# Excel 字體/列高工具
+# Excel 樣式登錄（每本活頁簿一份）
 # =========================
 def _clone_font(cell_font: Font, *, name=None, size=None, bold=None, color=None):
     if cell_font is None:
@@ -138,52 +143,87 @@ def _clone_font(cell_font: Font, *, name=None, size=None, bold=None, color=None)
     )
 
 
-def _set_base_font(cell, *, force_color=None, force_bold=None):
-    cell.font = _clone_font(
-        cell.font,
-        name=BASE_FONT_NAME,
-        size=BASE_FONT_SIZE,
-        bold=force_bold if force_bold is not None else cell.font.bold,
-        color=force_color if force_color is not None else cell.font.color,
-    )
+THIN_SIDE = Side(style="thin", color="D0D0D0")
+THICK_SIDE = Side(style="medium", color="111111")
+BORDER = Border(left=THIN_SIDE, right=THIN_SIDE, top=THIN_SIDE, bottom=THIN_SIDE)
+BOX_BORDER = Border(left=THICK_SIDE, right=THICK_SIDE, top=THICK_SIDE, bottom=THICK_SIDE)
+
+BLACK_FILL = PatternFill("solid", fgColor="111111")
+HEAD_FILL = PatternFill("solid", fgColor="F2F2F2")
+MANPOWER_FILL = PatternFill("solid", fgColor="FFF2CC")
+HEADER_FILL = PatternFill("solid", fgColor="F8CBAD")
+
+CENTER = Alignment(horizontal="center", vertical="center")
+LEFT = Alignment(horizontal="left", vertical="center")
+RIGHT = Alignment(horizontal="right", vertical="center")
 
 
-def _set_row_height(ws, r):
-    ws.row_dimensions[r].height = ROW_HEIGHT
+class StyleRegistry:
+    """
+    字型 / 填色 / 框線 / 對齊 / 數字格式的組合只建立一次
+    - 第一次遇到的組合照常設定到儲存格，記下它的 _style（只是幾個索引）
+    - 之後同組合的儲存格直接複製 _style，不再建立 Font / Border 物件
+    ⚠️ _style 的索引只對同一本活頁簿有效，所以每本 Workbook 各自一份（styles_for）
+    """
+
+    def __init__(self):
+        self._styles = {}
+
+    def apply(self, cell, *, bold=False, color=None, fill=None, border=BORDER, alignment=None, number_format="General"):
+        key = (bold, color, fill, border, alignment, number_format)
+        style = self._styles.get(key)
+        if style is not None:
+            cell._style = _copy.copy(style)
+            return cell
+
+        cell.font = _clone_font(cell.font, name=BASE_FONT_NAME, size=BASE_FONT_SIZE, bold=bold, color=color)
+        if fill is not None:
+            cell.fill = fill
+        if border is not None:
+            cell.border = border
+        if alignment is not None:
+            cell.alignment = alignment
+        cell.number_format = number_format
+        self._styles[key] = _copy.copy(cell._style)
+        return cell
+
+
+def styles_for(wb) -> StyleRegistry:
+    reg = getattr(wb, "_line_styles", None)
+    if reg is None:
+        reg = StyleRegistry()
+        wb._line_styles = reg
+    return reg
+
+
+def _set_row_heights(ws):
+    """整張表預設列高（取代逐列設定 row_dimensions）"""
+    ws.sheet_format.defaultRowHeight = ROW_HEIGHT
+    ws.sheet_format.customHeight = True
 
 
 # =========================
 # 欄位對照
 # =========================
 def normalize_columns(df: pd.DataFrame):
+    """依 schema 對欄位（不分大小寫/空白/底線），只留需要的 5 欄；回傳實際欄名"""
     df = df.copy()
     df.columns = [str(c).strip() for c in df.columns]
-    colmap = {str(c).strip().upper(): c for c in df.columns}
-
-    def pick(*cands):
-        for k in cands:
-            if k in colmap:
-                return colmap[k]
-        return None
-
-    c_pickdate = pick("PICKDATE", "PICK_DATE", "PICK DATETIME", "PICKTIME", "PICK_TIME")
-    c_packqty  = pick("PACKQTY", "PACK_QTY", "PCS", "QTY")
-    c_cweight  = pick("CWEIGHT", "C_WEIGHT", "C WEIGHT", "WEIGHT")
-    c_lineid   = pick("LINEID", "LINE_ID", "LINE", "LINE ID")
-    c_stotype  = pick("STO_TYPE", "STOTYPE", "SO_TYPE", "TYPE")
-
-    missing = [name for name, col in [
-        ("PICKDATE", c_pickdate),
-        ("PACKQTY",  c_packqty),
-        ("Cweight",  c_cweight),
-        ("LINEID",   c_lineid),
-        ("STO_TYPE", c_stotype),
-    ] if col is None]
+    found = resolve_columns(df.columns, SOURCE_SCHEMA)
 
+    missing = [name for name in SOURCE_SCHEMA.required_names if name not in found]
     if missing:
         raise KeyError(f"缺少必要欄位：{missing}\n目前欄位：{list(df.columns)}")
 
-    return df, c_pickdate, c_packqty, c_cweight, c_lineid, c_stotype
+    df = df[[found[name] for name in SOURCE_SCHEMA.names]]
+    return (
+        df,
+        found["PICKDATE"],
+        found["PACKQTY"],
+        found["Cweight"],
+        found["LINEID"],
+        found["STO_TYPE"],
+    )
 
 
 # =========================
@@ -433,83 +473,53 @@ def write_hourly_sheet(
         ws = wb[sheet_name]
         wb.remove(ws)
     ws = wb.create_sheet(sheet_name)
+    styles = styles_for(wb)
+    _set_row_heights(ws)
 
-    black_fill = PatternFill("solid", fgColor="111111")
-    head_fill = PatternFill("solid", fgColor="F2F2F2")
-    thin = Side(style="thin", color="D0D0D0")
-    border = Border(left=thin, right=thin, top=thin, bottom=thin)
-
-    center = Alignment(horizontal="center", vertical="center")
-    left = Alignment(horizontal="left", vertical="center")
-    right = Alignment(horizontal="right", vertical="center")
+    last_col = 1 + len(hours)
 
-    _set_row_height(ws, 1)
-    ws["A1"] = str(date_value)
-    ws["A1"].alignment = center
-    ws["A1"].fill = head_fill
-    ws["A1"].border = border
-    _set_base_font(ws["A1"], force_bold=True)
+    def label_cell(r, label):
+        styles.apply(ws.cell(row=r, column=1, value=label), bold=True, color="FFFFFF", fill=BLACK_FILL, alignment=LEFT)
 
+    styles.apply(ws.cell(row=1, column=1, value=str(date_value)), bold=True, fill=HEAD_FILL, alignment=CENTER)
     for j, h in enumerate(hours, start=2):
-        c = ws.cell(row=1, column=j, value=int(h))
-        c.alignment = center
-        c.fill = head_fill
-        c.border = border
-        _set_base_font(c, force_bold=True)
-
-    _set_row_height(ws, 2)
-    ws["A2"] = "撿貨（已撿數量）"
-    ws["A2"].fill = black_fill
-    ws["A2"].alignment = left
-    ws["A2"].border = border
-    _set_base_font(ws["A2"], force_bold=True, force_color="FFFFFF")
-
-    for j in range(2, 2 + len(hours)):
-        cell = ws.cell(row=2, column=j, value=None)
-        cell.alignment = right
-        cell.border = border
-        cell.number_format = NUM_FMT_2_HIDE0
-        _set_base_font(cell)
+        styles.apply(ws.cell(row=1, column=j, value=int(h)), bold=True, fill=HEAD_FILL, alignment=CENTER)
+
+    # 第 2 列：各線（PCS）加權合計，公式最後再填
+    label_cell(2, "撿貨（已撿數量）")
+    for j in range(2, last_col + 1):
+        styles.apply(ws.cell(row=2, column=j), alignment=RIGHT, number_format=NUM_FMT_2_HIDE0)
 
     r = 3
     pcs_weight_rows = []
 
     def write_row(label, values_by_hour=None, fill=None, is_manpower=False):
         nonlocal r
-        _set_row_height(ws, r)
-
-        a = ws.cell(row=r, column=1, value=label)
-        a.fill = black_fill
-        a.alignment = left
-        a.border = border
-        _set_base_font(a, force_bold=True, force_color="FFFFFF")
+        label_cell(r, label)
 
         for j, h in enumerate(hours, start=2):
             raw = "" if values_by_hour is None else values_by_hour.get(int(h), "")
 
+            fmt = None
             if is_manpower:
                 val, fmt = _manpower_cell_value_and_format(raw)
-                c = ws.cell(row=r, column=j, value=val)
-                if fmt:
-                    c.number_format = fmt
             else:
                 try:
                     fv = float(raw)
                     if abs(fv) < 1e-12:
-                        c = ws.cell(row=r, column=j, value="")
+                        val = ""
                     else:
-                        c = ws.cell(row=r, column=j, value=fv)
-                        c.number_format = NUM_FMT_2_HIDE0
+                        val, fmt = fv, NUM_FMT_2_HIDE0
                 except Exception:
-                    c = ws.cell(row=r, column=j, value="")
+                    val = ""
 
-            c.alignment = right
-            c.border = border
-            if fill is not None:
-                c.fill = fill
-                _set_base_font(c, force_bold=True)
-            else:
-                _set_base_font(c)
+            styles.apply(
+                ws.cell(row=r, column=j, value=val),
+                bold=fill is not None,
+                fill=fill,
+                alignment=RIGHT,
+                number_format=fmt or "General",
+            )
 
         row_idx = r
         r += 1
@@ -517,41 +527,23 @@ def write_hourly_sheet(
 
     def write_formula_row(label, numerator_row, denom_row, number_format):
         nonlocal r
-        _set_row_height(ws, r)
-
-        a = ws.cell(row=r, column=1, value=label)
-        a.fill = black_fill
-        a.alignment = left
-        a.border = border
-        _set_base_font(a, force_bold=True, force_color="FFFFFF")
+        label_cell(r, label)
 
-        for j in range(2, 2 + len(hours)):
+        for j in range(2, last_col + 1):
             col = get_column_letter(j)
             num = f"{col}{numerator_row}"
             den = f"{col}{denom_row}"
             formula = f'=IF(OR({den}="",{den}=0),"",IF({num}/{den}=0,"",{num}/{den}))'
-            c = ws.cell(row=r, column=j, value=formula)
-            c.alignment = right
-            c.border = border
-            c.number_format = number_format
-            _set_base_font(c)
+            styles.apply(ws.cell(row=r, column=j, value=formula), alignment=RIGHT, number_format=number_format)
 
         r += 1
 
     for lid in lineids:
         lid = str(lid)
 
-        _set_row_height(ws, r)
-        a = ws.cell(row=r, column=1, value=f"{lid} Line")
-        a.fill = black_fill
-        a.alignment = left
-        a.border = border
-        _set_base_font(a, force_bold=True, force_color="FFFFFF")
-        for j in range(2, 2 + len(hours)):
-            c = ws.cell(row=r, column=j, value=None)
-            c.border = border
-            c.alignment = right
-            _set_base_font(c)
+        label_cell(r, f"{lid} Line")
+        for j in range(2, last_col + 1):
+            styles.apply(ws.cell(row=r, column=j), alignment=RIGHT)
         r += 1
 
         pcs_weight_map = line_base_map.get((lid, "加權PCS"), {})
@@ -575,31 +567,24 @@ def write_hourly_sheet(
         row_man = write_row(
             f"{lid}（人數）",
             man_map,
-            fill=PatternFill("solid", fgColor="FFF2CC"),
+            fill=MANPOWER_FILL,
             is_manpower=True
         )
 
         write_formula_row("平均產力(加權) 4", numerator_row=row_pcs_w, denom_row=row_man, number_format=NUM_FMT_4_HIDE0)
         write_formula_row("平均產力(加權)", numerator_row=row_pcs_w, denom_row=row_man, number_format=NUM_FMT_2_HIDE0)
 
-        _set_row_height(ws, r)
-        for j in range(1, 2 + len(hours)):
-            c = ws.cell(row=r, column=j, value=None)
-            c.border = border
-            c.alignment = right if j >= 2 else left
-            _set_base_font(c)
+        for j in range(1, last_col + 1):
+            styles.apply(ws.cell(row=r, column=j), alignment=RIGHT if j >= 2 else LEFT)
         r += 1
 
-    for j in range(2, 2 + len(hours)):
+    for j in range(2, last_col + 1):
         col = get_column_letter(j)
         refs = ",".join([f"{col}{rr}" for rr in pcs_weight_rows]) if pcs_weight_rows else ""
-        c = ws.cell(row=2, column=j, value=(f'=IF(SUM({refs})=0,"",SUM({refs}))' if refs else '""'))
-        c.number_format = NUM_FMT_2_HIDE0
-        c.alignment = Alignment(horizontal="right", vertical="center")
-        _set_base_font(c)
+        ws.cell(row=2, column=j).value = f'=IF(SUM({refs})=0,"",SUM({refs}))' if refs else '""'
 
     ws.column_dimensions["A"].width = 24
-    for j in range(2, 2 + len(hours)):
+    for j in range(2, last_col + 1):
         ws.column_dimensions[get_column_letter(j)].width = 12
     ws.freeze_panes = "B3"
     return ws
@@ -694,18 +679,8 @@ def build_summary_sheet_with_achievers(
     if summary_name in wb.sheetnames:
         wb.remove(wb[summary_name])
     ws = wb.create_sheet(summary_name)
-
-    thin = Side(style="thin", color="D0D0D0")
-    thick = Side(style="medium", color="111111")
-    border = Border(left=thin, right=thin, top=thin, bottom=thin)
-    box_border = Border(left=thick, right=thick, top=thick, bottom=thick)
-
-    header_fill = PatternFill("solid", fgColor="F8CBAD")
-    sub_header_fill = PatternFill("solid", fgColor="F2F2F2")
-
-    center = Alignment(horizontal="center", vertical="center")
-    right = Alignment(horizontal="right", vertical="center")
-    left = Alignment(horizontal="left", vertical="center")
+    styles = styles_for(wb)
+    _set_row_heights(ws)
 
     headers = {
         1: "Line ID",
@@ -720,16 +695,8 @@ def build_summary_sheet_with_achievers(
         10: "差異(加權)",
     }
 
-    def _set_row_h(r):
-        ws.row_dimensions[r].height = ROW_HEIGHT
-
-    _set_row_h(1)
     for col, title in headers.items():
-        cell = ws.cell(1, col, title)
-        cell.fill = header_fill
-        cell.border = border
-        cell.alignment = center
-        _set_base_font(cell, force_bold=True)
+        styles.apply(ws.cell(1, col, title), bold=True, fill=HEADER_FILL, alignment=CENTER)
 
     ws.column_dimensions["A"].width = 12
     ws.column_dimensions["B"].width = 16
@@ -753,19 +720,24 @@ def build_summary_sheet_with_achievers(
         t = f'TEXT({expr},"#,##0.##")'
         return f'IF(RIGHT({t},1)=".",LEFT({t},LEN({t})-1),{t})'
 
+    # 每欄固定的對齊 / 數字格式
+    col_styles = {
+        1: (CENTER, "General"),
+        2: (CENTER, NUM_FMT_INT),
+        3: (CENTER, "@"),
+        7: (RIGHT, "@"),
+    }
+
     items = list(line_map.items())
     for i, (lid, rows) in enumerate(items):
         r = r0 + i
-        _set_row_h(r)
 
-        for col in [1,2,3,4,5,6,7,8,9,10]:
-            cell = ws.cell(r, col)
-            cell.border = border
-            cell.alignment = center if col in (1,2,3) else right
-            _set_base_font(cell)
+        for col in range(1, 11):
+            alignment, number_format = col_styles.get(col, (RIGHT, NUM_FMT_INT_HIDE0))
+            styles.apply(ws.cell(r, col), alignment=alignment, number_format=number_format)
 
         ws.cell(r, 1, str(lid).strip())
-        ws.cell(r, 2, TARGET_PER_MANHOUR).number_format = NUM_FMT_INT
+        ws.cell(r, 2, TARGET_PER_MANHOUR)
 
         man_row = rows["man"]
         pcsw_row = rows["pcs_w"]
@@ -775,17 +747,17 @@ def build_summary_sheet_with_achievers(
         pm_man_expr = sum_cells_formula(src, man_row, pm_cols)[1:]
         pm_pcs_expr = sum_cells_formula(src, pcsw_row, pm_cols)[1:]
 
-        ws.cell(r, 3, f'=IF({am_man_expr}=0,"",{text_no_trailing_dot(am_man_expr)})').number_format = "@"
-        ws.cell(r, 7, f'=IF({pm_man_expr}=0,"",{text_no_trailing_dot(pm_man_expr)})').number_format = "@"
+        ws.cell(r, 3, f'=IF({am_man_expr}=0,"",{text_no_trailing_dot(am_man_expr)})')
+        ws.cell(r, 7, f'=IF({pm_man_expr}=0,"",{text_no_trailing_dot(pm_man_expr)})')
 
-        ws.cell(r, 4, f'=IF($C{r}="","",TRUNC($B{r}*VALUE(SUBSTITUTE($C{r},",","")),0))').number_format = NUM_FMT_INT_HIDE0
-        ws.cell(r, 8, f'=IF($G{r}="","",TRUNC($B{r}*VALUE(SUBSTITUTE($G{r},",","")),0))').number_format = NUM_FMT_INT_HIDE0
+        ws.cell(r, 4, f'=IF($C{r}="","",TRUNC($B{r}*VALUE(SUBSTITUTE($C{r},",","")),0))')
+        ws.cell(r, 8, f'=IF($G{r}="","",TRUNC($B{r}*VALUE(SUBSTITUTE($G{r},",","")),0))')
 
-        ws.cell(r, 5, f'=IF($C{r}="","",IF({am_pcs_expr}=0,"",TRUNC({am_pcs_expr},0)))').number_format = NUM_FMT_INT_HIDE0
-        ws.cell(r, 9, f'=IF($G{r}="","",IF({pm_pcs_expr}=0,"",TRUNC({pm_pcs_expr},0)))').number_format = NUM_FMT_INT_HIDE0
+        ws.cell(r, 5, f'=IF($C{r}="","",IF({am_pcs_expr}=0,"",TRUNC({am_pcs_expr},0)))')
+        ws.cell(r, 9, f'=IF($G{r}="","",IF({pm_pcs_expr}=0,"",TRUNC({pm_pcs_expr},0)))')
 
-        ws.cell(r, 6, f'=IF(OR($D{r}="",$E{r}=""),"",TRUNC($E{r}-$D{r},0))').number_format = NUM_FMT_INT_HIDE0
-        ws.cell(r, 10, f'=IF(OR($H{r}="",$I{r}=""),"",TRUNC($I{r}-$H{r},0))').number_format = NUM_FMT_INT_HIDE0
+        ws.cell(r, 6, f'=IF(OR($D{r}="",$E{r}=""),"",TRUNC($E{r}-$D{r},0))')
+        ws.cell(r, 10, f'=IF(OR($H{r}="",$I{r}=""),"",TRUNC($I{r}-$H{r},0))')
 
     last_row = r0 + len(items) - 1
     if last_row < r0:
@@ -819,50 +791,31 @@ def build_summary_sheet_with_achievers(
         col_name = 13  # M
         col_money = 14 # N
 
-        _set_row_h(start_row)
-        for cc in range(col_line, col_money + 1):
-            c = ws.cell(start_row, cc)
-            c.border = border
-            _set_base_font(c)
-
-        tcell = ws.cell(start_row, col_line, title)
-        tcell.alignment = left
-        _set_base_font(tcell, force_bold=True)
+        styles.apply(ws.cell(start_row, col_line, title), bold=True, alignment=LEFT)
+        for cc in range(col_line + 1, col_money + 1):
+            styles.apply(ws.cell(start_row, cc))
         ws.merge_cells(start_row=start_row, start_column=col_line, end_row=start_row, end_column=col_money)
 
         hr = start_row + 1
-        _set_row_h(hr)
         h1 = ws.cell(hr, col_line, "達標 Line ID")
         h2 = ws.cell(hr, col_name, "姓名（自動帶入，可手改）")
         h3 = ws.cell(hr, col_money, "金額（可輸入/預設公式）")
         for c in (h1, h2, h3):
-            c.fill = sub_header_fill
-            c.border = border
-            c.alignment = center
-            _set_base_font(c, force_bold=True)
+            styles.apply(c, bold=True, fill=HEAD_FILL, alignment=CENTER)
 
         rr = hr + 1
         first_list_row = rr
 
         def _write_row(label, money_formula_or_blank, name_value=""):
             nonlocal rr
-            _set_row_h(rr)
-
-            c1 = ws.cell(rr, col_line, label)
-            c1.alignment = center
-            c1.border = border
-            _set_base_font(c1, force_bold=True)
-
-            c2 = ws.cell(rr, col_name, name_value or "")
-            c2.border = box_border
-            c2.alignment = left
-            _set_base_font(c2)
-
-            c3 = ws.cell(rr, col_money, money_formula_or_blank)
-            c3.border = box_border
-            c3.alignment = right
-            c3.number_format = NUM_FMT_MONEY_HIDE0
-            _set_base_font(c3)
+            styles.apply(ws.cell(rr, col_line, label), bold=True, alignment=CENTER)
+            styles.apply(ws.cell(rr, col_name, name_value or ""), border=BOX_BORDER, alignment=LEFT)
+            styles.apply(
+                ws.cell(rr, col_money, money_formula_or_blank),
+                border=BOX_BORDER,
+                alignment=RIGHT,
+                number_format=NUM_FMT_MONEY_HIDE0,
+            )
 
             rr += 1
 
@@ -916,9 +869,10 @@ def build_summary_sheet_with_achievers(
     return ws
 
 
+# 快取 key = 內容指紋 + 檔名；_raw 以底線開頭，Streamlit 不會每次重跑都雜湊整份內容
 @st.cache_data(show_spinner=False)
-def parse_source_file(raw: bytes, filename: str):
-    df = robust_read_bytes(raw, filename)
+def parse_source_file(fingerprint: str, filename: str, _raw: bytes):
+    df = robust_read_bytes(_raw, filename)
     df, c_pickdate, c_packqty, c_cweight, c_lineid, c_stotype = normalize_columns(df)
     df2, line_base, split = build_hourly_metrics(df, c_pickdate, c_packqty, c_cweight, c_lineid, c_stotype)
 
@@ -937,13 +891,13 @@ def parse_source_file(raw: bytes, filename: str):
     return df2, line_base, split, dates, date_to_hours, date_to_lineids_all, c_lineid, c_stotype
 
 
-def excel_bytes_from_inputs(
+def build_workbook_from_inputs(
     line_base, split,
     dates, date_to_hours, date_to_lineids_filtered,
     c_lineid, c_stotype,
     get_table_by_date_func,
     name_map
-) -> bytes:
+) -> Workbook:
     wb = Workbook()
     wb.remove(wb.active)
 
@@ -1018,11 +972,13 @@ def excel_bytes_from_inputs(
     sum_sheets = [sn for sn in wb.sheetnames if sn.startswith("彙總_")]
     other_sheets = [sn for sn in wb.sheetnames if not sn.startswith("彙總_")]
     wb._sheets = [wb[sn] for sn in sum_sheets + other_sheets]
+    return wb
+
 
+def excel_bytes_from_inputs(*args, **kwargs) -> bytes:
     out = BytesIO()
-    wb.save(out)
-    out.seek(0)
-    return out.read()
+    build_workbook_from_inputs(*args, **kwargs).save(out)
+    return out.getvalue()
 
 
 # =========================
@@ -1044,23 +1000,23 @@ if not up:
     st.info("請先上傳檔案。")
     st.stop()
 
-raw = up.getvalue()
+raw = upload_bytes(up)
 filename = up.name
 
 # 檔案變更時清理舊狀態（避免混到上一份）
-sig = hashlib.md5(raw).hexdigest()
+sig = upload_fingerprint(up)
 if st.session_state.get("src_sig_v5") != sig:
     for k in list(st.session_state.keys()):
         if (
             k.startswith("mp_store_") or k.startswith("mp_rev_") or k.startswith("mp_schema_")
             or k.startswith("am_fill_") or k.startswith("pm_fill_")
-            or k.startswith("excel_bytes_oneclick") or k.startswith("excel_name_oneclick")
         ):
             del st.session_state[k]
+    download_store.discard(st.session_state.pop("excel_token_v5", None))
     st.session_state["src_sig_v5"] = sig
 
 with st.spinner("解析檔案中..."):
-    df2, line_base, split, dates, date_to_hours, date_to_lineids_all, c_lineid, c_stotype = parse_source_file(raw, filename)
+    df2, line_base, split, dates, date_to_hours, date_to_lineids_all, c_lineid, c_stotype = parse_source_file(sig, filename, raw)
 
 st.success(f"讀取完成：共 {len(dates)} 天")
 
@@ -1208,10 +1164,10 @@ for d in dates:
 card_close()
 
 # =========================
-# ✅ 真正：產出excel = 下載excel（1-click）
+# 匯出 Excel（伺服器端暫存 + 一次性下載）
 # =========================
 st.markdown("---")
-card_open("⬇️ 匯出 Excel（真正一鍵：產出=下載）")
+card_open("⬇️ 匯出 Excel")
 
 base = os.path.splitext(os.path.basename(filename))[0]
 out_name = st.text_input(
@@ -1223,9 +1179,9 @@ out_name = st.text_input(
 def _get_table_by_date(d):
     return st.session_state.get(f"mp_store_{str(d)}")
 
-if st.button("⬇️ 產出並下載 Excel（1-click）", type="primary", use_container_width=True):
+if st.button("⬇️ 產出 Excel", type="primary", use_container_width=True):
     with st.spinner("Excel 產生中..."):
-        xbytes = excel_bytes_from_inputs(
+        wb = build_workbook_from_inputs(
             line_base=line_base,
             split=split,
             dates=dates,
@@ -1236,37 +1192,20 @@ if st.button("⬇️ 產出並下載 Excel（1-click）", type="primary", use_co
             get_table_by_date_func=_get_table_by_date,
             name_map=name_map,
         )
-
-    st.session_state["excel_bytes_oneclick"] = xbytes
-    st.session_state["excel_name_oneclick"] = out_name
-
-    b64 = base64.b64encode(xbytes).decode("utf-8")
-    safe_name = (out_name or "export.xlsx").replace('"', "").replace("\\", "_").replace("/", "_")
-
-    components.html(
-        f"""
-        <html><body>
-        <a id="dl" download="{safe_name}"
-           href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}">
-        </a>
-        <script>
-          document.getElementById('dl').click();
-        </script>
-        </body></html>
-        """,
-        height=0,
-    )
-
-    st.success("已觸發下載。若瀏覽器阻擋自動下載，請用下方「備援下載」按鈕。")
-
-# 備援下載（瀏覽器策略阻擋自動下載時）
-if st.session_state.get("excel_bytes_oneclick"):
-    st.download_button(
-        "⬇️ 備援下載（瀏覽器阻擋自動下載時使用）",
-        data=st.session_state["excel_bytes_oneclick"],
-        file_name=st.session_state.get("excel_name_oneclick", "export.xlsx"),
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        use_container_width=True
-    )
+        # 直接存到伺服器端暫存檔；session 只留 token
+        download_store.discard(st.session_state.get("excel_token_v5"))
+        st.session_state["excel_token_v5"] = download_store.put(wb.save, out_name or "export.xlsx")
+        del wb
+
+# 下載一次後暫存檔即刪除；逾時未下載也會自動清掉
+if download_store.download_button(
+    "⬇️ 下載 Excel",
+    st.session_state.get("excel_token_v5"),
+    key="excel_dl_v5",
+    use_container_width=True,
+):
+    st.success("Excel 已產出，請按「下載 Excel」。")
+else:
+    st.session_state.pop("excel_token_v5", None)
 
 card_close()
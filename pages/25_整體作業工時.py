@@ -17,6 +17,8 @@ from common_ui import (
     card_close,
     download_excel_card,  # ✅ 一行=按鈕（且外框不分段）
 )
+from export_recipe import ExportRecipe
+from report_schema import apply_schema, get_schema, missing_columns
 
 st.set_page_config(page_title="大豐KPI｜整體作業工時", page_icon="🕒", layout="wide")
 inject_logistics_theme()
@@ -30,7 +32,8 @@ set_page(
 # ----------------------------
 # helpers
 # ----------------------------
-REQ_COLS = ["上班打卡時間", "職務", "組別", "上班時數", "打卡時數", "員工姓名"]
+# 必要欄位登錄在 report_schema.py：attendance_hours（明細整份下載，不做欄位投影）
+SCHEMA = get_schema("attendance_hours")
 
 
 def _fmt2(x) -> str:
@@ -65,11 +68,11 @@ def robust_read_excel(uploaded_file) -> pd.DataFrame:
 
 
 def build_outputs(df_raw: pd.DataFrame) -> dict:
-    miss = [c for c in REQ_COLS if c not in df_raw.columns]
+    miss = missing_columns(df_raw.columns, SCHEMA)
     if miss:
         raise ValueError(f"缺少必要欄位：{', '.join(miss)}")
 
-    df0 = df_raw.copy()
+    df0 = apply_schema(df_raw, SCHEMA)
 
     # 3) 排除「上班打卡時間」空值/空白
     before_c = len(df0)
@@ -270,12 +273,13 @@ detail_df = detail_map[scope].copy()
 stamp = datetime.now().strftime("%Y%m%d_%H%M")
 filename = f"大豐KPI_整體作業工時_{scope}_{stamp}.xlsx"
 
-xlsx_bytes = make_excel_bytes(out["summary"], detail_df)
+# 只留配方，按下載時才寫 Excel
+export = ExportRecipe(make_excel_bytes, (out["summary"], detail_df), file_name=filename)
 
 download_excel_card(
-    title="✅ 下載 Excel（含：工時摘要 + 明細）",
-    data=xlsx_bytes,
+    export,
     filename=filename,
+    label="✅ 下載 Excel（含：工時摘要 + 明細）",
 )
 
 with st.expander("🔎 明細預覽（前 200 筆）", expanded=False):
@@ -2,8 +2,10 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
-from io import BytesIO, StringIO
+from io import BytesIO
 from datetime import datetime
+from itertools import chain
+from typing import Iterator
 import hashlib
 
 import numpy as np
@@ -18,6 +20,8 @@ from common_ui import (
     card_open,
     card_close,
 )
+from report_schema import apply_schema, get_schema, missing_columns
+from txt_stream import CHUNK_ROWS, iter_txt_chunks, peek_text
 
 st.set_page_config(page_title="大豐KPI｜整體作業量體", page_icon="🧹", layout="wide")
 inject_logistics_theme()
@@ -62,7 +66,8 @@ set_page(
 # =====================================
 # ✅ constants
 # =====================================
-NEED_COLS = ["packqty", "入數", "箱類型", "載具號", "BOXTYPE", "boxid"]
+# 必要欄位登錄在 report_schema.py：ship_unit_txt（明細整份下載，不做欄位投影）
+SCHEMA = get_schema("ship_unit_txt")
 CANDIDATE_SEPS = ["\t", ",", "|", ";"]
 
 ENCODING_CANDIDATES = [
@@ -186,74 +191,85 @@ def _detect_sep(text: str) -> str | None:
     return best if best_cnt > 0 else None
 
 
-def _read_txt_as_df(text: str, mode: str) -> pd.DataFrame:
+def _iter_txt_frames(raw: bytes, enc: str, head_text: str, mode: str, chunksize: int) -> Iterator[pd.DataFrame]:
     """
     mode: auto / sep:\t / sep:, / sep:| / sep:; / ws / fwf
+    逐塊產出（每塊 chunksize 列），整份文字不會一次 decode 進記憶體
     """
     if mode.startswith("sep:"):
-        sep = mode.split(":", 1)[1]
-        return pd.read_csv(StringIO(text), sep=sep, dtype=str, engine="python")
+        yield from iter_txt_chunks(raw, enc, sep=mode.split(":", 1)[1], chunksize=chunksize)
+        return
 
     if mode == "ws":
-        return pd.read_csv(StringIO(text), sep=r"\s+", dtype=str, engine="python")
+        yield from iter_txt_chunks(raw, enc, sep=r"\s+", chunksize=chunksize)
+        return
 
     if mode == "fwf":
-        return pd.read_fwf(StringIO(text), dtype=str)
+        yield from iter_txt_chunks(raw, enc, fwf=True, chunksize=chunksize)
+        return
 
     # auto
-    sep = _detect_sep(text)
+    sep = _detect_sep(head_text)
     if sep is not None:
-        return pd.read_csv(StringIO(text), sep=sep, dtype=str, engine="python")
+        yield from iter_txt_chunks(raw, enc, sep=sep, chunksize=chunksize)
+        return
 
-    # fallback：多空白 -> 固定寬度
+    # fallback：多空白 -> 固定寬度（用第一塊判斷欄數）
     try:
-        df_ws = pd.read_csv(StringIO(text), sep=r"\s+", dtype=str, engine="python")
-        if df_ws.shape[1] >= 2:
-            return df_ws
+        chunks = iter_txt_chunks(raw, enc, sep=r"\s+", chunksize=chunksize)
+        first = next(chunks, None)
+        if first is not None and first.shape[1] >= 2:
+            yield from chain([first], chunks)
+            return
     except Exception:
         pass
-    return pd.read_fwf(StringIO(text), dtype=str)
+    yield from iter_txt_chunks(raw, enc, fwf=True, chunksize=chunksize)
 
 
-def read_txt_bytes(raw: bytes, parse_mode: str, encoding_choice: str) -> tuple[pd.DataFrame, str]:
+def read_txt_chunks(
+    raw: bytes, parse_mode: str, encoding_choice: str, chunksize: int = CHUNK_ROWS
+) -> tuple[Iterator[pd.DataFrame], str]:
     if encoding_choice == "自動(偵測)":
-        enc, _ = detect_best_encoding(raw)
+        enc, head_text = detect_best_encoding(raw)
     else:
         enc = encoding_choice
+        head_text = peek_text(raw, enc, 4000)
 
-    text = raw.decode(enc, errors="replace")
-    df = _read_txt_as_df(text, parse_mode)
-    return df, enc
+    return _iter_txt_frames(raw, enc, head_text, parse_mode, chunksize), enc
 
 
 # =====================================
 # ✅ Read file（Excel/TXT/CSV）
 # =====================================
-def robust_read_file(uploaded_file, txt_parse_choice: str, txt_encoding_choice: str) -> tuple[pd.DataFrame, str | None]:
+PARSE_MAP = {
+    "自動": "auto",
+    "Tab": "sep:\t",
+    "逗號 ,": "sep:,",
+    "直線 |": "sep:|",
+    "分號 ;": "sep:;",
+    "多空白(對齊)": "ws",
+    "固定寬度(FWF)": "fwf",
+}
+
+
+def iter_file_frames(
+    uploaded_file, txt_parse_choice: str, txt_encoding_choice: str, chunksize: int = CHUNK_ROWS
+) -> tuple[Iterator[pd.DataFrame], str | None]:
+    """TXT/CSV 分塊讀取；Excel 整張一次讀（只會有一塊）"""
     name = (uploaded_file.name or "").lower()
     raw = uploaded_file.getvalue()
-
-    parse_map = {
-        "自動": "auto",
-        "Tab": "sep:\t",
-        "逗號 ,": "sep:,",
-        "直線 |": "sep:|",
-        "分號 ;": "sep:;",
-        "多空白(對齊)": "ws",
-        "固定寬度(FWF)": "fwf",
-    }
-    parse_mode = parse_map.get(txt_parse_choice, "auto")
+    parse_mode = PARSE_MAP.get(txt_parse_choice, "auto")
 
     if name.endswith(".txt") or name.endswith(".csv"):
-        df, used_enc = read_txt_bytes(raw, parse_mode=parse_mode, encoding_choice=txt_encoding_choice)
-        return df, used_enc
+        return read_txt_chunks(raw, parse_mode, txt_encoding_choice, chunksize)
 
     bio = BytesIO(raw)
     try:
-        return pd.read_excel(bio, engine="openpyxl"), None
+        df = pd.read_excel(bio, engine="openpyxl")
     except Exception:
         bio.seek(0)
-        return pd.read_excel(bio, engine="xlrd"), None
+        df = pd.read_excel(bio, engine="xlrd")
+    return iter([df]), None
 
 
 # =====================================
@@ -355,12 +371,13 @@ def apply_column_mapping(df: pd.DataFrame, map_in: str | None, map_box: str | No
 def compute(df_raw: pd.DataFrame) -> dict:
     df_raw = _normalize_columns(df_raw)
 
-    missing = [c for c in NEED_COLS if c not in df_raw.columns]
+    missing = missing_columns(df_raw.columns, SCHEMA)
     if missing:
         raise KeyError(
             f"⚠️ 找不到必要欄位：{missing}\n"
             f"目前讀到的欄位（前30）：{list(df_raw.columns)[:30]}{' ...' if len(df_raw.columns)>30 else ''}"
         )
+    df_raw = apply_schema(df_raw, SCHEMA)  # 同義寫法（大小寫/空白）→ 標準欄名
 
     before = len(df_raw)
 
@@ -394,9 +411,9 @@ def compute(df_raw: pd.DataFrame) -> dict:
     mask_box0 = boxtype == "0"
     mask_not_gm = ~mask_gm
 
-    # 4) 四項統計
-    unique_boxid_count = (
-        df.loc[mask_gm & mask_box1, "boxid"].astype(str).str.strip().replace("", np.nan).dropna().nunique()
+    # 4) 四項統計（A 是不重複 boxid，分塊時要用集合合併，不能直接相加）
+    gm_boxids = set(
+        df.loc[mask_gm & mask_box1, "boxid"].astype(str).str.strip().replace("", np.nan).dropna().unique()
     )
 
     ship_unit = pd.to_numeric(df["出貨單位（判斷後）"], errors="coerce")
@@ -409,13 +426,44 @@ def compute(df_raw: pd.DataFrame) -> dict:
         "removed_station": int(removed_station),
         "total_in": int(len(df_raw)),
         "total_after": int(len(df)),
-        "A_gm_cases": float(unique_boxid_count),
+        "gm_boxids": gm_boxids,
+        "A_gm_cases": float(len(gm_boxids)),
         "B_notgm_loose_pcs": float(total_shipunit_notgm_box0),
         "C_gm_box_pcs": float(total_shipunit_gm_box1),
         "D_notgm_box_pcs": float(total_shipunit_notgm_box1),
     }
 
 
+SUM_KEYS = ("removed_station", "total_in", "total_after", "B_notgm_loose_pcs", "C_gm_box_pcs", "D_notgm_box_pcs")
+
+
+def compute_streaming(frames: Iterator[pd.DataFrame], map_in, map_box, map_vehicle) -> dict:
+    """逐塊 compute 後合併統計：列數/PCS 直接相加、GM boxid 取聯集；不保留明細"""
+    total = {k: 0 for k in SUM_KEYS}
+    gm_boxids: set = set()
+    for chunk in frames:
+        chunk = apply_column_mapping(chunk, map_in=map_in, map_box=map_box, map_vehicle=map_vehicle)
+        out = compute(chunk)
+        for k in SUM_KEYS:
+            total[k] += out[k]
+        gm_boxids |= out["gm_boxids"]
+    total["A_gm_cases"] = float(len(gm_boxids))
+    return total
+
+
+def build_detail(files, txt_parse_choice, txt_encoding_choice, map_in, map_box, map_vehicle) -> pd.DataFrame:
+    """合併明細：只在勾選匯出明細時才重讀檔案組出來"""
+    details = []
+    for f in files:
+        frames, _ = iter_file_frames(f, txt_parse_choice, txt_encoding_choice)
+        for chunk in frames:
+            chunk = apply_column_mapping(chunk, map_in=map_in, map_box=map_box, map_vehicle=map_vehicle)
+            df_p = compute(chunk)["df_processed"]
+            df_p.insert(0, "來源檔名", f.name)
+            details.append(df_p)
+    return pd.concat(details, ignore_index=True) if details else pd.DataFrame()
+
+
 def make_excel_bytes(summary_all: pd.DataFrame, detail_all: pd.DataFrame) -> bytes:
     bio = BytesIO()
     with pd.ExcelWriter(bio, engine="openpyxl") as writer:
@@ -468,9 +516,12 @@ if not uploaded_files:
     st.info("請先上傳檔案（可多選）。")
     st.stop()
 
-# 用第一個檔案做欄位預覽與猜測（給下拉用）
+# 用第一個檔案的第一塊做欄位預覽與猜測（給下拉用；猜欄只看前 8000 列）
 try:
-    df_preview, used_enc_preview = robust_read_file(uploaded_files[0], txt_parse_choice, txt_encoding_choice)
+    preview_frames, used_enc_preview = iter_file_frames(uploaded_files[0], txt_parse_choice, txt_encoding_choice)
+    df_preview = next(preview_frames, None)
+    if df_preview is None:
+        raise ValueError("檔案沒有資料")
     df_preview = _normalize_columns(df_preview)
 except Exception as e:
     st.error(f"第一個檔案讀取失敗：{e}")
@@ -501,17 +552,15 @@ map_box = None if map_box == "（自動）" else map_box
 map_vehicle = None if map_vehicle == "（自動）" else map_vehicle
 
 results = []
-details = []
+ok_files = []
 errors = []
 
 with st.spinner("處理中…"):
     for f in uploaded_files:
         fname = f.name
         try:
-            df_raw, used_enc = robust_read_file(f, txt_parse_choice, txt_encoding_choice)
-            df_raw = apply_column_mapping(df_raw, map_in=map_in, map_box=map_box, map_vehicle=map_vehicle)
-
-            out = compute(df_raw)
+            frames, used_enc = iter_file_frames(f, txt_parse_choice, txt_encoding_choice)
+            out = compute_streaming(frames, map_in, map_box, map_vehicle)
 
             results.append(
                 {
@@ -527,9 +576,7 @@ with st.spinner("處理中…"):
                 }
             )
 
-            df_p = out["df_processed"].copy()
-            df_p.insert(0, "來源檔名", fname)
-            details.append(df_p)
+            ok_files.append(f)
 
         except Exception as e:
             errors.append({"檔名": fname, "錯誤": str(e)})
@@ -543,7 +590,6 @@ if not results:
     st.stop()
 
 summary_all = pd.DataFrame(results)
-detail_all = pd.concat(details, ignore_index=True) if details else pd.DataFrame()
 
 # KPI（合計）
 total_files_ok = len(summary_all)
@@ -585,7 +631,7 @@ card_close()
 # =====================================
 st.subheader("📤 匯出（統計總表 + 合併明細）")
 
-export_detail = st.checkbox("包含合併明細（明細很大時可能下載失敗）", value=True)
+export_detail = st.checkbox("包含合併明細（需重讀全部檔案；明細很大時可能下載失敗）", value=False)
 
 stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 fn_summary = f"DaFengKPI_OverallVolume_Summary_{stamp}.xlsx"
@@ -611,6 +657,9 @@ st.caption(f"統計總表大小：{len(xlsx_sum)/1024/1024:.2f} MB")
 
 # 2) ✅ 合併明細：提供兩種路徑
 if export_detail:
+    with st.spinner("組合併明細中…"):
+        detail_all = build_detail(ok_files, txt_parse_choice, txt_encoding_choice, map_in, map_box, map_vehicle)
+
     # 2-1) 先嘗試做「完整 Excel」（可能很大）
     try:
         bio_full = BytesIO()
@@ -664,6 +713,6 @@ if export_detail:
     except Exception as e:
         st.error(f"產生明細 CSV.gz 失敗：{e}")
 
-with st.expander("🔎 合併明細預覽（前 200 筆）", expanded=False):
-    st.dataframe(detail_all.head(200), use_container_width=True)
+    with st.expander("🔎 合併明細預覽（前 200 筆）", expanded=False):
+        st.dataframe(detail_all.head(200), use_container_width=True)
     
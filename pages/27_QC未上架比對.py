@@ -1,19 +1,18 @@
 # pages/27_QC未上架比對.py
 # -*- coding: utf-8 -*-
-import io
-from collections import defaultdict
+from dataclasses import dataclass, replace
 from datetime import datetime, date
-from typing import Optional, Tuple, Dict
+from typing import Dict, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 from openpyxl import load_workbook
-from openpyxl.styles import Alignment
-from openpyxl import Workbook
-from openpyxl.utils import get_column_letter
-import copy as _copy
 
 from common_ui import inject_logistics_theme, set_page, card_open, card_close
+from excel_export import SheetStyle, write_workbook
+from export_recipe import ExportRecipe, download_button
+from upload_buffer import byte_stream, upload_bytes
 
 
 # =============================
@@ -128,27 +127,138 @@ div[data-testid="stButton"] > button{
 
 
 # =============================
-# 工具：定位欄位 / 文字格式
+# 讀取：整張工作表 → 欄位（值 + 儲存格格式）
 # =============================
-def get_ws(wb, sheet_name: Optional[str]):
-    return wb[sheet_name] if sheet_name else wb.worksheets[0]
+@dataclass
+class SheetData:
+    title: str
+    headers: List[str]
+    df: pd.DataFrame               # 欄位用位置編號 0..n-1，值為原始儲存格值
+    formats: Dict[int, List[str]]  # 比對用欄位：每列的 number_format（推碼長 / 補 0 用）
+    col_formats: Dict[int, str]    # 每欄第一個數值/日期格的 number_format（整欄一致時輸出沿用）
+    cell_formats: Dict[int, List[Optional[str]]]  # 數值格格式不一致的欄：每列自己的 number_format（輸出逐格沿用）
 
 
-def find_header_col(ws, header_name: str, header_row: int = 1) -> Optional[int]:
+def _header_text(v) -> str:
+    return v.strip() if isinstance(v, str) else ""
+
+
+def find_header_idx(headers: List[str], header_name: str) -> Optional[int]:
+    target = header_name.strip()
     # exact
-    for c in range(1, ws.max_column + 1):
-        v = ws.cell(row=header_row, column=c).value
-        if isinstance(v, str) and v.strip() == header_name:
-            return c
+    for i, h in enumerate(headers):
+        if h and h == target:
+            return i
     # contains
-    target = header_name.strip()
-    for c in range(1, ws.max_column + 1):
-        v = ws.cell(row=header_row, column=c).value
-        if isinstance(v, str) and target in v.strip():
-            return c
+    for i, h in enumerate(headers):
+        if h and target in h:
+            return i
     return None
 
 
+def _ext(uploaded_file) -> str:
+    return (uploaded_file.name.split(".")[-1] or "").lower()
+
+
+def list_sheet_names(uploaded_file) -> List[str]:
+    ext = _ext(uploaded_file)
+    raw = upload_bytes(uploaded_file)
+    if ext in ("xlsx", "xlsm"):
+        wb = load_workbook(byte_stream(raw), read_only=True)
+        try:
+            return list(wb.sheetnames)
+        finally:
+            wb.close()
+    engine = {"xlsb": "pyxlsb", "xls": "xlrd"}.get(ext)
+    if engine is None:
+        raise ValueError(f"不支援的檔案格式：.{ext}\n支援：.xlsx / .xlsm / .xls / .xlsb")
+    return list(pd.ExcelFile(byte_stream(raw), engine=engine).sheet_names)
+
+
+def _read_xlsx_sheet(raw: bytes, sheet_name: Optional[str], format_headers: Tuple[str, ...]) -> SheetData:
+    """read_only 串流讀取：一次走完所有列，同時記下比對欄位的 number_format"""
+    wb = load_workbook(byte_stream(raw), read_only=True, data_only=True)
+    try:
+        ws = wb[sheet_name] if sheet_name else wb.worksheets[0]
+        rows = ws.iter_rows()
+        headers = [_header_text(c.value) for c in next(rows, ())]
+        fmt_cols = {i for i in (find_header_idx(headers, h) for h in format_headers) if i is not None}
+
+        columns: List[list] = [[] for _ in headers]
+        formats: Dict[int, List[str]] = {j: [] for j in fmt_cols}
+        col_formats: Dict[int, str] = {}
+        cell_formats: Dict[int, List[Optional[str]]] = {}
+        n = 0
+        for row in rows:
+            values = [c.value for c in row]
+            if all(v is None for v in values):
+                continue
+            while len(columns) < len(values):
+                columns.append([None] * n)
+                headers.append("")
+            for j, col in enumerate(columns):
+                v = values[j] if j < len(values) else None
+                col.append(v)
+                f = None
+                if v is not None and not isinstance(v, str):
+                    f = getattr(row[j], "number_format", None) or "General"
+                    if j not in col_formats:
+                        col_formats[j] = f
+                    elif j not in cell_formats and f != col_formats[j]:
+                        # 第一次遇到不同格式：之前的數值格都是 col_formats[j]，補齊後改逐格記錄
+                        cell_formats[j] = [
+                            col_formats[j] if u is not None and not isinstance(u, str) else None for u in col[:-1]
+                        ]
+                if j in cell_formats:
+                    cell_formats[j].append(f)
+            for j, fmts in formats.items():
+                fmts.append((getattr(row[j], "number_format", None) or "General") if j < len(row) else "General")
+            n += 1
+        title = ws.title
+    finally:
+        wb.close()
+
+    df = pd.DataFrame({j: pd.Series(col, dtype=object) for j, col in enumerate(columns)}, index=pd.RangeIndex(n))
+    return SheetData(title, headers, df, formats, col_formats, cell_formats)
+
+
+def read_sheet(uploaded_file, sheet_name: Optional[str], format_headers: Tuple[str, ...]) -> SheetData:
+    """支援 xlsx/xlsm/xls/xlsb；xls/xlsb 以文字讀入（沒有儲存格格式）"""
+    ext = _ext(uploaded_file)
+    raw = upload_bytes(uploaded_file)
+
+    if ext in ("xlsx", "xlsm"):
+        return _read_xlsx_sheet(raw, sheet_name, format_headers)
+
+    if ext == "xlsb":
+        try:
+            df = pd.read_excel(byte_stream(raw), engine="pyxlsb", sheet_name=sheet_name or 0, dtype=str, keep_default_na=False)
+        except Exception as e:
+            raise ValueError(f"讀取 .xlsb 失敗：{e}\n請確認 requirements.txt 有 pyxlsb")
+    elif ext == "xls":
+        try:
+            df = pd.read_excel(byte_stream(raw), engine="xlrd", sheet_name=sheet_name or 0, dtype=str, keep_default_na=False)
+        except ModuleNotFoundError:
+            raise ValueError(
+                "目前環境缺少 xlrd，無法讀取 .xls。\n"
+                "請在 requirements.txt 加上：xlrd==2.0.1\n"
+                "或先用 Excel 另存為 .xlsx 再上傳。"
+            )
+        except Exception as e:
+            raise ValueError(f"讀取 .xls 失敗：{e}\n建議先用 Excel 另存 .xlsx 再上傳。")
+    else:
+        raise ValueError(f"不支援的檔案格式：.{ext}\n支援：.xlsx / .xlsm / .xls / .xlsb")
+
+    headers = [_header_text(str(c)) for c in df.columns]
+    df = df.astype(object)
+    df.columns = range(df.shape[1])
+    formats = {j: ["General"] * len(df) for j in (find_header_idx(headers, h) for h in format_headers) if j is not None}
+    return SheetData(str(sheet_name or "Sheet1")[:31], headers, df, formats, {}, {})
+
+
+# =============================
+# 工具：碼長 / 文字化（整欄向量化）
+# =============================
 def zero_run_width(number_format: str) -> int:
     if not number_format:
         return 0
@@ -163,75 +273,108 @@ def zero_run_width(number_format: str) -> int:
     return best
 
 
-def normalize_code(value, fmt: str, fallback_width: int = 0) -> str:
-    """只用於比對（不回寫）"""
-    if value is None:
-        return ""
-    if isinstance(value, str):
-        return value.strip()
-    if isinstance(value, (datetime, date)):
-        return value.strftime("%Y-%m-%d")
-
-    width = max(zero_run_width(fmt or ""), fallback_width)
-
-    if isinstance(value, int):
-        s = str(value)
-        return s.zfill(width) if width >= 2 else s
+def _kind(v) -> str:
+    """s=文字、i=整數、f=浮點、d=日期、n=空白、o=其他"""
+    if v is None:
+        return "n"
+    if isinstance(v, str):
+        return "s"
+    if isinstance(v, bool):
+        return "o"
+    if isinstance(v, int):
+        return "i"
+    if isinstance(v, float):
+        return "n" if v != v else "f"
+    if isinstance(v, (datetime, date)):
+        return "d"
+    return "o"
+
+
+@dataclass
+class ColumnStats:
+    """單一欄位掃一次得到的統計：之後推碼長、比對、輸出都直接沿用"""
+    kinds: pd.Series        # 每格型別（見 _kind）
+    text: pd.Series         # 文字化結果（未補 0，空白為 ""）
+    integral: pd.Series     # 整數值的數字格（可依格式補 0）
+    fmt_w: pd.Series        # 每格 number_format 的連續 0 寬度
+    digit_len: int          # 純數字「文字格」的最大長度
+    fmt_width: int          # 非空白格的格式補 0 寬度最大值
+    number_fmt_width: int   # 非文字格（含空白格）的格式補 0 寬度最大值
+    counts: Dict[str, int]  # 各型別格數（文字 / 數字混用情形）
+
+    @property
+    def width(self) -> int:
+        """推斷碼長：格式補 0 寬度與純數字文字長度取最大"""
+        return max(self.fmt_width, self.digit_len)
+
+
+def _max(s: pd.Series) -> int:
+    return int(s.max()) if len(s) else 0
+
+
+def column_stats(sheet: SheetData, idx: int) -> ColumnStats:
+    s = sheet.df[idx]
+    kinds = s.map(_kind)
+    counts = kinds.value_counts().to_dict()
+    fmts = sheet.formats.get(idx) or ["General"] * len(s)
+    widths = {f: zero_run_width(f) for f in set(fmts)}
+    fmt_w = pd.Series([widths[f] for f in fmts], index=s.index, dtype="int64")
+
+    # 文字化：只處理這欄實際出現的型別
+    text = pd.Series("", index=s.index, dtype=object)
+    is_text = kinds.eq("s")
+    integral = kinds.eq("i")
+    if counts.get("s"):
+        text[is_text] = s[is_text].str.strip()
+    if counts.get("i"):
+        text[integral] = s[integral].map(str)
+    if counts.get("f"):
+        f = s[kinds.eq("f")].astype(float)
+        whole = (f - f.round()).abs() < 1e-9
+        text[f.index[whole]] = f[whole].round().astype("int64").map(str)
+        text[f.index[~whole]] = f[~whole].map(str)
+        integral[f.index[whole]] = True
+    if counts.get("d"):
+        m = kinds.eq("d")
+        text[m] = s[m].map(lambda v: v.strftime("%Y-%m-%d"))
+    if counts.get("o"):
+        m = kinds.eq("o")
+        text[m] = s[m].map(lambda v: str(v).strip())
+
+    digit_text = text[is_text] if counts.get("s") else text.iloc[:0]
+    digit_text = digit_text[digit_text.str.isdigit()]
+    return ColumnStats(
+        kinds=kinds,
+        text=text,
+        integral=integral,
+        fmt_w=fmt_w,
+        digit_len=_max(digit_text.str.len()),
+        fmt_width=_max(fmt_w[kinds.ne("n")]),
+        number_fmt_width=_max(fmt_w[~is_text]),
+        counts=counts,
+    )
 
-    if isinstance(value, float):
-        if abs(value - round(value)) < 1e-9:
-            iv = int(round(value))
-            s = str(iv)
-            return s.zfill(width) if width >= 2 else s
-        return str(value)
 
-    return str(value).strip()
+def zfill_digits(text: pd.Series, width: int) -> pd.Series:
+    if width < 2:
+        return text
+    digits = text.str.isdigit().fillna(False).astype(bool)
+    out = text.copy()
+    out[digits] = out[digits].str.zfill(width)
+    return out
 
 
-def normalize_unit(value) -> str:
-    """只用於比對（不回寫）"""
-    if value is None:
-        return ""
-    if isinstance(value, str):
-        return value.strip()
-    if isinstance(value, (datetime, date)):
-        return value.strftime("%Y-%m-%d")
-    if isinstance(value, float) and abs(value - round(value)) < 1e-9:
-        return str(int(round(value)))
-    if isinstance(value, int):
-        return str(value)
-    return str(value).strip()
-
-
-def _infer_digit_width(ws, col_idx: int, scan_limit: int = 50000) -> int:
-    """推斷碼長（未上架明細）"""
-    if col_idx is None:
-        return 0
-    w = 0
-    end_r = min(ws.max_row, scan_limit)
-    for r in range(2, end_r + 1):
-        cell = ws.cell(row=r, column=col_idx)
-        v = cell.value
-        if v is None:
-            continue
-
-        fmt = getattr(cell, "number_format", "") or ""
-        w = max(w, zero_run_width(fmt))
-
-        if isinstance(v, str):
-            s = v.strip()
-            if s.isdigit():
-                w = max(w, len(s))
-    return w
-
-
-def _pad_digits_for_compare(s: str, width: int) -> str:
-    """只拿來比對，不回寫到 QC"""
-    if not s:
-        return ""
-    if width >= 2 and s.isdigit():
-        return s.zfill(width)
-    return s
+def pad_numbers(stats: ColumnStats, min_width: int) -> pd.Series:
+    """數字格依自己的格式補 0（至少 min_width）；文字格不動"""
+    out = stats.text.copy()
+    if not stats.integral.any():
+        return out
+    pad = stats.fmt_w.clip(lower=min_width)
+    for w in sorted(set(pad[stats.integral].tolist())):
+        if w >= 2:
+            sel = stats.integral & pad.eq(w)
+            out[sel] = out[sel].str.zfill(w)
+    return out
 
 
 def format_date_value(v) -> str:
@@ -249,268 +392,57 @@ def format_date_value(v) -> str:
         return s
 
 
-# =============================
-# ✅ 輸出格式：欄寬 + 列高（全部 15.75）
-# =============================
-def apply_qc_layout(ws):
-    # 欄寬 A~K
-    for col_letter, w in COLUMN_WIDTHS.items():
-        ws.column_dimensions[col_letter].width = w
-
-    # 列高：全部 15.75
-    for r in range(1, ws.max_row + 1):
-        ws.row_dimensions[r].height = ROW_HEIGHT
-
-
-# =============================
-# ✅ 輸出用：可移動單位補滿 10 碼（不足補0）+ 設文字
-# =============================
-def pad_unit_to_10(ws, unit_col: int, start_row: int = 2, width: int = 10):
-    if not unit_col:
-        return
-    for r in range(start_row, ws.max_row + 1):
-        cell = ws.cell(row=r, column=unit_col)
-        v = cell.value
-        if v is None:
-            continue
-
-        if isinstance(v, float) and abs(v - round(v)) < 1e-9:
-            s = str(int(round(v)))
-        else:
-            s = str(v).strip()
-
-        if not s:
-            continue
-        if s.isdigit():
-            s = s.zfill(width)
-
-        cell.value = s
-        cell.number_format = "@"
-        if cell.alignment is None:
-            cell.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-
-
-# =============================
-# ✅ 輸出用：把指定欄位強制轉文字（避免科學記號/掉0）
-# - barcode 不補0，只轉成字串
-# - batch 依推寬度補0
-# =============================
-def force_text_digits(ws, col_idx: int, pad_width: int = 0, start_row: int = 2):
-    if not col_idx:
-        return
-    for r in range(start_row, ws.max_row + 1):
-        cell = ws.cell(row=r, column=col_idx)
-        v = cell.value
-        if v is None:
-            continue
-
-        if isinstance(v, float) and abs(v - round(v)) < 1e-9:
-            s = str(int(round(v)))
-        elif isinstance(v, int):
-            s = str(v)
-        else:
-            s = str(v).strip()
-
-        if not s:
-            continue
-
-        if pad_width >= 2 and s.isdigit():
-            s = s.zfill(pad_width)
-
-        cell.value = s
-        cell.number_format = "@"
-        if cell.alignment is None:
-            cell.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-
-
-def infer_col_digit_width(ws, col_idx: int, header_row: int = 1, scan_limit: int = 50000) -> int:
-    if not col_idx:
-        return 0
-    w = 0
-    end_r = min(ws.max_row, scan_limit)
-    for r in range(header_row + 1, end_r + 1):
-        cell = ws.cell(row=r, column=col_idx)
-        v = cell.value
-        if v is None:
-            continue
-        fmt = getattr(cell, "number_format", "") or ""
-        w = max(w, zero_run_width(fmt))
-        if isinstance(v, str):
-            s = v.strip()
-            if s.isdigit():
-                w = max(w, len(s))
-    return w
+def format_dates(s: pd.Series) -> pd.Series:
+    """同一個日期值只解析一次"""
+    codes, uniques = pd.factorize(s, use_na_sentinel=True)
+    table = np.array([format_date_value(u) for u in uniques] + [""], dtype=object)
+    return pd.Series(table[codes], index=s.index, dtype=object)
 
 
 # =============================
-# ✅ 刪除指定欄位（輸出檔用）
+# 比對鍵：(商品碼, 可移動單位)
 # =============================
-def delete_columns_by_headers(ws, headers_to_delete, header_row: int = 1):
-    if not headers_to_delete:
-        return
-
-    headers = []
-    for c in range(1, ws.max_column + 1):
-        v = ws.cell(row=header_row, column=c).value
-        headers.append("" if v is None else str(v).strip())
-
-    to_delete_cols = set()
-    for target in headers_to_delete:
-        t = str(target).strip()
-        if not t:
-            continue
-        for idx, h in enumerate(headers, start=1):
-            if not h:
-                continue
-            if h == t or (t in h):
-                to_delete_cols.add(idx)
-
-    for col_idx in sorted(to_delete_cols, reverse=True):
-        ws.delete_cols(col_idx, 1)
-
-    try:
-        if getattr(ws, "auto_filter", None) and ws.auto_filter.ref:
-            ws.auto_filter.ref = f"A1:{get_column_letter(ws.max_column)}{ws.max_row}"
-    except Exception:
-        pass
-
+def match_keys(code: ColumnStats, unit: ColumnStats, code_width: int, unit_width: int) -> pd.DataFrame:
+    return pd.DataFrame({
+        "code": zfill_digits(pad_numbers(code, code_width), code_width),
+        "unit": zfill_digits(unit.text, unit_width),
+    })
 
-def delete_cols_after_header(ws, header_name: str, header_row: int = 1):
-    col = find_header_col(ws, header_name, header_row)
-    if col is None:
-        return
-    if ws.max_column > col:
-        ws.delete_cols(col + 1, ws.max_column - col)
 
+def cell_format_writer(formats: List[Optional[str]]):
+    """逐格套原本的 number_format（formats 依輸出資料列順序；表頭在第 0 列）"""
 
-# =============================
-# 轉換：DataFrames -> openpyxl Workbook（xls/xlsb 用）
-# =============================
-def _dfs_to_workbook(sheets: Dict[str, pd.DataFrame]) -> Workbook:
-    wb = Workbook()
-    if wb.worksheets:
-        wb.remove(wb.worksheets[0])
-
-    for sheet_name, df in sheets.items():
-        name = str(sheet_name)[:31] if sheet_name else "Sheet1"
-        ws = wb.create_sheet(title=name)
+    def write(ws, row, col, value, props, fmt):
+        nf = formats[row - 1]
+        ws.write(row, col, value, fmt({**(props or {}), "num_format": nf}) if nf and nf != "General" else fmt(props))
 
-        headers = [("" if c is None else str(c)) for c in df.columns.tolist()]
-        ws.append(headers)
+    return write
 
-        for row in df.itertuples(index=False, name=None):
-            out_row = []
-            for v in row:
-                if v is None:
-                    out_row.append(None)
-                elif isinstance(v, float) and pd.isna(v):
-                    out_row.append(None)
-                else:
-                    out_row.append(v)
-            ws.append(out_row)
 
-    return wb
+def output_text(stats: ColumnStats, pad_width: int) -> pd.Series:
+    """輸出用：轉文字（避免科學記號 / 掉 0），純數字補到 pad_width；空白格維持空白"""
+    return zfill_digits(stats.text, pad_width).where(stats.kinds.ne("n"), None)
 
 
 # =============================
-# 讀取：支援 xlsx/xlsm/xls/xlsb（回傳 mode）
+# 主流程
 # =============================
-def _load_wb_from_upload(uploaded_file) -> Tuple[str, Workbook, str]:
-    name = uploaded_file.name
-    ext = (name.split(".")[-1] or "").lower()
-    raw = uploaded_file.getvalue()
-    bio = io.BytesIO(raw)
-
-    if ext in ("xlsx", "xlsm"):
-        keep_vba = (ext == "xlsm")
-        wb = load_workbook(bio, keep_vba=keep_vba)
-        return name, wb, "native"
-
-    if ext == "xlsb":
-        try:
-            sheets = pd.read_excel(
-                io.BytesIO(raw),
-                engine="pyxlsb",
-                sheet_name=None,
-                dtype=str,
-                keep_default_na=False,
-            )
-        except Exception as e:
-            raise ValueError(f"讀取 .xlsb 失敗：{e}\n請確認 requirements.txt 有 pyxlsb")
-        wb = _dfs_to_workbook(sheets)
-        return name, wb, "converted"
-
-    if ext == "xls":
-        try:
-            sheets = pd.read_excel(
-                io.BytesIO(raw),
-                engine="xlrd",
-                sheet_name=None,
-                dtype=str,
-                keep_default_na=False,
-            )
-        except ModuleNotFoundError:
-            raise ValueError(
-                "目前環境缺少 xlrd，無法讀取 .xls。\n"
-                "請在 requirements.txt 加上：xlrd==2.0.1\n"
-                "或先用 Excel 另存為 .xlsx 再上傳。"
-            )
-        except Exception as e:
-            raise ValueError(f"讀取 .xls 失敗：{e}\n建議先用 Excel 另存 .xlsx 再上傳。")
-        wb = _dfs_to_workbook(sheets)
-        return name, wb, "converted"
-
-    raise ValueError(f"不支援的檔案格式：.{ext}\n支援：.xlsx / .xlsm / .xls / .xlsb")
-
+QC_FORMAT_HEADERS = (QC_KEY_HEADER, UNIT_HEADER, BATCH_HEADER)
+UN_FORMAT_HEADERS = (UN_KEY_HEADER, UNIT_HEADER)
 
-# =============================
-# 小工具：刪除非符合列（保留 header）
-# =============================
-def _delete_non_matched_rows(ws, keep_rows, header_rows: int = 1):
-    max_row = ws.max_row
-    start = header_rows + 1
-    keep_set = set(r for r in keep_rows if start <= r <= max_row)
-    keep_sorted = sorted(keep_set)
-
-    segs = []
-    cur = start
-    for k in keep_sorted:
-        if cur < k:
-            segs.append((cur, k - 1))
-        cur = k + 1
-    if cur <= max_row:
-        segs.append((cur, max_row))
-
-    for s, e in reversed(segs):
-        ws.delete_rows(s, e - s + 1)
+TEXT_FORMAT = {"num_format": "@"}
+DATE_FORMAT = {"num_format": "@", "align": "center", "valign": "vcenter", "text_wrap": True}
 
-    try:
-        if getattr(ws, "auto_filter", None) and ws.auto_filter.ref:
-            ws.auto_filter.ref = f"A1:{get_column_letter(ws.max_column)}{ws.max_row}"
-    except Exception:
-        pass
 
+def process_sheets(qc: SheetData, un: SheetData) -> Tuple[int, ExportRecipe]:
+    qc_key_col = find_header_idx(qc.headers, QC_KEY_HEADER)
+    qc_unit_col = find_header_idx(qc.headers, UNIT_HEADER)
+    qc_barcode_col = find_header_idx(qc.headers, BARCODE_HEADER)
+    qc_batch_col = find_header_idx(qc.headers, BATCH_HEADER)
 
-# =============================
-# 主流程
-# =============================
-def process_wb(
-    qc_wb,
-    un_wb,
-    qc_sheet_name: Optional[str] = None,
-    un_sheet_name: Optional[str] = None,
-) -> Tuple[int, bytes]:
-    qc_ws = get_ws(qc_wb, qc_sheet_name)
-    un_ws = get_ws(un_wb, un_sheet_name)
-
-    qc_key_col = find_header_col(qc_ws, QC_KEY_HEADER, 1)
-    qc_unit_col = find_header_col(qc_ws, UNIT_HEADER, 1)
-    qc_barcode_col = find_header_col(qc_ws, BARCODE_HEADER, 1)
-    qc_batch_col = find_header_col(qc_ws, BATCH_HEADER, 1)
-
-    un_key_col = find_header_col(un_ws, UN_KEY_HEADER, 1)
-    un_unit_col = find_header_col(un_ws, UNIT_HEADER, 1)
-    un_date_col = find_header_col(un_ws, UN_DATE_HEADER, 1)
+    un_key_col = find_header_idx(un.headers, UN_KEY_HEADER)
+    un_unit_col = find_header_idx(un.headers, UNIT_HEADER)
+    un_date_col = find_header_idx(un.headers, UN_DATE_HEADER)
 
     if qc_key_col is None:
         raise ValueError(f"QC 找不到欄位：{QC_KEY_HEADER}")
@@ -524,111 +456,98 @@ def process_wb(
     if un_date_col is None:
         raise ValueError(f"未上架明細找不到欄位：{UN_DATE_HEADER}")
 
-    # 1) 推估商品碼長（比對用）
-    code_len = 0
-    for r in range(2, un_ws.max_row + 1):
-        cell = un_ws.cell(row=r, column=un_key_col)
-        if isinstance(cell.value, str):
-            s = cell.value.strip()
-            if s.isdigit():
-                code_len = max(code_len, len(s))
-        else:
-            code_len = max(code_len, zero_run_width(getattr(cell, "number_format", "") or ""))
-    fallback_width = code_len or 6
-
-    # 2) 推估可移動單位碼長（比對用）
-    unit_width = _infer_digit_width(un_ws, un_unit_col)
-
-    # 3) 建索引：(商品碼, 可移動單位) -> 進貨日
-    date_sets = defaultdict(set)
-    for r in range(2, un_ws.max_row + 1):
-        code_cell = un_ws.cell(row=r, column=un_key_col)
-        code = normalize_code(code_cell.value, getattr(code_cell, "number_format", ""), fallback_width)
-        if code and code.isdigit():
-            code = code.zfill(fallback_width)
+    # 0) 每個需要的欄位只掃一次
+    un_code, un_unit = column_stats(un, un_key_col), column_stats(un, un_unit_col)
+    qc_code, qc_unit = column_stats(qc, qc_key_col), column_stats(qc, qc_unit_col)
 
-        unit_cell = un_ws.cell(row=r, column=un_unit_col)
-        unit = normalize_unit(unit_cell.value)
-        unit = _pad_digits_for_compare(unit, unit_width)
+    # 1) 推估商品碼長（比對用）：文字取純數字長度，其餘取格式補 0 寬度
+    fallback_width = max(un_code.digit_len, un_code.number_fmt_width) or 6
 
-        d_cell = un_ws.cell(row=r, column=un_date_col)
-        d_str = format_date_value(d_cell.value)
+    # 2) 推估可移動單位碼長（比對用）
+    unit_width = un_unit.width
+
+    # 3) 未上架：(商品碼, 可移動單位) -> 進貨日（多個日期以「、」串接）
+    un_keys = match_keys(un_code, un_unit, fallback_width, unit_width)
+    un_keys["進貨日"] = format_dates(un.df[un_date_col])
+    un_keys = un_keys[un_keys["code"].ne("") & un_keys["unit"].ne("") & un_keys["進貨日"].ne("")]
+    date_map = (
+        un_keys.drop_duplicates()
+        .sort_values("進貨日")
+        .groupby(["code", "unit"], sort=False)["進貨日"]
+        .agg("、".join)
+        .reset_index()
+    )
 
-        if code and unit and d_str:
-            date_sets[(code, unit)].add(d_str)
+    # 4) QC 以 hash merge 帶出進貨日
+    qc_keys = match_keys(qc_code, qc_unit, fallback_width, unit_width)
+    in_dates = qc_keys.merge(date_map, on=["code", "unit"], how="left")["進貨日"].fillna("").to_numpy(dtype=object)
+    matched = in_dates != ""
 
-    date_map: Dict[Tuple[str, str], str] = {k: "、".join(sorted(v)) for k, v in date_sets.items()}
+    # 5) 組輸出表（新增/覆蓋「進貨日」）
+    out = qc.df.copy()
+    headers = list(qc.headers)
+    # 整欄格式一致的才設欄格式；不一致的欄之後逐格寫回各自的格式
+    col_formats = {
+        j: {"num_format": f} for j, f in qc.col_formats.items() if f and f != "General" and j not in qc.cell_formats
+    }
 
-    # 4) 新增/定位「進貨日」
-    qc_date_col = find_header_col(qc_ws, "進貨日", 1)
+    qc_date_col = find_header_idx(headers, UN_DATE_HEADER)
     if qc_date_col is None:
-        qc_date_col = qc_ws.max_column + 1
-        hdr = qc_ws.cell(row=1, column=qc_date_col, value="進貨日")
-        src_hdr = qc_ws.cell(row=1, column=qc_unit_col)
-        try:
-            hdr._style = _copy.copy(src_hdr._style)
-        except Exception:
-            pass
-        hdr.alignment = _copy.copy(getattr(src_hdr, "alignment", Alignment(horizontal="center", vertical="center")))
-
-    # 5) 填入進貨日 + 收集 match rows
-    match_rows = []
-    for r in range(2, qc_ws.max_row + 1):
-        code_cell = qc_ws.cell(row=r, column=qc_key_col)
-        code = normalize_code(code_cell.value, getattr(code_cell, "number_format", ""), fallback_width)
-        if code and code.isdigit():
-            code = code.zfill(fallback_width)
-
-        unit_cell = qc_ws.cell(row=r, column=qc_unit_col)
-        unit = normalize_unit(unit_cell.value)
-        unit = _pad_digits_for_compare(unit, unit_width)
-
-        d_str = date_map.get((code, unit), "")
-
-        out_cell = qc_ws.cell(row=r, column=qc_date_col)
-        out_cell.value = d_str
-        out_cell.number_format = "@"
-        out_cell.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-
-        if d_str:
-            match_rows.append(r)
+        qc_date_col = len(headers)
+        headers.append(UN_DATE_HEADER)
+    out[qc_date_col] = np.where(matched, in_dates, None)
+    col_formats[qc_date_col] = DATE_FORMAT
 
     # ✅ 5.5) 可移動單位：補滿10碼
-    pad_unit_to_10(qc_ws, qc_unit_col, start_row=2, width=10)
+    out[qc_unit_col] = output_text(qc_unit, 10)
+    col_formats[qc_unit_col] = TEXT_FORMAT
 
     # ✅ 5.6) 國際條碼：文字化（避免 E+12）
     if qc_barcode_col is not None:
-        force_text_digits(qc_ws, qc_barcode_col, pad_width=0)
+        out[qc_barcode_col] = output_text(column_stats(qc, qc_barcode_col), 0)
+        col_formats[qc_barcode_col] = TEXT_FORMAT
 
     # ✅ 5.7) 批號：推寬度後補0 + 文字化
     if qc_batch_col is not None:
-        batch_w = infer_col_digit_width(qc_ws, qc_batch_col)
-        force_text_digits(qc_ws, qc_batch_col, pad_width=batch_w)
-
-    # ✅ 5.8) 刪除你指定的欄位
-    delete_columns_by_headers(qc_ws, DELETE_HEADERS, header_row=1)
-
-    # ✅ 5.9) 只保留到「進貨日」為止（右邊全部刪掉）
-    delete_cols_after_header(qc_ws, "進貨日", header_row=1)
-
-    # ✅ 5.10) 套用欄寬 + 列高（全部 15.75）
-    apply_qc_layout(qc_ws)
-
-    # 6) 產生符合分頁：複製 QC → 刪除不符合列
-    if MATCH_SHEET_NAME in qc_wb.sheetnames:
-        del qc_wb[MATCH_SHEET_NAME]
-
-    mws = qc_wb.copy_worksheet(qc_ws)
-    mws.title = MATCH_SHEET_NAME
-    _delete_non_matched_rows(mws, keep_rows=match_rows, header_rows=1)
-
-    # ✅ 符合分頁也套同樣欄寬/列高
-    apply_qc_layout(mws)
+        qc_batch = column_stats(qc, qc_batch_col)
+        out[qc_batch_col] = output_text(qc_batch, qc_batch.width)
+        col_formats[qc_batch_col] = TEXT_FORMAT
+
+    # ✅ 5.8) 刪除你指定的欄位；5.9) 只保留到「進貨日」為止（右邊全部刪掉）
+    targets = [str(t).strip() for t in DELETE_HEADERS if str(t).strip()]
+    keep = [j for j, h in enumerate(headers) if not (h and any(h == t or t in h for t in targets))]
+    kept_headers = [headers[j] for j in keep]
+    last = find_header_idx(kept_headers, UN_DATE_HEADER)
+    if last is not None:
+        keep = keep[:last + 1]
+
+    out = out[keep]
+    out.columns = [headers[j] for j in keep]
+    # 上面轉成文字 / 另設格式的欄不算（j 已在 col_formats）
+    mixed = {k: qc.cell_formats[j] for k, j in enumerate(keep) if j in qc.cell_formats and j not in col_formats}
+
+    # ✅ 5.10) 欄寬 A~K + 列高（全部 15.75）
+    style = SheetStyle(
+        header={"bold": True, "align": "center", "valign": "vcenter"},
+        # 以輸出欄位序號對應格式：QC 表頭可能重複或空白，用欄名會互相覆蓋
+        column_formats={k: col_formats[j] for k, j in enumerate(keep) if j in col_formats},
+        widths=COLUMN_WIDTHS,
+        freeze=None,
+        row_height=ROW_HEIGHT,
+    )
 
-    out = io.BytesIO()
-    qc_wb.save(out)
-    out.seek(0)
-    return len(match_rows), out.getvalue()
+    # 6) 兩張表：QC 全部列 + 只有符合列的分頁；只留配方，按下載時才寫 Excel
+    qc_title = qc.title if qc.title != MATCH_SHEET_NAME else f"{qc.title}_QC"
+    match_rows = np.flatnonzero(matched)
+    sheets = {
+        qc_title: (out, replace(style, cell_writers={k: cell_format_writer(f) for k, f in mixed.items()})),
+        MATCH_SHEET_NAME: (
+            out.loc[matched].reset_index(drop=True),
+            replace(style, cell_writers={k: cell_format_writer([f[i] for i in match_rows]) for k, f in mixed.items()}),
+        ),
+    }
+    out_name = f"QC未上架比對_輸出_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    return int(matched.sum()), ExportRecipe(write_workbook, (sheets,), file_name=out_name)
 
 
 # =============================
@@ -679,15 +598,13 @@ with st.expander("進階設定（工作表選擇）", expanded=False):
     with c1:
         if qc_file:
             try:
-                _, qc_wb_preview, _ = _load_wb_from_upload(qc_file)
-                qc_sheet_name = st.selectbox("QC 工作表", options=qc_wb_preview.sheetnames, index=0)
+                qc_sheet_name = st.selectbox("QC 工作表", options=list_sheet_names(qc_file), index=0)
             except Exception as e:
                 st.error(str(e))
     with c2:
         if un_file:
             try:
-                _, un_wb_preview, _ = _load_wb_from_upload(un_file)
-                un_sheet_name = st.selectbox("未上架明細 工作表", options=un_wb_preview.sheetnames, index=0)
+                un_sheet_name = st.selectbox("未上架明細 工作表", options=list_sheet_names(un_file), index=0)
             except Exception as e:
                 st.error(str(e))
 
@@ -697,7 +614,7 @@ run = st.button("🚀 產出比對", disabled=not ready)
 card_close()
 
 status_msg = "請依序上傳：QC 明細 + 未上架明細"
-xlsx_bytes = None
+export = None
 matched = None
 
 if ready:
@@ -706,28 +623,17 @@ if ready:
 if run:
     try:
         with st.spinner("處理中…"):
-            _, qc_wb, _ = _load_wb_from_upload(qc_file)
-            _, un_wb, _ = _load_wb_from_upload(un_file)
-
-            matched, xlsx_bytes = process_wb(
-                qc_wb=qc_wb,
-                un_wb=un_wb,
-                qc_sheet_name=qc_sheet_name,
-                un_sheet_name=un_sheet_name,
-            )
+            qc_sheet = read_sheet(qc_file, qc_sheet_name, QC_FORMAT_HEADERS)
+            un_sheet = read_sheet(un_file, un_sheet_name, UN_FORMAT_HEADERS)
+
+            matched, export = process_sheets(qc_sheet, un_sheet)
     except Exception as e:
         st.error(f"❌ 執行失敗：{e}")
 
-if xlsx_bytes is not None:
+if export is not None:
     card_open("✅ 產出結果")
     st.success(f"完成！符合筆數：{matched}")
-    out_name = f"QC未上架比對_輸出_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    st.download_button(
-        label="📥 下載輸出 Excel",
-        data=xlsx_bytes,
-        file_name=out_name,
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-    )
+    download_button("📥 下載輸出 Excel", export)
     card_close()
 
 st.markdown(f'<div class="qc-banner">{status_msg}</div>', unsafe_allow_html=True)
@@ -19,6 +19,7 @@ try:
 except Exception:
     HAS_COMMON_UI = False
 
+from html_table import read_html_table
 
 # =============================
 # helpers
@@ -60,6 +61,12 @@ def _is_fake_xls(raw: bytes) -> bool:
 
 
 def _read_fake_xls_text_or_html(raw: bytes) -> pd.DataFrame:
+    # 含 <table 才會真的解析（找不到表格直接丟 ValueError，改走文字表格）
+    try:
+        return read_html_table(raw)
+    except ValueError:
+        pass
+
     for enc in ("utf-8-sig", "utf-8", "cp950", "big5"):
         try:
             text = raw.decode(enc, errors="replace")
@@ -69,12 +76,6 @@ def _read_fake_xls_text_or_html(raw: bytes) -> pd.DataFrame:
     if text is None:
         text = raw.decode("utf-8", errors="replace")
 
-    if "<table" in text.lower():
-        dfs = pd.read_html(io.StringIO(text))
-        if not dfs:
-            raise ValueError("偵測為 HTML，但找不到 table")
-        return dfs[0]
-
     # tab -> comma
     try:
         df = pd.read_csv(io.StringIO(text), sep="\t")
@@ -23,7 +23,13 @@ try:
 except Exception:
     HAS_COMMON_UI = False
 
+import download_store
+from html_table import looks_like_html, read_html_table
+from report_schema import apply_schema, find_column, get_schema
+from upload_buffer import byte_stream, sniff, upload_bytes, upload_fingerprint
+
 TPE = ZoneInfo("Asia/Taipei")
+PROD_SCHEMA = get_schema("hourly_efficiency")
 
 STATUS_PASS = "達標"
 STATUS_FAIL = "未達標"
@@ -32,6 +38,18 @@ STATUS_NA = "未判斷"
 # ✅ 特殊工時（分鐘）：12點、13點只有 30 分鐘
 WORK_MINUTES_BY_HOUR = {12: 30, 13: 30}
 
+# 固定開始時間（姓名 → HH:MM），名單外的人一律 08:00
+FIXED_START_TIMES = {
+    "范明俊": "08:00", "阮玉名": "08:00", "李茂銓": "08:00", "河文強": "08:00",
+    "蔡麗珠": "08:00", "潘文一": "08:00", "阮伊黃": "08:00", "葉欲弘": "09:00",
+    "阮武玉玄": "08:00", "吳黃金珠": "08:30", "潘氏青江": "08:00", "陳國慶": "08:30",
+    "楊心如": "08:00", "阮瑞美黃緣": "08:00", "周芸蓁": "08:00", "黎氏瓊": "08:00",
+    "王文楷": "08:30", "潘氏慶平": "08:00", "阮氏美麗": "08:00", "岳子恆": "08:30",
+    "郭雙燕": "08:30", "阮孟勇": "08:00", "廖永成": "08:30", "楊浩傑": "08:30",
+    "黃日康": "08:30", "蔣金妮": "08:30", "柴家欣": "08:30", "邱思捷": "09:00",
+    "王建成": "09:00",
+}
+
 
 # =============================
 # 欄位整理 / 檢查
@@ -42,12 +60,6 @@ def _norm_cols(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def require_columns(df: pd.DataFrame, required: list, label: str):
-    missing = [c for c in required if c not in df.columns]
-    if missing:
-        raise ValueError(f"{label} 缺少欄位：{missing}\n目前欄位：{list(df.columns)}")
-
-
 def clean_line(series: pd.Series) -> pd.Series:
     return series.astype(str).str.strip()
 
@@ -68,15 +80,6 @@ def _safe_time(s: str) -> str:
         return "08:00"
 
 
-def _bytes_sig(b: bytes) -> str:
-    if b is None:
-        return "0"
-    n = len(b)
-    head = b[:128]
-    tail = b[-128:] if n >= 128 else b
-    return f"{n}-{hash(head)}-{hash(tail)}"
-
-
 def _slot_minutes(hour: int) -> int:
     return int(WORK_MINUTES_BY_HOUR.get(int(hour), 60))
 
@@ -86,25 +89,6 @@ def _slot_minutes(hour: int) -> int:
 #   - 你的 .xls 其實是 TSV：檔頭像 b'BOXID\\tOR...'
 #   - 修正：python engine 不支援 low_memory → 不再傳入
 # =============================
-def _looks_like_html(raw: bytes) -> bool:
-    head = raw[:4096].lstrip().lower()
-    return (b"<html" in head) or (b"<!doctype" in head) or (b"<table" in head)
-
-
-def _read_html_table(raw: bytes) -> pd.DataFrame:
-    for enc in ["utf-8-sig", "utf-8", "cp950", "big5", "ms950", "latin1", "gb18030"]:
-        try:
-            text = raw.decode(enc, errors="ignore")
-            tables = pd.read_html(StringIO(text))
-            tables = [t for t in tables if isinstance(t, pd.DataFrame) and t.shape[1] >= 2]
-            if not tables:
-                continue
-            return max(tables, key=lambda x: x.shape[0] * x.shape[1])
-        except Exception:
-            continue
-    raise ValueError("偵測為 HTML 但解析表格失敗（read_html 失敗）。")
-
-
 def _read_csv_guess(raw: bytes) -> pd.DataFrame:
     encodings = ["utf-8-sig", "utf-8", "cp950", "big5", "ms950", "gb18030", "latin1"]
     seps = ["\t", ",", ";", "|"]  # ✅ tab 放第一優先
@@ -121,7 +105,7 @@ def _read_csv_guess(raw: bytes) -> pd.DataFrame:
                     if engine == "c":
                         kwargs["low_memory"] = False
 
-                    df = pd.read_csv(io.BytesIO(raw), **kwargs)
+                    df = pd.read_csv(byte_stream(raw), **kwargs)
                     if df.shape[1] <= 1:
                         continue
                     return df
@@ -141,17 +125,17 @@ def _read_csv_guess(raw: bytes) -> pd.DataFrame:
 
 def read_table_robust(file_name: str, raw: bytes, label: str = "檔案") -> pd.DataFrame:
     ext = os.path.splitext(file_name)[1].lower()
-    head = raw[:2048]
+    head = sniff(raw, 2048)
     looks_tsv = (b"\t" in head) and (head.count(b"\t") >= 2)
 
     # ---- xlsx 類 ----
     if ext in (".xlsx", ".xlsm", ".xltx", ".xltm"):
         try:
-            return pd.read_excel(io.BytesIO(raw), engine="openpyxl")
+            return pd.read_excel(byte_stream(raw), engine="openpyxl")
         except Exception:
             # 有些被改副檔名 → 當文字檔讀
-            if _looks_like_html(raw):
-                return _read_html_table(raw)
+            if looks_like_html(raw):
+                return read_html_table(raw, min_cols=2)
             return _read_csv_guess(raw)
 
     # ---- .xls：先當文字檔（你這種最常見）----
@@ -161,7 +145,7 @@ def read_table_robust(file_name: str, raw: bytes, label: str = "檔案") -> pd.D
             if looks_tsv:
                 for enc in ["utf-8-sig", "utf-8", "cp950", "big5", "ms950", "latin1", "gb18030"]:
                     try:
-                        df = pd.read_csv(io.BytesIO(raw), sep="\t", encoding=enc, engine="c", low_memory=False)
+                        df = pd.read_csv(byte_stream(raw), sep="\t", encoding=enc, engine="c", low_memory=False)
                         if df.shape[1] > 1:
                             return df
                     except Exception:
@@ -172,11 +156,11 @@ def read_table_robust(file_name: str, raw: bytes, label: str = "檔案") -> pd.D
             # 2) 再嘗試真正 xls（需要 xlrd，且檔案真的是 BIFF xls）
             try:
                 import xlrd  # noqa: F401
-                return pd.read_excel(io.BytesIO(raw), engine="xlrd")
+                return pd.read_excel(byte_stream(raw), engine="xlrd")
             except Exception as e_xls:
-                if _looks_like_html(raw):
+                if looks_like_html(raw):
                     try:
-                        return _read_html_table(raw)
+                        return read_html_table(raw, min_cols=2)
                     except Exception:
                         pass
                 raise ValueError(
@@ -187,11 +171,169 @@ def read_table_robust(file_name: str, raw: bytes, label: str = "檔案") -> pd.D
                 )
 
     # ---- 其他：先當文字檔 ----
-    if _looks_like_html(raw):
-        return _read_html_table(raw)
+    if looks_like_html(raw):
+        return read_html_table(raw, min_cols=2)
     return _read_csv_guess(raw)
 
 
+# =============================
+# 計算引擎（只依檔案內容，可快取）
+#   - 檔案 → 名單 + 去重明細 → 每(線別, 段數, 小時)加權PCS
+#   - 「現在時間」截止只在畫面階段套用（hourly_status），時間往前走不必重讀檔
+# =============================
+SEG_COLS = {1: "第一段", 2: "第二段", 3: "第三段", 4: "第四段"}
+BASE_COLS = ["線別", "段數", "姓名", "開始時間"]
+
+
+def build_roster(df_mem_raw: pd.DataFrame) -> pd.DataFrame:
+    """人員名單 → 每(線別, 段數)一人（同一格重複時取名單上第一個）"""
+    line_col = find_column(df_mem_raw.columns, ["LINEID", "線別", "LineID", "LINE Id", "Line Id"])
+    if line_col is None:
+        raise ValueError("人員名單找不到線別欄位（需要 LINEID 或 線別）。")
+    for colname in SEG_COLS.values():
+        if colname not in df_mem_raw.columns:
+            raise ValueError(f"人員名單缺少欄位：{colname}（需要 第一段～第四段）")
+
+    line_id = df_mem_raw[line_col].astype(object).map(lambda v: str(v).strip() if pd.notna(v) else "")
+    valid = line_id.ne("") & line_id.str.lower().ne("nan")
+    segs = df_mem_raw.loc[valid, list(SEG_COLS.values())].astype(object)
+    segs.columns = list(SEG_COLS)
+    segs.insert(0, "線別", line_id[valid])
+
+    # 逐列、每列第一段～第四段的順序攤平（與原本 iterrows 的順序相同）
+    long = segs.melt(id_vars="線別", var_name="段數", value_name="姓名", ignore_index=False)
+    long = long.rename_axis("__row").reset_index().sort_values(["__row", "段數"], kind="stable")
+    long = long[long["姓名"].notna()]
+    long["姓名"] = long["姓名"].map(lambda v: str(v).strip())
+    long = long[long["姓名"].ne("")]
+    if long.empty:
+        raise ValueError("人員名單解析後為空：請確認 第一段～第四段 內有姓名。")
+
+    long["開始時間"] = long["姓名"].map(lambda n: _safe_time(FIXED_START_TIMES.get(n, "08:00")))
+    roster_df = long[BASE_COLS].reset_index(drop=True)
+    roster_df["線別"] = clean_line(roster_df["線別"])
+    roster_df["段數"] = clean_zone_1to4(roster_df["段數"])
+    roster_df = roster_df[roster_df["段數"].notna()]
+    return roster_df.drop_duplicates(["線別", "段數"], keep="first").reset_index(drop=True)
+
+
+def prepare_detail(df_raw: pd.DataFrame, roster_df: pd.DataFrame) -> pd.DataFrame:
+    """生產資料 → 去重、併名單、標記是否納入計算（早於開始時間不算）"""
+    df_raw = _norm_cols(df_raw)  # ✅ 避免欄位尾巴空白
+
+    # 欄位對照 + 必要欄位檢查 + PICKDATE/PACKQTY/Cweight 轉型（schema：hourly_efficiency）
+    df_raw = apply_schema(df_raw, PROD_SCHEMA, label="生產資料檔案")
+    df_raw = df_raw[df_raw["PICKDATE"].notna()].copy()
+
+    df_raw = df_raw.rename(columns={"LINEID": "線別", "ZONEID": "段數"})
+    df_raw["線別"] = clean_line(df_raw["線別"])
+    df_raw["段數"] = clean_zone_1to4(df_raw["段數"])
+    df_raw = df_raw[df_raw["段數"].notna()].copy()
+
+    df_raw["PACKQTY"] = df_raw["PACKQTY"].fillna(0)
+    df_raw["Cweight"] = df_raw["Cweight"].fillna(0)
+
+    # 去重
+    rid_cols = [c for c in df_raw.columns if c not in ("__rid",)]
+    df_raw["__rid"] = pd.util.hash_pandas_object(df_raw[rid_cols], index=False)
+    df_raw = df_raw.drop_duplicates("__rid", keep="first").copy()
+
+    df = pd.merge(df_raw, roster_df, on=["線別", "段數"], how="left", validate="m:1")
+    df["姓名"] = df["姓名"].fillna("未設定")
+    df["開始時間"] = df["開始時間"].fillna("08:00").map(_safe_time)
+
+    df["小時"] = df["PICKDATE"].dt.hour
+    df["PICK_MIN"] = df["PICKDATE"].dt.hour * 60 + df["PICKDATE"].dt.minute
+
+    st_parts = df["開始時間"].astype(str).str.split(":", n=1, expand=True)
+    st_h = pd.to_numeric(st_parts[0], errors="coerce").fillna(8).astype(int)
+    st_m = pd.to_numeric(st_parts[1], errors="coerce").fillna(0).astype(int)
+    df["開始分鐘"] = st_h * 60 + st_m
+
+    df["納入計算"] = df["PICK_MIN"] >= df["開始分鐘"]
+    df["排除原因"] = np.where(df["納入計算"], "", "早於開始時間")
+
+    df["加權PCS"] = df["PACKQTY"] * df["Cweight"]
+    return df
+
+
+# 快取 key 只看檔名 + 內容指紋（upload_fingerprint）；底線開頭的 _raw 參數 Streamlit 不會再雜湊整份內容
+@st.cache_data(show_spinner=False, max_entries=4)
+def load_inputs(
+    prod_name: str, prod_fp: str, mem_name: str, mem_fp: str, _prod_raw: bytes, _mem_raw: bytes
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """(名單, 去重後明細)；同檔重跑直接取快取"""
+    roster_df = build_roster(_norm_cols(read_table_robust(mem_name, _mem_raw, label="人員名單檔案")))
+    # 生產資料（✅ 這裡已支援 .xls 假檔 TSV）
+    df_raw = read_table_robust(prod_name, _prod_raw, label="生產資料檔案")
+    return roster_df, prepare_detail(df_raw, roster_df)
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_hour_buckets(
+    prod_name: str, prod_fp: str, mem_name: str, mem_fp: str, _prod_raw: bytes, _mem_raw: bytes
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    (名單, 每(線別, 段數, 姓名, 開始時間, 小時)的納入計算加權PCS)
+    - 只存彙總（幾百列），頁面每分鐘重跑時不必再複製整份明細
+    """
+    roster_df, df = load_inputs(prod_name, prod_fp, mem_name, mem_fp, _prod_raw, _mem_raw)
+    buckets = df[df["納入計算"]].groupby(BASE_COLS + ["小時"], as_index=False)["加權PCS"].sum()
+    return roster_df, buckets.rename(columns={"加權PCS": "當小時加權PCS"})
+
+
+def hourly_status(
+    roster_df: pd.DataFrame,
+    buckets: pd.DataFrame,
+    *,
+    hour_min: int,
+    cur_h: int,
+    cur_m: int,
+    target_hr: float,
+) -> tuple[list[int], pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """套用截止時間：每人每小時的目標 / 狀態 → (hour_cols, keys, hourly_full, dist)"""
+    hour_cols = list(range(int(hour_min), int(cur_h) + 1)) if int(cur_h) >= int(hour_min) else [int(cur_h)]
+
+    keys = roster_df[BASE_COLS].drop_duplicates().copy()
+    grid_hours = keys.assign(_k=1).merge(pd.DataFrame({"小時": hour_cols, "_k": 1}), on="_k").drop(columns=["_k"])
+    hourly_full = grid_hours.merge(buckets, on=BASE_COLS + ["小時"], how="left")
+    hourly_full["當小時加權PCS"] = pd.to_numeric(hourly_full["當小時加權PCS"], errors="coerce").fillna(0.0)
+
+    parts = hourly_full["開始時間"].astype(str).str.split(":", n=1, expand=True)
+    s_h = pd.to_numeric(parts[0], errors="coerce").fillna(8).astype(int)
+    s_m = pd.to_numeric(parts[1], errors="coerce").fillna(0).astype(int)
+    hh = pd.to_numeric(hourly_full["小時"], errors="coerce").fillna(0).astype(int)
+    slot = hh.map(lambda x: _slot_minutes(int(x))).astype(int)
+    end_m = np.where(hh == cur_h, np.minimum(cur_m, slot), slot).astype(int)
+
+    minutes_worked = np.where(
+        hh > cur_h, 0,
+        np.where(
+            hh < s_h, 0,
+            np.where(
+                hh == s_h, np.maximum(0, end_m - s_m),
+                end_m
+            )
+        )
+    ).astype(float)
+
+    hourly_full["本小時有效分鐘"] = minutes_worked
+    hourly_full["本小時目標"] = (minutes_worked / 60.0) * float(target_hr)
+    hourly_full["狀態"] = np.where(
+        hourly_full["本小時有效分鐘"] <= 0,
+        None,
+        np.where(hourly_full["當小時加權PCS"] >= hourly_full["本小時目標"], STATUS_PASS, STATUS_FAIL)
+    )
+
+    dist = (
+        hourly_full[hourly_full["狀態"].isin([STATUS_PASS, STATUS_FAIL])]
+        .groupby(["線別", "小時", "狀態"], as_index=False)
+        .size()
+        .rename(columns={"size": "count"})
+    )
+    return hour_cols, keys, hourly_full, dist
+
+
 # =============================
 # KPI 計數（某小時）
 # =============================
@@ -488,17 +630,6 @@ def main():
 
     st.markdown("### ⏱️ 各時段作業效率（Excel：保留公式＋色塊自動更新；支援舊 Excel）")
 
-    fixed_time_map = {
-        "范明俊": "08:00", "阮玉名": "08:00", "李茂銓": "08:00", "河文強": "08:00",
-        "蔡麗珠": "08:00", "潘文一": "08:00", "阮伊黃": "08:00", "葉欲弘": "09:00",
-        "阮武玉玄": "08:00", "吳黃金珠": "08:30", "潘氏青江": "08:00", "陳國慶": "08:30",
-        "楊心如": "08:00", "阮瑞美黃緣": "08:00", "周芸蓁": "08:00", "黎氏瓊": "08:00",
-        "王文楷": "08:30", "潘氏慶平": "08:00", "阮氏美麗": "08:00", "岳子恆": "08:30",
-        "郭雙燕": "08:30", "阮孟勇": "08:00", "廖永成": "08:30", "楊浩傑": "08:30",
-        "黃日康": "08:30", "蔣金妮": "08:30", "柴家欣": "08:30", "邱思捷": "09:00",
-        "王建成": "09:00",
-    }
-
     with st.sidebar:
         st.markdown("### 設定")
         target_hr = st.number_input("每小時目標（加權PCS/小時）", min_value=1.0, value=790.0, step=10.0)
@@ -526,138 +657,31 @@ def main():
         st.info("請先上傳兩個檔案：生產資料 + 人員名單。")
         return
 
-    prod_sig = _bytes_sig(prod_file.getvalue())
-    mem_sig = _bytes_sig(mem_file.getvalue())
-    settings_sig = f"{target_hr}-{hour_min}-{use_now}-{now.hour}-{now.minute}"
+    # 上傳內容只取一次：簽章與讀檔共用同一份 bytes
+    prod_raw = upload_bytes(prod_file)
+    mem_raw = upload_bytes(mem_file)
+    prod_sig = upload_fingerprint(prod_file)
+    mem_sig = upload_fingerprint(mem_file)
+    # 截止時間不在簽章內：時間往前走只重算畫面（彙總已快取），不重讀檔
+    settings_sig = f"{target_hr}-{hour_min}"
 
-    last = st.session_state.get("_29_last_sig", None)
     cur_sig = (prod_sig, mem_sig, settings_sig)
-    should_run = manual or (auto_calc and (last != cur_sig))
-    if not should_run:
-        st.caption("（目前結果已是最新；如有更新檔案/設定會自動同步）")
+    last = st.session_state.get("_29_last_sig", None)
+    if manual or auto_calc:
+        if last != cur_sig:
+            download_store.discard(st.session_state.pop("_29_excel_token", None))
+        st.session_state["_29_last_sig"] = cur_sig
+    elif last != cur_sig:
+        st.caption("（檔案/設定已變更，請按「🚀 立即更新/重算」）")
         return
-    st.session_state["_29_last_sig"] = cur_sig
 
     try:
-        # 人員名單
-        df_mem_raw = _norm_cols(read_table_robust(mem_file.name, mem_file.getvalue(), label="人員名單檔案"))
-
-        line_col_candidates = ["LINEID", "線別", "LineID", "LINE Id", "Line Id"]
-        line_col = next((c for c in line_col_candidates if c in df_mem_raw.columns), None)
-        if line_col is None:
-            raise ValueError("人員名單找不到線別欄位（需要 LINEID 或 線別）。")
-
-        seg_cols = {1: "第一段", 2: "第二段", 3: "第三段", 4: "第四段"}
-        for _, colname in seg_cols.items():
-            if colname not in df_mem_raw.columns:
-                raise ValueError(f"人員名單缺少欄位：{colname}（需要 第一段～第四段）")
-
-        member_list = []
-        for _, row in df_mem_raw.iterrows():
-            line_id = str(row.get(line_col, "")).strip()
-            if not line_id or line_id.lower() == "nan":
-                continue
-            for zid, colname in seg_cols.items():
-                name = row.get(colname, None)
-                if pd.notna(name) and str(name).strip() != "":
-                    n_str = str(name).strip()
-                    st_time = _safe_time(fixed_time_map.get(n_str, "08:00"))
-                    member_list.append({"線別": line_id, "段數": zid, "姓名": n_str, "開始時間": st_time})
-
-        roster_df = pd.DataFrame(member_list)
-        if roster_df.empty:
-            raise ValueError("人員名單解析後為空：請確認 第一段～第四段 內有姓名。")
-
-        roster_df["線別"] = clean_line(roster_df["線別"])
-        roster_df["段數"] = clean_zone_1to4(roster_df["段數"])
-        roster_df = roster_df[roster_df["段數"].notna()].copy()
-        roster_df = roster_df.drop_duplicates(["線別", "段數"], keep="first").copy()
-        roster_df = roster_df[["線別", "段數", "姓名", "開始時間"]].copy()
-
-        # 生產資料（✅ 這裡已支援 .xls 假檔 TSV）
-        df_raw = read_table_robust(prod_file.name, prod_file.getvalue(), label="生產資料檔案")
-        df_raw = _norm_cols(df_raw)  # ✅ 避免欄位尾巴空白
-
-        require_columns(df_raw, ["PICKDATE", "LINEID", "ZONEID", "PACKQTY", "Cweight"], "生產資料檔案")
-
-        df_raw["PICKDATE"] = pd.to_datetime(df_raw["PICKDATE"], errors="coerce")
-        df_raw = df_raw[df_raw["PICKDATE"].notna()].copy()
-
-        df_raw = df_raw.rename(columns={"LINEID": "線別", "ZONEID": "段數"})
-        df_raw["線別"] = clean_line(df_raw["線別"])
-        df_raw["段數"] = clean_zone_1to4(df_raw["段數"])
-        df_raw = df_raw[df_raw["段數"].notna()].copy()
-
-        df_raw["PACKQTY"] = pd.to_numeric(df_raw["PACKQTY"], errors="coerce").fillna(0)
-        df_raw["Cweight"] = pd.to_numeric(df_raw["Cweight"], errors="coerce").fillna(0)
-
-        # 去重
-        rid_cols = [c for c in df_raw.columns if c not in ("__rid",)]
-        df_raw["__rid"] = pd.util.hash_pandas_object(df_raw[rid_cols], index=False)
-        df_raw = df_raw.drop_duplicates("__rid", keep="first").copy()
-
-        df = pd.merge(df_raw, roster_df, on=["線別", "段數"], how="left", validate="m:1")
-        df["姓名"] = df["姓名"].fillna("未設定")
-        df["開始時間"] = df["開始時間"].fillna("08:00").map(_safe_time)
-
-        df["小時"] = df["PICKDATE"].dt.hour
-        df["PICK_MIN"] = df["PICKDATE"].dt.hour * 60 + df["PICKDATE"].dt.minute
-
-        st_parts = df["開始時間"].astype(str).str.split(":", n=1, expand=True)
-        st_h = pd.to_numeric(st_parts[0], errors="coerce").fillna(8).astype(int)
-        st_m = pd.to_numeric(st_parts[1], errors="coerce").fillna(0).astype(int)
-        df["開始分鐘"] = st_h * 60 + st_m
-
-        df["納入計算"] = df["PICK_MIN"] >= df["開始分鐘"]
-        df["排除原因"] = np.where(df["納入計算"], "", "早於開始時間")
-
-        df["加權PCS"] = df["PACKQTY"] * df["Cweight"]
+        roster_df, buckets = load_hour_buckets(prod_file.name, prod_sig, mem_file.name, mem_sig, prod_raw, mem_raw)
 
         # Streamlit 顯示
         cur_h, cur_m = now.hour, now.minute
-        hour_cols = list(range(int(hour_min), int(cur_h) + 1)) if int(cur_h) >= int(hour_min) else [int(cur_h)]
-        base_cols = ["線別", "段數", "姓名", "開始時間"]
-
-        df_calc = df[df["納入計算"]].copy()
-        hourly_sum = df_calc.groupby(base_cols + ["小時"], as_index=False)["加權PCS"].sum()
-        hourly_sum = hourly_sum.rename(columns={"加權PCS": "當小時加權PCS"})
-
-        keys = roster_df[base_cols].drop_duplicates().copy()
-        grid_hours = keys.assign(_k=1).merge(pd.DataFrame({"小時": hour_cols, "_k": 1}), on="_k").drop(columns=["_k"])
-        hourly_full = grid_hours.merge(hourly_sum, on=base_cols + ["小時"], how="left")
-        hourly_full["當小時加權PCS"] = pd.to_numeric(hourly_full["當小時加權PCS"], errors="coerce").fillna(0.0)
-
-        parts = hourly_full["開始時間"].astype(str).str.split(":", n=1, expand=True)
-        s_h = pd.to_numeric(parts[0], errors="coerce").fillna(8).astype(int)
-        s_m = pd.to_numeric(parts[1], errors="coerce").fillna(0).astype(int)
-        hh = pd.to_numeric(hourly_full["小時"], errors="coerce").fillna(0).astype(int)
-        slot = hh.map(lambda x: _slot_minutes(int(x))).astype(int)
-        end_m = np.where(hh == cur_h, np.minimum(cur_m, slot), slot).astype(int)
-
-        minutes_worked = np.where(
-            hh > cur_h, 0,
-            np.where(
-                hh < s_h, 0,
-                np.where(
-                    hh == s_h, np.maximum(0, end_m - s_m),
-                    end_m
-                )
-            )
-        ).astype(float)
-
-        hourly_full["本小時有效分鐘"] = minutes_worked
-        hourly_full["本小時目標"] = (minutes_worked / 60.0) * float(target_hr)
-        hourly_full["狀態"] = np.where(
-            hourly_full["本小時有效分鐘"] <= 0,
-            None,
-            np.where(hourly_full["當小時加權PCS"] >= hourly_full["本小時目標"], STATUS_PASS, STATUS_FAIL)
-        )
-
-        dist = (
-            hourly_full[hourly_full["狀態"].isin([STATUS_PASS, STATUS_FAIL])]
-            .groupby(["線別", "小時", "狀態"], as_index=False)
-            .size()
-            .rename(columns={"size": "count"})
+        hour_cols, keys, hourly_full, dist = hourly_status(
+            roster_df, buckets, hour_min=int(hour_min), cur_h=int(cur_h), cur_m=int(cur_m), target_hr=float(target_hr)
         )
 
         st.success("計算完成 ✅（Excel：公式＋色塊會自動更新）")
@@ -687,27 +711,33 @@ def main():
             if HAS_COMMON_UI:
                 card_close()
 
-        # 明細輸出（Excel 會用公式重算加權PCS）
-        detail_df = df.copy().sort_values(["線別", "段數", "PICKDATE"]).reset_index(drop=True)
-        if "加權PCS" not in detail_df.columns:
-            detail_df["加權PCS"] = np.nan
-
-        xlsx_bytes = build_excel_bytes_with_formulas_and_colors(
-            detail_df=detail_df,
-            roster_df=roster_df,
-            hour_cols=hour_cols,
-            target_hr=float(target_hr),
-            now_h=int(cur_h),
-            now_m=int(cur_m),
-        )
-        filename = f"產能時段_公式_色塊_{datetime.now(TPE).strftime('%H%M')}.xlsx"
-        st.download_button(
+        # 明細輸出（Excel 會用公式重算加權PCS）：按下才產生，不隨每分鐘重跑重建
+        if st.button("📄 產出 Excel（保留公式＋色塊自動變色）", use_container_width=True):
+            with st.spinner("Excel 產生中..."):
+                _, df = load_inputs(prod_file.name, prod_sig, mem_file.name, mem_sig, prod_raw, mem_raw)
+                detail_df = df.sort_values(["線別", "段數", "PICKDATE"]).reset_index(drop=True)
+                if "加權PCS" not in detail_df.columns:
+                    detail_df["加權PCS"] = np.nan
+
+                xlsx_bytes = build_excel_bytes_with_formulas_and_colors(
+                    detail_df=detail_df,
+                    roster_df=roster_df,
+                    hour_cols=hour_cols,
+                    target_hr=float(target_hr),
+                    now_h=int(cur_h),
+                    now_m=int(cur_m),
+                )
+                filename = f"產能時段_公式_色塊_{datetime.now(TPE).strftime('%H%M')}.xlsx"
+                download_store.discard(st.session_state.get("_29_excel_token"))
+                st.session_state["_29_excel_token"] = download_store.put_bytes(xlsx_bytes, filename)
+
+        if not download_store.download_button(
             "⬇️ 下載 Excel（保留公式＋色塊自動變色）",
-            data=xlsx_bytes,
-            file_name=filename,
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            st.session_state.get("_29_excel_token"),
+            key="_29_excel_dl",
             use_container_width=True,
-        )
+        ):
+            st.session_state.pop("_29_excel_token", None)
 
     except Exception as e:
         st.error(f"發生錯誤：{e}")
@@ -6,6 +6,14 @@ from typing import Dict, List, Tuple, Optional, Any
 import pandas as pd
 import streamlit as st
 
+import session_store
+from excel_export import column_widths, set_openpyxl_widths
+from export_recipe import Exportable, ExportRecipe, download_button
+from master_data import location_master_uploader
+from report_schema import find_column
+from result_cache import cached_call
+from upload_buffer import byte_stream, upload_bytes, upload_fingerprint
+
 try:
     from common_ui import (
         inject_logistics_theme,
@@ -73,13 +81,8 @@ except ModuleNotFoundError:
     def card_close():
         st.markdown("")
 
-    def download_excel_card(data: bytes, file_name: str, label: str):
-        st.download_button(
-            label=label,
-            data=data,
-            file_name=file_name,
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        )
+    def download_excel_card(data: Exportable, file_name: str, label: str):
+        download_button(label, data, file_name=file_name)
 
     def sidebar_controls(default_top_n: int = 30, enable_exclude_windows: bool = False, state_key_prefix: str = ""):
         with st.sidebar:
@@ -411,15 +414,15 @@ def _extract_exclude_value_from_controls(controls: Dict[str, Any]) -> Any:
 def read_excel_any_quiet_bytes(name: str, content: bytes) -> Dict[str, pd.DataFrame]:
     ext = (name.split(".")[-1] or "").lower()
     if ext in ("xlsx", "xlsm"):
-        xl = pd.ExcelFile(io.BytesIO(content), engine="openpyxl")
+        xl = pd.ExcelFile(byte_stream(content), engine="openpyxl")
         return {sn: pd.read_excel(xl, sheet_name=sn) for sn in xl.sheet_names}
     if ext == "xls":
-        xl = pd.ExcelFile(io.BytesIO(content), engine="xlrd")
+        xl = pd.ExcelFile(byte_stream(content), engine="xlrd")
         return {sn: pd.read_excel(xl, sheet_name=sn) for sn in xl.sheet_names}
     if ext == "csv":
         for enc in ("utf-8-sig", "cp950", "big5"):
             try:
-                return {"CSV": pd.read_csv(io.BytesIO(content), encoding=enc)}
+                return {"CSV": pd.read_csv(byte_stream(content), encoding=enc)}
             except Exception:
                 continue
         raise Exception("CSV 讀取失敗（請確認編碼）")
@@ -432,20 +435,6 @@ def _strip_cols(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def find_first_column(df: pd.DataFrame, candidates: List[str]) -> Optional[str]:
-    cols = [str(c).strip() for c in df.columns]
-    s = set(cols)
-    for name in candidates:
-        if name in s:
-            return name
-    norm_map = {re.sub(r"[（）\(\)\s]", "", c): c for c in cols}
-    for name in candidates:
-        key = re.sub(r"[（）\(\)\s]", "", name)
-        if key in norm_map:
-            return norm_map[key]
-    return None
-
-
 def normalize_to_qc(series: pd.Series) -> pd.Series:
     return series.astype(str).str.strip().str.upper().eq("QC")
 
@@ -464,31 +453,6 @@ def prepare_filtered_df(df: pd.DataFrame) -> pd.DataFrame:
     return df[normalize_to_qc(df["由"]) & to_not_excluded_mask(df["到"])].copy()
 
 
-# =========================================================
-# ✅ 棚別主檔：儲位→棚別
-# =========================================================
-def load_slot_master_bytes(upload_name: str, content: bytes) -> pd.DataFrame:
-    sheets = read_excel_any_quiet_bytes(upload_name, content)
-    df0 = None
-    for _, d in sheets.items():
-        if d is not None and not d.empty:
-            df0 = d
-            break
-    if df0 is None or df0.empty:
-        return pd.DataFrame()
-
-    df0 = _strip_cols(df0)
-    if "儲位" not in df0.columns or "棚別" not in df0.columns:
-        return pd.DataFrame()
-
-    out = df0[["儲位", "棚別"]].copy()
-    out["儲位"] = out["儲位"].astype(str).str.strip()
-    out["棚別"] = out["棚別"].astype(str).str.strip()
-    out = out[out["儲位"].astype(str).str.len() > 0].copy()
-    out = out.drop_duplicates(subset=["儲位"], keep="last")
-    return out
-
-
 # =========================================================
 # 計算：休息 / 空窗 / clamp + 棚別比對筆數
 # =========================================================
@@ -715,15 +679,10 @@ def compute_all_day_for_group(
 # Excel 匯出（bytes）
 # =========================================================
 def autosize_columns(ws, df: pd.DataFrame):
-    from openpyxl.utils import get_column_letter
-    cols = list(df.columns) if df is not None else []
-    for i, col in enumerate(cols, start=1):
-        if df is not None and not df.empty:
-            sample = [len(str(x)) for x in df[col].head(800).tolist()]
-            max_len = max([len(str(col))] + sample)
-        else:
-            max_len = max(len(str(col)), 8)
-        ws.column_dimensions[get_column_letter(i)].width = min(max_len + 2, 60)
+    if df is None:
+        return
+    widths = column_widths(df, max_width=60, min_width=10 if df.empty else 0, sample=800)
+    set_openpyxl_widths(ws, widths)
 
 
 def shade_rows_by_efficiency(ws, header_name="效率_件每小時", green="C6EFCE", red="FFC7CE", target_eff=20):
@@ -1008,6 +967,238 @@ def build_excel_bytes(
     return out.getvalue()
 
 
+# =========================================================
+# 計算（不含畫面，可快取）
+# =========================================================
+def compute_putaway(
+    file_bytes: bytes,
+    file_name: str,
+    *,
+    name_map: Dict[str, str],
+    shelf_index: Optional[pd.Series],
+    target_eff_map: Dict[str, float],
+    idle_threshold: int,
+    exclude_idle_ranges: List[Tuple[dt.time, dt.time]],
+    global_start_time: Optional[dt.time],
+) -> Dict[str, Any]:
+    """
+    上架 KPI 計算（不含畫面）：回傳彙總、樞紐表與 Excel bytes
+    - 資料不足（缺欄位、過濾後為空…）丟 ValueError，訊息直接給畫面顯示
+    - 只依賴參數，方便交給 result_cache 依內容 + 條件快取
+    - shelf_index：儲位主檔的 儲位→棚別 索引（master_data），沒有主檔時為 None
+    """
+    sheets = read_excel_any_quiet_bytes(file_name, file_bytes)
+
+    kept_all = []
+    for sn, df in sheets.items():
+        k = prepare_filtered_df(df)
+        if not k.empty:
+            k["__sheet__"] = sn
+            kept_all.append(k)
+
+    if not kept_all:
+        raise ValueError("無符合資料（可能缺『由/到』欄或過濾後為空）。")
+
+    data = pd.concat(kept_all, ignore_index=True)
+
+    user_col = find_column(data.columns, INPUT_USER_CANDIDATES)
+    revdt_col = find_column(data.columns, REV_DT_CANDIDATES)
+    if user_col is None:
+        raise ValueError("找不到『記錄輸入人』欄位（候選：記錄輸入人/記錄輸入者/建立人/輸入人）。")
+    if revdt_col is None:
+        raise ValueError("找不到『修訂日期/時間』欄位（候選：修訂日期/修訂時間/修訂日/異動時間/修改時間）。")
+
+    data["__dt__"] = pd.to_datetime(data[revdt_col], errors="coerce")
+    data["__code__"] = data[user_col].astype(str).str.strip()
+
+    # ✅ 上架人姓名
+    data["對應姓名"] = data["__code__"].map(name_map).fillna("")
+
+    # ✅ 棚別比對（到→棚別）
+    data["__to_loc__"] = data["到"].astype(str).str.strip()
+
+    if shelf_index is not None and not shelf_index.empty:
+        data["棚別"] = data["__to_loc__"].map(shelf_index).fillna("")
+    else:
+        data["棚別"] = ""
+
+    data["__shelf_match__"] = data["棚別"].astype(str).str.strip().ne("")
+
+    # ✅ 儲位類型：棚別抓區碼3，抓不到用 到(儲位)
+    data["棚別_區碼3"] = data["棚別"].apply(_extract_zone3)
+    fallback_zone3 = data["__to_loc__"].apply(_extract_zone3)
+    data["棚別_區碼3"] = data["棚別_區碼3"].where(data["棚別_區碼3"].ne(""), fallback_zone3)
+    data["儲位類型"] = data["棚別_區碼3"].apply(_map_storage_type).fillna("")
+
+    dt_data = data.dropna(subset=["__dt__"]).copy()
+    if dt_data.empty:
+        raise ValueError("資料沒有可用的修訂日期時間，無法計算。")
+
+    dt_data["日期"] = dt_data["__dt__"].dt.date
+
+    # ✅ 日彙總：同一人同一天的低空、高空分開計算
+    dt_data["儲位類型"] = dt_data["儲位類型"].astype(str).str.strip()
+    dt_data["儲位類型"] = dt_data["儲位類型"].where(
+        dt_data["儲位類型"].isin(TARGET_EFF_DEFAULTS),
+        "未分類",
+    )
+    daily = (
+        dt_data.groupby([user_col, "對應姓名", "儲位類型", "日期"], dropna=False)
+        .apply(lambda g: compute_all_day_for_group(
+            g,
+            idle_threshold_min=int(idle_threshold),
+            exclude_idle_ranges=exclude_idle_ranges,
+            start_time=global_start_time,
+        ))
+        .reset_index()
+    )
+    daily["達標門檻"] = daily["儲位類型"].map(target_eff_map)
+    daily["是否達標"] = daily.apply(
+        lambda r: (
+            "達標" if float(r["效率_件每小時"]) >= float(r["達標門檻"]) else "未達標"
+        ) if pd.notna(r["達標門檻"]) else "不適用",
+        axis=1,
+    )
+
+    # ✅ 個人總彙總：每人、每種儲位類型各一列
+    summary = (
+        daily.groupby([user_col, "對應姓名", "儲位類型"], dropna=False, as_index=False)
+        .agg(
+            総日數=("日期", "nunique"),
+            總筆數=("當日筆數", "sum"),
+            總工時_分鐘_扣休=("當日工時_分鐘_扣休", "sum"),
+            比對棚別筆數=("比對棚別筆數", "sum"),
+        )
+    )
+
+    summary["效率_件每小時"] = summary.apply(
+        lambda r: _eff(int(r["總筆數"]), int(r["總工時_分鐘_扣休"])),
+        axis=1,
+    )
+    summary["達標門檻"] = summary["儲位類型"].map(target_eff_map)
+    summary["是否達標"] = summary.apply(
+        lambda r: (
+            "達標" if float(r["效率_件每小時"]) >= float(r["達標門檻"]) else "未達標"
+        ) if pd.notna(r["達標門檻"]) else "不適用",
+        axis=1,
+    )
+
+    for c in ["總筆數", "總工時_分鐘_扣休", "比對棚別筆數"]:
+        summary[c] = summary[c].fillna(0).astype(int)
+
+    summary["比對棚別率"] = summary.apply(
+        lambda r: (int(r["比對棚別筆數"]) / int(r["總筆數"])) if int(r["總筆數"]) > 0 else 0.0,
+        axis=1,
+    )
+
+    classified_summary = summary[summary["儲位類型"].isin(["低空", "高空"])].copy()
+    total_groups = int(len(classified_summary))
+    met_groups = int(classified_summary["是否達標"].eq("達標").sum())
+    rate = (met_groups / total_groups) if total_groups > 0 else 0.0
+    low_groups = classified_summary[classified_summary["儲位類型"].eq("低空")]
+    high_groups = classified_summary[classified_summary["儲位類型"].eq("高空")]
+    low_met = int(low_groups["是否達標"].eq("達標").sum())
+    high_met = int(high_groups["是否達標"].eq("達標").sum())
+
+    total_match = int(summary["比對棚別筆數"].sum())
+    total_cnt = int(summary["總筆數"].sum())
+    match_rate_all = (total_match / total_cnt) if total_cnt > 0 else 0.0
+
+    total_row = {
+        user_col: "整體合計",
+        "對應姓名": "",
+        "儲位類型": "全部",
+        "総日數": int(summary["総日數"].sum()),
+        "總筆數": int(summary["總筆數"].sum()),
+        "總工時_分鐘_扣休": int(summary["總工時_分鐘_扣休"].sum()),
+        "效率_件每小時": _eff(int(summary["總筆數"].sum()), int(summary["總工時_分鐘_扣休"].sum())),
+        "達標門檻": None,
+        "是否達標": "不適用",
+        "比對棚別筆數": int(total_match),
+        "比對棚別率": float(match_rate_all),
+    }
+    summary_out = pd.concat([summary, pd.DataFrame([total_row])], ignore_index=True)
+
+    # ✅ 樞紐：每人每棚別
+    shelf_for_group = dt_data["棚別"].astype(str).str.strip()
+    shelf_for_group = shelf_for_group.where(shelf_for_group.ne(""), "未比對")
+    shelf_person_long = (
+        dt_data.assign(_棚別分類=shelf_for_group)
+        .groupby([user_col, "對應姓名", "_棚別分類"], dropna=False)
+        .size()
+        .reset_index(name="筆數")
+        .rename(columns={"_棚別分類": "棚別"})
+    )
+    if not shelf_person_long.empty:
+        shelf_person_pivot = (
+            shelf_person_long.pivot_table(
+                index=[user_col, "對應姓名"],
+                columns="棚別",
+                values="筆數",
+                aggfunc="sum",
+                fill_value=0,
+            )
+            .reset_index()
+        )
+        cols = [c for c in shelf_person_pivot.columns if c not in (user_col, "對應姓名")]
+        cols_sorted = [c for c in cols if c != "未比對"] + (["未比對"] if "未比對" in cols else [])
+        shelf_person_pivot = shelf_person_pivot[[user_col, "對應姓名"] + cols_sorted]
+    else:
+        shelf_person_pivot = pd.DataFrame()
+
+    # ✅ 樞紐：每人每儲位類型
+    stype_for_group = dt_data["儲位類型"].astype(str).str.strip()
+    stype_for_group = stype_for_group.where(stype_for_group.ne(""), "未分類")
+    stype_person_long = (
+        dt_data.assign(_儲位類型分類=stype_for_group)
+        .groupby([user_col, "對應姓名", "_儲位類型分類"], dropna=False)
+        .size()
+        .reset_index(name="筆數")
+        .rename(columns={"_儲位類型分類": "儲位類型"})
+    )
+    if not stype_person_long.empty:
+        stype_person_pivot = (
+            stype_person_long.pivot_table(
+                index=[user_col, "對應姓名"],
+                columns="儲位類型",
+                values="筆數",
+                aggfunc="sum",
+                fill_value=0,
+            )
+            .reset_index()
+        )
+        prefer = ["低空", "高空", "未分類"]
+        cols = [c for c in stype_person_pivot.columns if c not in (user_col, "對應姓名")]
+        ordered = [c for c in prefer if c in cols] + [c for c in cols if c not in prefer]
+        stype_person_pivot = stype_person_pivot[[user_col, "對應姓名"] + ordered]
+    else:
+        stype_person_pivot = pd.DataFrame()
+
+    return {
+        "user_col": user_col,
+        "summary": summary,
+        "total_groups": int(total_groups),
+        "met_groups": int(met_groups),
+        "low_groups": int(len(low_groups)),
+        "low_met": int(low_met),
+        "high_groups": int(len(high_groups)),
+        "high_met": int(high_met),
+        "rate": float(rate),
+        # build_excel_bytes 的參數：按下載時才產生 Excel（結果本身只存資料表，才能進 result_cache）
+        "export_frames": {
+            "user_col": user_col,
+            "summary_out": summary_out,
+            "daily": daily,
+            "shelf_person_pivot": shelf_person_pivot,
+            "stype_person_pivot": stype_person_pivot,
+        },
+        "total_match": int(total_match),
+        "match_rate_all": float(match_rate_all),
+        "shelf_person_pivot": shelf_person_pivot,
+        "stype_person_pivot": stype_person_pivot,
+    }
+
+
 # =========================================================
 # Streamlit Page
 # =========================================================
@@ -1019,9 +1210,6 @@ def main():
         subtitle="整天合併計算｜不分上午/下午｜Excel 匯出含：彙總/明細/總表"
     )
 
-    if "putaway_last" not in st.session_state:
-        st.session_state.putaway_last = None
-
     # Sidebar：上架人設定
     render_putaway_people_settings_panel()
 
@@ -1065,10 +1253,10 @@ def main():
 
     # ✅ 棚別主檔在主畫面（只上傳，不展示表格）
     card_open("📚 棚別主檔（儲位明細）")
-    slot_master_file = st.file_uploader(
+    slot_master = location_master_uploader(
         "上傳棚別主檔（需含欄位：『儲位』『棚別』）",
-        type=["xlsx", "xlsm", "xls", "csv"],
         key="putaway_slot_master_main",
+        requires=(["儲位"], ["棚別"]),
         help="比對：明細欄位『到』(儲位) → 主檔『儲位』對應出『棚別』；查得到棚別即算比對成功。",
     )
     card_close()
@@ -1085,13 +1273,11 @@ def main():
     card_close()
 
     # ✅ 條件變更提醒
-    last = st.session_state.putaway_last
+    last = session_store.get("putaway_last")
     people_settings_snapshot = _get_putaway_people_settings()
     people_hash = str(sorted([(k, v.get("name", ""), v.get("area", "")) for k, v in people_settings_snapshot.items()]))
 
-    slot_hash = ""
-    if slot_master_file is not None:
-        slot_hash = f"{slot_master_file.name}:{len(slot_master_file.getvalue())}"
+    slot_hash = f"{slot_master.name}:{slot_master.version}" if slot_master is not None else ""
 
     current_params = {
         "low_target_eff": int(low_target_eff),
@@ -1109,250 +1295,71 @@ def main():
     # ✅ 計算
     if run_clicked:
         with st.spinner("計算中，請稍候..."):
-            sheets = read_excel_any_quiet_bytes(uploaded.name, uploaded.getvalue())
-
-            kept_all = []
-            for sn, df in sheets.items():
-                k = prepare_filtered_df(df)
-                if not k.empty:
-                    k["__sheet__"] = sn
-                    kept_all.append(k)
-
-            if not kept_all:
-                st.error("無符合資料（可能缺『由/到』欄或過濾後為空）。")
-                st.session_state.putaway_last = None
-                return
-
-            data = pd.concat(kept_all, ignore_index=True)
-
-            user_col = find_first_column(data, INPUT_USER_CANDIDATES)
-            revdt_col = find_first_column(data, REV_DT_CANDIDATES)
-            if user_col is None:
-                st.error("找不到『記錄輸入人』欄位（候選：記錄輸入人/記錄輸入者/建立人/輸入人）。")
-                st.session_state.putaway_last = None
-                return
-            if revdt_col is None:
-                st.error("找不到『修訂日期/時間』欄位（候選：修訂日期/修訂時間/修訂日/異動時間/修改時間）。")
-                st.session_state.putaway_last = None
-                return
-
-            data["__dt__"] = pd.to_datetime(data[revdt_col], errors="coerce")
-            data["__code__"] = data[user_col].astype(str).str.strip()
-
             # ✅ 上架人姓名
-            people_settings = _get_putaway_people_settings()
-            custom_name_map = {k: v.get("name", "") for k, v in people_settings.items() if v.get("name")}
+            custom_name_map = {k: v.get("name", "") for k, v in people_settings_snapshot.items() if v.get("name")}
             merged_name_map = {**NAME_MAP, **custom_name_map}
-            data["對應姓名"] = data["__code__"].map(merged_name_map).fillna("")
-
-            # ✅ 棚別比對（到→棚別）
-            data["__to_loc__"] = data["到"].astype(str).str.strip()
-
-            slot_map_shelf = {}
-            if slot_master_file is not None:
-                try:
-                    slot_master_df = load_slot_master_bytes(slot_master_file.name, slot_master_file.getvalue())
-                    if not slot_master_df.empty:
-                        slot_map_shelf = dict(zip(slot_master_df["儲位"], slot_master_df["棚別"]))
-                    else:
-                        st.warning("⚠️ 棚別主檔讀取成功但缺必要欄位（需含：儲位、棚別），將不計算棚別。")
-                except Exception as e:
-                    st.warning(f"⚠️ 棚別主檔讀取失敗：{e}，將不計算棚別。")
-
-            if slot_map_shelf:
-                data["棚別"] = data["__to_loc__"].map(slot_map_shelf).fillna("")
-            else:
-                data["棚別"] = ""
-
-            data["__shelf_match__"] = data["棚別"].astype(str).str.strip().ne("")
-
-            # ✅ 儲位類型：棚別抓區碼3，抓不到用 到(儲位)
-            data["棚別_區碼3"] = data["棚別"].apply(_extract_zone3)
-            fallback_zone3 = data["__to_loc__"].apply(_extract_zone3)
-            data["棚別_區碼3"] = data["棚別_區碼3"].where(data["棚別_區碼3"].ne(""), fallback_zone3)
-            data["儲位類型"] = data["棚別_區碼3"].apply(_map_storage_type).fillna("")
-
-            dt_data = data.dropna(subset=["__dt__"]).copy()
-            if dt_data.empty:
-                st.error("資料沒有可用的修訂日期時間，無法計算。")
-                st.session_state.putaway_last = None
-                return
-
-            dt_data["日期"] = dt_data["__dt__"].dt.date
-
-            # ✅ 日彙總：同一人同一天的低空、高空分開計算
-            dt_data["儲位類型"] = dt_data["儲位類型"].astype(str).str.strip()
-            dt_data["儲位類型"] = dt_data["儲位類型"].where(
-                dt_data["儲位類型"].isin(TARGET_EFF_DEFAULTS),
-                "未分類",
-            )
-            daily = (
-                dt_data.groupby([user_col, "對應姓名", "儲位類型", "日期"], dropna=False)
-                .apply(lambda g: compute_all_day_for_group(
-                    g,
-                    idle_threshold_min=int(idle_threshold),
-                    exclude_idle_ranges=exclude_idle_ranges,
-                    start_time=global_start_time,
-                ))
-                .reset_index()
-            )
-            daily["達標門檻"] = daily["儲位類型"].map(target_eff_map)
-            daily["是否達標"] = daily.apply(
-                lambda r: (
-                    "達標" if float(r["效率_件每小時"]) >= float(r["達標門檻"]) else "未達標"
-                ) if pd.notna(r["達標門檻"]) else "不適用",
-                axis=1,
-            )
-
-            # ✅ 個人總彙總：每人、每種儲位類型各一列
-            summary = (
-                daily.groupby([user_col, "對應姓名", "儲位類型"], dropna=False, as_index=False)
-                .agg(
-                    総日數=("日期", "nunique"),
-                    總筆數=("當日筆數", "sum"),
-                    總工時_分鐘_扣休=("當日工時_分鐘_扣休", "sum"),
-                    比對棚別筆數=("比對棚別筆數", "sum"),
-                )
-            )
-
-            summary["效率_件每小時"] = summary.apply(
-                lambda r: _eff(int(r["總筆數"]), int(r["總工時_分鐘_扣休"])),
-                axis=1,
-            )
-            summary["達標門檻"] = summary["儲位類型"].map(target_eff_map)
-            summary["是否達標"] = summary.apply(
-                lambda r: (
-                    "達標" if float(r["效率_件每小時"]) >= float(r["達標門檻"]) else "未達標"
-                ) if pd.notna(r["達標門檻"]) else "不適用",
-                axis=1,
-            )
-
-            for c in ["總筆數", "總工時_分鐘_扣休", "比對棚別筆數"]:
-                summary[c] = summary[c].fillna(0).astype(int)
 
-            summary["比對棚別率"] = summary.apply(
-                lambda r: (int(r["比對棚別筆數"]) / int(r["總筆數"])) if int(r["總筆數"]) > 0 else 0.0,
-                axis=1,
-            )
-
-            classified_summary = summary[summary["儲位類型"].isin(["低空", "高空"])].copy()
-            total_groups = int(len(classified_summary))
-            met_groups = int(classified_summary["是否達標"].eq("達標").sum())
-            rate = (met_groups / total_groups) if total_groups > 0 else 0.0
-            low_groups = classified_summary[classified_summary["儲位類型"].eq("低空")]
-            high_groups = classified_summary[classified_summary["儲位類型"].eq("高空")]
-            low_met = int(low_groups["是否達標"].eq("達標").sum())
-            high_met = int(high_groups["是否達標"].eq("達標").sum())
-
-            total_match = int(summary["比對棚別筆數"].sum())
-            total_cnt = int(summary["總筆數"].sum())
-            match_rate_all = (total_match / total_cnt) if total_cnt > 0 else 0.0
-
-            total_row = {
-                user_col: "整體合計",
-                "對應姓名": "",
-                "儲位類型": "全部",
-                "総日數": int(summary["総日數"].sum()),
-                "總筆數": int(summary["總筆數"].sum()),
-                "總工時_分鐘_扣休": int(summary["總工時_分鐘_扣休"].sum()),
-                "效率_件每小時": _eff(int(summary["總筆數"].sum()), int(summary["總工時_分鐘_扣休"].sum())),
-                "達標門檻": None,
-                "是否達標": "不適用",
-                "比對棚別筆數": int(total_match),
-                "比對棚別率": float(match_rate_all),
+            # ✅ 棚別主檔（到→棚別）
+            shelf_index = None
+            slot_fp = ""
+            if slot_master is not None:
+                loc_col, shelf_col = slot_master.column(["儲位"]), slot_master.column(["棚別"])
+                if loc_col and shelf_col:
+                    shelf_index = slot_master.index(shelf_col, loc_col=loc_col, keep="last")
+                    slot_fp = slot_master.version
+                else:
+                    st.warning("⚠️ 棚別主檔讀取成功但缺必要欄位（需含：儲位、棚別），將不計算棚別。")
+
+            # 同一份檔 + 同條件（含人員設定、棚別主檔內容）→ 直接取快取，跨 session 共用
+            cache_params = {
+                "suffix": uploaded.name.rsplit(".", 1)[-1].lower(),
+                "name_map": merged_name_map,
+                "slot_master": slot_fp,
+                "target_eff_map": target_eff_map,
+                "idle_threshold": int(idle_threshold),
+                "exclude_idle_ranges": exclude_idle_ranges,
+                "global_start_time": global_start_time,
             }
-            summary_out = pd.concat([summary, pd.DataFrame([total_row])], ignore_index=True)
-
-            # ✅ 樞紐：每人每棚別
-            shelf_for_group = dt_data["棚別"].astype(str).str.strip()
-            shelf_for_group = shelf_for_group.where(shelf_for_group.ne(""), "未比對")
-            shelf_person_long = (
-                dt_data.assign(_棚別分類=shelf_for_group)
-                .groupby([user_col, "對應姓名", "_棚別分類"], dropna=False)
-                .size()
-                .reset_index(name="筆數")
-                .rename(columns={"_棚別分類": "棚別"})
-            )
-            if not shelf_person_long.empty:
-                shelf_person_pivot = (
-                    shelf_person_long.pivot_table(
-                        index=[user_col, "對應姓名"],
-                        columns="棚別",
-                        values="筆數",
-                        aggfunc="sum",
-                        fill_value=0,
-                    )
-                    .reset_index()
-                )
-                cols = [c for c in shelf_person_pivot.columns if c not in (user_col, "對應姓名")]
-                cols_sorted = [c for c in cols if c != "未比對"] + (["未比對"] if "未比對" in cols else [])
-                shelf_person_pivot = shelf_person_pivot[[user_col, "對應姓名"] + cols_sorted]
-            else:
-                shelf_person_pivot = pd.DataFrame()
-
-            # ✅ 樞紐：每人每儲位類型
-            stype_for_group = dt_data["儲位類型"].astype(str).str.strip()
-            stype_for_group = stype_for_group.where(stype_for_group.ne(""), "未分類")
-            stype_person_long = (
-                dt_data.assign(_儲位類型分類=stype_for_group)
-                .groupby([user_col, "對應姓名", "_儲位類型分類"], dropna=False)
-                .size()
-                .reset_index(name="筆數")
-                .rename(columns={"_儲位類型分類": "儲位類型"})
-            )
-            if not stype_person_long.empty:
-                stype_person_pivot = (
-                    stype_person_long.pivot_table(
-                        index=[user_col, "對應姓名"],
-                        columns="儲位類型",
-                        values="筆數",
-                        aggfunc="sum",
-                        fill_value=0,
-                    )
-                    .reset_index()
+            try:
+                result = cached_call(
+                    "putaway_all_day",
+                    upload_bytes(uploaded),
+                    cache_params,
+                    lambda: compute_putaway(
+                        upload_bytes(uploaded),
+                        uploaded.name,
+                        name_map=merged_name_map,
+                        shelf_index=shelf_index,
+                        target_eff_map=target_eff_map,
+                        idle_threshold=int(idle_threshold),
+                        exclude_idle_ranges=exclude_idle_ranges,
+                        global_start_time=global_start_time,
+                    ),
+                    fingerprint=upload_fingerprint(uploaded),
                 )
-                prefer = ["低空", "高空", "未分類"]
-                cols = [c for c in stype_person_pivot.columns if c not in (user_col, "對應姓名")]
-                ordered = [c for c in prefer if c in cols] + [c for c in cols if c not in prefer]
-                stype_person_pivot = stype_person_pivot[[user_col, "對應姓名"] + ordered]
-            else:
-                stype_person_pivot = pd.DataFrame()
-
-            xlsx_bytes = build_excel_bytes(
-                user_col=user_col,
-                summary_out=summary_out,
-                daily=daily,
-                shelf_person_pivot=shelf_person_pivot,
-                stype_person_pivot=stype_person_pivot,
-            )
-            xlsx_name = f"{uploaded.name.rsplit('.', 1)[0]}_上架績效_整天版.xlsx"
+            except ValueError as e:
+                st.error(str(e))
+                session_store.discard("putaway_last")
+                return
 
-            st.session_state.putaway_last = {
+            export_frames = result.pop("export_frames")
+            session_store.put("putaway_last", {
+                **result,
                 "params": current_params,
-                "user_col": user_col,
-                "summary": summary,
                 "low_target_eff": float(low_target_eff),
                 "high_target_eff": float(high_target_eff),
                 "top_n": int(top_n),
-                "total_groups": int(total_groups),
-                "met_groups": int(met_groups),
-                "low_groups": int(len(low_groups)),
-                "low_met": int(low_met),
-                "high_groups": int(len(high_groups)),
-                "high_met": int(high_met),
-                "rate": float(rate),
-                "xlsx_bytes": xlsx_bytes,
-                "xlsx_name": xlsx_name,
-                "total_match": int(total_match),
-                "match_rate_all": float(match_rate_all),
-                "shelf_person_pivot": shelf_person_pivot,
-                "stype_person_pivot": stype_person_pivot,
-            }
+                "xlsx": ExportRecipe(
+                    build_excel_bytes,
+                    kwargs=export_frames,
+                    file_name=f"{uploaded.name.rsplit('.', 1)[0]}_上架績效_整天版.xlsx",
+                ),
+            })
 
     # ======================
     # ✅ 顯示（主畫面：只顯示兩個樞紐表）
     # ======================
-    last = st.session_state.putaway_last
+    last = session_store.get("putaway_last")
     if not last:
         st.info("請先上傳上架作業原始資料並點選「🚀 產出 KPI」")
         return
@@ -1369,8 +1376,7 @@ def main():
     high_groups = int(last["high_groups"])
     high_met = int(last["high_met"])
     rate = float(last["rate"])
-    xlsx_bytes = last["xlsx_bytes"]
-    xlsx_name = last["xlsx_name"]
+    xlsx = last["xlsx"]
     total_match = int(last.get("total_match", 0))
     match_rate_all = float(last.get("match_rate_all", 0.0))
 
@@ -1428,8 +1434,8 @@ def main():
     card_close()
 
     download_excel_card(
-        xlsx_bytes,
-        xlsx_name,
+        xlsx,
+        xlsx.file_name,
         label="⬇️ 匯出 KPI 報表（Excel：整天版，含『總表』）",
     )
 
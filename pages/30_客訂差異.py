@@ -14,16 +14,21 @@ Streamlit 頁面版：客訂差異分析
 
 from __future__ import annotations
 
-from io import BytesIO
+from dataclasses import replace
 from pathlib import Path
 from typing import Iterable
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 
-from openpyxl.cell.rich_text import CellRichText, TextBlock
-from openpyxl.cell.text import InlineFont
-from openpyxl.styles import Alignment, Font, PatternFill
+from arrow_strings import as_text, categorize
+from excel_export import SheetStyle, SuffixEmphasis, write_workbook
+from export_bundle import build_report, raw_format_selector
+from export_recipe import download_button
+from master_data import LocationMaster, location_master_uploader
+from report_schema import find_column
+from upload_cache import cached_text_table
 
 
 # =====================================================
@@ -123,60 +128,12 @@ MAX_ALT_LOCS = 3
 # =====================================================
 # Streamlit 上傳檔案讀取
 # =====================================================
-def _uploaded_to_bytes(uploaded_file) -> bytes:
-    uploaded_file.seek(0)
-    return uploaded_file.read()
-
-
-def read_file_smart(uploaded_file) -> pd.DataFrame:
-    """讀取 Streamlit UploadedFile，支援 xlsx/xls/csv/txt/假 xls。"""
-    file_name = getattr(uploaded_file, "name", "uploaded_file")
-    data = _uploaded_to_bytes(uploaded_file)
-    header = data[:8]
-
-    # xlsx / xlsm
-    if header.startswith(b"PK"):
-        return pd.read_excel(BytesIO(data), dtype=str, keep_default_na=False)
-
-    # 真正 xls：Streamlit Cloud 需 requirements.txt 有 xlrd
-    if header.startswith(b"\xD0\xCF\x11\xE0"):
-        try:
-            return pd.read_excel(BytesIO(data), dtype=str, keep_default_na=False, engine="xlrd")
-        except ImportError as exc:
-            raise ImportError(
-                f"{file_name} 是舊版 .xls 格式，Streamlit Cloud 需要安裝 xlrd。\n"
-                "請在 requirements.txt 加上：xlrd"
-            ) from exc
-
-    # 假 xls / txt / csv
-    encodings = ["utf-8-sig", "cp950", "big5", "utf-16", "latin1"]
-    seps = ["\t", ",", "|", ";"]
-    last_error: Exception | None = None
-
-    for enc in encodings:
-        for sep in seps:
-            try:
-                df = pd.read_csv(
-                    BytesIO(data),
-                    sep=sep,
-                    dtype=str,
-                    encoding=enc,
-                    keep_default_na=False,
-                    engine="python",
-                )
-                if len(df.columns) > 1:
-                    return df
-            except Exception as e:
-                last_error = e
-
-    raise ValueError(f"檔案讀取失敗：{file_name}\n最後錯誤：{last_error}")
-
-
 def read_and_concat_files(uploaded_files: Iterable, file_type_name: str) -> pd.DataFrame:
     all_df: list[pd.DataFrame] = []
 
     for uploaded_file in uploaded_files or []:
-        df = read_file_smart(uploaded_file)
+        # 共用文字表讀取器：庫存明細等在其他頁讀過就直接取快取
+        df = cached_text_table(uploaded_file)
         df.columns = df.columns.astype(str).str.strip()
         df["來源檔案"] = getattr(uploaded_file, "name", "uploaded_file")
         all_df.append(df)
@@ -184,7 +141,8 @@ def read_and_concat_files(uploaded_files: Iterable, file_type_name: str) -> pd.D
     if not all_df:
         raise ValueError(f"未上傳任何{file_type_name}檔案")
 
-    return pd.concat(all_df, ignore_index=True)
+    # 來源檔案每列重複同一個檔名 → category
+    return categorize(pd.concat(all_df, ignore_index=True), ["來源檔案"])
 
 
 # =====================================================
@@ -206,9 +164,9 @@ def is_customer_order(order_no) -> bool:
 
 
 def _find_column(df: pd.DataFrame, possible_columns: list[str], title: str) -> str:
-    for col in possible_columns:
-        if col in df.columns:
-            return col
+    col = find_column(df.columns, possible_columns)
+    if col is not None:
+        return col
 
     raise ValueError(
         f"{title}找不到必要欄位。\n\n"
@@ -268,12 +226,16 @@ def find_inventory_qty_column(df):
     return None
 
 
+LOCATION_LOC_CANDIDATES = ["儲位", "庫位", "LOCATION", "LOC", "PICKLOC"]
+LOCATION_SHED_CANDIDATES = ["棚別", "區域", "倉別", "儲區", "ZONE", "AREA"]
+
+
 def find_location_master_loc_column(df):
-    return _find_column(df, ["儲位", "庫位", "LOCATION", "LOC", "PICKLOC"], "儲位明細")
+    return _find_column(df, LOCATION_LOC_CANDIDATES, "儲位明細")
 
 
 def find_location_master_shed_column(df):
-    return _find_column(df, ["棚別", "區域", "倉別", "儲區", "ZONE", "AREA"], "儲位明細")
+    return _find_column(df, LOCATION_SHED_CANDIDATES, "儲位明細")
 
 
 # =====================================================
@@ -296,17 +258,12 @@ def clean_difference_df(df: pd.DataFrame) -> pd.DataFrame:
     result = result[OUTPUT_COLUMNS]
 
     for col in result.columns:
-        result[col] = result[col].astype(str).str.strip()
+        result[col] = as_text(result[col], fill=None)
 
-    result["差異量"] = (
-        result["差異量"].astype(str).str.replace(",", "", regex=False).str.strip()
-    )
+    result["差異量"] = result["差異量"].str.replace(",", "", regex=False)
     result["差異量"] = pd.to_numeric(result["差異量"], errors="coerce").fillna(0).astype(int)
     result = result[result["差異量"] != 0].copy()
 
-    for col in ["儲位", "國際條碼", "商品碼", "批次"]:
-        result[col] = result[col].astype(str).str.strip()
-
     return result
 
 
@@ -315,7 +272,7 @@ def clean_order_df(order_df: pd.DataFrame):
     order_df.columns = order_df.columns.astype(str).str.strip()
 
     order_col = find_order_column(order_df)
-    order_df[order_col] = order_df[order_col].astype(str).str.strip()
+    order_df[order_col] = as_text(order_df[order_col], fill=None)
 
     order_df["訂單類型"] = order_df[order_col].apply(
         lambda x: "客訂單" if is_customer_order(x) else "非客訂單"
@@ -324,7 +281,7 @@ def clean_order_df(order_df: pd.DataFrame):
 
     customer_order_product_df = order_df[order_df["訂單類型"] == "客訂單"].copy()
     product_col = find_product_column(customer_order_product_df)
-    customer_order_product_df[product_col] = customer_order_product_df[product_col].astype(str).str.strip()
+    customer_order_product_df[product_col] = as_text(customer_order_product_df[product_col], fill=None)
 
     unique_customer_product_df = (
         customer_order_product_df[customer_order_product_df[product_col] != ""]
@@ -347,14 +304,14 @@ def build_inventory_location_map(inventory_df: pd.DataFrame):
     days_col = find_inventory_days_column(inventory_df)
     qty_col = find_inventory_qty_column(inventory_df)
 
-    inventory_df[product_col] = inventory_df[product_col].astype(str).str.strip()
-    inventory_df[loc_col] = inventory_df[loc_col].astype(str).str.strip()
+    inventory_df[product_col] = as_text(inventory_df[product_col], fill=None)
+    inventory_df[loc_col] = as_text(inventory_df[loc_col], fill=None)
 
     inventory_df = inventory_df[(inventory_df[product_col] != "") & (inventory_df[loc_col] != "")].copy()
 
     if qty_col:
         inventory_df["_可用量排序"] = pd.to_numeric(
-            inventory_df[qty_col].astype(str).str.replace(",", "", regex=False), errors="coerce"
+            as_text(inventory_df[qty_col], fill=None).str.replace(",", "", regex=False), errors="coerce"
         ).fillna(0)
         inventory_df = inventory_df[inventory_df["_可用量排序"] > 0].copy()
     else:
@@ -367,7 +324,7 @@ def build_inventory_location_map(inventory_df: pd.DataFrame):
 
     if days_col:
         inventory_df["_剩餘天數排序"] = pd.to_numeric(
-            inventory_df[days_col].astype(str).str.replace(",", "", regex=False), errors="coerce"
+            as_text(inventory_df[days_col], fill=None).str.replace(",", "", regex=False), errors="coerce"
         )
     else:
         inventory_df["_剩餘天數排序"] = pd.NA
@@ -382,7 +339,7 @@ def build_inventory_location_map(inventory_df: pd.DataFrame):
 
     inventory_location_map = {}
     for product, group in inventory_unique_loc_df.groupby(product_col):
-        locs = group[loc_col].astype(str).str.strip().tolist()
+        locs = group[loc_col].tolist()
         inventory_location_map[str(product).strip()] = locs
 
     return inventory_location_map, inventory_unique_loc_df.copy(), product_col, loc_col, expiry_col, days_col, qty_col
@@ -407,41 +364,32 @@ def add_other_locations_by_short_expiry(diff_result: pd.DataFrame, inventory_loc
     return diff_result
 
 
-def build_location_shed_map(location_df: pd.DataFrame):
-    location_df = location_df.copy()
-    location_df.columns = location_df.columns.astype(str).str.strip()
-
-    loc_col = find_location_master_loc_column(location_df)
-    shed_col = find_location_master_shed_column(location_df)
+def build_location_shed_map(master: LocationMaster):
+    """儲位主檔 → (儲位:棚別 索引, 儲位棚別對照表, 儲位欄, 棚別欄)；索引由登錄表共用"""
+    loc_col = find_location_master_loc_column(master.frame)
+    shed_col = find_location_master_shed_column(master.frame)
 
-    location_df[loc_col] = location_df[loc_col].astype(str).str.strip()
-    location_df[shed_col] = location_df[shed_col].astype(str).str.strip()
-
-    location_df = location_df[(location_df[loc_col] != "") & (location_df[shed_col] != "")].copy()
-    location_df = location_df.drop_duplicates(subset=[loc_col], keep="first").copy()
-
-    location_shed_map = dict(zip(location_df[loc_col], location_df[shed_col]))
-    location_summary_df = location_df[[loc_col, shed_col]].rename(columns={loc_col: "儲位", shed_col: "棚別"}).copy()
+    location_shed_map = master.index(shed_col, loc_col=loc_col, keep="first")
+    location_summary_df = location_shed_map.rename("棚別").rename_axis("儲位").reset_index()
 
     return location_shed_map, location_summary_df, loc_col, shed_col
 
 
-def run_analysis(diff_files, order_files, inventory_files, location_files):
+def run_analysis(diff_files, order_files, inventory_files, location_master: LocationMaster):
     raw_diff_df = read_and_concat_files(diff_files, "差異明細")
     raw_order_df = read_and_concat_files(order_files, "訂單明細")
     raw_inventory_df = read_and_concat_files(inventory_files, "庫存明細")
-    raw_location_df = read_and_concat_files(location_files, "儲位明細")
+    raw_location_df = location_master.frame
 
     diff_result = clean_difference_df(raw_diff_df)
 
     order_df, customer_order_product_df, unique_customer_product_df, order_col, product_col = clean_order_df(raw_order_df)
 
-    customer_product_set = set(unique_customer_product_df["商品"].astype(str).str.strip().tolist())
+    customer_product_set = set(unique_customer_product_df["商品"].tolist())
 
-    diff_result["訂單類型"] = diff_result["商品碼"].apply(
-        lambda x: "客訂單" if str(x).strip() in customer_product_set else "非客訂單"
-    )
-    diff_result["備註"] = diff_result["訂單類型"].apply(lambda x: "客訂單" if x == "客訂單" else "正常")
+    is_customer = as_text(diff_result["商品碼"], fill=None).isin(customer_product_set)
+    diff_result["訂單類型"] = np.where(is_customer, "客訂單", "非客訂單")
+    diff_result["備註"] = np.where(is_customer, "客訂單", "正常")
 
     (
         inventory_location_map,
@@ -455,8 +403,8 @@ def run_analysis(diff_files, order_files, inventory_files, location_files):
 
     diff_result = add_other_locations_by_short_expiry(diff_result, inventory_location_map)
 
-    location_shed_map, location_summary_df, location_loc_col, location_shed_col = build_location_shed_map(raw_location_df)
-    diff_result["棚別"] = diff_result["儲位"].apply(lambda x: location_shed_map.get(str(x).strip(), ""))
+    location_shed_map, location_summary_df, location_loc_col, location_shed_col = build_location_shed_map(location_master)
+    diff_result["棚別"] = as_text(diff_result["儲位"], fill=None).map(location_shed_map).fillna("")
     diff_result = diff_result[FINAL_COLUMNS]
 
     stats = {
@@ -499,73 +447,31 @@ def run_analysis(diff_files, order_files, inventory_files, location_files):
 # =====================================================
 # Excel 匯出與美化
 # =====================================================
-def format_worksheet(ws) -> None:
-    ws.freeze_panes = "A2"
-    ws.auto_filter.ref = ws.dimensions
-
-    header_fill = PatternFill("solid", fgColor="1E3A8A")
-    header_font = Font(color="FFFFFF", bold=True)
-
-    for cell in ws[1]:
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal="center", vertical="center")
-
-    for row in ws.iter_rows():
-        for cell in row:
-            cell.alignment = Alignment(vertical="center")
-
-    for column_cells in ws.columns:
-        max_length = 0
-        column_letter = column_cells[0].column_letter
-        for cell in column_cells:
-            cell_value = str(cell.value) if cell.value is not None else ""
-            max_length = max(max_length, len(cell_value))
-        ws.column_dimensions[column_letter].width = min(max_length + 4, 50)
-
-
-def apply_barcode_last5_big(ws, header_name="國際條碼", normal_size=11, big_size=18) -> None:
-    barcode_col = None
-    for cell in ws[1]:
-        if str(cell.value).strip() == header_name:
-            barcode_col = cell.column
-            break
-
-    if barcode_col is None:
-        return
+EXPORT_STYLE = SheetStyle(
+    header={"bold": True, "font_color": "#FFFFFF", "bg_color": "#1E3A8A", "align": "center", "valign": "vcenter"},
+    body={"valign": "vcenter"},
+    width_padding=4,
+    autofilter=True,
+)
 
-    normal_font = InlineFont(sz=normal_size)
-    big_font = InlineFont(sz=big_size, b=True)
+# 完整明細：國際條碼後 5 碼放大加粗（列數過多時改為後 5 碼輔助欄）
+DETAIL_STYLE = replace(
+    EXPORT_STYLE,
+    suffix_emphasis={"國際條碼": SuffixEmphasis(5, big={"bold": True, "font_size": 18})},
+)
 
-    for row in range(2, ws.max_row + 1):
-        cell = ws.cell(row=row, column=barcode_col)
-        value = "" if cell.value is None else str(cell.value).strip()
-        if value == "":
-            continue
-        if len(value) <= 5:
-            cell.value = CellRichText([TextBlock(big_font, value)])
-        else:
-            cell.value = CellRichText([
-                TextBlock(normal_font, value[:-5]),
-                TextBlock(big_font, value[-5:]),
-            ])
 
+# 合併原始明細：選 Parquet / CSV 時不寫進 Excel，另存成檔案一起打包
+RAW_SHEETS = ("差異明細_合併原始", "庫存明細_合併原始", "儲位明細_合併原始")
 
-def build_excel_bytes(sheets: dict[str, pd.DataFrame]) -> bytes:
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        for sheet_name, df in sheets.items():
-            safe_name = sheet_name[:31]
-            df.to_excel(writer, index=False, sheet_name=safe_name)
+OUTPUT_NAME = "30_客訂差異_多檔合併整理後_含最短效其他儲位與棚別.xlsx"
 
-        for sheet_name in writer.book.sheetnames:
-            ws = writer.book[sheet_name]
-            format_worksheet(ws)
-            if sheet_name == "完整明細":
-                apply_barcode_last5_big(ws, header_name="國際條碼", normal_size=11, big_size=18)
 
-    output.seek(0)
-    return output.getvalue()
+def build_excel_bytes(sheets: dict[str, pd.DataFrame]) -> bytes:
+    return write_workbook({
+        sheet_name: (df, DETAIL_STYLE if sheet_name == "完整明細" else EXPORT_STYLE)
+        for sheet_name, df in sheets.items()
+    })
 
 
 # =====================================================
@@ -616,23 +522,33 @@ def main() -> None:
         inventory_files = render_uploader("3️⃣ 上傳庫存明細，可多選", "用商品欄位比對其他儲位，並依最短效排序")
     with col2:
         order_files = render_uploader("2️⃣ 上傳訂單明細，可多選", "用訂單號判斷客訂單，再抓客訂商品")
-        location_files = render_uploader("4️⃣ 上傳儲位明細，可多選", "用儲位比對棚別")
+        location_master = location_master_uploader(
+            "4️⃣ 上傳儲位明細，可多選",
+            key="customer_diff_location_master",
+            requires=(LOCATION_LOC_CANDIDATES, LOCATION_SHED_CANDIDATES),
+            help="用儲位比對棚別",
+            accept_multiple_files=True,
+        )
 
-    ready = all([diff_files, order_files, inventory_files, location_files])
+    ready = all([diff_files, order_files, inventory_files]) and location_master is not None
 
     if not ready:
         st.info("請先上傳 4 類檔案，才能開始產生客訂差異分析結果。")
         return
 
+    raw_format = raw_format_selector("customer_diff_raw_format")
+
     if st.button("🚀 開始產生客訂差異報表", type="primary", use_container_width=True):
         try:
             with st.spinner("資料讀取與比對中，請稍候..."):
-                diff_result, sheets, stats = run_analysis(diff_files, order_files, inventory_files, location_files)
-                excel_bytes = build_excel_bytes(sheets)
+                diff_result, sheets, stats = run_analysis(diff_files, order_files, inventory_files, location_master)
+                report = build_report(
+                    sheets, RAW_SHEETS, build_excel_bytes, raw_format=raw_format, workbook_name=OUTPUT_NAME
+                )
 
             st.session_state["customer_diff_result"] = diff_result
             st.session_state["customer_diff_stats"] = stats
-            st.session_state["customer_diff_excel_bytes"] = excel_bytes
+            st.session_state["customer_diff_report"] = report
             st.success("客訂差異報表產生完成。")
 
         except Exception as e:
@@ -645,7 +561,7 @@ def main() -> None:
 
     diff_result = st.session_state["customer_diff_result"]
     stats = st.session_state["customer_diff_stats"]
-    excel_bytes = st.session_state["customer_diff_excel_bytes"]
+    report = st.session_state["customer_diff_report"]
 
     st.subheader("📊 統計摘要")
     m1, m2, m3, m4 = st.columns(4)
@@ -661,12 +577,9 @@ def main() -> None:
     st.subheader("📋 完整明細預覽")
     st.dataframe(diff_result.head(1000), use_container_width=True, hide_index=True)
 
-    output_name = "30_客訂差異_多檔合併整理後_含最短效其他儲位與棚別.xlsx"
-    st.download_button(
-        label="📥 下載 Excel 報表",
-        data=excel_bytes,
-        file_name=output_name,
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    download_button(
+        "📥 下載 Excel 報表" if report.file_name.endswith(".xlsx") else "📥 下載報表（Excel + 原始明細 ZIP）",
+        report,
         use_container_width=True,
     )
 
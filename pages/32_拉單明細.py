@@ -1,11 +1,9 @@
-from io import BytesIO
-
 import pandas as pd
 import streamlit as st
-from openpyxl import load_workbook
-from openpyxl.utils import get_column_letter
 
 from common_ui import inject_logistics_theme, set_page, card_open, card_close
+from excel_export import SheetStyle, write_workbook
+from export_recipe import ExportRecipe, download_button
 
 st.set_page_config(page_title="拉單明細", page_icon="📄", layout="wide")
 inject_logistics_theme()
@@ -48,27 +46,8 @@ def adjust_one_sheet(df, sheet_name, file_name):
     return df[KEEP_COLUMNS]
 
 
-def autosize_excel(excel_bytes):
-    bio = BytesIO(excel_bytes)
-    wb = load_workbook(bio)
-
-    for ws in wb.worksheets:
-        ws.freeze_panes = "A2"
-
-        for column_cells in ws.columns:
-            max_length = 0
-            col_letter = get_column_letter(column_cells[0].column)
-
-            for cell in column_cells:
-                if cell.value is not None:
-                    max_length = max(max_length, len(str(cell.value)))
-
-            ws.column_dimensions[col_letter].width = min(max_length + 2, 28)
-
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-    return output.getvalue()
+# 欄寬依內容（上限 28）、凍結表頭
+EXPORT_STYLE = SheetStyle(max_width=28)
 
 
 def process_files(uploaded_files):
@@ -85,14 +64,12 @@ def process_files(uploaded_files):
 
             merged_sheets[sheet_name].append(adjusted_df)
 
-    output = BytesIO()
-
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        for sheet_name, dfs in merged_sheets.items():
-            final_df = pd.concat(dfs, ignore_index=True)
-            final_df.to_excel(writer, sheet_name=sheet_name, index=False)
-
-    return autosize_excel(output.getvalue())
+    # 只留配方，按下載時才寫 Excel
+    sheets = {
+        sheet_name: (pd.concat(dfs, ignore_index=True), EXPORT_STYLE)
+        for sheet_name, dfs in merged_sheets.items()
+    }
+    return ExportRecipe(write_workbook, (sheets,), file_name="拉單明細整理.xlsx")
 
 
 card_open("📄 拉單明細整理")
@@ -113,17 +90,11 @@ if uploaded_files:
 
     if st.button("開始整理", use_container_width=True):
         try:
-            output_bytes = process_files(uploaded_files)
+            export = process_files(uploaded_files)
 
             st.success("拉單明細整理完成")
 
-            st.download_button(
-                label="下載拉單明細整理.xlsx",
-                data=output_bytes,
-                file_name="拉單明細整理.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                use_container_width=True,
-            )
+            download_button("下載拉單明細整理.xlsx", export, use_container_width=True)
 
         except Exception as e:
             st.error("處理失敗")
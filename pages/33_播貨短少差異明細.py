@@ -1,14 +1,13 @@
 import pandas as pd
 import streamlit as st
 from datetime import datetime
-from io import BytesIO
-
-from openpyxl import load_workbook
-from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
-from openpyxl.worksheet.table import Table, TableStyleInfo
-from openpyxl.utils import get_column_letter
 
+from arrow_strings import as_text
 from common_ui import inject_logistics_theme, set_page, card_open, card_close
+from excel_export import SheetStyle, write_workbook
+from export_recipe import ExportRecipe, download_button
+from master_data import LocationMaster, location_master_uploader
+from upload_cache import cached_text_table
 
 
 st.set_page_config(
@@ -26,7 +25,8 @@ set_page("播貨短少差異明細", "上傳短少明細、庫存明細、儲位
 # =========================
 
 def read_excel_first_sheet(uploaded_file):
-    return pd.read_excel(uploaded_file, dtype=str)
+    # 庫存明細常在其他頁面上傳過，走共用文字表讀取器才會命中同一份解析快取
+    return cached_text_table(uploaded_file)
 
 
 def clean_columns(df):
@@ -68,6 +68,11 @@ def clean_text(value):
     return text
 
 
+def clean_text_series(series):
+    # clean_text 的整欄向量化版本（庫存明細動輒數十萬列）
+    return as_text(series).str.replace(r"\.0$", "", regex=True)
+
+
 def to_number(value):
     if pd.isna(value):
         return 0
@@ -148,7 +153,7 @@ def pick_locations(stock_rows, col_location, col_canuseqty, col_calculated, col_
     else:
         data["_效期_sort"] = pd.Timestamp.max
 
-    data[col_location] = data[col_location].fillna("").astype(str).str.strip()
+    data[col_location] = as_text(data[col_location])
 
     rule1 = data[
         (data["_Canuseqty_num"] == 0) &
@@ -198,88 +203,30 @@ def pick_locations(stock_rows, col_location, col_canuseqty, col_calculated, col_
 # Excel 輸出格式
 # =========================
 
-def format_excel_bytes(df):
-    output = BytesIO()
-
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name="揀差異明細")
-
-    output.seek(0)
-
-    wb = load_workbook(output)
-    ws = wb["揀差異明細"]
-
-    max_row = ws.max_row
-    max_col = ws.max_column
-
-    header_fill = PatternFill("solid", fgColor="0F766E")
-    header_font = Font(color="FFFFFF", bold=True)
-    row_fill = PatternFill("solid", fgColor="EAF1DD")
-    thin = Side(style="thin", color="D9E2F3")
-    border = Border(left=thin, right=thin, top=thin, bottom=thin)
-
-    for cell in ws[1]:
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal="center", vertical="center")
-        cell.border = border
-
-    for row in range(2, max_row + 1):
-        for col in range(1, max_col + 1):
-            cell = ws.cell(row=row, column=col)
-            cell.border = border
-            cell.alignment = Alignment(vertical="center")
-
-            if row % 2 == 0:
-                cell.fill = row_fill
-
-    widths = {
-        "A": 12,
-        "B": 18,
-        "C": 12,
-        "D": 45,
-        "E": 14,
-        "F": 14,
-        "G": 14,
-        "H": 14,
-        "I": 12,
-    }
+_THIN = {"border": 1, "border_color": "#D9E2F3"}
 
-    for col, width in widths.items():
-        ws.column_dimensions[col].width = width
-
-    if max_row >= 2:
-        table_ref = f"A1:{get_column_letter(max_col)}{max_row}"
-        tab = Table(displayName="PickDiffTable", ref=table_ref)
-
-        style = TableStyleInfo(
-            name="TableStyleMedium4",
-            showFirstColumn=False,
-            showLastColumn=False,
-            showRowStripes=True,
-            showColumnStripes=False,
-        )
-
-        tab.tableStyleInfo = style
-        ws.add_table(tab)
-
-    ws.freeze_panes = "A2"
+EXPORT_STYLE = SheetStyle(
+    header={"bold": True, "font_color": "#FFFFFF", "bg_color": "#0F766E", "align": "center", "valign": "vcenter", **_THIN},
+    body={"valign": "vcenter", **_THIN},
+    band={"bg_color": "#EAF1DD"},
+    widths={"A": 12, "B": 18, "C": 12, "D": 45, "E": 14, "F": 14, "G": 14, "H": 14, "I": 12},
+    table_style="Table Style Medium 4",
+    table_name="PickDiffTable",
+)
 
-    final_output = BytesIO()
-    wb.save(final_output)
-    final_output.seek(0)
 
-    return final_output
+def export_recipe(df, file_name):
+    # 只留配方，按下載時才寫 Excel
+    return ExportRecipe(write_workbook, ({"揀差異明細": (df, EXPORT_STYLE)},), file_name=file_name)
 
 
 # =========================
 # 主處理
 # =========================
 
-def build_pick_diff(shortage_file, stock_file, location_file):
+def build_pick_diff(shortage_file, stock_file, location_master: LocationMaster):
     shortage_df = clean_columns(read_excel_first_sheet(shortage_file))
     stock_df = clean_columns(read_excel_first_sheet(stock_file))
-    location_df = clean_columns(read_excel_first_sheet(location_file))
 
     # 短少明細欄位
     shortage_time_col = find_col(shortage_df, ["回報時間", "時間"])
@@ -295,9 +242,9 @@ def build_pick_diff(shortage_file, stock_file, location_file):
     stock_calculated_col = find_col(stock_df, ["已試算", "試算"])
     stock_expiry_col = find_col(stock_df, ["效期", "有效日期", "保存期限", "到期日"], required=False)
 
-    # 儲位明細欄位
-    location_loc_col = find_col(location_df, ["儲位", "儲位號", "儲位名稱"])
-    location_shed_col = find_col(location_df, ["棚別", "棚"])
+    # 儲位明細欄位（主檔由登錄表共用）
+    location_loc_col = find_col(location_master.frame, ["儲位", "儲位號", "儲位名稱"])
+    location_shed_col = find_col(location_master.frame, ["棚別", "棚"])
 
     # 只抓當天日期
     today = datetime.today().date()
@@ -309,7 +256,7 @@ def build_pick_diff(shortage_file, stock_file, location_file):
         return pd.DataFrame(), today
 
     # 同一天同商品碼加總
-    shortage_df[shortage_item_col] = shortage_df[shortage_item_col].apply(clean_text)
+    shortage_df[shortage_item_col] = clean_text_series(shortage_df[shortage_item_col])
     shortage_df[shortage_qty_col] = shortage_df[shortage_qty_col].apply(to_number)
 
     agg_dict = {
@@ -317,7 +264,7 @@ def build_pick_diff(shortage_file, stock_file, location_file):
     }
 
     if shortage_barcode_col:
-        shortage_df[shortage_barcode_col] = shortage_df[shortage_barcode_col].apply(clean_text)
+        shortage_df[shortage_barcode_col] = clean_text_series(shortage_df[shortage_barcode_col])
         agg_dict[shortage_barcode_col] = "first"
 
     shortage_df = (
@@ -327,13 +274,10 @@ def build_pick_diff(shortage_file, stock_file, location_file):
     )
 
     # 清理庫存與儲位資料
-    stock_df[stock_item_col] = stock_df[stock_item_col].apply(clean_text)
-    stock_df[stock_location_col] = stock_df[stock_location_col].fillna("").astype(str).str.strip()
+    stock_df[stock_item_col] = clean_text_series(stock_df[stock_item_col])
+    stock_df[stock_location_col] = as_text(stock_df[stock_location_col])
 
-    location_df[location_loc_col] = location_df[location_loc_col].fillna("").astype(str).str.strip()
-    location_df[location_shed_col] = location_df[location_shed_col].fillna("").astype(str).str.strip()
-
-    shed_map = dict(zip(location_df[location_loc_col], location_df[location_shed_col]))
+    shed_map = location_master.index(location_shed_col, loc_col=location_loc_col, keep="last")
 
     result_rows = []
 
@@ -446,23 +390,24 @@ with col2:
     )
 
 with col3:
-    location_file = st.file_uploader(
+    location_master = location_master_uploader(
         "③ 上傳儲位明細",
-        type=["xlsx", "xls"],
         key="location_file",
+        requires=(["儲位", "儲位號", "儲位名稱"], ["棚別", "棚"]),
+        fuzzy=True,
     )
 
 st.divider()
 
 if st.button("產生揀差異明細", type="primary", use_container_width=True):
-    if not shortage_file or not stock_file or not location_file:
+    if not shortage_file or not stock_file or location_master is None:
         st.warning("請先上傳【短少明細】、【庫存明細】、【儲位明細】三個檔案。")
     else:
         try:
             result_df, today = build_pick_diff(
                 shortage_file=shortage_file,
                 stock_file=stock_file,
-                location_file=location_file,
+                location_master=location_master,
             )
 
             if result_df.empty:
@@ -476,13 +421,9 @@ if st.button("產生揀差異明細", type="primary", use_container_width=True):
                     hide_index=True,
                 )
 
-                excel_file = format_excel_bytes(result_df)
-
-                st.download_button(
-                    label="下載揀差異明細 Excel",
-                    data=excel_file,
-                    file_name=f"揀差異明細_{today}.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                download_button(
+                    "下載揀差異明細 Excel",
+                    export_recipe(result_df, f"揀差異明細_{today}.xlsx"),
                     use_container_width=True,
                 )
 
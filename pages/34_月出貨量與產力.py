@@ -7,9 +7,10 @@ from typing import BinaryIO
 
 import pandas as pd
 import streamlit as st
-from openpyxl import Workbook
-from openpyxl.styles import Alignment, Font, PatternFill
-from openpyxl.utils import get_column_letter
+import session_store
+from arrow_strings import as_text, categorize
+from excel_export import SheetStyle, rows_to_frame, write_workbook
+from txt_stream import iter_txt_chunks, peek_text
 
 
 PAGE_TITLE = "月出貨量與產力"
@@ -75,6 +76,11 @@ def to_number(value):
         return None
 
 
+def sum_numbers(series: pd.Series) -> float:
+    # 空的字串欄 .sum() 會回傳 ""（分塊時很常遇到），一律用 Python sum 從 0 起算
+    return float(sum(series.map(to_number).dropna(), 0))
+
+
 def calc_unit_qty(packqty, qty_per_box):
     """GCOR 排除資料：單位入數 = packqty / 揀貨入數。"""
     packqty_num = to_number(packqty)
@@ -108,12 +114,6 @@ def is_gcor_packqty_100(buyersreference_value, packqty_value) -> bool:
     return buyer_text == "GCOR" and packqty_num is not None and packqty_num >= 100
 
 
-def clean_illegal_excel_text(value):
-    if isinstance(value, str):
-        return re.sub(r"[\000-\010]|[\013-\014]|[\016-\037]", "", value)
-    return value
-
-
 def load_master_mapping(master_file: BinaryIO) -> tuple[dict[str, str], str]:
     master_file.seek(0)
     all_sheets = pd.read_excel(master_file, sheet_name=None, dtype=str)
@@ -148,20 +148,39 @@ def detect_separator(text: str) -> str:
     return best_separator if candidates[best_separator] > 0 else r"\s{2,}"
 
 
-def read_txt_smart(uploaded_file: BinaryIO) -> pd.DataFrame:
+def _clean_txt_frame(df: pd.DataFrame) -> pd.DataFrame:
+    df.columns = df.columns.astype(str).str.strip()
+    for column in df.columns:
+        df[column] = as_text(df[column]).replace({"nan": "", "None": "", "NaN": "", "NAN": ""})
+    # BOXTYPE / buyersreference 只有少數幾種值
+    return categorize(df, ["BOXTYPE", "buyersreference"])
+
+
+def iter_txt_smart(uploaded_file: BinaryIO):
+    """分塊讀取出貨 TXT／CSV；第一塊就解析失敗時改用固定寬度。"""
     uploaded_file.seek(0)
     raw = uploaded_file.read()
     encoding = detect_encoding(raw)
-    text = raw.decode(encoding, errors="replace")
-    separator = detect_separator(text)
+    separator = detect_separator(peek_text(raw, encoding))
     try:
-        df = pd.read_csv(io.StringIO(text), sep=separator, dtype=str, engine="python", on_bad_lines="skip")
+        chunks = iter_txt_chunks(raw, encoding, sep=separator, on_bad_lines="skip")
+        first = next(chunks, None)
     except Exception:
-        df = pd.read_fwf(io.StringIO(text), dtype=str)
-    df.columns = df.columns.astype(str).str.strip()
-    for column in df.columns:
-        df[column] = df[column].astype(str).str.strip().replace({"nan": "", "None": "", "NaN": "", "NAN": ""})
-    return df
+        chunks = iter_txt_chunks(raw, encoding, fwf=True)
+        first = next(chunks, None)
+    if first is None:
+        return
+    yield _clean_txt_frame(first)
+    for chunk in chunks:
+        yield _clean_txt_frame(chunk)
+
+
+def read_txt_smart(uploaded_file: BinaryIO) -> pd.DataFrame:
+    """完整明細（只在下載明細時使用）。"""
+    frames = list(iter_txt_smart(uploaded_file))
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
 
 
 def add_pick_qty_by_sku(df: pd.DataFrame, master_mapping: dict[str, str]):
@@ -215,13 +234,13 @@ def process_dataframe(df: pd.DataFrame, master_mapping: dict[str, str]):
     main_boxtype = main_df["BOXTYPE"].map(normalize_text)
     gcor_boxtype = gcor_df["BOXTYPE"].map(normalize_text)
 
-    main_b0 = main_df.loc[main_boxtype.eq("0"), "單位入數"].map(to_number).dropna().sum()
+    main_b0 = sum_numbers(main_df.loc[main_boxtype.eq("0"), "單位入數"])
     main_b1_count = int(main_boxtype.eq("1").sum())
-    main_b1_qty = main_df.loc[main_boxtype.eq("1"), "packqty"].map(to_number).dropna().sum()
-    gcor_units = gcor_df["單位入數"].map(to_number).dropna().sum()
-    gcor_b0 = gcor_df.loc[gcor_boxtype.eq("0"), "單位入數"].map(to_number).dropna().sum()
+    main_b1_qty = sum_numbers(main_df.loc[main_boxtype.eq("1"), "packqty"])
+    gcor_units = sum_numbers(gcor_df["單位入數"])
+    gcor_b0 = sum_numbers(gcor_df.loc[gcor_boxtype.eq("0"), "單位入數"])
     gcor_b1_count = int(gcor_boxtype.eq("1").sum())
-    gcor_b1_qty = gcor_df.loc[gcor_boxtype.eq("1"), "packqty"].map(to_number).dropna().sum()
+    gcor_b1_qty = sum_numbers(gcor_df.loc[gcor_boxtype.eq("1"), "packqty"])
     final_b0 = main_b0 + gcor_units
 
     stats = {
@@ -240,24 +259,7 @@ def process_dataframe(df: pd.DataFrame, master_mapping: dict[str, str]):
         "gcor_boxtype_1_packqty_sum": gcor_b1_qty,
         "final_boxtype_0_unit_sum": final_b0,
     }
-    summary_rows = [
-        ["統計項目", "數量"],
-        ["主統計 BOXTYPE=0 單位入數加總", main_b0],
-        ["主統計 BOXTYPE=1 筆數", main_b1_count],
-        ["主統計 BOXTYPE=1 packqty加總", main_b1_qty],
-        ["GCOR排除資料 單位入數加總", gcor_units],
-        ["BOXTYPE=0 單位入數加總+GCOR排除資料 單位入數加總", final_b0],
-        ["SKU比對成功筆數", matched],
-        ["SKU比對不到筆數", unmatched],
-    ]
-    gcor_summary_rows = [
-        ["統計項目", "數量"],
-        ["GCOR且packqty>=100資料筆數", len(gcor_df)],
-        ["GCOR排除資料 單位入數加總", gcor_units],
-        ["BOXTYPE=0 單位入數加總", gcor_b0],
-        ["BOXTYPE=1 筆數", gcor_b1_count],
-        ["BOXTYPE=1 packqty 加總數量", gcor_b1_qty],
-    ]
+    summary_rows, gcor_summary_rows = summary_rows_from_stats(stats)
     return (
         df.drop(columns="_是否GCOR排除"),
         gcor_df.drop(columns="_是否GCOR排除"),
@@ -267,44 +269,65 @@ def process_dataframe(df: pd.DataFrame, master_mapping: dict[str, str]):
     )
 
 
-def _append_dataframe(ws, df: pd.DataFrame) -> None:
-    ws.append(list(df.columns))
-    for row in df.itertuples(index=False, name=None):
-        ws.append([clean_illegal_excel_text(value) for value in row])
+def summary_rows_from_stats(stats: dict[str, float]) -> tuple[list[list], list[list]]:
+    summary_rows = [
+        ["統計項目", "數量"],
+        ["主統計 BOXTYPE=0 單位入數加總", stats["main_boxtype_0_unit_sum"]],
+        ["主統計 BOXTYPE=1 筆數", stats["main_boxtype_1_count"]],
+        ["主統計 BOXTYPE=1 packqty加總", stats["main_boxtype_1_packqty_sum"]],
+        ["GCOR排除資料 單位入數加總", stats["gcor_unit_sum"]],
+        ["BOXTYPE=0 單位入數加總+GCOR排除資料 單位入數加總", stats["final_boxtype_0_unit_sum"]],
+        ["SKU比對成功筆數", stats["sku_matched_count"]],
+        ["SKU比對不到筆數", stats["sku_unmatched_count"]],
+    ]
+    gcor_summary_rows = [
+        ["統計項目", "數量"],
+        ["GCOR且packqty>=100資料筆數", stats["gcor_count"]],
+        ["GCOR排除資料 單位入數加總", stats["gcor_unit_sum"]],
+        ["BOXTYPE=0 單位入數加總", stats["gcor_boxtype_0_unit_sum"]],
+        ["BOXTYPE=1 筆數", stats["gcor_boxtype_1_count"]],
+        ["BOXTYPE=1 packqty 加總數量", stats["gcor_boxtype_1_packqty_sum"]],
+    ]
+    return summary_rows, gcor_summary_rows
+
+
+def aggregate_file_streaming(uploaded_file: BinaryIO, master_mapping: dict[str, str]) -> dict[str, float]:
+    """逐塊處理、只累加統計值（所有統計項目都是可加總的筆數／加總），不保留明細。"""
+    total = empty_total_stats()
+    for chunk in iter_txt_smart(uploaded_file):
+        *_, stats = process_dataframe(chunk, master_mapping)
+        for key in total:
+            total[key] += stats[key]
+    return total
+
 
+def build_detail_zip(data_files, master_mapping: dict[str, str], summary_bytes: bytes) -> bytes:
+    """使用者要下載明細時才完整讀檔、產生各檔明細 Excel。"""
+    zip_output = io.BytesIO()
+    with zipfile.ZipFile(zip_output, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("多檔案彙總統計.xlsx", summary_bytes)
+        for uploaded in data_files:
+            df = read_txt_smart(uploaded)
+            output_df, gcor_df, summary, gcor_summary, _ = process_dataframe(df, master_mapping)
+            stem = re.sub(r"\.(txt|csv)$", "", uploaded.name, flags=re.IGNORECASE)
+            archive.writestr(f"{stem}_月出貨量與產力.xlsx", make_detail_excel(output_df, gcor_df, summary, gcor_summary))
+    return zip_output.getvalue()
 
-def _format_workbook(workbook: Workbook) -> None:
-    header_fill = PatternFill("solid", fgColor=GREEN)
-    header_font = Font(color="FFFFFF", bold=True)
-    for ws in workbook.worksheets:
-        ws.freeze_panes = "A2"
-        ws.auto_filter.ref = ws.dimensions
-        for cell in ws[1]:
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal="center")
-        for index, cells in enumerate(ws.columns, start=1):
-            length = max((len(str(cell.value)) for cell in cells if cell.value is not None), default=0)
-            ws.column_dimensions[get_column_letter(index)].width = min(length + 2, 50)
+
+EXPORT_STYLE = SheetStyle(
+    header={"bold": True, "font_color": "#FFFFFF", "bg_color": f"#{GREEN}", "align": "center"},
+    autofilter=True,
+    strip_control_chars=True,
+)
 
 
 def make_detail_excel(df_output, gcor_detail_df, summary_rows, gcor_summary_rows) -> bytes:
-    workbook = Workbook()
-    ws = workbook.active
-    ws.title = "處理後資料"
-    _append_dataframe(ws, df_output)
-    ws = workbook.create_sheet("統計總表")
-    for row in summary_rows:
-        ws.append(row)
-    ws = workbook.create_sheet("GCOR排除統計")
-    for row in gcor_summary_rows:
-        ws.append(row)
-    ws = workbook.create_sheet("GCOR排除資料明細")
-    _append_dataframe(ws, gcor_detail_df)
-    _format_workbook(workbook)
-    output = io.BytesIO()
-    workbook.save(output)
-    return output.getvalue()
+    return write_workbook({
+        "處理後資料": (df_output, EXPORT_STYLE),
+        "統計總表": (rows_to_frame(summary_rows), EXPORT_STYLE),
+        "GCOR排除統計": (rows_to_frame(gcor_summary_rows), EXPORT_STYLE),
+        "GCOR排除資料明細": (gcor_detail_df, EXPORT_STYLE),
+    })
 
 
 def empty_total_stats() -> dict[str, float]:
@@ -331,21 +354,13 @@ def make_batch_summary(batch_rows: list[dict], total: dict[str, float]) -> bytes
         "main_boxtype_1_packqty_sum", "gcor_count", "gcor_unit_sum", "final_boxtype_0_unit_sum",
         "gcor_boxtype_0_unit_sum", "gcor_boxtype_1_count", "gcor_boxtype_1_packqty_sum",
     ]
-    workbook = Workbook()
-    ws = workbook.active
-    ws.title = "各檔案統計"
-    ws.append(headers)
-    for item in batch_rows:
-        ws.append([item[key] for key in keys])
-    ws = workbook.create_sheet("全部檔案總計")
-    ws.append(["統計項目", "數量"])
     labels = dict(zip(keys[1:], headers[1:]))
-    for key in keys[1:]:
-        ws.append([labels[key], total[key]])
-    _format_workbook(workbook)
-    output = io.BytesIO()
-    workbook.save(output)
-    return output.getvalue()
+    per_file = pd.DataFrame([[item[key] for key in keys] for item in batch_rows], columns=headers)
+    grand_total = pd.DataFrame([[labels[key], total[key]] for key in keys[1:]], columns=["統計項目", "數量"])
+    return write_workbook({
+        "各檔案統計": (per_file, EXPORT_STYLE),
+        "全部檔案總計": (grand_total, EXPORT_STYLE),
+    })
 
 
 def _fmt(value) -> str:
@@ -380,17 +395,12 @@ def run_app() -> None:
 
         batch_rows: list[dict] = []
         failed: list[dict] = []
-        detail_files: list[tuple[str, bytes]] = []
         total = empty_total_stats()
         progress = st.progress(0, text="開始處理…")
 
         for index, uploaded in enumerate(data_files, start=1):
             try:
-                df = read_txt_smart(uploaded)
-                output_df, gcor_df, summary, gcor_summary, stats = process_dataframe(df, mapping)
-                stem = re.sub(r"\.(txt|csv)$", "", uploaded.name, flags=re.IGNORECASE)
-                output_name = f"{stem}_月出貨量與產力.xlsx"
-                detail_files.append((output_name, make_detail_excel(output_df, gcor_df, summary, gcor_summary)))
+                stats = aggregate_file_streaming(uploaded, mapping)
                 row = {"file_name": uploaded.name, **stats}
                 batch_rows.append(row)
                 for key in total:
@@ -406,23 +416,19 @@ def run_app() -> None:
             return
 
         summary_bytes = make_batch_summary(batch_rows, total)
-        zip_output = io.BytesIO()
-        with zipfile.ZipFile(zip_output, "w", zipfile.ZIP_DEFLATED) as archive:
-            archive.writestr("多檔案彙總統計.xlsx", summary_bytes)
-            for filename, content in detail_files:
-                archive.writestr(filename, content)
-
-        st.session_state["monthly_shipping_result"] = {
+        session_store.put("monthly_shipping_result", {
             "batch_rows": batch_rows,
             "failed": failed,
             "total": total,
             "summary": summary_bytes,
-            "zip": zip_output.getvalue(),
+            "zip": None,  # 明細 ZIP 等使用者按下才產生
+            "mapping": mapping,
+            "ok_files": [row["file_name"] for row in batch_rows],
             "sheet": sheet_name,
             "mapping_count": len(mapping),
-        }
+        })
 
-    result = st.session_state.get("monthly_shipping_result")
+    result = session_store.get("monthly_shipping_result")
     if not result:
         return
 
@@ -444,7 +450,16 @@ def run_app() -> None:
 
     d1, d2 = st.columns(2)
     d1.download_button("下載彙總統計 Excel", result["summary"], "多檔案彙總統計.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", use_container_width=True)
-    d2.download_button("下載全部結果 ZIP", result["zip"], "月出貨量與產力_全部結果.zip", "application/zip", type="primary", use_container_width=True)
+    if result["zip"] is None:
+        if d2.button("產生各檔明細 ZIP", type="primary", use_container_width=True):
+            ok_names = set(result["ok_files"])
+            ok_files = [f for f in data_files if f.name in ok_names]
+            with st.spinner("產生明細中…（需完整讀取每個檔案）"):
+                result["zip"] = build_detail_zip(ok_files, result["mapping"], result["summary"])
+            session_store.put("monthly_shipping_result", result)   # get() 回傳的是副本，改完要存回
+            st.rerun()
+    else:
+        d2.download_button("下載全部結果 ZIP", result["zip"], "月出貨量與產力_全部結果.zip", "application/zip", type="primary", use_container_width=True)
 
     if result["failed"]:
         with st.expander("查看處理失敗檔案", expanded=True):
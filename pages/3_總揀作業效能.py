@@ -9,6 +9,9 @@ import pandas as pd
 import streamlit as st
 
 from common_ui import inject_logistics_theme, set_page, card_open, card_close
+from excel_export import column_widths, set_openpyxl_widths
+from export_recipe import ExportRecipe, download_button
+import session_store
 
 
 # =========================================================
@@ -424,7 +427,6 @@ def build_export_xlsx_bytes(
 ) -> bytes:
     from openpyxl import Workbook
     from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
-    from openpyxl.utils import get_column_letter
 
     wb = Workbook()
     ws = wb.active
@@ -492,13 +494,7 @@ def build_export_xlsx_bytes(
                 ws.cell(i, j).fill = fill_red
                 ws.cell(i, j).font = font_red
 
-    for cidx in range(1, len(df.columns) + 1):
-        max_len = 10
-        for ridx in range(1, header_row + len(df) + 1):
-            v = ws.cell(ridx, cidx).value
-            if v is not None:
-                max_len = max(max_len, len(str(v)) + 2)
-        ws.column_dimensions[get_column_letter(cidx)].width = min(max_len, 48)
+    set_openpyxl_widths(ws, column_widths(df, min_width=10, max_width=48))
 
     out = io.BytesIO()
     wb.save(out)
@@ -664,9 +660,6 @@ def main():
     run = st.button("🚀 產出報表", type="primary", disabled=not files)
     card_close()
 
-    if "picking_result" not in st.session_state:
-        st.session_state.picking_result = None
-
     if run:
         with st.spinner("計算中，請稍候..."):
             raw_df = _load_uploaded_files(files)
@@ -694,22 +687,27 @@ def main():
             )
 
             final_title = report_title.strip() or "總揀作業效能報表（整天版）"
-            xlsx_bytes = build_export_xlsx_bytes(
-                title=final_title,
-                all_day_df=all_day_stats,
-                low_threshold=float(low_threshold),
-                high_threshold=float(high_threshold),
+            # 只留配方，按下載時才寫 Excel
+            xlsx = ExportRecipe(
+                build_export_xlsx_bytes,
+                kwargs={
+                    "title": final_title,
+                    "all_day_df": all_day_stats,
+                    "low_threshold": float(low_threshold),
+                    "high_threshold": float(high_threshold),
+                },
+                file_name=f"{final_title}.xlsx",
             )
 
-            st.session_state.picking_result = {
+            session_store.put("picking_result", {
                 "report_title": final_title,
                 "all_day_stats": all_day_stats,
-                "xlsx_bytes": xlsx_bytes,
+                "xlsx": xlsx,
                 "low_threshold": float(low_threshold),
                 "high_threshold": float(high_threshold),
-            }
+            })
 
-    result = st.session_state.picking_result
+    result = session_store.get("picking_result")
     if not result:
         st.info("請先上傳檔案並點「產出報表」。")
         return
@@ -726,12 +724,7 @@ def main():
         st.dataframe(_style_kpi_rows(all_day_stats, low_thr, high_thr), use_container_width=True, hide_index=True)
     card_close()
 
-    st.download_button(
-        label="⬇️ 匯出報表（Excel）",
-        data=result["xlsx_bytes"],
-        file_name=f"{result['report_title']}.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-    )
+    download_button("⬇️ 匯出報表（Excel）", result["xlsx"])
 
 
 if __name__ == "__main__":
@@ -17,6 +17,9 @@ import warnings
 import pandas as pd
 import streamlit as st
 
+from excel_export import PLAIN_STYLE, write_workbook
+from export_recipe import ExportRecipe, download_button
+
 warnings.filterwarnings("ignore")
 
 # ---- 套用平台風格（有就用，沒有就退回原生）----
@@ -252,23 +255,28 @@ def render_util_block(title: str, r: dict):
 # =========================
 # 匯出 Excel
 # =========================
-def build_output_excel_bytes(
+def build_output_excel(
     base_name: str,
     df_util: pd.DataFrame,
     df_detail: pd.DataFrame,
     df_shelf: pd.DataFrame,
     df_type: pd.DataFrame,
     df_unknown: pd.DataFrame,
-) -> tuple[str, bytes]:
-    out = io.BytesIO()
-    with pd.ExcelWriter(out, engine="xlsxwriter") as writer:
-        df_util.to_excel(writer, sheet_name="儲位類型使用率", index=False)
-        df_detail.to_excel(writer, sheet_name="明細(含儲位類型)", index=False)
-        df_shelf.to_excel(writer, sheet_name="棚別統計", index=False)
-        df_type.to_excel(writer, sheet_name="儲位類型統計", index=False)
-        df_unknown.to_excel(writer, sheet_name="未知明細", index=False)
-    out.seek(0)
-    return f"{base_name}_4_儲位使用率_輸出.xlsx", out.getvalue()
+) -> ExportRecipe:
+    # 只留配方，按下載時才寫 Excel（明細表很大，不必每次重跑都寫一次）
+    sheets = {
+        "儲位類型使用率": df_util,
+        "明細(含儲位類型)": df_detail,
+        "棚別統計": df_shelf,
+        "儲位類型統計": df_type,
+        "未知明細": df_unknown,
+    }
+    return ExportRecipe(
+        write_workbook,
+        (sheets,),
+        {"default_style": PLAIN_STYLE},
+        file_name=f"{base_name}_4_儲位使用率_輸出.xlsx",
+    )
 
 
 # =========================
@@ -378,7 +386,7 @@ def main():
             df_shelf = pd.DataFrame(columns=["棚別", "筆數"])
 
         base = os.path.splitext(uploaded.name)[0]
-        out_name, out_bytes = build_output_excel_bytes(
+        export = build_output_excel(
             base_name=base,
             df_util=df_util,
             df_detail=df_detail,
@@ -388,11 +396,9 @@ def main():
         )
 
         _spacer(8)
-        st.download_button(
+        download_button(
             "⬇️ 匯出（儲位使用率 Excel）",
-            data=out_bytes,
-            file_name=out_name,
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            export,
             use_container_width=True,
         )
 
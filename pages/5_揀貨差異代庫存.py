@@ -6,9 +6,12 @@ from typing import List, Dict, Tuple
 
 import pandas as pd
 import streamlit as st
-import openpyxl
-from openpyxl.styles import PatternFill, Font
 
+from arrow_strings import as_text
+from excel_export import ConditionalRule, SheetStyle, SuffixEmphasis, write_workbook
+from export_recipe import ExportRecipe, download_button
+from master_data import LocationMaster, location_master_uploader
+from upload_cache import cached_parse
 from common_ui import (
     inject_logistics_theme,
     set_page,
@@ -16,16 +19,6 @@ from common_ui import (
     card_close,
 )
 
-# =========================
-# 嘗試啟用 Rich Text（若版本不支援，走 fallback）
-# =========================
-RICH_OK = True
-try:
-    from openpyxl.cell.rich_text import CellRichText, TextBlock  # type: ignore
-    from openpyxl.cell.text import InlineFont  # type: ignore
-except Exception:
-    RICH_OK = False
-
 
 # =========================
 # 通用讀檔：xlsx/xls/html假xls/csv/tsv
@@ -40,6 +33,15 @@ def sniff_file_type_bytes(b: bytes) -> str:
 
 
 def read_table_any_bytes(file_bytes: bytes, filename: str) -> pd.DataFrame:
+    # 同一份檔案（內容 hash 相同）直接取快取的解析結果
+    return cached_parse(
+        file_bytes,
+        lambda b: _parse_table_any_bytes(b, filename),
+        reader="table_any",
+    )
+
+
+def _parse_table_any_bytes(file_bytes: bytes, filename: str) -> pd.DataFrame:
     ftype = sniff_file_type_bytes(file_bytes)
 
     if ftype == "xlsx":
@@ -76,40 +78,20 @@ def read_table_any_bytes(file_bytes: bytes, filename: str) -> pd.DataFrame:
 # =========================
 # 儲位明細：自動抓欄位 + 建立 儲位 -> 棚別 對照
 # =========================
-def detect_col(df: pd.DataFrame, candidates: List[str]) -> str | None:
-    cols = [str(c).strip() for c in df.columns]
-    for cand in candidates:
-        if cand in cols:
-            return cand
-    # 放寬：包含關鍵字
-    for cand in candidates:
-        for c in cols:
-            if cand in c:
-                return c
-    return None
-
-
-def build_loc_to_shelf(slot_df: pd.DataFrame) -> Dict[str, str]:
-    slot_df = slot_df.copy()
-    slot_df.columns = slot_df.columns.astype(str).str.strip()
-
-    loc_col = detect_col(slot_df, ["儲位", "儲位編號", "Location", "LOC", "Loc"])
-    shelf_col = detect_col(slot_df, ["棚別", "棚架", "Shelf", "SHELF"])
+def build_loc_to_shelf(master: LocationMaster) -> pd.Series:
+    """儲位主檔 → 儲位:棚別 索引（登錄表共用，同一份主檔只建一次）"""
+    loc_col = master.column(["儲位", "儲位編號", "Location", "LOC", "Loc"], fuzzy=True)
+    shelf_col = master.column(["棚別", "棚架", "Shelf", "SHELF"], fuzzy=True)
 
     if not loc_col or not shelf_col:
         raise ValueError(
             "❌ 儲位明細抓不到必要欄位。\n"
             f"找到儲位欄：{loc_col}\n"
             f"找到棚別欄：{shelf_col}\n"
-            f"目前欄位：{slot_df.columns.tolist()}"
+            f"目前欄位：{master.frame.columns.tolist()}"
         )
 
-    tmp = slot_df[[loc_col, shelf_col]].copy()
-    tmp[loc_col] = tmp[loc_col].astype(str).str.strip()
-    tmp[shelf_col] = tmp[shelf_col].astype(str).str.strip()
-    tmp = tmp[(tmp[loc_col] != "") & (tmp[loc_col].str.lower() != "nan")]
-
-    return dict(zip(tmp[loc_col], tmp[shelf_col]))
+    return master.index(shelf_col, loc_col=loc_col, keep="last")
 
 
 # =========================
@@ -244,7 +226,7 @@ def process_one_short(
 # =========================
 # 組合欄位：統一最大對數、插入棚別欄、固定欄位順序
 # =========================
-def normalize_and_add_shelf(df: pd.DataFrame, max_pairs: int, loc_to_shelf: Dict[str, str]) -> pd.DataFrame:
+def normalize_and_add_shelf(df: pd.DataFrame, max_pairs: int, loc_to_shelf: pd.Series) -> pd.DataFrame:
     df = df.copy()
     for i in range(1, max_pairs + 1):
         if f"儲位{i}" not in df.columns:
@@ -274,27 +256,6 @@ def normalize_and_add_shelf(df: pd.DataFrame, max_pairs: int, loc_to_shelf: Dict
 # =========================
 # Excel 輔助
 # =========================
-def write_headers(ws, columns: List[str]):
-    for c, name in enumerate(columns, start=1):
-        ws.cell(row=1, column=c, value=name)
-
-
-def write_df_rows(ws, df: pd.DataFrame, start_row: int) -> int:
-    end_row = start_row - 1
-    for r_i, row in enumerate(df.itertuples(index=False), start=start_row):
-        for c_i, val in enumerate(row, start=1):
-            ws.cell(row=r_i, column=c_i, value=val)
-        end_row = r_i
-    return end_row
-
-
-def find_col_index(ws, header_name: str) -> int | None:
-    for c in range(1, ws.max_column + 1):
-        if ws.cell(row=1, column=c).value == header_name:
-            return c
-    return None
-
-
 def normalize_barcode_value(v) -> str:
     """把可能是數字/浮點/科學記號的條碼安全轉成字串，並盡量補 13 碼"""
     if v is None:
@@ -309,126 +270,80 @@ def normalize_barcode_value(v) -> str:
     return s
 
 
-def apply_barcode_last5_big_all(ws, barcode_col: int, start_row: int = 2) -> bool:
-    """
-    全欄套用：國際條碼同一格後五碼放大（RichText）。
-    True=成功；False=不支援或失敗。
-    """
-    if not RICH_OK:
-        return False
-
-    normal_f = InlineFont(sz=11)  # type: ignore
-    big_f = InlineFont(sz=16, b=True)  # type: ignore
-
-    try:
-        for r in range(start_row, ws.max_row + 1):
-            ws.cell(row=r, column=barcode_col).number_format = "@"
-
-        for r in range(start_row, ws.max_row + 1):
-            cell = ws.cell(row=r, column=barcode_col)
-            s = normalize_barcode_value(cell.value)
-            if not s:
-                continue
+def normalize_barcodes(s: pd.Series) -> pd.Series:
+    """normalize_barcode_value 的整欄版本（匯出用）"""
+    t = as_text(s)
+    t = t.mask(t.str.lower().eq("nan"), "")
+    t = t.str.replace(r"\.0$", "", regex=True)
+    short = t.str.isdigit() & t.str.len().lt(13)
+    return t.mask(short, t.str.zfill(13))
 
-            last5 = s[-5:] if len(s) >= 5 else s
-            prefix = s[:-5] if len(s) >= 5 else ""
 
-            rich = CellRichText()  # type: ignore
-            if prefix:
-                rich.append(TextBlock(normal_f, prefix))  # type: ignore
-            rich.append(TextBlock(big_f, last5))  # type: ignore
-            cell.value = rich
-
-        return True
-    except Exception:
-        return False
+BARCODE_EMPHASIS = SuffixEmphasis(5, big={"bold": True, "font_size": 16}, normalize=normalize_barcodes)
 
 
-def add_barcode_last5_column_fallback(ws, barcode_col: int):
-    """
-    若 RichText 不支援：新增『國際條碼_後五碼』欄並整格放大。
-    """
-    insert_pos = barcode_col + 1
-    ws.insert_cols(insert_pos)
-    ws.cell(row=1, column=insert_pos, value="國際條碼_後五碼")
-
-    big_font = Font(size=16, bold=True)
-    for r in range(2, ws.max_row + 1):
-        s = normalize_barcode_value(ws.cell(row=r, column=barcode_col).value)
-        last5 = s[-5:] if len(s) >= 5 else s
-        c = ws.cell(row=r, column=insert_pos, value=last5)
-        c.font = big_font
-
-
-def build_export_xlsx_bytes(dfs2: List[pd.DataFrame], output_sheet_name: str = "結果") -> Tuple[bytes, str]:
+def _stack_blocks(dfs2: List[pd.DataFrame]) -> Tuple[pd.DataFrame, List[Dict[str, int]]]:
+    """多檔依欄位位置接續（表頭用第一份），回傳合併表與各區塊的資料列範圍"""
+    columns = list(dfs2[0].columns)
+    frames, blocks = [], []
+    start = 0
+    for idx, df in enumerate(dfs2, start=1):
+        df = df.iloc[:, :len(columns)].set_axis(columns[:min(df.shape[1], len(columns))], axis=1)
+        frames.append(df)
+        blocks.append({"idx": idx, "start": start, "end": start + len(df) - 1})
+        start += len(df)
+    return pd.concat(frames, ignore_index=True), blocks
+
+
+def build_export_recipe(
+    dfs2: List[pd.DataFrame],
+    output_sheet_name: str = "結果",
+    file_name: str = "報表.xlsx",
+) -> Tuple[ExportRecipe, str]:
     """
+    匯出配方（欄位檢查當下做；Excel 等按下載時才寫）
     - 單一工作表
     - 多檔接續貼上（不留空白行）
-    - 綠底：效期2/效期3… == 主效期
+    - 綠底：效期2/效期3… == 主效期（條件格式）
     - 黃底：第二份少揀檔區塊只黃國際條碼欄
-    - 國際條碼後五碼放大（RichText 或 fallback 欄）
+    - 國際條碼後五碼放大（RichText；列數超過門檻改為後五碼輔助欄）
     """
     if not dfs2:
         raise ValueError("❌ 沒有可輸出的資料")
 
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = output_sheet_name
-
-    columns = list(dfs2[0].columns)
-    write_headers(ws, columns)
-
-    blocks = []
-    cur_row = 2
-    for idx, df in enumerate(dfs2, start=1):
-        start = cur_row
-        end = write_df_rows(ws, df, start_row=start)
-        blocks.append({"idx": idx, "start": start, "end": end})
-        cur_row = end + 1
-
-    green_fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
-    yellow_fill = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
-
-    main_exp_col = find_col_index(ws, "效期")
-    barcode_col = find_col_index(ws, "國際條碼")
-    if main_exp_col is None:
+    df, blocks = _stack_blocks(dfs2)
+    if "效期" not in df.columns:
         raise ValueError("❌ 找不到主欄位『效期』，請確認輸出表頭")
-    if barcode_col is None:
+    if "國際條碼" not in df.columns:
         raise ValueError("❌ 找不到欄位『國際條碼』，請確認輸出表頭")
 
-    exp_cols = []
-    for c in range(1, ws.max_column + 1):
-        header = ws.cell(row=1, column=c).value
-        if isinstance(header, str) and header.startswith("效期") and header != "效期":
-            exp_cols.append(c)
-
-    # 標色：效期一致 -> 綠底（欄位：效期2/效期3...）
-    for r in range(2, ws.max_row + 1):
-        ref = ws.cell(row=r, column=main_exp_col).value
-        if ref in (None, "", "nan"):
-            continue
-        for c in exp_cols:
-            if ws.cell(row=r, column=c).value == ref:
-                ws.cell(row=r, column=c).fill = green_fill
-
-    # 全欄後五碼放大
-    used_rich = apply_barcode_last5_big_all(ws, barcode_col, start_row=2)
-    if not used_rich:
-        add_barcode_last5_column_fallback(ws, barcode_col)
-
-    # 第二份：只黃國際條碼欄
+    exp_cols = tuple(c for c in df.columns if isinstance(c, str) and c.startswith("效期") and c != "效期")
+    rules = [
+        ConditionalRule(exp_cols, {
+            "type": "formula",
+            "criteria": '=AND(${效期}{row}<>"",{col}{row}=${效期}{row})',
+            "format": {"bg_color": "#C6EFCE"},
+        }),
+    ]
     block2 = next((b for b in blocks if b["idx"] == 2), None)
-    if block2:
-        # 若 fallback 插入了新欄，barcode_col 位置仍是原本的國際條碼欄（沒變）
-        for r in range(block2["start"], block2["end"] + 1):
-            ws.cell(row=r, column=barcode_col).fill = yellow_fill
-
-    out = io.BytesIO()
-    wb.save(out)
-    wb.close()
-
-    note = "RichText" if used_rich else "Fallback(新增後五碼欄)"
-    return out.getvalue(), note
+    if block2 and block2["end"] >= block2["start"]:
+        rules.append(ConditionalRule(
+            ("國際條碼",),
+            {"type": "formula", "criteria": "=TRUE", "format": {"bg_color": "#FFFF00"}},
+            first_row=block2["start"],
+            last_row=block2["end"],
+        ))
+
+    style = SheetStyle(
+        header=None,
+        widths=None,
+        freeze=None,
+        column_formats={"國際條碼": {"num_format": "@"}},
+        conditional=tuple(rules),
+        suffix_emphasis={"國際條碼": BARCODE_EMPHASIS},
+    )
+    mode = "RichText" if BARCODE_EMPHASIS.use_rich(len(df)) else f"後五碼輔助欄（超過 {BARCODE_EMPHASIS.max_rich_rows:,} 列）"
+    return ExportRecipe(write_workbook, ({output_sheet_name: (df, style)},), file_name=file_name), mode
 
 
 # =========================
@@ -454,13 +369,14 @@ def main():
         type=["xlsx", "xls", "xlsm", "csv", "txt"],
         accept_multiple_files=False,
     )
-    slot_file = st.file_uploader(
+    slot_master = location_master_uploader(
         "儲位明細（含棚別）",
-        type=["xlsx", "xls", "xlsm", "csv", "txt"],
-        accept_multiple_files=False,
+        key="pickdiff_slot_master",
+        requires=(["儲位", "儲位編號", "Location", "LOC", "Loc"], ["棚別", "棚架", "Shelf", "SHELF"]),
+        fuzzy=True,
     )
 
-    run = st.button("🚀 產出分析", type="primary", disabled=(not short_files or not common_file or not slot_file))
+    run = st.button("🚀 產出分析", type="primary", disabled=(not short_files or not common_file or slot_master is None))
     card_close()
 
     if not run:
@@ -482,8 +398,7 @@ def main():
                 )
 
             # 儲位明細 -> 儲位:棚別 map
-            slot_df = read_table_any_bytes(slot_file.getvalue(), slot_file.name)
-            loc_to_shelf = build_loc_to_shelf(slot_df)
+            loc_to_shelf = build_loc_to_shelf(slot_master)
 
             # 每份少揀檔各自算出 df（不合併計算）
             dfs = []
@@ -510,20 +425,19 @@ def main():
             # 合併預覽（畫面用）
             preview_df = pd.concat(dfs2, ignore_index=True)
 
-            # 匯出 bytes
-            xlsx_bytes, mode_note = build_export_xlsx_bytes(dfs2, output_sheet_name="結果")
+            # 匯出配方
+            export, mode_note = build_export_recipe(
+                dfs2,
+                output_sheet_name="結果",
+                file_name="揀貨差異_多檔接續輸出_含棚別_後五碼放大.xlsx",
+            )
 
         card_open("🧾 結果預覽")
         st.caption(f"匯出處理：國際條碼後五碼放大模式 = {mode_note}")
         st.dataframe(preview_df.head(int(show_preview_rows)), use_container_width=True, hide_index=True)
         card_close()
 
-        st.download_button(
-            "⬇️ 匯出報表（Excel）",
-            data=xlsx_bytes,
-            file_name="揀貨差異_多檔接續輸出_含棚別_後五碼放大.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        )
+        download_button("⬇️ 匯出報表（Excel）", export)
 
     except Exception as e:
         st.error("❌ 執行失敗")
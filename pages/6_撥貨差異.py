@@ -4,7 +4,10 @@ import os
 import pandas as pd
 import streamlit as st
 
+from arrow_strings import TEXT_DTYPE, as_text, text_frame
 from common_ui import inject_logistics_theme, set_page, card_open, card_close
+from export_recipe import ExportRecipe, download_button
+from master_data import SOURCE_COL, LocationMaster, location_master_uploader, norm_loc
 
 
 st.set_page_config(page_title="大豐物流 - 撥貨差異", page_icon="🔁", layout="wide")
@@ -24,11 +27,11 @@ def _read_source_with_lookup_from_bytes(data: bytes):
         xls = pd.ExcelFile(bio, engine="openpyxl")
         sheets = xls.sheet_names
         main_sheet = "儲位明細" if "儲位明細" in sheets else sheets[0]
-        main_df = pd.read_excel(xls, sheet_name=main_sheet, dtype=str).dropna(how="all").copy()
+        main_df = pd.read_excel(xls, sheet_name=main_sheet, dtype=TEXT_DTYPE).dropna(how="all").copy()
 
         lookup_df = None
         if "儲位" in sheets:
-            lookup_df = pd.read_excel(xls, sheet_name="儲位", dtype=str).dropna(how="all").copy()
+            lookup_df = pd.read_excel(xls, sheet_name="儲位", dtype=TEXT_DTYPE).dropna(how="all").copy()
 
         return main_df, lookup_df
 
@@ -38,11 +41,11 @@ def _read_source_with_lookup_from_bytes(data: bytes):
         xls = pd.ExcelFile(bio, engine="xlrd")
         sheets = xls.sheet_names
         main_sheet = "儲位明細" if "儲位明細" in sheets else sheets[0]
-        main_df = pd.read_excel(xls, sheet_name=main_sheet, dtype=str).dropna(how="all").copy()
+        main_df = pd.read_excel(xls, sheet_name=main_sheet, dtype=TEXT_DTYPE).dropna(how="all").copy()
 
         lookup_df = None
         if "儲位" in sheets:
-            lookup_df = pd.read_excel(xls, sheet_name="儲位", dtype=str).dropna(how="all").copy()
+            lookup_df = pd.read_excel(xls, sheet_name="儲位", dtype=TEXT_DTYPE).dropna(how="all").copy()
 
         return main_df, lookup_df
 
@@ -52,7 +55,7 @@ def _read_source_with_lookup_from_bytes(data: bytes):
         tables = pd.read_html(io.BytesIO(data), encoding="utf-8", keep_default_na=False)
         if not tables:
             raise ValueError("HTML 內沒有表格可讀取")
-        return tables[0].dropna(how="all").copy(), None
+        return text_frame(tables[0].dropna(how="all").copy()), None
 
     # TSV/CSV（假 xls 常見）
     sample = head.decode("utf-8", errors="ignore")
@@ -64,14 +67,14 @@ def _read_source_with_lookup_from_bytes(data: bytes):
             txt = data.decode(enc, errors="strict")
             df = pd.read_csv(
                 io.StringIO(txt), sep=sep, engine="python",
-                dtype=str, keep_default_na=False
+                dtype=TEXT_DTYPE, keep_default_na=False
             ).dropna(how="all").copy()
 
             if df.shape[1] <= 1:
                 alt_sep = "," if sep == "\t" else "\t"
                 df2 = pd.read_csv(
                     io.StringIO(txt), sep=alt_sep, engine="python",
-                    dtype=str, keep_default_na=False
+                    dtype=TEXT_DTYPE, keep_default_na=False
                 ).dropna(how="all").copy()
                 if df2.shape[1] > df.shape[1]:
                     df = df2
@@ -84,56 +87,6 @@ def _read_source_with_lookup_from_bytes(data: bytes):
     raise ValueError(f"無法讀取來源檔。最後錯誤：{last_err}")
 
 
-def _read_any_table_from_bytes(data: bytes) -> pd.DataFrame:
-    """主檔：讀第一張表（支援 xlsx/xls/html/text）"""
-    head = data[:4096]
-
-    if head.startswith(b"PK\x03\x04"):
-        bio = io.BytesIO(data)
-        xls = pd.ExcelFile(bio, engine="openpyxl")
-        return pd.read_excel(xls, sheet_name=xls.sheet_names[0], dtype=str).dropna(how="all").copy()
-
-    if head.startswith(b"\xD0\xCF\x11\xe0\xa1\xb1\x1a\xe1"):
-        bio = io.BytesIO(data)
-        xls = pd.ExcelFile(bio, engine="xlrd")
-        return pd.read_excel(xls, sheet_name=xls.sheet_names[0], dtype=str).dropna(how="all").copy()
-
-    head_text = head.decode("utf-8", errors="ignore").lower()
-    if "<html" in head_text or "<table" in head_text:
-        tables = pd.read_html(io.BytesIO(data), encoding="utf-8", keep_default_na=False)
-        if not tables:
-            raise ValueError("HTML 內沒有表格可讀取")
-        return tables[0].dropna(how="all").copy()
-
-    sample = head.decode("utf-8", errors="ignore")
-    sep = "\t" if sample.count("\t") >= sample.count(",") else ","
-
-    last_err = None
-    for enc in ("utf-8-sig", "cp950", "big5", "utf-8", "latin1"):
-        try:
-            txt = data.decode(enc, errors="strict")
-            df = pd.read_csv(
-                io.StringIO(txt), sep=sep, engine="python",
-                dtype=str, keep_default_na=False
-            ).dropna(how="all").copy()
-
-            if df.shape[1] <= 1:
-                alt_sep = "," if sep == "\t" else "\t"
-                df2 = pd.read_csv(
-                    io.StringIO(txt), sep=alt_sep, engine="python",
-                    dtype=str, keep_default_na=False
-                ).dropna(how="all").copy()
-                if df2.shape[1] > df.shape[1]:
-                    df = df2
-
-            return df
-        except Exception as e:
-            last_err = e
-            continue
-
-    raise ValueError(f"無法讀取主檔。最後錯誤：{last_err}")
-
-
 # =========================
 # 工具（沿用你原本邏輯）
 # =========================
@@ -142,7 +95,7 @@ def to_num(s: pd.Series) -> pd.Series:
 
 
 def is_zero_like(series: pd.Series) -> pd.Series:
-    s_str = series.astype(str).str.strip()
+    s_str = as_text(series, fill=None)
     s_num = to_num(series)
     return (s_str == "0") | (s_num == 0)
 
@@ -162,12 +115,6 @@ def must_col_ci(df: pd.DataFrame, target: str):
     return c
 
 
-def norm_loc(x) -> str:
-    if pd.isna(x):
-        return ""
-    return str(x).strip()[:9]
-
-
 def reorder_final_cols(df: pd.DataFrame) -> pd.DataFrame:
     cols = ["SONO", "差異量", "儲位", "國際條碼", "商品名稱", "棚別", "商品號", "來源檔名"]
     for c in cols:
@@ -198,29 +145,29 @@ def step3_apply_macro2_logic_keep_sono(df_detail: pd.DataFrame, lookup_df: pd.Da
     colH = base.columns[7]     # 差異量
     colP = base.columns[15]    # 儲位
 
-    base[colF] = base[colF].astype(str).str.strip().str[:13]
-    base[colP] = base[colP].astype(str).str.strip().str[:9]
+    base[colF] = as_text(base[colF], fill=None).str[:13]
+    base[colP] = as_text(base[colP], fill=None).str[:9]
 
     mask_keep = ~is_zero_like(base[colH])
     base = base.loc[mask_keep].copy()
     sono_series = sono_series.loc[base.index]
 
-    shelf = pd.Series([""] * len(base), index=base.index, dtype=object)
+    shelf = pd.Series("", index=base.index, dtype=TEXT_DTYPE)
     if lookup_df is not None and lookup_df.shape[1] >= 2:
         k = lookup_df.columns[0]
         v = lookup_df.columns[1]
         mapping = dict(
             zip(
-                lookup_df[k].astype(str).str.strip().map(norm_loc),
-                lookup_df[v].astype(str).str.strip()
+                as_text(lookup_df[k], fill=None).map(norm_loc),
+                as_text(lookup_df[v], fill=None)
             )
         )
         shelf = base[colP].map(norm_loc).map(mapping).fillna("")
 
     out = pd.DataFrame({
-        "SONO": sono_series.astype(str),
-        "儲位": base[colP].astype(str).str.strip(),
-        "棚別": shelf.astype(str),
+        "SONO": as_text(sono_series, fill=None, strip=False),
+        "儲位": as_text(base[colP], fill=None),
+        "棚別": as_text(shelf, fill=None, strip=False),
         "商品號": base[colE],
         "國際條碼": base[colF],
         "商品名稱": base[colG],
@@ -230,23 +177,23 @@ def step3_apply_macro2_logic_keep_sono(df_detail: pd.DataFrame, lookup_df: pd.Da
     return out
 
 
-def build_master_loc_shelf_map(df_master: pd.DataFrame) -> dict:
+def build_master_loc_shelf_map(master: LocationMaster) -> pd.Series:
+    """主檔 → 儲位(前 9 碼):棚別 索引（登錄表共用，同一份主檔只建一次）"""
+    df_master = master.frame
     c_loc = find_col_ci(df_master, "儲位")
     c_shelf = find_col_ci(df_master, "棚別")
 
     if c_loc is None or c_shelf is None:
-        if df_master.shape[1] < 2:
+        # 主檔一定會多一欄「來源檔案」（上傳時補上的檔名），不算原始欄位
+        columns = [c for c in df_master.columns if c != SOURCE_COL]
+        if len(columns) < 2:
             raise ValueError("主檔欄位不足，至少要兩欄（儲位、棚別）")
-        c_loc = df_master.columns[0]
-        c_shelf = df_master.columns[1]
+        c_loc, c_shelf = columns[0], columns[1]
 
-    loc = df_master[c_loc].map(norm_loc)
-    shelf = df_master[c_shelf].astype(str).str.strip()
-    m = (loc != "")
-    return dict(zip(loc[m], shelf[m]))
+    return master.index(c_shelf, loc_col=c_loc, key="loc9", keep="last")
 
 
-def step4_overwrite_shelf(df_macro2: pd.DataFrame, master_map: dict) -> tuple[pd.DataFrame, pd.DataFrame]:
+def step4_overwrite_shelf(df_macro2: pd.DataFrame, master_map: pd.Series) -> tuple[pd.DataFrame, pd.DataFrame]:
     df = df_macro2.copy()
     key = df["儲位"].map(norm_loc)
     shelf_master = key.map(master_map)
@@ -256,6 +203,21 @@ def step4_overwrite_shelf(df_macro2: pd.DataFrame, master_map: dict) -> tuple[pd
     return df, not_found
 
 
+def build_output_excel_bytes(out_or: pd.DataFrame, out_final: pd.DataFrame, out_notfound: pd.DataFrame) -> bytes:
+    bio = io.BytesIO()
+    with pd.ExcelWriter(bio, engine="openpyxl") as writer:
+        (out_or if not out_or.empty else pd.DataFrame({"msg": ["無資料"]})).to_excel(
+            writer, index=False, sheet_name="1_篩選明細_OR"
+        )
+        (out_final if not out_final.empty else pd.DataFrame({"msg": ["無資料"]})).to_excel(
+            writer, index=False, sheet_name="差異明細"
+        )
+        (out_notfound if not out_notfound.empty else pd.DataFrame({"msg": ["無資料"]})).to_excel(
+            writer, index=False, sheet_name="3_主檔找不到儲位"
+        )
+    return bio.getvalue()
+
+
 def main():
     set_page("撥貨差異（棚別比對）", icon="🔁", subtitle="多來源檔 OR 篩選 → 第二巨集邏輯 → 主檔棚別覆蓋 → 匯出下載")
 
@@ -269,20 +231,18 @@ def main():
     )
 
     st.write("② 上傳主檔（儲位→棚別）")
-    master_file = st.file_uploader(
+    master = location_master_uploader(
         "主檔（單檔）",
-        type=["xlsx", "xls", "csv", "tsv", "txt", "htm", "html"],
-        accept_multiple_files=False,
+        key="transfer_diff_master",
         label_visibility="collapsed",
     )
 
-    run = st.button("🚀 開始分析並產出 Excel", use_container_width=True, disabled=not (src_files and master_file))
+    run = st.button("🚀 開始分析並產出 Excel", use_container_width=True, disabled=not src_files or master is None)
 
     if run:
         try:
-            with st.spinner("讀取主檔中..."):
-                df_master = _read_any_table_from_bytes(master_file.getvalue())
-                master_map = build_master_loc_shelf_map(df_master)
+            with st.spinner("建立主檔索引中..."):
+                master_map = build_master_loc_shelf_map(master)
 
             all_or, all_final, all_notfound = [], [], []
             prog = st.progress(0)
@@ -319,27 +279,10 @@ def main():
 
             out_name = os.path.splitext(src_files[0].name)[0] + "_多檔_棚別覆蓋.xlsx"
 
-            bio = io.BytesIO()
-            with pd.ExcelWriter(bio, engine="openpyxl") as writer:
-                (out_or if not out_or.empty else pd.DataFrame({"msg": ["無資料"]})).to_excel(
-                    writer, index=False, sheet_name="1_篩選明細_OR"
-                )
-                (out_final if not out_final.empty else pd.DataFrame({"msg": ["無資料"]})).to_excel(
-                    writer, index=False, sheet_name="差異明細"
-                )
-                (out_notfound if not out_notfound.empty else pd.DataFrame({"msg": ["無資料"]})).to_excel(
-                    writer, index=False, sheet_name="3_主檔找不到儲位"
-                )
-
-            bio.seek(0)
+            # 只留配方，按下載時才寫 Excel
+            export = ExportRecipe(build_output_excel_bytes, (out_or, out_final, out_notfound), file_name=out_name)
             st.success("✅ 已完成！請下載結果檔。")
-            st.download_button(
-                "⬇️ 下載輸出 Excel",
-                data=bio,
-                file_name=out_name,
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                use_container_width=True,
-            )
+            download_button("⬇️ 下載輸出 Excel", export, use_container_width=True)
 
         except Exception as e:
             st.error(f"❌ 執行失敗：{e}")
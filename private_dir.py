@@ -0,0 +1,38 @@
+"""
+本機暫存目錄（只限本使用者）
+- 快取 / 溢出檔會被 pickle.load 讀回：目錄若可被別人寫入，等於讓別人在 app 裡執行程式碼
+- 預設放在系統暫存目錄下、名稱帶使用者名稱，不同使用者各用各的
+- 建立時權限 0o700；已存在的目錄要是自己擁有的真目錄（不可是符號連結），其他人可讀寫的權限會收回
+- 檢查不過丟 PermissionError（OSError），呼叫端照「磁碟不可用」處理
+"""
+
+from __future__ import annotations
+
+import getpass
+import os
+import stat
+import tempfile
+from pathlib import Path
+
+
+def default_dir(name: str) -> Path:
+    """系統暫存目錄下、本使用者專用的子目錄名稱（只組路徑，不建立）"""
+    try:
+        user = getpass.getuser()
+    except Exception:
+        user = str(os.getuid()) if hasattr(os, "getuid") else "user"
+    return Path(tempfile.gettempdir()) / f"{name}_{user}"
+
+
+def private_dir(path: Path) -> Path:
+    """確保 path 是本使用者專用目錄（不存在就以 0o700 建立）；不安全時丟 PermissionError"""
+    path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        raise PermissionError(f"暫存路徑不是目錄（或是符號連結）：{path}")
+    if hasattr(os, "getuid"):
+        if info.st_uid != os.getuid():
+            raise PermissionError(f"暫存目錄不屬於目前使用者：{path}")
+        if info.st_mode & 0o077:
+            os.chmod(path, 0o700)
+    return path
@@ -18,13 +18,19 @@ from __future__ import annotations
 import os
 import numpy as np
 import pandas as pd
-import tempfile
 import io
 from datetime import datetime, time
 from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
 from openpyxl.formatting.rule import FormulaRule
 from openpyxl.utils import get_column_letter
 
+from arrow_strings import as_text
+from excel_export import iter_shards
+from export_recipe import ExportRecipe
+from report_schema import find_column
+from result_cache import cached_call
+from upload_buffer import byte_stream
+
 # ===== 可調參數 =====
 THRESHOLD_MIN = 10  # 空窗門檻（分鐘）
 USER_COLS = ["記錄輸入人","建立人員","建立者","輸入人","建立者姓名","操作人員","建立人"]
@@ -54,15 +60,6 @@ def map_name_from_id(x: str) -> str:
     return ID_TO_NAME.get(s.lstrip("0"), "")
 
 # ---------- 小工具 ----------
-def pick_col(cols, candidates):
-    cols_norm = [str(c).strip() for c in cols]
-    for cand in candidates:
-        if cand in cols_norm: return cand
-    for cand in candidates:
-        for c in cols_norm:
-            if cand in c: return c
-    return None
-
 def to_dt(series: pd.Series) -> pd.Series:
     if pd.api.types.is_datetime64_any_dtype(series):
         return pd.to_datetime(series, errors="coerce")
@@ -79,18 +76,24 @@ def to_dt(series: pd.Series) -> pd.Series:
         return pd.NaT
     return series.apply(parse_one)
 
-def read_any(path: str) -> dict:
-    ext = os.path.splitext(path)[1].lower()
+def read_any(src, ext: str | None = None) -> dict:
+    """src 可為檔案路徑，或上傳內容 bytes（直接從記憶體讀，不另寫暫存檔）"""
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        ext = (ext or ".xlsx").lower()
+        open_src = lambda: byte_stream(src)
+    else:
+        ext = os.path.splitext(src)[1].lower()
+        open_src = lambda: src
     if ext in [".xlsx",".xlsm",".xltx",".xltm"]:
-        return pd.read_excel(path, sheet_name=None, engine="openpyxl")
+        return pd.read_excel(open_src(), sheet_name=None, engine="openpyxl")
     if ext == ".xls":   # 老 .xls 需 xlrd，可能會有 OLE2 警告，不影響輸出 .xlsx
-        return pd.read_excel(path, sheet_name=None)
+        return pd.read_excel(open_src(), sheet_name=None)
     if ext in [".csv",".txt"]:
-        return {"CSV": pd.read_csv(path, encoding="utf-8", low_memory=False)}
+        return {"CSV": pd.read_csv(open_src(), encoding="utf-8", low_memory=False)}
     try:
-        return pd.read_excel(path, sheet_name=None, engine="openpyxl")
+        return pd.read_excel(open_src(), sheet_name=None, engine="openpyxl")
     except Exception:
-        return {"CSV": pd.read_csv(path, encoding="utf-8", low_memory=False)}
+        return {"CSV": pd.read_csv(open_src(), encoding="utf-8", low_memory=False)}
 
 # ---------- 計算「排除時間區間」的分鐘數（用在總分鐘） ----------
 def calc_exclude_minutes_for_range(date_obj, user_id, first_ts, last_ts, skip_rules):
@@ -158,7 +161,7 @@ def annotate_idle(qc_df: pd.DataFrame, user_col: str, time_col: str, skip_rules=
         if col not in merged.columns: merged[col] = pd.NA
 
     tmp = merged[[user_col, time_col]].copy()
-    tmp["_user"] = tmp[user_col].astype(str).str.strip()
+    tmp["_user"] = as_text(tmp[user_col], fill=None)
     tmp["_dt"] = to_dt(tmp[time_col])
     tmp = tmp.loc[tmp["_dt"].notna()].copy()
     tmp.sort_values(by=["_user","_dt"], inplace=True)
@@ -297,13 +300,87 @@ def calc_rest_minutes_for_pm(first_ts: pd.Timestamp, last_ts: pd.Timestamp) -> i
     if _ge(f,_t(13,29)) and _le(l,_t(20,40)): return 45
     return 0
 
+# ---------- 依「實際重疊」重算休息 / 排除分鐘（向量化） ----------
+# skip_rules 帶 category（休息 / 登入空窗 / 空窗）時，只扣工作區間與各時段實際重疊的分鐘
+# 例如 09:30-11:00 只扣 10:00-10:15；09:00-09:56 不扣
+OVERLAP_CATEGORIES = ("休息", "登入空窗", "空窗")
+OVERLAP_USER_COLS = ("記錄輸入人", "資料輸入人", "輸入人", "姓名")
+OVERLAP_REQUIRED = {"第一筆修訂日期", "最後一筆修訂日期", "休息分鐘", "總分鐘", "總工時", "效率"}
+
+def _clock(t: time) -> pd.Timedelta:
+    return pd.Timedelta(hours=t.hour, minutes=t.minute, seconds=t.second)
+
+def _overlap_minutes(first: pd.Series, last: pd.Series, t_start: time, t_end: time) -> pd.Series:
+    """每列 [first, last] 與當日 [t_start, t_end] 的重疊分鐘（不重疊為 0）"""
+    day = first.dt.normalize()
+    win_start = day + _clock(t_start)
+    win_end = day + _clock(t_end)
+    left = first.where(first > win_start, win_start)
+    right = last.where(last < win_end, win_end)
+    return (right - left).dt.total_seconds().div(60).clip(lower=0)
+
+def recalc_rest_by_overlap(df: pd.DataFrame, skip_rules) -> pd.DataFrame:
+    """
+    依每列實際工作區間重算：休息分鐘、登入空窗、總分鐘、總工時、效率
+    - 一般「空窗」不顯示成欄位，但仍納入總分鐘扣除
+    - 每條規則對整欄一次計算（規則數 × 向量運算），不逐列呼叫
+    """
+    if df is None or df.empty or not OVERLAP_REQUIRED.issubset(df.columns):
+        return df
+
+    out = df.copy()
+    if "登入空窗" not in out.columns:
+        out.insert(out.columns.get_loc("休息分鐘") + 1, "登入空窗", np.nan)
+
+    first = pd.to_datetime(out["第一筆修訂日期"], errors="coerce")
+    last = pd.to_datetime(out["最後一筆修訂日期"], errors="coerce")
+    valid = first.notna() & last.notna() & (last > first)
+    if not valid.any():
+        return out
+    first, last = first[valid], last[valid]
+
+    users = [as_text(out.loc[valid, c]) for c in OVERLAP_USER_COLS if c in out.columns]
+    minutes = {c: pd.Series(0.0, index=first.index) for c in OVERLAP_CATEGORIES}
+    for rule in skip_rules or []:
+        if not isinstance(rule, dict) or rule.get("category") not in minutes:
+            continue
+        t_start, t_end = rule.get("t_start"), rule.get("t_end")
+        if t_start is None or t_end is None or t_start >= t_end:
+            continue
+        overlap = _overlap_minutes(first, last, t_start, t_end)
+        rule_user = str(rule.get("user") or "").strip()
+        if rule_user:
+            # 有填人員：代碼或姓名任一欄相符才扣
+            hit = pd.Series(False, index=first.index)
+            for u in users:
+                hit |= u.eq(rule_user)
+            overlap = overlap.where(hit, 0.0)
+        minutes[rule["category"]] += overlap
+
+    raw_minutes = (last - first).dt.total_seconds().div(60)
+    total_minutes = (raw_minutes - sum(minutes.values())).clip(lower=0)
+    if "筆數" in out.columns:
+        pieces = pd.to_numeric(out.loc[valid, "筆數"], errors="coerce")
+    else:
+        pieces = pd.Series(np.nan, index=first.index)
+    eff = (pieces / total_minutes * 60).round(2).where(pieces.notna() & (total_minutes > 0), 0.0)
+
+    out.loc[valid, "休息分鐘"] = minutes["休息"].round().astype(int)
+    out.loc[valid, "登入空窗"] = minutes["登入空窗"].round().astype(int)
+    out.loc[valid, "總分鐘"] = total_minutes.round(2)
+    out.loc[valid, "總工時"] = (total_minutes / 60).round(2)
+    out.loc[valid, "效率"] = eff
+    if out["登入空窗"].notna().all():
+        out["登入空窗"] = out["登入空窗"].astype(int)
+    return out
+
 # ---------- 全日統計 ----------
 def build_efficiency_table_full(qc_with_idle: pd.DataFrame, user_col: str, time_col: str, skip_rules=None) -> pd.DataFrame:
     if skip_rules is None:
         skip_rules = []
 
     df = qc_with_idle.copy()
-    df["_user"] = df[user_col].astype(str).str.strip()
+    df["_user"] = as_text(df[user_col], fill=None)
     df["_name"] = df["_user"].apply(map_name_from_id)
     df["_dt"]   = to_dt(df[time_col])
     df = df.loc[df["_dt"].notna()].copy()
@@ -375,7 +452,7 @@ def build_efficiency_table_ampm(qc_with_idle: pd.DataFrame, user_col: str, time_
         skip_rules = []
 
     df = qc_with_idle.copy()
-    df["_user"] = df[user_col].astype(str).str.strip()
+    df["_user"] = as_text(df[user_col], fill=None)
     df["_name"] = df["_user"].apply(map_name_from_id)
     df["_dt"]   = to_dt(df[time_col])
     df = df.loc[df["_dt"].notna()].copy()
@@ -446,6 +523,10 @@ def build_efficiency_table_ampm(qc_with_idle: pd.DataFrame, user_col: str, time_
 def write_grouped_ampm_sheet(wb, ampm_df: pd.DataFrame, sheet_name="AMPM_日期分組"):
     COLS = ["記錄輸入人","姓名","筆數","第一筆修訂日期","最後一筆修訂日期",
             "休息分鐘","總分鐘","總工時","效率","空窗筆數","空窗總分鐘","空窗明細"]
+    widths = [12,12,7,19,19,9,9,9,8,9,10,60]
+    if "登入空窗" in ampm_df.columns:
+        i = COLS.index("休息分鐘") + 1
+        COLS.insert(i, "登入空窗"); widths.insert(i, 9)
     if sheet_name in wb.sheetnames:
         del wb[sheet_name]
     ws = wb.create_sheet(sheet_name)
@@ -460,7 +541,6 @@ def write_grouped_ampm_sheet(wb, ampm_df: pd.DataFrame, sheet_name="AMPM_日期
     red   = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
     gray  = PatternFill(start_color="F2F2F2", end_color="F2F2F2", fill_type="solid")
 
-    widths = [12,12,7,19,19,9,9,9,8,9,10,60]
     for i,w in enumerate(widths, start=1):
         ws.column_dimensions[get_column_letter(i)].width = w
 
@@ -512,9 +592,101 @@ def write_grouped_ampm_sheet(wb, ampm_df: pd.DataFrame, sheet_name="AMPM_日期
         r += 1      # 每日間空一行
 
 # ===================== Streamlit/Cloud 可呼叫入口 =====================
-def run_qc_efficiency(file_bytes: bytes, original_name: str, skip_rules: list[dict] | None = None) -> dict:
+def _set_two_decimal_format(ws, col_letter, nrows):
+    for r in range(2, nrows+1):
+        ws[f"{col_letter}{r}"].number_format = "0.00"
+
+
+def _col_letter(df, col):
+    return get_column_letter(list(df.columns).index(col) + 1)
+
+
+def _add_efficiency_colors(ws, df):
+    # 欄位位置依實際欄序（多了「登入空窗」欄時效率欄會往後移）
+    nrows = len(df)
+    if nrows <= 0:
+        return
+    data_range = f"A2:{get_column_letter(len(df.columns))}{nrows+1}"
+    eff_col_anchor = f"${_col_letter(df, '效率')}2"
+    green_fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
+    red_fill   = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
+    ws.conditional_formatting.add(data_range, FormulaRule(
+        formula=[f"=AND({eff_col_anchor}>=20,NOT(ISBLANK({eff_col_anchor})))"],
+        stopIfTrue=False, fill=green_fill))
+    ws.conditional_formatting.add(data_range, FormulaRule(
+        formula=[f"=AND({eff_col_anchor}<20,NOT(ISBLANK({eff_col_anchor})))"],
+        stopIfTrue=False, fill=red_fill))
+
+
+def _rename_ampm_titles(ws):
+    # AMPM 分頁文字替換（保留原本功能）
+    for row in ws.iter_rows():
+        for cell in row:
+            v = cell.value
+            if isinstance(v, str):
+                t = v.strip()
+                if t == "第一階段": cell.value = "上午達標"
+                elif t == "第二階段": cell.value = "下午達標"
+
+
+def write_qc_workbook(
+    processed: dict,
+    full_df: pd.DataFrame,
+    ampm_df: pd.DataFrame,
+    idle_details: pd.DataFrame,
+    total_df: pd.DataFrame,
+) -> bytes:
+    """
+    run_qc_efficiency 的匯出 Excel（條件著色 + AMPM_日期分組）
+    - processed：要一起寫進活頁簿的來源分頁（空 dict = 不寫）
+    - 由 ExportRecipe 在按下載時才呼叫
+    """
+    out = io.BytesIO()
+    with pd.ExcelWriter(out, engine="openpyxl") as writer:
+        # 各來源分頁（含空窗欄）；超過 Excel 列數上限拆成 名稱_1、名稱_2…
+        for name, df in processed.items():
+            safe = (name or "Sheet1")[:31]
+            for part_name, part, _ in iter_shards(safe, df):
+                part.to_excel(writer, index=False, sheet_name=part_name)
+
+        # 記錄輸入人統計（全日）
+        if not full_df.empty:
+            full_df.to_excel(writer, index=False, sheet_name="記錄輸入人統計")
+            ws = writer.book["記錄輸入人統計"]
+            _add_efficiency_colors(ws, full_df)
+            for col in ("總分鐘", "總工時", "效率"):
+                _set_two_decimal_format(ws, _col_letter(full_df, col), len(full_df))
+
+        # 記錄輸入人統計_AMPM（分段；下午用『午後空窗…』）
+        if not ampm_df.empty:
+            ampm_df.to_excel(writer, index=False, sheet_name="記錄輸入人統計_AMPM")
+            ws2 = writer.book["記錄輸入人統計_AMPM"]
+            _add_efficiency_colors(ws2, ampm_df)
+            for col in ("總分鐘", "總工時", "效率"):
+                _set_two_decimal_format(ws2, _col_letter(ampm_df, col), len(ampm_df))
+            # 原本存檔後重開活頁簿替換，改在寫入時直接換掉，省一次整本讀寫
+            _rename_ampm_titles(ws2)
+
+        # 空窗明細（同樣可能超過列數上限）/ 總結
+        for part_name, part, _ in iter_shards("空窗明細", idle_details):
+            part.to_excel(writer, index=False, sheet_name=part_name)
+        total_df.to_excel(writer, index=False, sheet_name="空窗統計_總結")
+
+        # 視覺化分頁：AMPM_日期分組
+        write_grouped_ampm_sheet(writer.book, ampm_df, sheet_name="AMPM_日期分組")
+    return out.getvalue()
+
+
+def run_qc_efficiency(
+    file_bytes: bytes,
+    original_name: str,
+    skip_rules: list[dict] | None = None,
+    *,
+    actual_overlap_rest: bool = False,
+    raw_format: str = "xlsx",
+) -> dict:
     """
-    Streamlit / API 入口：上傳檔(bytes) → 回傳統計表 + 已格式化的 Excel(bytes)
+    Streamlit / API 入口：上傳檔(bytes) → 回傳統計表 + 匯出 Excel 配方（按下載時才產生）
 
     Parameters
     ----------
@@ -528,6 +700,12 @@ def run_qc_efficiency(file_bytes: bytes, original_name: str, skip_rules: list[di
           {"user": "20201109001" 或 ""(空字串=全員), "t_start": datetime.time, "t_end": datetime.time},
           ...
         ]
+        可另帶 "category"（休息 / 登入空窗 / 空窗），搭配 actual_overlap_rest 使用
+    actual_overlap_rest : bool
+        True：匯出前依實際工作區間重算休息分鐘／登入空窗／總分鐘／總工時／效率（recalc_rest_by_overlap）
+    raw_format : str
+        "xlsx"：各來源分頁照舊寫進 Excel；其他（parquet / csv.gz）：不寫進 Excel，
+        改放在回傳的 raw_tables，由呼叫端另存打包（export_bundle.write_bundle）
 
     Returns
     -------
@@ -536,8 +714,9 @@ def run_qc_efficiency(file_bytes: bytes, original_name: str, skip_rules: list[di
         "full_df": DataFrame,   # 記錄輸入人統計（全日）
         "ampm_df": DataFrame,   # 記錄輸入人統計（AM/PM）
         "idle_df": DataFrame,   # 空窗明細
-        "xlsx_bytes": bytes,    # 含條件著色+AMPM日期分組的輸出 Excel
+        "xlsx": ExportRecipe,   # 含條件著色+AMPM日期分組的輸出 Excel（按下載時才產生）
         "total_idle": int,      # 全體空窗筆數
+        "raw_tables": dict,     # raw_format 非 xlsx 時：{來源分頁名稱: DataFrame}，否則為空
       }
     """
     if skip_rules is None:
@@ -560,7 +739,7 @@ def run_qc_efficiency(file_bytes: bytes, original_name: str, skip_rules: list[di
             t_end = datetime.strptime(t_end, "%H:%M").time()
         if t_end < t_start:
             continue
-        cleaned.append({"user": user, "t_start": t_start, "t_end": t_end})
+        cleaned.append({"user": user, "t_start": t_start, "t_end": t_end, "category": r.get("category")})
     skip_rules = cleaned
 
     suffix = os.path.splitext(original_name)[1].lower()
@@ -570,266 +749,230 @@ def run_qc_efficiency(file_bytes: bytes, original_name: str, skip_rules: list[di
     processed = {}
     idle_details_all = []
 
-    with tempfile.TemporaryDirectory() as td:
-        in_path = os.path.join(td, f"upload{suffix}")
-        with open(in_path, "wb") as f:
-            f.write(file_bytes)
+    sheets = read_any(file_bytes, suffix)
 
-        sheets = read_any(in_path)
-
-        # 2) 每張表處理：找 QC，算空窗，補姓名（保留你原本邏輯）
-        for name, df in sheets.items():
-            if df is None or df.empty:
-                processed[name] = df
-                continue
-            # ===== 固定排除：姓名=羅仲宇（所有統計/圖表/匯出一致） =====
-            if df is not None and not df.empty and '姓名' in df.columns:
-                s = df['姓名'].fillna('').astype(str).str.strip()
-                df = df[s.ne('羅仲宇')].copy()
+    # 2) 每張表處理：找 QC，算空窗，補姓名（保留你原本邏輯）
+    for name, df in sheets.items():
+        if df is None or df.empty:
+            processed[name] = df
+            continue
+        # ===== 固定排除：姓名=羅仲宇（所有統計/圖表/匯出一致） =====
+        if df is not None and not df.empty and '姓名' in df.columns:
+            s = as_text(df['姓名'])
+            df = df[s.ne('羅仲宇')].copy()
 
 
-            df = df.copy()
-            dest_col = pick_col(df.columns, [DEST_COL])
-            if dest_col and DEST_VALUE_QC in df[dest_col].astype(str).unique().tolist():
-                qc = df.loc[df[dest_col].astype(str) == DEST_VALUE_QC].copy()
-            else:
-                qc = df.copy()
-
-            ucol = pick_col(qc.columns, USER_COLS)
-            tcol = pick_col(qc.columns, TIME_COLS)
-
-            # ====== 先排除「多筆人員＋時間區間」的紀錄（不參與任何統計） ======
-            if ucol and tcol and skip_rules:
-                dt_series = to_dt(qc[tcol])
-                t_series = dt_series.dt.time
-
-                mask_all = pd.Series(False, index=qc.index)
-                for rule in skip_rules:
-                    t_start = rule["t_start"]
-                    t_end = rule["t_end"]
-                    user_rule = str(rule["user"]).strip()
-
-                    def _time_in_range(t, ts=t_start, te=t_end):
-                        return isinstance(t, time) and (t >= ts) and (t <= te)
-
-                    mask_time = t_series.apply(_time_in_range)
-                    if user_rule:
-                        mask_user = qc[ucol].astype(str).str.strip() == user_rule
-                    else:
-                        mask_user = pd.Series(True, index=qc.index)
-
-                    mask_all = mask_all | (mask_time & mask_user)
-
-                exclude_idx = qc.index[mask_all]
-                if len(exclude_idx) > 0:
-                    qc = qc.drop(exclude_idx)
-                    df = df.drop(exclude_idx, errors="ignore")
-
-            # ====== 欄位不齊就補空窗欄/姓名後直接輸出 ======
-            if not ucol or not tcol:
-                for col in ["空窗分鐘", "空窗旗標", "空窗區間", "午後空窗分鐘", "午後空窗旗標", "午後空窗區間"]:
-                    if col not in df.columns:
-                        df[col] = pd.NA
-                user_guess = pick_col(df.columns, USER_COLS)
-                if user_guess and "姓名" not in df.columns:
-                    df["姓名"] = df[user_guess].astype(str).apply(map_name_from_id)
-                processed[name] = df
-                continue
-
-            # 空窗計算會再扣掉：午休 + 「排除區間」時間（你的 annotate_idle 已支援）
-            qc_with_idle = annotate_idle(qc, ucol, tcol, skip_rules=skip_rules)
-
-            df_out = df.copy()
-            df_out.loc[qc_with_idle.index, ["空窗分鐘","空窗旗標","空窗區間",
-                                            "午後空窗分鐘","午後空窗旗標","午後空窗區間"]] = \
-               qc_with_idle[["空窗分鐘","空窗旗標","空窗區間",
-                             "午後空窗分鐘","午後空窗旗標","午後空窗區間"]].values
-
-            if "姓名" not in df_out.columns:
-                df_out["姓名"] = ""
-            try:
-                df_out.loc[:, "姓名"] = df_out[ucol].astype(str).apply(map_name_from_id)
-            except Exception:
-                pass
-            processed[name] = df_out
-
-            # 空窗明細分頁資料（上午：空窗旗標；下午：午後空窗旗標）
-            if not qc_with_idle.empty:
-                tmp = qc_with_idle.copy()
-                tmp["_user"] = tmp[ucol].astype(str).str.strip()
-                tmp["_name"] = tmp["_user"].apply(map_name_from_id)
-                tmp["_dt"]   = to_dt(tmp[tcol])
-                tmp = tmp.loc[tmp["_dt"].notna()].copy()
-                tmp.sort_values(by=["_user","_dt"], inplace=True)
-                tmp["日期"] = tmp["_dt"].dt.date
-                tmp["起"] = tmp["_dt"].shift(1).dt.strftime("%H:%M")
-                tmp["迄"] = tmp["_dt"].dt.strftime("%H:%M")
-                tmp["來源分頁"] = name
-                tmp["記錄輸入人"] = tmp["_user"]; tmp["姓名"] = tmp["_name"]
-
-                tmp_am = tmp.loc[tmp["空窗旗標"]==1, ["來源分頁","日期","記錄輸入人","姓名","起","迄","空窗分鐘","空窗區間"]]
-                tmp_pm = tmp.loc[tmp["午後空窗旗標"]==1, ["來源分頁","日期","記錄輸入人","姓名","起","迄"]].assign(
-                    空窗分鐘=tmp.loc[tmp["午後空窗旗標"]==1,"午後空窗分鐘"].values,
-                    空窗區間=tmp.loc[tmp["午後空窗旗標"]==1,"午後空窗區間"].values
-                )
-                tmp2 = pd.concat([tmp_am, tmp_pm], ignore_index=True)
-                if not tmp2.empty:
-                    idle_details_all.append(tmp2)
-
-        # 3) 彙整全日/AMPM 表
-        full_df = pd.DataFrame()
-        ampm_df = pd.DataFrame()
-        if processed:
-            big = pd.concat(processed.values(), ignore_index=True)
-            ucol_all = pick_col(big.columns, USER_COLS)
-            tcol_all = pick_col(big.columns, TIME_COLS)
-            if ucol_all and tcol_all:
-                full_df = build_efficiency_table_full(big, ucol_all, tcol_all, skip_rules=skip_rules)
-                ampm_df = build_efficiency_table_ampm(big, ucol_all, tcol_all, skip_rules=skip_rules)
-
-        # 空窗明細彙整 + 排序
-        if idle_details_all:
-            idle_details = pd.concat(idle_details_all, ignore_index=True)
-            final_cols = ["來源分頁","日期","記錄輸入人","姓名","起","迄","空窗分鐘","空窗區間"]
-            for c in final_cols:
-                if c not in idle_details.columns:
-                    idle_details[c] = "" if c in ["來源分頁","記錄輸入人","姓名","起","迄","空窗區間"] else 0
-            idle_details = idle_details[final_cols].copy()
-            idle_details.sort_values(by=["日期","記錄輸入人","起","迄"], inplace=True, ignore_index=True)
+        df = df.copy()
+        dest_col = find_column(df.columns, [DEST_COL], fuzzy=True)
+        is_qc = as_text(df[dest_col], fill=None, strip=False).eq(DEST_VALUE_QC) if dest_col else None
+        if is_qc is not None and is_qc.any():
+            qc = df.loc[is_qc].copy()
         else:
-            idle_details = pd.DataFrame(columns=["來源分頁","日期","記錄輸入人","姓名","起","迄","空窗分鐘","空窗區間"])
+            qc = df.copy()
+
+        ucol = find_column(qc.columns, USER_COLS, fuzzy=True)
+        tcol = find_column(qc.columns, TIME_COLS, fuzzy=True)
+
+        # ====== 先排除「多筆人員＋時間區間」的紀錄（不參與任何統計） ======
+        if ucol and tcol and skip_rules:
+            dt_series = to_dt(qc[tcol])
+            t_series = dt_series.dt.time
+
+            mask_all = pd.Series(False, index=qc.index)
+            for rule in skip_rules:
+                t_start = rule["t_start"]
+                t_end = rule["t_end"]
+                user_rule = str(rule["user"]).strip()
+
+                def _time_in_range(t, ts=t_start, te=t_end):
+                    return isinstance(t, time) and (t >= ts) and (t <= te)
+
+                mask_time = t_series.apply(_time_in_range)
+                if user_rule:
+                    mask_user = as_text(qc[ucol], fill=None) == user_rule
+                else:
+                    mask_user = pd.Series(True, index=qc.index)
+
+                mask_all = mask_all | (mask_time & mask_user)
+
+            exclude_idx = qc.index[mask_all]
+            if len(exclude_idx) > 0:
+                qc = qc.drop(exclude_idx)
+                df = df.drop(exclude_idx, errors="ignore")
+
+        # ====== 欄位不齊就補空窗欄/姓名後直接輸出 ======
+        if not ucol or not tcol:
+            for col in ["空窗分鐘", "空窗旗標", "空窗區間", "午後空窗分鐘", "午後空窗旗標", "午後空窗區間"]:
+                if col not in df.columns:
+                    df[col] = pd.NA
+            user_guess = find_column(df.columns, USER_COLS, fuzzy=True)
+            if user_guess and "姓名" not in df.columns:
+                df["姓名"] = df[user_guess].astype(str).apply(map_name_from_id)
+            processed[name] = df
+            continue
 
-        # ===== 一致過濾：只保留「同時有 記錄輸入人 + 姓名」的資料（KPI/圖表/匯出 Excel 全部一致）=====
+        # 空窗計算會再扣掉：午休 + 「排除區間」時間（你的 annotate_idle 已支援）
+        qc_with_idle = annotate_idle(qc, ucol, tcol, skip_rules=skip_rules)
+
+        df_out = df.copy()
+        df_out.loc[qc_with_idle.index, ["空窗分鐘","空窗旗標","空窗區間",
+                                        "午後空窗分鐘","午後空窗旗標","午後空窗區間"]] = \
+           qc_with_idle[["空窗分鐘","空窗旗標","空窗區間",
+                         "午後空窗分鐘","午後空窗旗標","午後空窗區間"]].values
+
+        if "姓名" not in df_out.columns:
+            df_out["姓名"] = ""
+        try:
+            df_out.loc[:, "姓名"] = df_out[ucol].astype(str).apply(map_name_from_id)
+        except Exception:
+            pass
+        processed[name] = df_out
+
+        # 空窗明細分頁資料（上午：空窗旗標；下午：午後空窗旗標）
+        if not qc_with_idle.empty:
+            tmp = qc_with_idle.copy()
+            tmp["_user"] = as_text(tmp[ucol], fill=None)
+            tmp["_name"] = tmp["_user"].apply(map_name_from_id)
+            tmp["_dt"]   = to_dt(tmp[tcol])
+            tmp = tmp.loc[tmp["_dt"].notna()].copy()
+            tmp.sort_values(by=["_user","_dt"], inplace=True)
+            tmp["日期"] = tmp["_dt"].dt.date
+            tmp["起"] = tmp["_dt"].shift(1).dt.strftime("%H:%M")
+            tmp["迄"] = tmp["_dt"].dt.strftime("%H:%M")
+            tmp["來源分頁"] = name
+            tmp["記錄輸入人"] = tmp["_user"]; tmp["姓名"] = tmp["_name"]
+
+            tmp_am = tmp.loc[tmp["空窗旗標"]==1, ["來源分頁","日期","記錄輸入人","姓名","起","迄","空窗分鐘","空窗區間"]]
+            tmp_pm = tmp.loc[tmp["午後空窗旗標"]==1, ["來源分頁","日期","記錄輸入人","姓名","起","迄"]].assign(
+                空窗分鐘=tmp.loc[tmp["午後空窗旗標"]==1,"午後空窗分鐘"].values,
+                空窗區間=tmp.loc[tmp["午後空窗旗標"]==1,"午後空窗區間"].values
+            )
+            tmp2 = pd.concat([tmp_am, tmp_pm], ignore_index=True)
+            if not tmp2.empty:
+                idle_details_all.append(tmp2)
+
+    # 3) 彙整全日/AMPM 表
+    full_df = pd.DataFrame()
+    ampm_df = pd.DataFrame()
+    if processed:
+        big = pd.concat(processed.values(), ignore_index=True)
+        ucol_all = find_column(big.columns, USER_COLS, fuzzy=True)
+        tcol_all = find_column(big.columns, TIME_COLS, fuzzy=True)
+        if ucol_all and tcol_all:
+            full_df = build_efficiency_table_full(big, ucol_all, tcol_all, skip_rules=skip_rules)
+            ampm_df = build_efficiency_table_ampm(big, ucol_all, tcol_all, skip_rules=skip_rules)
+
+    # 空窗明細彙整 + 排序
+    if idle_details_all:
+        idle_details = pd.concat(idle_details_all, ignore_index=True)
+        final_cols = ["來源分頁","日期","記錄輸入人","姓名","起","迄","空窗分鐘","空窗區間"]
+        for c in final_cols:
+            if c not in idle_details.columns:
+                idle_details[c] = "" if c in ["來源分頁","記錄輸入人","姓名","起","迄","空窗區間"] else 0
+        idle_details = idle_details[final_cols].copy()
+        idle_details.sort_values(by=["日期","記錄輸入人","起","迄"], inplace=True, ignore_index=True)
+    else:
+        idle_details = pd.DataFrame(columns=["來源分頁","日期","記錄輸入人","姓名","起","迄","空窗分鐘","空窗區間"])
 
-        def _nonempty_series(s: pd.Series) -> pd.Series:
+    # ===== 一致過濾：只保留「同時有 記錄輸入人 + 姓名」的資料（KPI/圖表/匯出 Excel 全部一致）=====
 
-            return s.fillna("").astype(str).str.strip().ne("")
+    def _nonempty_series(s: pd.Series) -> pd.Series:
 
+        return as_text(s).ne("")
 
-        def _filter_user_and_name(df: pd.DataFrame) -> pd.DataFrame:
 
-            if df is None or df.empty:
+    def _filter_user_and_name(df: pd.DataFrame) -> pd.DataFrame:
+
+        if df is None or df.empty:
+
+            return df
 
-                return df
+        if "記錄輸入人" in df.columns and "姓名" in df.columns:
 
-            if "記錄輸入人" in df.columns and "姓名" in df.columns:
+            return df[_nonempty_series(df["記錄輸入人"]) & _nonempty_series(df["姓名"])].copy()
 
-                return df[_nonempty_series(df["記錄輸入人"]) & _nonempty_series(df["姓名"])].copy()
+        return df
 
+
+    full_df = _filter_user_and_name(full_df)
+
+    ampm_df = _filter_user_and_name(ampm_df)
+
+    idle_details = _filter_user_and_name(idle_details)
+
+    # ===== 固定排除：姓名=羅仲宇（KPI/圖表/匯出 Excel 全部一致）=====
+    def _exclude_name(df: pd.DataFrame, name: str = '羅仲宇') -> pd.DataFrame:
+        if df is None or df.empty:
+            return df
+        if '姓名' not in df.columns:
             return df
+        s = as_text(df['姓名'])
+        return df[s.ne(name)].copy()
 
+    full_df = _exclude_name(full_df)
+    ampm_df = _exclude_name(ampm_df)
+    idle_details = _exclude_name(idle_details)
 
-        full_df = _filter_user_and_name(full_df)
-
-        ampm_df = _filter_user_and_name(ampm_df)
-
-        idle_details = _filter_user_and_name(idle_details)
-
-        # ===== 固定排除：姓名=羅仲宇（KPI/圖表/匯出 Excel 全部一致）=====
-        def _exclude_name(df: pd.DataFrame, name: str = '羅仲宇') -> pd.DataFrame:
-            if df is None or df.empty:
-                return df
-            if '姓名' not in df.columns:
-                return df
-            s = df['姓名'].fillna('').astype(str).str.strip()
-            return df[s.ne(name)].copy()
-
-        full_df = _exclude_name(full_df)
-        ampm_df = _exclude_name(ampm_df)
-        idle_details = _exclude_name(idle_details)
-
-
-        total_idle = int(idle_details["空窗分鐘"].notna().sum()) if not idle_details.empty else 0
-        total_df = pd.DataFrame({"項目":[f"全體空窗筆數(>{THRESHOLD_MIN}分)"], "數量":[total_idle]})
-
-        # ===== 輸出（保留條件著色 + AMPM_日期分組）=====
-        out_path = os.path.join(td, "驗收達標_含空窗_AMPM.xlsx")
-
-        def set_two_decimal_format(ws, col_letter, nrows):
-            for r in range(2, nrows+1):
-                ws[f"{col_letter}{r}"].number_format = "0.00"
-
-        with pd.ExcelWriter(out_path, engine="openpyxl") as writer:
-            # 各來源分頁（含空窗欄）
-            for name, df in processed.items():
-                safe = (name or "Sheet1")[:31]
-                df.to_excel(writer, index=False, sheet_name=safe)
-
-            # 記錄輸入人統計（全日）
-            if not full_df.empty:
-                full_df.to_excel(writer, index=False, sheet_name="記錄輸入人統計")
-                ws = writer.book["記錄輸入人統計"]
-                nrows = len(full_df)
-                if nrows > 0:
-                    data_range = f"A2:M{nrows+1}"
-                    eff_col_anchor = "$J2"
-                    green_fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
-                    red_fill   = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
-                    ws.conditional_formatting.add(data_range, FormulaRule(
-                        formula=[f"=AND({eff_col_anchor}>=20,NOT(ISBLANK({eff_col_anchor})))"],
-                        stopIfTrue=False, fill=green_fill))
-                    ws.conditional_formatting.add(data_range, FormulaRule(
-                        formula=[f"=AND({eff_col_anchor}<20,NOT(ISBLANK({eff_col_anchor})))"],
-                        stopIfTrue=False, fill=red_fill))
-                    set_two_decimal_format(ws,"H",nrows)
-                    set_two_decimal_format(ws,"I",nrows)
-                    set_two_decimal_format(ws,"J",nrows)
-
-            # 記錄輸入人統計_AMPM（分段；下午用『午後空窗…』）
-            if not ampm_df.empty:
-                ampm_df.to_excel(writer, index=False, sheet_name="記錄輸入人統計_AMPM")
-                ws2 = writer.book["記錄輸入人統計_AMPM"]
-                nrows2 = len(ampm_df)
-                if nrows2 > 0:
-                    data_range2 = f"A2:N{nrows2+1}"
-                    eff_col_anchor2 = "$K2"
-                    green_fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
-                    red_fill   = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
-                    ws2.conditional_formatting.add(data_range2, FormulaRule(
-                        formula=[f"=AND({eff_col_anchor2}>=20,NOT(ISBLANK({eff_col_anchor2})))"],
-                        stopIfTrue=False, fill=green_fill))
-                    ws2.conditional_formatting.add(data_range2, FormulaRule(
-                        formula=[f"=AND({eff_col_anchor2}<20,NOT(ISBLANK({eff_col_anchor2})))"],
-                        stopIfTrue=False, fill=red_fill))
-                    set_two_decimal_format(ws2,"I",nrows2)
-                    set_two_decimal_format(ws2,"J",nrows2)
-                    set_two_decimal_format(ws2,"K",nrows2)
-
-            # 空窗明細 / 總結
-            idle_details.to_excel(writer, index=False, sheet_name="空窗明細")
-            total_df.to_excel(writer, index=False, sheet_name="空窗統計_總結")
-
-            # 視覺化分頁：AMPM_日期分組
-            write_grouped_ampm_sheet(writer.book, ampm_df, sheet_name="AMPM_日期分組")
-
-        # AMPM 分頁文字替換（保留原本功能）
-        from openpyxl import load_workbook
-        def _rename_ampm_titles(xlsx_path, sheet_name="記錄輸入人統計_AMPM"):
-            try:
-                wb = load_workbook(xlsx_path)
-            except Exception:
-                return
-            if sheet_name not in wb.sheetnames:
-                wb.close(); return
-            ws = wb[sheet_name]
-            for row in ws.iter_rows():
-                for cell in row:
-                    v = cell.value
-                    if isinstance(v, str):
-                        t = v.strip()
-                        if t == "第一階段": cell.value = "上午達標"
-                        elif t == "第二階段": cell.value = "下午達標"
-            wb.save(xlsx_path); wb.close()
-
-        _rename_ampm_titles(out_path)
-
-        with open(out_path, "rb") as f:
-            xlsx_bytes = f.read()
+    # ===== 依實際重疊重算扣休（寫 Excel 前就算好，匯出檔不用再回頭修）=====
+    if actual_overlap_rest:
+        full_df = recalc_rest_by_overlap(full_df, skip_rules)
+        ampm_df = recalc_rest_by_overlap(ampm_df, skip_rules)
+
+
+    total_idle = int(idle_details["空窗分鐘"].notna().sum()) if not idle_details.empty else 0
+    total_df = pd.DataFrame({"項目":[f"全體空窗筆數(>{THRESHOLD_MIN}分)"], "數量":[total_idle]})
+
+    # ===== 輸出：只留配方，按下載時才寫 Excel =====
+    # raw_format 非 xlsx 時來源分頁不寫進 Excel，改由呼叫端另存成明細檔
+    xlsx = ExportRecipe(
+        write_qc_workbook,
+        (processed if raw_format == "xlsx" else {}, full_df, ampm_df, idle_details, total_df),
+        file_name="驗收達標_含空窗_AMPM.xlsx",
+    )
 
     return {
         "full_df": full_df,
         "ampm_df": ampm_df,
         "idle_df": idle_details,
-        "xlsx_bytes": xlsx_bytes,
+        "xlsx": xlsx,
         "total_idle": total_idle,
+        "raw_tables": {} if raw_format == "xlsx" else {(name or "Sheet1"): df for name, df in processed.items()},
     }
+
+
+def run_qc_efficiency_cached(
+    file_bytes: bytes,
+    original_name: str,
+    skip_rules: list[dict] | None = None,
+    *,
+    actual_overlap_rest: bool = False,
+    raw_format: str = "xlsx",
+    fingerprint: str | None = None,
+) -> dict:
+    """
+    run_qc_efficiency 的快取版（result_cache）：同一份檔 + 同一組排除規則 / 設定直接回傳上次結果
+    - 檔名只有副檔名會影響讀取方式，key 只取副檔名，改名重傳也能命中
+    - fingerprint：upload_fingerprint(uploaded)，有給就不必再掃一次內容
+    """
+    params = {
+        "suffix": os.path.splitext(original_name)[1].lower(),
+        "skip_rules": [
+            {k: r.get(k) for k in ("user", "t_start", "t_end", "category")}
+            for r in (skip_rules or []) if isinstance(r, dict)
+        ],
+        "actual_overlap_rest": bool(actual_overlap_rest),
+        "raw_format": raw_format,
+    }
+    return cached_call(
+        "qc_efficiency",
+        file_bytes,
+        params,
+        lambda: run_qc_efficiency(
+            file_bytes,
+            original_name,
+            skip_rules,
+            actual_overlap_rest=actual_overlap_rest,
+            raw_format=raw_format,
+        ),
+        fingerprint=fingerprint,
+    )
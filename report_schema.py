@@ -0,0 +1,277 @@
+"""
+報表欄位 schema 登錄表
+- 每份報表宣告：標準欄名、同義欄名、型別、必要/選用
+- 讀檔時用 usecols_for() 只解析需要的欄位（WMS 匯出動輒上百欄）
+- 讀進來後 apply_schema() 統一 rename 成標準欄名、檢查缺欄、轉型
+- find_column() 取代各頁自寫的 pick_col / find_first_column / detect_col / _resolve_col
+"""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+
+# =====================================
+# 欄名正規化 / 單欄比對
+# =====================================
+def normalize_col_name(s: Any) -> str:
+    """欄名比對用：去空白（含全形）、去括號等符號、-./ 視同底線、英文不分大小寫"""
+    s = str(s).strip().replace("\u3000", " ")
+    s = re.sub(r"\s+", "", s)
+    s = s.replace("-", "_").replace(".", "_").replace("/", "_")
+    s = re.sub(r"[^0-9a-zA-Z_\u4e00-\u9fff]", "", s)
+    return s.lower()
+
+
+def find_column(columns: Iterable[Any], candidates: Sequence[str], *, fuzzy: bool = False) -> Optional[Any]:
+    """
+    依候選順序找欄位，回傳「實際的欄位名稱」（可直接 df[col]）
+    1) 去頭尾空白後完全相同
+    2) normalize_col_name 後相同
+    3) fuzzy=True：欄名包含候選字（區分大小寫）
+    """
+    cols = list(columns)
+    stripped: Dict[str, Any] = {}
+    normed: Dict[str, Any] = {}
+    for c in cols:
+        stripped.setdefault(str(c).strip(), c)
+        normed.setdefault(normalize_col_name(c), c)
+
+    for cand in candidates:
+        hit = stripped.get(str(cand).strip())
+        if hit is not None:
+            return hit
+    for cand in candidates:
+        hit = normed.get(normalize_col_name(cand))
+        if hit is not None:
+            return hit
+    if fuzzy:
+        for cand in candidates:
+            key = str(cand).strip()
+            if not key:
+                continue
+            for c in cols:
+                if key in str(c).strip():
+                    return c
+    return None
+
+
+# =====================================
+# Schema 定義
+# =====================================
+@dataclass(frozen=True)
+class ColumnSpec:
+    name: str                       # 標準欄名（rename 後的名稱）
+    aliases: Tuple[str, ...] = ()   # 同義欄名（依優先順序）
+    dtype: Optional[str] = None     # "str" / "num" / "datetime"；None = 保留原樣
+    required: bool = True
+
+    @property
+    def candidates(self) -> Tuple[str, ...]:
+        return (self.name,) + tuple(self.aliases)
+
+
+@dataclass(frozen=True)
+class ReportSchema:
+    key: str
+    columns: Tuple[ColumnSpec, ...]
+    # True：只保留 schema 內的欄位（讀檔時 usecols 投影）
+    # False：明細要整份下載/整列去重的報表，保留所有欄位
+    project: bool = True
+
+    @property
+    def names(self) -> List[str]:
+        return [c.name for c in self.columns]
+
+    @property
+    def required_names(self) -> List[str]:
+        return [c.name for c in self.columns if c.required]
+
+
+def resolve_columns(columns: Iterable[Any], schema: ReportSchema) -> Dict[str, Any]:
+    """標準欄名 → 實際欄名；同一個實際欄位只會對到一個標準欄"""
+    cols = list(columns)
+    out: Dict[str, Any] = {}
+    used = set()
+    for spec in schema.columns:
+        remaining = [c for c in cols if c not in used]
+        hit = find_column(remaining, spec.candidates)
+        if hit is not None:
+            out[spec.name] = hit
+            used.add(hit)
+    return out
+
+
+def missing_columns(columns: Iterable[Any], schema: ReportSchema) -> List[str]:
+    found = resolve_columns(columns, schema)
+    return [n for n in schema.required_names if n not in found]
+
+
+def header_matches(labels: Sequence[Any], schema: ReportSchema) -> bool:
+    """表頭偵測用：這一列能對到所有必要欄位 → 視為表頭"""
+    return not missing_columns([x for x in labels if x not in (None, "")], schema)
+
+
+def usecols_for(schema: ReportSchema) -> Optional[Callable[[Any], bool]]:
+    """給 pd.read_csv / pd.read_excel / read_sheet_streaming 的 usecols；不投影的 schema 回傳 None"""
+    if not schema.project:
+        return None
+    wanted = {normalize_col_name(c) for spec in schema.columns for c in spec.candidates}
+    return lambda col: normalize_col_name(col) in wanted
+
+
+def _coerce(s: pd.Series, dtype: Optional[str]) -> pd.Series:
+    if dtype == "num":
+        return pd.to_numeric(s, errors="coerce")
+    if dtype == "datetime":
+        if pd.api.types.is_datetime64_any_dtype(s):
+            return s
+        return pd.to_datetime(s, errors="coerce")
+    if dtype == "str":
+        if pd.api.types.is_string_dtype(s) and not pd.api.types.is_object_dtype(s):
+            return s
+        return s.astype(str).where(s.notna(), None)
+    return s
+
+
+def apply_schema(
+    df: pd.DataFrame,
+    schema: ReportSchema,
+    *,
+    label: str = "檔案",
+    strict: bool = True,
+) -> pd.DataFrame:
+    """
+    依 schema 整理讀進來的表：
+    - 欄名去頭尾空白，對到的欄位 rename 成標準欄名
+    - strict=True 時缺必要欄位直接 ValueError
+    - schema.project=True 時只留 schema 欄位（依 schema 順序）；缺欄時保留原欄位方便對照
+    - 依 dtype 轉型（只動 schema 內的欄位）
+    """
+    df = df.copy()
+    df.columns = [str(c).strip() for c in df.columns]
+
+    found = resolve_columns(df.columns, schema)
+    missing = [n for n in schema.required_names if n not in found]
+    if missing and strict:
+        raise ValueError(f"{label} 缺少欄位：{missing}\n目前欄位：{list(df.columns)}")
+
+    rename = {actual: name for name, actual in found.items() if actual != name}
+    if rename:
+        # 標準欄名若已被其他未對到的欄位佔用，先讓位，避免 rename 後重複欄名
+        taken = [c for c in df.columns if c in set(rename.values()) and c not in rename]
+        if taken:
+            df = df.drop(columns=taken)
+        df = df.rename(columns=rename)
+
+    if schema.project and not missing:
+        df = df[[n for n in schema.names if n in found]]
+
+    for spec in schema.columns:
+        if spec.dtype and spec.name in found:
+            df[spec.name] = _coerce(df[spec.name], spec.dtype)
+    return df
+
+
+# =====================================
+# 登錄表：各報表的欄位需求
+# =====================================
+SCHEMAS: Dict[str, ReportSchema] = {}
+
+
+def register(schema: ReportSchema) -> ReportSchema:
+    SCHEMAS[schema.key] = schema
+    return schema
+
+
+def get_schema(key: str) -> ReportSchema:
+    if key not in SCHEMAS:
+        raise KeyError(f"未登錄的報表 schema：{key}")
+    return SCHEMAS[key]
+
+
+# 10｜進貨驗收量（採購單驗收量明細）
+register(ReportSchema(
+    key="inbound_receipt",
+    columns=(
+        ColumnSpec("入庫類型", ("入庫型態", "入庫类型")),
+        ColumnSpec("驗收入庫數量", ("驗收入庫量", "驗收入庫"), dtype="num"),
+        ColumnSpec("供應商代號", ("廠商代號", "供應商編號", "廠商編號")),
+        # ⚠️ 若真的沒有 DC採購單號，才退回採購單號
+        ColumnSpec("DC採購單號", ("DC採購單号", "DC採購單", "採購單號(DC)", "採購單號")),
+        ColumnSpec("商品品號", ("商品代號", "商品料號", "品號", "料號")),
+    ),
+))
+
+# 13｜庫存訂單實出量分析（明細整份下載 → 不投影）
+register(ReportSchema(
+    key="stock_order_actual",
+    project=False,
+    columns=(
+        ColumnSpec("箱類型", ("箱型", "箱别", "箱別", "boxtype_name", "carton_type", "箱種", "箱种")),
+        ColumnSpec("packqty", ("pack_qty", "pack quantity", "數量", "数量", "pcs", "qty", "pack"), dtype="num"),
+        ColumnSpec("入數", ("入数", "入數量", "入数量", "innum", "in_qty", "unitspercase", "units_per_case", "casepack", "case_pack"), dtype="num"),
+        ColumnSpec("buyersreference", ("buyers_reference", "buyer reference", "buyerref", "order_type", "單別", "单别", "refer", "buyers ref")),
+        ColumnSpec("BOXTYPE", ("box_type", "箱別型態", "箱型態", "箱别型态", "箱類型代碼", "箱类型代码"), dtype="num"),
+        ColumnSpec("externorderkey", ("extern_order_key", "orderkey", "order_key", "order id", "order_id", "訂單號", "订单号", "單號", "单号", "externorder")),
+        ColumnSpec("SKU", ("item", "itemcode", "item_code", "商品", "商品碼", "商品码", "品號", "品号", "料號", "料号")),
+        ColumnSpec("boxid", ("box_id", "box id", "箱號", "箱号", "箱碼", "箱码", "cartonid", "carton_id", "containerid", "container_id")),
+    ),
+))
+
+# 24｜出貨作業線產能
+register(ReportSchema(
+    key="line_capacity",
+    columns=(
+        ColumnSpec("PICKDATE", ("PICK_DATE", "PICK DATETIME", "PICKTIME", "PICK_TIME")),
+        ColumnSpec("PACKQTY", ("PACK_QTY", "PCS", "QTY")),
+        ColumnSpec("Cweight", ("C_WEIGHT", "C WEIGHT", "WEIGHT")),
+        ColumnSpec("LINEID", ("LINE_ID", "LINE", "LINE ID")),
+        ColumnSpec("STO_TYPE", ("STOTYPE", "SO_TYPE", "TYPE")),
+    ),
+))
+
+# 25｜整體作業工時（出勤報表；明細整份下載 → 不投影）
+register(ReportSchema(
+    key="attendance_hours",
+    project=False,
+    columns=(
+        ColumnSpec("上班打卡時間"),
+        ColumnSpec("職務"),
+        ColumnSpec("組別"),
+        ColumnSpec("上班時數"),
+        ColumnSpec("打卡時數"),
+        ColumnSpec("員工姓名"),
+    ),
+))
+
+# 26｜出貨單位數（TXT；明細整份下載 → 不投影）
+register(ReportSchema(
+    key="ship_unit_txt",
+    project=False,
+    columns=(
+        ColumnSpec("packqty"),
+        ColumnSpec("入數"),
+        ColumnSpec("箱類型"),
+        ColumnSpec("載具號"),
+        ColumnSpec("BOXTYPE"),
+        ColumnSpec("boxid"),
+    ),
+))
+
+# 29｜各時段作業效率（整列 hash 去重 + 明細整份輸出 → 不投影）
+register(ReportSchema(
+    key="hourly_efficiency",
+    project=False,
+    columns=(
+        ColumnSpec("PICKDATE", dtype="datetime"),
+        ColumnSpec("LINEID"),
+        ColumnSpec("ZONEID"),
+        ColumnSpec("PACKQTY", dtype="num"),
+        ColumnSpec("Cweight", dtype="num"),
+    ),
+))
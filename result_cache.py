@@ -0,0 +1,220 @@
+"""
+運算結果快取（記憶體 + 磁碟兩層）
+- key = 上傳內容指紋（BLAKE2b）+ 正規化後的參數（排除規則、門檻、空窗門檻、起始時間、人員設定…）
+- 記憶體層：同一個 process 內最近用過的結果，總大小不超過 MEMORY_BYTES（與 session_store 同樣的算法），
+  重跑 / 換頁回來直接拿；結果的 DataFrame 常與 session_store 共用，只限筆數會讓溢出釋放不了記憶體
+- 磁碟層：pickle 存在本機（本使用者專用目錄），跨 session、不同使用者算同一份檔也能直接回傳；
+  總容量超過上限時依最後使用時間（LRU）淘汰
+- 結果是 dict 時回傳淺拷貝：呼叫端增刪 key 不會改到快取；DataFrame 仍共用，請勿原地修改
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, time
+from pathlib import Path
+from typing import Any, Callable, Dict, Mapping, Optional
+
+from private_dir import default_dir, private_dir
+from result_size import result_bytes
+from upload_buffer import content_digest
+
+
+# ===== 可調參數（可用環境變數覆寫） =====
+CACHE_DIR = Path(os.environ.get("RESULT_CACHE_DIR", default_dir("gf_result_cache")))
+MAX_CACHE_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))  # 512 MB
+MEMORY_BYTES = int(os.environ.get("RESULT_CACHE_MEMORY_BYTES", str(128 * 1024 * 1024)))  # 記憶體層上限
+CACHE_VERSION = "4"  # 引擎計算邏輯或結果格式變更時 +1，舊快取自然失效
+
+_LOCK = threading.Lock()
+_MEMORY: "OrderedDict[str, Any]" = OrderedDict()
+_MEMORY_SIZES: Dict[str, int] = {}
+
+
+# =====================================
+# key
+# =====================================
+def normalize_params(value: Any) -> Any:
+    """參數轉成可穩定序列化的形式（dict 依 key 排序、時間轉 ISO 字串、set 排序）"""
+    if isinstance(value, Mapping):
+        return {str(k): normalize_params(v) for k, v in sorted(value.items(), key=lambda kv: str(kv[0]))}
+    if isinstance(value, (list, tuple)):
+        return [normalize_params(v) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted(normalize_params(v) for v in value)
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def result_key(namespace: str, content: bytes, params: Mapping[str, Any], fingerprint: Optional[str] = None) -> str:
+    digest = fingerprint or content_digest(content)
+    opts = json.dumps(normalize_params(params), sort_keys=True, ensure_ascii=False)
+    return content_digest(f"{CACHE_VERSION}|{namespace}|{digest}|{opts}".encode("utf-8"))
+
+
+def _entry_path(key: str) -> Path:
+    return CACHE_DIR / f"{key}.pkl"
+
+
+# =====================================
+# 記憶體層
+# =====================================
+def _memory_get(key: str) -> Any:
+    with _LOCK:
+        if key not in _MEMORY:
+            return None
+        _MEMORY.move_to_end(key)
+        return _MEMORY[key]
+
+
+def _memory_put(key: str, value: Any) -> None:
+    size = result_bytes(value)
+    with _LOCK:
+        _MEMORY.pop(key, None)
+        _MEMORY_SIZES.pop(key, None)
+        if size > MEMORY_BYTES:
+            return  # 單筆就超過上限：只留磁碟層
+        _MEMORY[key] = value
+        _MEMORY_SIZES[key] = size
+        total = sum(_MEMORY_SIZES.values())
+        while total > MEMORY_BYTES:
+            old, _ = _MEMORY.popitem(last=False)
+            total -= _MEMORY_SIZES.pop(old)
+
+
+# =====================================
+# 磁碟層
+# =====================================
+def _disk_ok() -> bool:
+    """磁碟層目錄存在且只限本使用者，才讀裡面的 pickle"""
+    if not CACHE_DIR.exists():
+        return False
+    try:
+        private_dir(CACHE_DIR)
+    except OSError:
+        return False
+    return True
+
+
+def _load(path: Path) -> Any:
+    try:
+        with open(path, "rb") as f:
+            value = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        # 壞檔（寫到一半被砍、版本不相容…）直接丟掉重算
+        try:
+            path.unlink()
+        except OSError:
+            pass
+        return None
+    try:
+        os.utime(path, None)  # 更新使用時間，供 LRU 判斷
+    except OSError:
+        pass
+    return value
+
+
+def _store(path: Path, value: Any) -> None:
+    try:
+        private_dir(CACHE_DIR)
+    except OSError:
+        return  # 目錄不安全 / 建不起來：只留記憶體層
+    tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except Exception:
+        # 存不進 pickle 的結果（含 lambda、開啟中的檔案…）：只留記憶體層
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+        return
+    _evict()
+
+
+def _evict(max_bytes: Optional[int] = None) -> None:
+    """總容量超過上限 → 由最久沒用的開始刪"""
+    limit = MAX_CACHE_BYTES if max_bytes is None else int(max_bytes)
+    entries = []
+    total = 0
+    for p in CACHE_DIR.glob("*.pkl"):
+        try:
+            stat = p.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, p))
+        total += stat.st_size
+    if total <= limit:
+        return
+    for _, size, p in sorted(entries, key=lambda x: x[0]):
+        try:
+            p.unlink()
+        except OSError:
+            continue
+        total -= size
+        if total <= limit:
+            break
+
+
+# =====================================
+# 對外介面
+# =====================================
+def _copy_out(value: Any) -> Any:
+    return dict(value) if isinstance(value, dict) else value
+
+
+def cached_call(
+    namespace: str,
+    content: bytes,
+    params: Mapping[str, Any],
+    compute: Callable[[], Any],
+    *,
+    fingerprint: Optional[str] = None,
+) -> Any:
+    """
+    同 namespace + 同上傳內容 + 同參數 → 直接回傳上次結果；否則呼叫 compute() 並寫回兩層快取
+
+    params 要完整描述「會影響結果的設定」；只影響畫面顯示的（Top N 等）不要放，才能共用。
+    compute() 丟出例外時不快取，例外照常往外拋。
+    已有 upload_fingerprint(uploaded) 時傳 fingerprint，不必再掃一次內容。
+    """
+    key = result_key(namespace, content, params, fingerprint)
+
+    value = _memory_get(key)
+    if value is not None:
+        return _copy_out(value)
+
+    path = _entry_path(key)
+    if _disk_ok() and path.exists():
+        value = _load(path)
+        if value is not None:
+            _memory_put(key, value)
+            return _copy_out(value)
+
+    value = compute()
+    if value is None:
+        return None
+    _memory_put(key, value)
+    with _LOCK:
+        _store(path, value)
+    return _copy_out(value)
+
+
+def clear_cache() -> None:
+    """清空兩層快取（維護用）"""
+    with _LOCK:
+        _MEMORY.clear()
+        _MEMORY_SIZES.clear()
+        if _disk_ok():
+            _evict(max_bytes=0)
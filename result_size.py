@@ -0,0 +1,51 @@
+"""
+結果大小估算（session_store 的預算、result_cache 的記憶體層共用同一套算法）
+- 依實際參照到的物件計算：展開 dict / list / tuple 與匯出配方的參數
+- 同一個物件只算一次（多個欄位 / 配方共用同一個 DataFrame 不會重複計）
+- 不依賴 streamlit（result_cache 本身也不匯入 streamlit）
+"""
+
+from __future__ import annotations
+
+import sys
+from typing import Any, Iterator, Set
+
+import pandas as pd
+
+
+def _children(value: Any):
+    # 匯出配方（ExportRecipe）用 inputs() 列出參數；用鴨子型別，免得這裡要匯入 streamlit
+    inputs = getattr(value, "inputs", None)
+    if callable(inputs):
+        return inputs()
+    if isinstance(value, dict):
+        return value.values()
+    if isinstance(value, (list, tuple)):
+        return value
+    return None
+
+
+def _leaves(value: Any, seen: Set[int]) -> Iterator[Any]:
+    """value 實際參照到的物件（同一物件只出現一次）"""
+    if id(value) in seen:
+        return
+    seen.add(id(value))
+    children = _children(value)
+    if children is None:
+        yield value
+        return
+    for child in children:
+        yield from _leaves(child, seen)
+
+
+def _leaf_bytes(value: Any) -> int:
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    return sys.getsizeof(value)
+
+
+def result_bytes(value: Any) -> int:
+    """結果實際佔用的位元組"""
+    return sum(_leaf_bytes(v) for v in _leaves(value, set()))
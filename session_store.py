@@ -0,0 +1,318 @@
+"""
+Session 結果暫存（記憶體預算 + 溢出到磁碟）
+- session_state 只放輕量 handle；結果本體（DataFrame、xlsx bytes…）由這裡統一保管
+- 每個 session、整個 process 各有位元組預算；超過時由最久沒用（LRU）的結果開始溢出到本機：
+  DataFrame → Parquet（讀回型別會變的改 pickle）、bytes → 檔案、匯出配方 → pickle，其餘小欄位留在記憶體
+- 暫存目錄只限本使用者（權限 0o700、檢查擁有者），別人放進去的檔案不會被 pickle.load
+- 大小依實際參照到的物件計算（匯出配方的參數也算；同一個 DataFrame 只算一次）
+- get() 讀回原本的物件，頁面不必知道是否溢出過；溢出的結果被讀到時會再搬回記憶體
+- session 結束（handle 被回收）或被覆寫時，記憶體與暫存檔一併釋放
+"""
+
+from __future__ import annotations
+
+import itertools
+import os
+import pickle
+import shutil
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import pandas as pd
+import streamlit as st
+
+from export_recipe import ExportRecipe
+from private_dir import default_dir, private_dir
+from result_size import result_bytes
+
+# ===== 可調參數（可用環境變數覆寫） =====
+SPILL_DIR = Path(os.environ.get("SESSION_STORE_DIR", default_dir("gf_session_store")))
+SESSION_BUDGET = int(os.environ.get("SESSION_STORE_SESSION_BYTES", str(256 * 1024 * 1024)))  # 每個 session
+GLOBAL_BUDGET = int(os.environ.get("SESSION_STORE_GLOBAL_BYTES", str(1024 * 1024 * 1024)))  # 整個 process
+SPILL_MIN_BYTES = int(os.environ.get("SESSION_STORE_SPILL_MIN_BYTES", str(256 * 1024)))  # 小於此的欄位不溢出
+ORPHAN_TTL = int(os.environ.get("SESSION_STORE_ORPHAN_TTL", str(12 * 3600)))  # 秒；前一個 process 留下的暫存檔
+
+_LOCK = threading.RLock()
+_IDS = itertools.count(1)
+
+
+# =====================================
+# 大小估算
+# =====================================
+def _spillable(value: Any) -> bool:
+    return isinstance(value, (pd.DataFrame, bytes, bytearray, ExportRecipe)) and result_bytes(value) >= SPILL_MIN_BYTES
+
+
+# =====================================
+# 單筆結果
+# =====================================
+@dataclass
+class _Entry:
+    entry_id: int
+    session_id: str
+    value: Any                       # 記憶體中的本體；dict 溢出後大欄位換成 _Spilled
+    size: int
+    spilled: Dict[Any, "_Spilled"] = field(default_factory=dict)   # 欄位 key（整筆為 None）→ 暫存檔
+
+
+@dataclass
+class _Spilled:
+    path: Path
+    kind: str                        # parquet / pickle / bytes
+    size: int
+
+
+_ENTRIES: "OrderedDict[int, _Entry]" = OrderedDict()   # LRU：越後面越近期使用
+
+
+class ResultHandle:
+    """放在 session_state 的輕量代號；被回收（session 結束、覆寫）時釋放結果"""
+
+    __slots__ = ("entry_id", "__weakref__")
+
+    def __init__(self, entry_id: int):
+        self.entry_id = entry_id
+        weakref.finalize(self, _release, entry_id)
+
+    def __repr__(self) -> str:
+        return f"ResultHandle({self.entry_id})"
+
+
+def _session_id() -> str:
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+        ctx = get_script_run_ctx()
+        return ctx.session_id if ctx is not None else "default"
+    except Exception:
+        return "default"
+
+
+# =====================================
+# 溢出 / 讀回
+# =====================================
+def _parquet_safe(df: pd.DataFrame) -> bool:
+    """
+    Parquet 讀回型別不變才走 Parquet：
+    object 欄（[1, None]、"0012" 配 None…）讀回會被 Arrow 推斷成 float64 / str，改走 pickle
+    """
+    if isinstance(df.index, pd.MultiIndex) or df.index.dtype == object:
+        return False
+    if not all(isinstance(c, str) for c in df.columns) or df.columns.duplicated().any():
+        return False
+    return not any(dt == object for dt in df.dtypes)
+
+
+def _write_part(entry: _Entry, part_key: Any, value: Any) -> _Spilled:
+    private_dir(SPILL_DIR)
+    stem = SPILL_DIR / f"{os.getpid()}_{entry.entry_id}_{len(entry.spilled)}"
+    size = result_bytes(value)
+    if isinstance(value, (bytes, bytearray)):
+        path = stem.with_suffix(".bin")
+        path.write_bytes(value)
+        return _Spilled(path, "bytes", size)
+    if isinstance(value, pd.DataFrame) and _parquet_safe(value):
+        path = stem.with_suffix(".parquet")
+        try:
+            value.to_parquet(path, index=True)
+            return _Spilled(path, "parquet", size)
+        except Exception:
+            # Arrow 轉不過：改用 pickle
+            path.unlink(missing_ok=True)
+    path = stem.with_suffix(".pkl")
+    try:
+        with open(path, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return _Spilled(path, "pickle", size)
+
+
+def _read_part(spill: _Spilled) -> Any:
+    if spill.kind == "bytes":
+        return spill.path.read_bytes()
+    if spill.kind == "parquet":
+        return pd.read_parquet(spill.path)
+    private_dir(SPILL_DIR)
+    with open(spill.path, "rb") as f:
+        return pickle.load(f)
+
+
+def _value_bytes(value: Any) -> int:
+    if value is None:
+        return 0
+    return result_bytes(value)
+
+
+def _spill(entry: _Entry) -> None:
+    """
+    把一筆結果的大欄位寫到磁碟，記憶體只留小欄位
+    - 寫不出去的部分留在記憶體、照樣計入大小：磁碟滿 / 無權限，或配方的 build 是頁面裡的函式（無法 pickle）
+    - 配方與其他欄位共用的 DataFrame，要等配方也溢出才真的釋放；大小以剩下實際參照到的物件重算
+    """
+    value = entry.value
+    if isinstance(value, dict):
+        parts = [(k, v) for k, v in value.items() if _spillable(v)]
+    else:
+        parts = [(None, value)] if _spillable(value) else []
+    for k, v in parts:
+        try:
+            spill = _write_part(entry, k, v)
+        except (OSError, pickle.PicklingError, AttributeError, TypeError):
+            continue
+        entry.spilled[k] = spill
+        if k is None:
+            entry.value = None
+        else:
+            value[k] = None
+    entry.size = _value_bytes(entry.value)
+
+
+def _materialize(entry: _Entry) -> Any:
+    """組回完整結果（不改動 entry 本身）"""
+    if not entry.spilled:
+        return entry.value
+    if None in entry.spilled:
+        return _read_part(entry.spilled[None])
+    out = dict(entry.value)
+    for k, spill in entry.spilled.items():
+        out[k] = _read_part(spill)
+    return out
+
+
+def _drop_files(entry: _Entry) -> None:
+    for spill in entry.spilled.values():
+        spill.path.unlink(missing_ok=True)
+    entry.spilled.clear()
+
+
+def _in_memory(session_id: Optional[str] = None) -> int:
+    return sum(e.size for e in _ENTRIES.values() if session_id is None or e.session_id == session_id)
+
+
+def _enforce(session_id: str) -> None:
+    """session / 全域超過預算 → 由最久沒用的開始溢出（最新放進來的那筆最後才動）"""
+    for sid, budget in ((session_id, SESSION_BUDGET), (None, GLOBAL_BUDGET)):
+        total = _in_memory(sid)
+        if total <= budget:
+            continue
+        for entry in list(_ENTRIES.values()):
+            if sid is not None and entry.session_id != sid:
+                continue
+            before = entry.size
+            _spill(entry)
+            total -= before - entry.size
+            if total <= budget:
+                break
+
+
+def _release(entry_id: int) -> None:
+    with _LOCK:
+        entry = _ENTRIES.pop(entry_id, None)
+    if entry is not None:
+        _drop_files(entry)
+
+
+# =====================================
+# 對外介面
+# =====================================
+def _copy(value: Any) -> Any:
+    return dict(value) if isinstance(value, dict) else value
+
+
+def put(key: str, value: Any) -> None:
+    """存結果到 session_state[key]（實際只放 handle）；value 為 None 等同 discard"""
+    if value is None:
+        discard(key)
+        return
+    session_id = _session_id()
+    with _LOCK:
+        entry_id = next(_IDS)
+        # dict 存淺拷貝：呼叫端之後改自己的 dict 不會動到這裡
+        _ENTRIES[entry_id] = _Entry(entry_id, session_id, _copy(value), _value_bytes(value))
+        _enforce(session_id)
+    st.session_state[key] = ResultHandle(entry_id)   # 舊 handle 被覆寫 → 自動釋放
+
+
+def get(key: str, default: Any = None) -> Any:
+    """讀回結果；溢出過的自動從磁碟讀回（夠小就搬回記憶體）"""
+    handle = st.session_state.get(key)
+    if not isinstance(handle, ResultHandle):
+        return default if handle is None else handle
+    with _LOCK:
+        entry = _ENTRIES.get(handle.entry_id)
+        if entry is None:
+            return default
+        _ENTRIES.move_to_end(handle.entry_id)
+        try:
+            value = _materialize(entry)
+        except OSError:
+            # 暫存檔被外部清掉：結果遺失，當作沒有
+            _ENTRIES.pop(handle.entry_id, None)
+            return default
+        if entry.spilled:
+            full = _value_bytes(value)
+            if full <= SESSION_BUDGET:
+                _drop_files(entry)
+                entry.value, entry.size = _copy(value), full
+                _enforce(entry.session_id)
+    return _copy(value)
+
+
+def has(key: str) -> bool:
+    handle = st.session_state.get(key)
+    if isinstance(handle, ResultHandle):
+        return handle.entry_id in _ENTRIES
+    return handle is not None
+
+
+def discard(key: str) -> None:
+    handle = st.session_state.pop(key, None)
+    if isinstance(handle, ResultHandle):
+        _release(handle.entry_id)
+
+
+def usage() -> Dict[str, int]:
+    """目前用量（維護 / 除錯用）：記憶體位元組、溢出位元組、筆數"""
+    with _LOCK:
+        return {
+            "memory_bytes": _in_memory(),
+            "spilled_bytes": sum(s.size for e in _ENTRIES.values() for s in e.spilled.values()),
+            "entries": len(_ENTRIES),
+        }
+
+
+def purge_orphans(now: Optional[float] = None) -> None:
+    """刪掉前一個 process 留下、超過 ORPHAN_TTL 的暫存檔"""
+    now = time.time() if now is None else now
+    if not SPILL_DIR.exists():
+        return
+    try:
+        private_dir(SPILL_DIR)
+    except OSError:
+        return
+    prefix = f"{os.getpid()}_"
+    for p in SPILL_DIR.iterdir():
+        if p.name.startswith(prefix):
+            continue
+        try:
+            if now - p.stat().st_mtime > ORPHAN_TTL:
+                p.unlink()
+        except OSError:
+            pass
+
+
+def clear_store() -> None:
+    """清空所有 session 的結果與暫存目錄（維護用）"""
+    with _LOCK:
+        _ENTRIES.clear()
+        shutil.rmtree(SPILL_DIR, ignore_errors=True)
+
+
+purge_orphans()
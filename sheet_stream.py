@@ -0,0 +1,190 @@
+"""
+串流讀取 Excel 工作表（xlsx / xlsm / xlsb）
+- openpyxl read-only / pyxlsb 逐列讀取，不先把整張表展開成 Python list
+- 表頭只在前 scan_rows 列內尋找（ERP 報表常有標題/條件等前置列）
+- 找到表頭後，資料列直接寫進「每欄一個 list」的欄緩衝，最後一次組成 DataFrame
+"""
+
+from __future__ import annotations
+
+import io
+from typing import Any, Callable, Iterator, List, Optional, Sequence
+
+import pandas as pd
+
+XLSB_EXTS = {"xlsb"}
+OPENPYXL_EXTS = {"xlsx", "xlsm", "xltx", "xltm"}
+STREAMABLE_EXTS = XLSB_EXTS | OPENPYXL_EXTS
+
+
+def _is_blank(v: Any) -> bool:
+    return v is None or (isinstance(v, str) and v.strip() == "")
+
+
+def _is_empty_row(vals: Sequence[Any]) -> bool:
+    return all(_is_blank(v) for v in vals)
+
+
+def _clean_value(v: Any) -> Any:
+    # 與 pd.read_excel 一致：整數值的 float 轉回 int
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    return v
+
+
+def row_labels(vals: Sequence[Any]) -> List[str]:
+    """表頭判斷用：把一列轉成去空白後的字串（空格保留為 ""）"""
+    return [str(v).strip() if v is not None else "" for v in vals]
+
+
+def iter_sheet_rows(file_bytes: bytes, sheet_name: str | int, ext: str) -> Iterator[tuple]:
+    """逐列產出工作表的儲存格值（tuple）；sheet_name 可用名稱或索引"""
+    ext = ext.lower().lstrip(".")
+    bio = io.BytesIO(file_bytes)
+
+    if ext in XLSB_EXTS:
+        try:
+            from pyxlsb import open_workbook
+        except Exception as e:
+            raise ImportError("讀取 .xlsb 需要安裝 pyxlsb（requirements.txt 加上 pyxlsb）。") from e
+
+        with open_workbook(bio) as wb:
+            name = wb.sheets[sheet_name] if isinstance(sheet_name, int) else sheet_name
+            if name not in wb.sheets:
+                raise KeyError(f"找不到工作表：{name}（目前工作表：{', '.join(wb.sheets)}）")
+            with wb.get_sheet(name) as sh:
+                for row in sh.rows():
+                    yield tuple(c.v for c in row)
+        return
+
+    if ext in OPENPYXL_EXTS:
+        from openpyxl import load_workbook
+
+        wb = load_workbook(bio, read_only=True, data_only=True)
+        try:
+            name = wb.sheetnames[sheet_name] if isinstance(sheet_name, int) else sheet_name
+            if name not in wb.sheetnames:
+                raise KeyError(f"找不到工作表：{name}（目前工作表：{', '.join(wb.sheetnames)}）")
+            for row in wb[name].iter_rows(values_only=True):
+                yield row
+        finally:
+            wb.close()
+        return
+
+    raise ValueError(f"不支援串流讀取的副檔名：{ext}")
+
+
+def read_sheet_streaming(
+    file_bytes: bytes,
+    sheet_name: str | int,
+    ext: str,
+    *,
+    is_header: Optional[Callable[[List[str]], bool]] = None,
+    scan_rows: int = 250,
+    fallback_first_nonempty: bool = True,
+    max_blank_run: Optional[int] = None,
+    usecols: Optional[Callable[[str], bool]] = None,
+) -> pd.DataFrame:
+    """
+    串流讀取一張工作表：
+
+    - is_header(labels) 在前 scan_rows 列內找表頭；找不到時
+      fallback_first_nonempty=True → 用第一個非空列當表頭，
+      False → 視為無表頭（欄名 0..n-1，掃描過的列全部當資料）
+    - 空白列一律略過；max_blank_run 有值時，連續空白列達此數即視為表尾
+    - 資料列超出表頭寬度的部分捨棄，不足補 None
+    - usecols(欄名) 有值時只緩衝回傳 True 的欄位；只在 is_header 命中時套用，
+      退回第一個非空列當表頭時保留全部欄位（方便對照欄名）
+    """
+    rows = iter_sheet_rows(file_bytes, sheet_name, ext)
+
+    # 1) 有界視窗內找表頭（只暫存 scan_rows 列）
+    window: List[tuple] = []
+    header_idx: Optional[int] = None
+    first_nonempty: Optional[int] = None
+    for vals in rows:
+        window.append(vals)
+        i = len(window) - 1
+        if first_nonempty is None and not _is_empty_row(vals):
+            first_nonempty = i
+        if is_header is not None and is_header(row_labels(vals)):
+            header_idx = i
+            break
+        if len(window) >= scan_rows:
+            break
+
+    matched = header_idx is not None
+    if header_idx is None and fallback_first_nonempty:
+        header_idx = first_nonempty
+
+    if header_idx is not None:
+        header = row_labels(window[header_idx])
+        while header and header[-1] == "":
+            header.pop()
+        header = [h if h else f"未命名欄位_{i+1}" for i, h in enumerate(header)]
+        project = usecols if matched else None
+        keep = [j for j, h in enumerate(header) if project is None or project(h)]
+        header = [header[j] for j in keep]
+        pending = window[header_idx + 1:]
+        width: Optional[int] = len(header)
+    else:
+        header = []
+        keep = []
+        pending = window
+        width = None  # 無表頭：欄數依資料最寬列決定
+    del window
+
+    # 2) 資料列 → 欄緩衝
+    columns: List[list] = [[] for _ in header]
+    n_rows = 0
+    blank_run = 0
+
+    def _push(vals: tuple) -> bool:
+        nonlocal n_rows, blank_run
+        if _is_empty_row(vals):
+            blank_run += 1
+            return not (max_blank_run is not None and n_rows and blank_run >= max_blank_run)
+        blank_run = 0
+        if width is None:
+            while len(columns) < len(vals):
+                columns.append([None] * n_rows)
+            for j in range(len(columns)):
+                columns[j].append(_clean_value(vals[j]) if j < len(vals) else None)
+        else:
+            n = len(vals)
+            for k, j in enumerate(keep):
+                columns[k].append(_clean_value(vals[j]) if j < n else None)
+        n_rows += 1
+        return True
+
+    keep_going = True
+    for vals in pending:
+        if not _push(vals):
+            keep_going = False
+            break
+    if keep_going:
+        for vals in rows:
+            if not _push(vals):
+                break
+    rows.close()
+
+    if width is None:
+        header = list(range(len(columns)))
+    df = pd.DataFrame({j: col for j, col in enumerate(columns)}, index=pd.RangeIndex(n_rows))
+    df.columns = header
+    return df
+
+
+def sheet_names(file_bytes: bytes, ext: str) -> List[str]:
+    ext = ext.lower().lstrip(".")
+    bio = io.BytesIO(file_bytes)
+    if ext in XLSB_EXTS:
+        from pyxlsb import open_workbook
+        with open_workbook(bio) as wb:
+            return list(wb.sheets)
+    from openpyxl import load_workbook
+    wb = load_workbook(bio, read_only=True, data_only=True)
+    try:
+        return list(wb.sheetnames)
+    finally:
+        wb.close()
@@ -9,11 +9,18 @@
 """
 from __future__ import annotations
 
-import os, re, tempfile, datetime as dt
-from typing import Dict, Any, Tuple, List
+import io, os, re, datetime as dt
+from typing import Dict, Any, Tuple
 
 import pandas as pd
 
+from arrow_strings import as_text
+from excel_export import column_widths, set_openpyxl_widths
+from export_recipe import ExportRecipe
+from report_schema import find_column
+from result_cache import cached_call
+from upload_buffer import byte_stream
+
 # ====== 參數（可被呼叫端覆寫） ======
 TO_EXCLUDE_KEYWORDS = ["CGS", "JCPL", "QC99", "GREAT0001X", "GX010", "PD99"]
 TO_EXCLUDE_PATTERN = re.compile("|".join(re.escape(k) for k in TO_EXCLUDE_KEYWORDS), flags=re.IGNORECASE)
@@ -73,44 +80,38 @@ def _strip_cols(df: pd.DataFrame) -> pd.DataFrame:
     df.columns = [str(c).strip() for c in df.columns]
     return df
 
-def find_first_column(df: pd.DataFrame, candidates: List[str]) -> str | None:
-    cols = {str(c).strip(): c for c in df.columns}
-    for name in candidates:
-        if name in cols:
-            return name
-    norm = {re.sub(r"[（）\(\)\s]", "", k): k for k in cols}
-    for name in candidates:
-        key = re.sub(r"[（）\(\)\s]", "", name)
-        if key in norm:
-            return norm[key]
-    return None
-
-def read_excel_any_quiet(path: str) -> Dict[str, pd.DataFrame]:
-    ext = os.path.splitext(path)[1].lower()
+def read_excel_any_quiet(src, ext: str | None = None) -> Dict[str, pd.DataFrame]:
+    """src 可為檔案路徑，或上傳內容 bytes（直接從記憶體讀，不另寫暫存檔）"""
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        ext = (ext or ".xlsx").lower()
+        open_src = lambda: byte_stream(src)
+    else:
+        ext = os.path.splitext(src)[1].lower()
+        open_src = lambda: src
     if ext in (".xlsx", ".xlsm"):
-        xl = pd.ExcelFile(path, engine="openpyxl")
+        xl = pd.ExcelFile(open_src(), engine="openpyxl")
         return {sn: pd.read_excel(xl, sheet_name=sn) for sn in xl.sheet_names}
     if ext == ".xls":
-        xl = pd.ExcelFile(path, engine="xlrd")
+        xl = pd.ExcelFile(open_src(), engine="xlrd")
         return {sn: pd.read_excel(xl, sheet_name=sn) for sn in xl.sheet_names}
     if ext == ".xlsb":
-        xl = pd.ExcelFile(path, engine="pyxlsb")
+        xl = pd.ExcelFile(open_src(), engine="pyxlsb")
         return {sn: pd.read_excel(xl, sheet_name=sn) for sn in xl.sheet_names}
     if ext == ".csv":
         for enc in ("utf-8-sig", "cp950", "big5"):
             try:
-                return {"CSV": pd.read_csv(path, encoding=enc)}
+                return {"CSV": pd.read_csv(open_src(), encoding=enc)}
             except Exception:
                 continue
         raise Exception("CSV 讀取失敗。")
     raise Exception("不支援的副檔名。")
 
 def normalize_to_qc(series: pd.Series) -> pd.Series:
-    s = series.astype(str).str.strip().str.upper()
+    s = as_text(series, fill=None).str.upper()
     return s.eq("QC")
 
 def to_not_excluded_mask(series: pd.Series) -> pd.Series:
-    s = series.astype(str).str.strip()
+    s = as_text(series, fill=None)
     return ~s.str.contains(TO_EXCLUDE_PATTERN, na=False)
 
 def prepare_filtered_df(df: pd.DataFrame) -> pd.DataFrame:
@@ -122,15 +123,10 @@ def prepare_filtered_df(df: pd.DataFrame) -> pd.DataFrame:
     return df[normalize_to_qc(df["由"]) & to_not_excluded_mask(df["到"])].copy()
 
 def autosize_columns(ws, df: pd.DataFrame):
-    from openpyxl.utils import get_column_letter
-    cols = list(df.columns) if df is not None else []
-    for i, col in enumerate(cols, start=1):
-        if df is not None and not df.empty:
-            sample = [len(str(x)) for x in df[col].head(1000).tolist()]
-            max_len = max([len(str(col))] + sample)
-        else:
-            max_len = max(len(str(col)), 8)
-        ws.column_dimensions[get_column_letter(i)].width = min(max_len + 2, 60)
+    if df is None:
+        return
+    widths = column_widths(df, max_width=60, min_width=10 if df.empty else 0, sample=1000)
+    set_openpyxl_widths(ws, widths)
 
 def break_minutes_for_span(first_dt: pd.Timestamp, last_dt: pd.Timestamp) -> Tuple[int,str]:
     if pd.isna(first_dt) or pd.isna(last_dt):
@@ -310,11 +306,74 @@ def write_block_report(writer, detail_long: pd.DataFrame, user_col: str, target_
                 for c in range(1, len(header)+1):
                     ws.cell(row=row, column=c).fill = fill
 
-    from openpyxl.utils import get_column_letter
-    for c in range(1, len(header)+1):
-        max_len = max(len(str(header[c-1])),
-                      max((len(str(ws.cell(row=r, column=c).value)) for r in range(1, ws.max_row+1)), default=0))
-        ws.column_dimensions[get_column_letter(c)].width = min(max_len + 2, 60)
+    # 欄寬：直接由寫出的資料算（不再逐格讀回工作表）
+    shown = df[df["時段"].isin(["上午", "下午"])]
+    values = pd.DataFrame({
+        h: shown[c] for h, c in zip(header, [user_col, "對應姓名", "筆數", "工作區間", "總分鐘",
+                                            "效率_件每小時", "休息分鐘", "空窗分鐘", "空窗時段"])
+    })
+    set_openpyxl_widths(ws, column_widths(values, max_width=60))
+
+def write_shelf_workbook(
+    summary_out: pd.DataFrame,
+    daily: pd.DataFrame,
+    detail_long: pd.DataFrame,
+    user_col: str,
+    target_eff: float,
+) -> bytes:
+    """run_shelf_efficiency 的匯出 Excel（保留著色與報表）；由 ExportRecipe 在按下載時才呼叫"""
+    out = io.BytesIO()
+    with pd.ExcelWriter(out, engine="openpyxl",
+                        datetime_format="yyyy-mm-dd hh:mm:ss",
+                        date_format="yyyy-mm-dd") as writer:
+        sum_cols = [
+            user_col, "對應姓名", "総日數",
+            "總筆數","總工時_分鐘_扣休","效率_件每小時",
+            "上午筆數","上午工時_分鐘","上午效率_件每小時",
+            "下午筆數","下午工時_分鐘_扣休","下午效率_件每小時",
+        ]
+        summary_out[sum_cols].to_excel(writer, index=False, sheet_name="彙總")
+        ws_sum = writer.sheets["彙總"]; autosize_columns(ws_sum, summary_out[sum_cols])
+
+        det_cols = [
+            user_col, "對應姓名", "日期",
+            "第一筆時間","最後一筆時間","當日筆數",
+            "休息分鐘_整體","當日工時_分鐘_扣休","效率_件每小時",
+            "上午_第一筆","上午_最後一筆","上午_筆數","上午_工時_分鐘","上午_效率_件每小時",
+            "上午_空窗分鐘","上午_空窗時段",
+            "下午_第一筆","下午_最後一筆","下午_筆數","下午_休息分鐘",
+            "下午_工時_分鐘_扣休","下午_效率_件每小時",
+            "下午_空窗分鐘_扣休","下午_空窗時段",
+        ]
+        daily.sort_values([user_col,"日期","第一筆時間"])[det_cols].to_excel(writer, index=False, sheet_name="明細")
+        ws_det = writer.sheets["明細"]; autosize_columns(ws_det, daily[det_cols])
+
+        if not detail_long.empty:
+            long_cols = [user_col,"對應姓名","日期","時段","第一筆時間","最後一筆時間",
+                         "筆數","工時_分鐘","休息分鐘","空窗分鐘","空窗時段",
+                         "效率_件每小時","命中規則"]
+            detail_long[long_cols].to_excel(writer, index=False, sheet_name="明細_時段")
+            ws_long = writer.sheets["明細_時段"]; autosize_columns(ws_long, detail_long[long_cols])
+            shade_rows_by_efficiency(ws_long, header_name="效率_件每小時", target_eff=target_eff)
+
+            write_block_report(writer, detail_long, user_col, target_eff=target_eff)
+
+        rules_rows = []
+        for i,(st_ge,ed_le,mins,tag) in enumerate(BREAK_RULES, start=1):
+            rules_rows.append({
+                "優先序": i,
+                "首時間條件(>=)": st_ge.strftime("%H:%M:%S"),
+                "末時間條件(<=)": ed_le.strftime("%H:%M:%S"),
+                "休息分鐘": mins,
+                "規則說明": tag
+            })
+        rules_df = pd.DataFrame(rules_rows, columns=["優先序","首時間條件(>=)","末時間條件(<=)","休息分鐘","規則說明"])
+        rules_df.to_excel(writer, index=False, sheet_name="休息規則")
+        ws_rule = writer.sheets["休息規則"]; autosize_columns(ws_rule, rules_df)
+
+        shade_rows_by_efficiency(ws_sum, header_name="效率_件每小時", target_eff=target_eff)
+        shade_rows_by_efficiency(ws_det, header_name="效率_件每小時", target_eff=target_eff)
+    return out.getvalue()
 
 def run_shelf_efficiency(file_bytes: bytes, filename: str, params: Dict[str, Any] | None = None) -> Dict[str, Any]:
     params = params or {}
@@ -323,184 +382,129 @@ def run_shelf_efficiency(file_bytes: bytes, filename: str, params: Dict[str, Any
 
     suffix = os.path.splitext(filename)[1].lower() or ".xlsx"
 
-    with tempfile.TemporaryDirectory() as td:
-        in_path = os.path.join(td, f"upload{suffix}")
-        with open(in_path, "wb") as f:
-            f.write(file_bytes)
-
-        sheets = read_excel_any_quiet(in_path)
-
-        kept_all = []
-        for sn, df in sheets.items():
-            k = prepare_filtered_df(df)
-            if not k.empty:
-                k["__sheet__"] = sn
-                kept_all.append(k)
-
-        if not kept_all:
-            raise Exception("無符合資料（可能缺『由/到』欄或過濾後為空）。")
-
-        data = pd.concat(kept_all, ignore_index=True)
-
-        user_col = find_first_column(data, INPUT_USER_CANDIDATES)
-        revdt_col = find_first_column(data, REV_DT_CANDIDATES)
-        if user_col is None:
-            raise Exception("找不到『記錄輸入人』欄位。")
-        if revdt_col is None:
-            raise Exception("找不到『修訂日期/時間』欄位。")
-
-        data["__dt__"] = pd.to_datetime(data[revdt_col], errors="coerce")
-        data["__code__"] = data[user_col].astype(str).str.strip()
-        data["對應姓名"] = data["__code__"].map(NAME_MAP).fillna("")
-
-        dt_data = data.dropna(subset=["__dt__"]).copy()
-        if dt_data.empty:
-            raise Exception("資料沒有可用的修訂日期時間，無法計算。")
-
-        dt_data["日期"] = dt_data["__dt__"].dt.date
-
-        daily = (
-            dt_data.groupby([user_col, "對應姓名", "日期"], dropna=False)
-                   .apply(lambda g: compute_am_pm_for_group(g, idle_threshold=idle_threshold))
-                   .reset_index()
-        )
-
-        # 彙總
-        summary = (
-            daily.groupby([user_col, "對應姓名"], dropna=False, as_index=False)
-                 .agg(
-                     総日數=("日期", "nunique"),
-                     總筆數=("當日筆數", "sum"),
-                     總工時_分鐘_扣休=("當日工時_分鐘_扣休", "sum"),
-                     上午筆數=("上午_筆數", "sum"),
-                     上午工時_分鐘=("上午_工時_分鐘", "sum"),
-                     下午筆數=("下午_筆數", "sum"),
-                     下午工時_分鐘_扣休=("下午_工時_分鐘_扣休", "sum"),
-                 )
-        )
-
-        def _eff(n, m):
-            return round((n / m * 60.0), 2) if m and m > 0 else 0.0
-
-        summary["上午效率_件每小時"] = summary.apply(lambda r: _eff(r["上午筆數"], r["上午工時_分鐘"]), axis=1)
-        summary["下午效率_件每小時"] = summary.apply(lambda r: _eff(r["下午筆數"], r["下午工時_分鐘_扣休"]), axis=1)
-        summary["總工時_分鐘_扣休"] = summary["上午工時_分鐘"].fillna(0).astype(int) + summary["下午工時_分鐘_扣休"].fillna(0).astype(int)
-        summary["效率_件每小時"] = summary.apply(lambda r: _eff(r["總筆數"], r["總工時_分鐘_扣休"]), axis=1)
-
-        for c in ["總筆數","總工時_分鐘_扣休","上午筆數","上午工時_分鐘","下午筆數","下午工時_分鐘_扣休"]:
-            summary[c] = summary[c].fillna(0).astype(int)
-        summary = summary.sort_values(["總筆數","總工時_分鐘_扣休"], ascending=[False, False])
-
-        total_people = int(summary[user_col].nunique())
-        met_people = int((summary["效率_件每小時"] >= target_eff).sum())
-        rate = (met_people / total_people) if total_people > 0 else 0.0
-
-        total_row = {
-            user_col: "整體合計", "對應姓名": "",
-            "総日數": int(summary["総日數"].sum()),
-            "總筆數": int(summary["總筆數"].sum()),
-            "總工時_分鐘_扣休": int(summary["總工時_分鐘_扣休"].sum()),
-            "上午筆數": int(summary["上午筆數"].sum()),
-            "上午工時_分鐘": int(summary["上午工時_分鐘"].sum()),
-            "下午筆數": int(summary["下午筆數"].sum()),
-            "下午工時_分鐘_扣休": int(summary["下午工時_分鐘_扣休"].sum()),
-            "效率_件每小時": _eff(int(summary["總筆數"].sum()), int(summary["總工時_分鐘_扣休"].sum())),
-            "上午效率_件每小時": _eff(int(summary["上午筆數"].sum()), int(summary["上午工時_分鐘"].sum())),
-            "下午效率_件每小時": _eff(int(summary["下午筆數"].sum()), int(summary["下午工時_分鐘_扣休"].sum())),
-        }
-        summary_out = pd.concat([summary, pd.DataFrame([total_row])], ignore_index=True)
-
-        # 明細_時段（長表）
-        long_rows = []
-        for _, r in daily.iterrows():
-            if r["上午_筆數"] > 0:
-                long_rows.append({
-                    user_col: r[user_col], "對應姓名": r["對應姓名"], "日期": r["日期"],
-                    "時段": "上午",
-                    "第一筆時間": r["上午_第一筆"], "最後一筆時間": r["上午_最後一筆"],
-                    "筆數": int(r["上午_筆數"]),
-                    "工時_分鐘": int(r["上午_工時_分鐘"]),
-                    "休息分鐘": 0,
-                    "空窗分鐘": int(r["上午_空窗分鐘"]),
-                    "空窗時段": r["上午_空窗時段"],
-                    "效率_件每小時": r["上午_效率_件每小時"],
-                    "命中規則": "上午不扣休",
-                })
-            if r["下午_筆數"] > 0:
-                long_rows.append({
-                    user_col: r[user_col], "對應姓名": r["對應姓名"], "日期": r["日期"],
-                    "時段": "下午",
-                    "第一筆時間": r["下午_第一筆"], "最後一筆時間": r["下午_最後一筆"],
-                    "筆數": int(r["下午_筆數"]),
-                    "工時_分鐘": int(r["下午_工時_分鐘_扣休"]),
-                    "休息分鐘": int(r["下午_休息分鐘"]),
-                    "空窗分鐘": int(r["下午_空窗分鐘_扣休"]),
-                    "空窗時段": r["下午_空窗時段"],
-                    "效率_件每小時": r["下午_效率_件每小時"],
-                    "命中規則": r["下午_命中規則"],
-                })
-        detail_long = pd.DataFrame(long_rows)
-        if not detail_long.empty:
-            detail_long = detail_long.sort_values([user_col,"日期","時段","第一筆時間"])
-
-        # 匯出 Excel（保留著色與報表）
-        base = os.path.splitext(os.path.basename(filename))[0]
-        xlsx_name = f"{base}上架績效.xlsx"
-        out_path = os.path.join(td, "result.xlsx")
-
-        with pd.ExcelWriter(out_path, engine="openpyxl",
-                            datetime_format="yyyy-mm-dd hh:mm:ss",
-                            date_format="yyyy-mm-dd") as writer:
-            sum_cols = [
-                user_col, "對應姓名", "総日數",
-                "總筆數","總工時_分鐘_扣休","效率_件每小時",
-                "上午筆數","上午工時_分鐘","上午效率_件每小時",
-                "下午筆數","下午工時_分鐘_扣休","下午效率_件每小時",
-            ]
-            summary_out[sum_cols].to_excel(writer, index=False, sheet_name="彙總")
-            ws_sum = writer.sheets["彙總"]; autosize_columns(ws_sum, summary_out[sum_cols])
-
-            det_cols = [
-                user_col, "對應姓名", "日期",
-                "第一筆時間","最後一筆時間","當日筆數",
-                "休息分鐘_整體","當日工時_分鐘_扣休","效率_件每小時",
-                "上午_第一筆","上午_最後一筆","上午_筆數","上午_工時_分鐘","上午_效率_件每小時",
-                "上午_空窗分鐘","上午_空窗時段",
-                "下午_第一筆","下午_最後一筆","下午_筆數","下午_休息分鐘",
-                "下午_工時_分鐘_扣休","下午_效率_件每小時",
-                "下午_空窗分鐘_扣休","下午_空窗時段",
-            ]
-            daily.sort_values([user_col,"日期","第一筆時間"])[det_cols].to_excel(writer, index=False, sheet_name="明細")
-            ws_det = writer.sheets["明細"]; autosize_columns(ws_det, daily[det_cols])
-
-            if not detail_long.empty:
-                long_cols = [user_col,"對應姓名","日期","時段","第一筆時間","最後一筆時間",
-                             "筆數","工時_分鐘","休息分鐘","空窗分鐘","空窗時段",
-                             "效率_件每小時","命中規則"]
-                detail_long[long_cols].to_excel(writer, index=False, sheet_name="明細_時段")
-                ws_long = writer.sheets["明細_時段"]; autosize_columns(ws_long, detail_long[long_cols])
-                shade_rows_by_efficiency(ws_long, header_name="效率_件每小時", target_eff=target_eff)
-
-                write_block_report(writer, detail_long, user_col, target_eff=target_eff)
-
-            rules_rows = []
-            for i,(st_ge,ed_le,mins,tag) in enumerate(BREAK_RULES, start=1):
-                rules_rows.append({
-                    "優先序": i,
-                    "首時間條件(>=)": st_ge.strftime("%H:%M:%S"),
-                    "末時間條件(<=)": ed_le.strftime("%H:%M:%S"),
-                    "休息分鐘": mins,
-                    "規則說明": tag
-                })
-            rules_df = pd.DataFrame(rules_rows, columns=["優先序","首時間條件(>=)","末時間條件(<=)","休息分鐘","規則說明"])
-            rules_df.to_excel(writer, index=False, sheet_name="休息規則")
-            ws_rule = writer.sheets["休息規則"]; autosize_columns(ws_rule, rules_df)
-
-            shade_rows_by_efficiency(ws_sum, header_name="效率_件每小時", target_eff=target_eff)
-            shade_rows_by_efficiency(ws_det, header_name="效率_件每小時", target_eff=target_eff)
-
-        with open(out_path, "rb") as f:
-            xlsx_bytes = f.read()
+    sheets = read_excel_any_quiet(file_bytes, suffix)
+
+    kept_all = []
+    for sn, df in sheets.items():
+        k = prepare_filtered_df(df)
+        if not k.empty:
+            k["__sheet__"] = sn
+            kept_all.append(k)
+
+    if not kept_all:
+        raise Exception("無符合資料（可能缺『由/到』欄或過濾後為空）。")
+
+    data = pd.concat(kept_all, ignore_index=True)
+
+    user_col = find_column(data.columns, INPUT_USER_CANDIDATES)
+    revdt_col = find_column(data.columns, REV_DT_CANDIDATES)
+    if user_col is None:
+        raise Exception("找不到『記錄輸入人』欄位。")
+    if revdt_col is None:
+        raise Exception("找不到『修訂日期/時間』欄位。")
+
+    data["__dt__"] = pd.to_datetime(data[revdt_col], errors="coerce")
+    data["__code__"] = as_text(data[user_col], fill=None)
+    data["對應姓名"] = data["__code__"].map(NAME_MAP).fillna("")
+
+    dt_data = data.dropna(subset=["__dt__"]).copy()
+    if dt_data.empty:
+        raise Exception("資料沒有可用的修訂日期時間，無法計算。")
+
+    dt_data["日期"] = dt_data["__dt__"].dt.date
+
+    daily = (
+        dt_data.groupby([user_col, "對應姓名", "日期"], dropna=False)
+               .apply(lambda g: compute_am_pm_for_group(g, idle_threshold=idle_threshold))
+               .reset_index()
+    )
+
+    # 彙總
+    summary = (
+        daily.groupby([user_col, "對應姓名"], dropna=False, as_index=False)
+             .agg(
+                 総日數=("日期", "nunique"),
+                 總筆數=("當日筆數", "sum"),
+                 總工時_分鐘_扣休=("當日工時_分鐘_扣休", "sum"),
+                 上午筆數=("上午_筆數", "sum"),
+                 上午工時_分鐘=("上午_工時_分鐘", "sum"),
+                 下午筆數=("下午_筆數", "sum"),
+                 下午工時_分鐘_扣休=("下午_工時_分鐘_扣休", "sum"),
+             )
+    )
+
+    def _eff(n, m):
+        return round((n / m * 60.0), 2) if m and m > 0 else 0.0
+
+    summary["上午效率_件每小時"] = summary.apply(lambda r: _eff(r["上午筆數"], r["上午工時_分鐘"]), axis=1)
+    summary["下午效率_件每小時"] = summary.apply(lambda r: _eff(r["下午筆數"], r["下午工時_分鐘_扣休"]), axis=1)
+    summary["總工時_分鐘_扣休"] = summary["上午工時_分鐘"].fillna(0).astype(int) + summary["下午工時_分鐘_扣休"].fillna(0).astype(int)
+    summary["效率_件每小時"] = summary.apply(lambda r: _eff(r["總筆數"], r["總工時_分鐘_扣休"]), axis=1)
+
+    for c in ["總筆數","總工時_分鐘_扣休","上午筆數","上午工時_分鐘","下午筆數","下午工時_分鐘_扣休"]:
+        summary[c] = summary[c].fillna(0).astype(int)
+    summary = summary.sort_values(["總筆數","總工時_分鐘_扣休"], ascending=[False, False])
+
+    total_people = int(summary[user_col].nunique())
+    met_people = int((summary["效率_件每小時"] >= target_eff).sum())
+    rate = (met_people / total_people) if total_people > 0 else 0.0
+
+    total_row = {
+        user_col: "整體合計", "對應姓名": "",
+        "総日數": int(summary["総日數"].sum()),
+        "總筆數": int(summary["總筆數"].sum()),
+        "總工時_分鐘_扣休": int(summary["總工時_分鐘_扣休"].sum()),
+        "上午筆數": int(summary["上午筆數"].sum()),
+        "上午工時_分鐘": int(summary["上午工時_分鐘"].sum()),
+        "下午筆數": int(summary["下午筆數"].sum()),
+        "下午工時_分鐘_扣休": int(summary["下午工時_分鐘_扣休"].sum()),
+        "效率_件每小時": _eff(int(summary["總筆數"].sum()), int(summary["總工時_分鐘_扣休"].sum())),
+        "上午效率_件每小時": _eff(int(summary["上午筆數"].sum()), int(summary["上午工時_分鐘"].sum())),
+        "下午效率_件每小時": _eff(int(summary["下午筆數"].sum()), int(summary["下午工時_分鐘_扣休"].sum())),
+    }
+    summary_out = pd.concat([summary, pd.DataFrame([total_row])], ignore_index=True)
+
+    # 明細_時段（長表）
+    long_rows = []
+    for _, r in daily.iterrows():
+        if r["上午_筆數"] > 0:
+            long_rows.append({
+                user_col: r[user_col], "對應姓名": r["對應姓名"], "日期": r["日期"],
+                "時段": "上午",
+                "第一筆時間": r["上午_第一筆"], "最後一筆時間": r["上午_最後一筆"],
+                "筆數": int(r["上午_筆數"]),
+                "工時_分鐘": int(r["上午_工時_分鐘"]),
+                "休息分鐘": 0,
+                "空窗分鐘": int(r["上午_空窗分鐘"]),
+                "空窗時段": r["上午_空窗時段"],
+                "效率_件每小時": r["上午_效率_件每小時"],
+                "命中規則": "上午不扣休",
+            })
+        if r["下午_筆數"] > 0:
+            long_rows.append({
+                user_col: r[user_col], "對應姓名": r["對應姓名"], "日期": r["日期"],
+                "時段": "下午",
+                "第一筆時間": r["下午_第一筆"], "最後一筆時間": r["下午_最後一筆"],
+                "筆數": int(r["下午_筆數"]),
+                "工時_分鐘": int(r["下午_工時_分鐘_扣休"]),
+                "休息分鐘": int(r["下午_休息分鐘"]),
+                "空窗分鐘": int(r["下午_空窗分鐘_扣休"]),
+                "空窗時段": r["下午_空窗時段"],
+                "效率_件每小時": r["下午_效率_件每小時"],
+                "命中規則": r["下午_命中規則"],
+            })
+    detail_long = pd.DataFrame(long_rows)
+    if not detail_long.empty:
+        detail_long = detail_long.sort_values([user_col,"日期","時段","第一筆時間"])
+
+    # 匯出 Excel：只留配方，按下載時才寫
+    base = os.path.splitext(os.path.basename(filename))[0]
+    xlsx_name = f"{base}上架績效.xlsx"
+    xlsx = ExportRecipe(
+        write_shelf_workbook,
+        (summary_out, daily, detail_long, user_col, target_eff),
+        file_name=xlsx_name,
+    )
 
     # UI 用的彙總欄位（統一名稱方便共用 UI）
     ui_summary = summary_out.copy()
@@ -521,7 +525,7 @@ def run_shelf_efficiency(file_bytes: bytes, filename: str, params: Dict[str, Any
         "summary_df": ui_summary,
         "detail_df": daily,
         "ampm_df": detail_long.rename(columns={user_col: "記錄輸入人", "對應姓名":"姓名"}) if not detail_long.empty else pd.DataFrame(),
-        "xlsx_bytes": xlsx_bytes,
+        "xlsx": xlsx,
         "xlsx_name": xlsx_name,
         "target_eff": target_eff,
         "people": total_people,
@@ -530,3 +534,30 @@ def run_shelf_efficiency(file_bytes: bytes, filename: str, params: Dict[str, Any
         "avg_eff": avg_eff,
         "pass_rate": f"{rate:.0%}",
     }
+
+
+def run_shelf_efficiency_cached(
+    file_bytes: bytes,
+    filename: str,
+    params: Dict[str, Any] | None = None,
+    *,
+    fingerprint: str | None = None,
+) -> Dict[str, Any]:
+    """
+    run_shelf_efficiency 的快取版（result_cache）：同一份檔 + 同門檻 / 空窗門檻直接回傳上次結果
+    - 匯出檔名取自上傳檔名，所以檔名也算在 key 裡
+    - fingerprint：upload_fingerprint(uploaded)，有給就不必再掃一次內容
+    """
+    params = params or {}
+    key_params = {
+        "filename": os.path.basename(filename),
+        "target_eff": float(params.get("target_eff", DEFAULT_TARGET_EFF)),
+        "idle_threshold": int(params.get("idle_threshold", DEFAULT_IDLE_MIN_THRESHOLD)),
+    }
+    return cached_call(
+        "shelf_efficiency",
+        file_bytes,
+        key_params,
+        lambda: run_shelf_efficiency(file_bytes, filename, params),
+        fingerprint=fingerprint,
+    )
@@ -0,0 +1,44 @@
+"""
+分塊讀取大型 TXT / CSV 出貨明細
+- 以 TextIOWrapper 邊讀邊解碼，不先把整份 bytes decode 成一個大字串
+- 每次只產出 chunksize 列的 DataFrame（Arrow 字串欄），呼叫端逐塊累加統計即可
+"""
+
+from __future__ import annotations
+
+import io
+from typing import Iterator, Optional
+
+import pandas as pd
+
+from arrow_strings import TEXT_DTYPE
+
+CHUNK_ROWS = 200_000  # 每塊列數：約數十 MB 記憶體，月檔也能在固定記憶體內跑完
+
+
+def iter_txt_chunks(
+    raw: bytes,
+    encoding: str,
+    *,
+    sep: Optional[str] = None,
+    fwf: bool = False,
+    chunksize: int = CHUNK_ROWS,
+    **read_kwargs,
+) -> Iterator[pd.DataFrame]:
+    """逐塊產出 DataFrame；fwf=True 走固定寬度，否則用 sep 分欄（python engine，支援 regex 分隔）"""
+    stream = io.TextIOWrapper(io.BytesIO(raw), encoding=encoding, errors="replace")
+    try:
+        if fwf:
+            reader = pd.read_fwf(stream, dtype=TEXT_DTYPE, chunksize=chunksize, **read_kwargs)
+        else:
+            reader = pd.read_csv(stream, sep=sep, dtype=TEXT_DTYPE, engine="python", chunksize=chunksize, **read_kwargs)
+        with reader:
+            for chunk in reader:
+                yield chunk
+    finally:
+        stream.close()
+
+
+def peek_text(raw: bytes, encoding: str, n_bytes: int = 200_000) -> str:
+    """只解碼檔頭一段，給分隔符號 / 欄位判斷用"""
+    return raw[:n_bytes].decode(encoding, errors="replace")
@@ -0,0 +1,74 @@
+"""
+上傳檔緩衝區（零複製）
+- 每次執行只向 UploadedFile 取一次內容，記在上傳物件上，之後重複呼叫都拿同一份
+- hash / 檔頭判斷用 memoryview 切片，不產生整份 bytes 副本
+- 解析用 byte_stream()：BytesIO 直接共用原本的 bytes 緩衝區（不可用 BytesIO(memoryview)，那會複製）
+- 指紋：整份內容的 BLAKE2b，同一個上傳物件只算一次；變更偵測、快取 key 一律用 upload_fingerprint()
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+from typing import Union
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+_ATTR = "_gf_upload_bytes"
+_DIGEST_ATTR = "_gf_upload_digest"
+DIGEST_SIZE = 16  # 128-bit：檔頭檔尾相同、長度相同的兩份日報也不會撞
+
+
+def upload_bytes(uploaded) -> bytes:
+    """上傳檔內容（同一個上傳物件重複呼叫不會再複製）"""
+    data = getattr(uploaded, _ATTR, None)
+    if data is None:
+        data = uploaded.getvalue()
+        try:
+            setattr(uploaded, _ATTR, data)
+        except AttributeError:
+            pass
+    return data
+
+
+def upload_view(uploaded) -> memoryview:
+    return memoryview(upload_bytes(uploaded))
+
+
+def _whole_bytes(data: Buffer):
+    """memoryview 若涵蓋整個 bytes 物件，回傳底層 bytes；否則 None"""
+    if isinstance(data, bytes):
+        return data
+    if isinstance(data, memoryview) and isinstance(data.obj, bytes) and data.nbytes == len(data.obj):
+        return data.obj
+    return None
+
+
+def byte_stream(data: Buffer) -> io.BytesIO:
+    """給 pandas / openpyxl 的檔案物件；bytes 來源時不複製"""
+    whole = _whole_bytes(data)
+    return io.BytesIO(whole if whole is not None else bytes(data))
+
+
+def sniff(data: Buffer, n: int = 4096) -> bytes:
+    """只取檔頭 n bytes（判斷格式 / 編碼用）"""
+    return bytes(memoryview(data)[:n])
+
+
+def content_digest(data: Buffer) -> str:
+    """整份內容的 BLAKE2b 十六進位字串（memoryview 直接餵，不複製）"""
+    return hashlib.blake2b(memoryview(data), digest_size=DIGEST_SIZE).hexdigest()
+
+
+def upload_fingerprint(uploaded) -> str:
+    """上傳檔指紋（同一個上傳物件只算一次）；沒有上傳 → 空字串"""
+    if uploaded is None:
+        return ""
+    digest = getattr(uploaded, _DIGEST_ATTR, None)
+    if digest is None:
+        digest = content_digest(upload_bytes(uploaded))
+        try:
+            setattr(uploaded, _DIGEST_ATTR, digest)
+        except AttributeError:
+            pass
+    return digest
@@ -0,0 +1,223 @@
+"""
+上傳檔解析快取（content-addressed）
+- key = 上傳內容指紋（BLAKE2b，upload_buffer.content_digest）+ 讀取參數（reader / sheet / dtype ...）
+- 解析後的 DataFrame 以 Parquet 存在本機磁碟，跨使用者、重跑都可共用
+- 跨頁面共用的前提是讀取參數相同：各頁自帶的 reader（讀法不同，key 也不同）只在同頁命中；
+  要跨頁共用同一份匯出檔，就都用 cached_text_table（全部欄位當文字、空格為空字串）
+- 快取總容量超過上限時，依最後使用時間（LRU）淘汰最舊的檔案
+- 寫不進 Parquet 的表（混型欄、重複欄名…）直接回傳解析結果，不影響原本流程
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import pandas as pd
+
+from arrow_strings import TEXT_DTYPE, as_text
+from html_table import looks_like_html, read_html_table
+from upload_buffer import byte_stream, content_digest, sniff, upload_bytes, upload_fingerprint
+
+
+# ===== 可調參數（可用環境變數覆寫） =====
+CACHE_DIR = Path(os.environ.get("UPLOAD_CACHE_DIR", os.path.join(tempfile.gettempdir(), "gf_upload_cache")))
+MAX_CACHE_BYTES = int(os.environ.get("UPLOAD_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))  # 1 GB
+CACHE_VERSION = "3"  # 讀取邏輯或存檔格式變更時 +1，舊快取自然失效
+_LOCK = threading.Lock()
+
+
+def cache_key(content: bytes, fingerprint: Optional[str] = None, **options: Any) -> str:
+    """
+    上傳內容指紋 + 讀取參數 → 快取 key（同檔同參數 = 同 key）
+    - 已有 upload_fingerprint(uploaded) 時傳 fingerprint，不必再掃一次內容
+    """
+    digest = fingerprint or content_digest(content)
+    opts = json.dumps(options, sort_keys=True, ensure_ascii=False, default=str)
+    return content_digest(f"{CACHE_VERSION}|{digest}|{opts}".encode("utf-8"))
+
+
+def _entry_path(key: str) -> Path:
+    return CACHE_DIR / f"{key}.parquet"
+
+
+def _load(path: Path) -> Optional[pd.DataFrame]:
+    try:
+        df = pd.read_parquet(path)
+    except Exception:
+        # 壞檔（寫到一半被砍、磁碟滿…）直接丟掉重來
+        try:
+            path.unlink()
+        except OSError:
+            pass
+        return None
+    try:
+        os.utime(path, None)  # 更新使用時間，供 LRU 判斷
+    except OSError:
+        pass
+    return df
+
+
+def _store(path: Path, df: pd.DataFrame) -> None:
+    if df.columns.duplicated().any():
+        return
+    if not all(isinstance(c, str) for c in df.columns):
+        return
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        df.to_parquet(tmp, index=True)
+        os.replace(tmp, path)
+    except Exception:
+        # 混型 object 欄等 Arrow 轉不過的情況：不快取
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+        return
+    _evict()
+
+
+def _evict(max_bytes: Optional[int] = None) -> None:
+    """總容量超過上限 → 由最久沒用的開始刪"""
+    limit = MAX_CACHE_BYTES if max_bytes is None else int(max_bytes)
+    entries = []
+    total = 0
+    for p in CACHE_DIR.glob("*.parquet"):
+        try:
+            stat = p.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, p))
+        total += stat.st_size
+    if total <= limit:
+        return
+    for _, size, p in sorted(entries, key=lambda x: x[0]):
+        try:
+            p.unlink()
+        except OSError:
+            continue
+        total -= size
+        if total <= limit:
+            break
+
+
+def cached_parse(
+    content: bytes,
+    parse: Callable[[bytes], pd.DataFrame],
+    fingerprint: Optional[str] = None,
+    **options: Any,
+) -> pd.DataFrame:
+    """
+    以上傳內容 + 讀取參數查快取；命中直接讀 Parquet，未命中才呼叫 parse(content) 並寫回快取。
+
+    options 要完整描述「怎麼讀」（reader 名稱、sheet、dtype…），
+    不同頁面用同一組 options 讀同一個檔，才會共用同一份解析結果（見 cached_text_table）。
+    """
+    key = cache_key(content, fingerprint, **options)
+    path = _entry_path(key)
+
+    if path.exists():
+        df = _load(path)
+        if df is not None:
+            return df
+
+    df = parse(content)
+    if isinstance(df, pd.DataFrame):
+        with _LOCK:
+            _store(path, df)
+    return df
+
+
+# =====================================
+# 共用文字表讀取器
+# - 快取 key 含 reader 名稱：各頁各自的 reader 只在同頁重跑時命中。
+#   要跨頁共用（庫存明細、儲位主檔…），就都經由 cached_text_table 讀
+# =====================================
+TEXT_TABLE_READER = "text_table"
+
+
+def _first_sheet(content: bytes, engine: Optional[str]) -> pd.DataFrame:
+    xl = pd.ExcelFile(byte_stream(content), engine=engine)
+    first = None
+    for sn in xl.sheet_names:
+        df = xl.parse(sn, dtype=TEXT_DTYPE, keep_default_na=False)
+        if not df.empty:
+            return df
+        if first is None:
+            first = df
+    return first if first is not None else pd.DataFrame()
+
+
+def _read_text_table(content: bytes, filename: str) -> pd.DataFrame:
+    last_err: Optional[Exception] = None
+    for enc in ("utf-8-sig", "cp950", "big5", "utf-16", "latin1"):
+        for sep in ("\t", ",", "|", ";"):
+            try:
+                df = pd.read_csv(
+                    byte_stream(content),
+                    sep=sep,
+                    dtype=TEXT_DTYPE,
+                    encoding=enc,
+                    keep_default_na=False,
+                    engine="python",
+                )
+            except Exception as e:
+                last_err = e
+                continue
+            if df.shape[1] > 1:
+                return df
+    raise ValueError(f"檔案讀取失敗：{filename}\n最後錯誤：{last_err}")
+
+
+def read_text_table(content: bytes, filename: str) -> pd.DataFrame:
+    """xlsx / xls / xlsb / HTML 假 xls / csv / tsv / txt → DataFrame（文字欄、空格為空字串、欄名去空白）"""
+    ext = os.path.splitext(filename)[1].lower()
+    head = sniff(content, 8)
+    if head[:2] == b"PK":
+        df = _first_sheet(content, "openpyxl")
+    elif head[:4] == b"\xD0\xCF\x11\xE0":
+        try:
+            df = _first_sheet(content, "xlrd")
+        except ImportError as e:
+            raise RuntimeError("目前環境可能未安裝 xlrd，.xls 無法讀取；請先另存為 .xlsx 再上傳。") from e
+    elif ext == ".xlsb":
+        try:
+            df = _first_sheet(content, "pyxlsb")
+        except ImportError as e:
+            raise RuntimeError("目前環境可能未安裝 pyxlsb，.xlsb 無法讀取；請先另存為 .xlsx 再上傳。") from e
+    elif looks_like_html(content):
+        df = read_html_table(content, min_cols=2)
+        df = df.apply(lambda s: as_text(s, fill="", strip=False))
+    else:
+        df = _read_text_table(content, filename)
+    df.columns = [str(c).strip() for c in df.columns]
+    return df
+
+
+
+
+def cached_text_table(uploaded, fingerprint: Optional[str] = None) -> pd.DataFrame:
+    """
+    上傳檔 → read_text_table 的結果（經解析快取）
+    - 所有頁面用同一組 key：同一份匯出檔在任一頁讀過，其他頁直接取快取
+    - fingerprint：upload_fingerprint(uploaded)，有給就不必再掃一次內容
+    """
+    name = getattr(uploaded, "name", "uploaded_file")
+    return cached_parse(
+        upload_bytes(uploaded),
+        lambda b: read_text_table(b, name),
+        fingerprint or upload_fingerprint(uploaded),
+        reader=TEXT_TABLE_READER,
+        ext=os.path.splitext(name)[1].lower(),
+    )
+
+
+def clear_cache() -> None:
+    """清空快取目錄（維護用）"""
+    with _LOCK:
+        _evict(max_bytes=0)